@@ -1,5 +1,4 @@
 # pi/app.py
-import cv2
 import time
 import json
 import logging
@@ -11,35 +10,39 @@ from flask import Flask, render_template, Response, jsonify, request
 from flask_sock import Sock
 
 # Import hệ thống cốt lõi
-from core.system import SortingSystem, LOG_FILE, DATABASE_FILE, QUEUE_STATE_FILE, CONFIG_FILE, SENSOR_ENTRY_MOCK_PIN
+from core.system import SortingSystem, BASE_DIR, LOG_FILE, DATABASE_FILE, QUEUE_JOURNAL_FILE, CONFIG_FILE, SENSOR_ENTRY_MOCK_PIN
+from core.gpio import RealGPIO
+from core.logging_setup import setup_logging, get_logging_stats
+from core.control import SPLIT_PROCESS, SystemProxy
+from core.handoff import wait_for_exit
 
 # ==================================================
-# THIẾT LẬP LOGGING (Lấy từ app_god.py)
+# THIẾT LẬP LOGGING (Bất đồng bộ: QueueHandler -> QueueListener)
 # ==================================================
-from logging.handlers import RotatingFileHandler
+# Các luồng nóng (camera, gantry, lane, sort) chỉ đưa record vào hàng đợi;
+# việc format + ghi file xoay vòng lên thẻ SD do luồng QueueListener đảm nhận.
 os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-handler = RotatingFileHandler(LOG_FILE, maxBytes=2_000_000, backupCount=5, encoding="utf-8")
-logging.basicConfig(
-    handlers=[handler, logging.StreamHandler()],
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] (%(threadName)s) %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
+setup_logging(
+    LOG_FILE,
+    queue_size=int(os.environ.get("APP_LOG_QUEUE_SIZE", "10000")),
+    rate_limit_interval=float(os.environ.get("APP_LOG_RATE_LIMIT", "5.0"))
 )
 logging.info("[SYSTEM] Log system initialized ✅")
 logging.info(f"[PATH] CONFIG_FILE: {CONFIG_FILE}")
 logging.info(f"[PATH] LOG_FILE: {LOG_FILE}")
 logging.info(f"[PATH] DATABASE_FILE: {DATABASE_FILE}")
-logging.info(f"[PATH] QUEUE_STATE_FILE: {QUEUE_STATE_FILE}")
+logging.info(f"[PATH] QUEUE_JOURNAL_FILE: {QUEUE_JOURNAL_FILE}")
 
 # ==================================================
 # KHỞI TẠO FLASK VÀ HỆ THỐNG
 # ==================================================
-app = Flask(__name__, template_folder=os.path.join(os.path.dirname(BASE_DIR), 'templates'))
+app = Flask(__name__, template_folder=os.path.join(BASE_DIR, 'templates'))
 sock = Sock(app)
 
 # Tạo một (và chỉ một) instance của SortingSystem
 # Instance này sẽ quản lý tất cả state, threads, và logic.
-system = SortingSystem()
+# APP_SPLIT_PROCESS=1: GPIO/hàng chờ/relay chạy ở tiến trình riêng (core/control.py), web chỉ giữ proxy.
+system = SystemProxy() if SPLIT_PROCESS else SortingSystem()
 
 # ==================================================
 # LOGIC XÁC THỰC (Lấy từ app_god.py)
@@ -47,6 +50,7 @@ system = SortingSystem()
 AUTH_ENABLED = os.environ.get("APP_AUTH_ENABLED", "false").strip().lower() in {"1", "true", "yes", "on"}
 USERNAME = os.environ.get("APP_USERNAME", "admin")
 PASSWORD = os.environ.get("APP_PASSWORD", "123")
+PORT = int(os.environ.get("APP_PORT", "3000"))
 system.system_state["auth_enabled"] = AUTH_ENABLED # Cập nhật state
 
 def check_auth(username, password):
@@ -80,12 +84,11 @@ def index():
 @requires_auth
 def video_feed():
     def generate_frames():
+        import cv2 # Nạp khi có client xem video, không làm chậm khởi động
         while system.main_loop_running:
             frame = None
             if not system.error_manager.is_maintenance():
-                with system.frame_lock:
-                    if system.latest_frame is not None:
-                        frame = system.latest_frame.copy()
+                frame, _ = system.get_latest_frame("video_feed", reject_stale=False) # Chỉ ghi tuổi frame
             
             if frame is None:
                 import numpy as np
@@ -119,10 +122,30 @@ def get_config():
 @app.route('/api/sort_log')
 @requires_auth
 def get_sort_log():
-    data = system.get_sort_log_data()
-    if "error" in data:
-        return jsonify(data), 500
-    return jsonify(data)
+    # ETag lấy trước dữ liệu: nếu có lô ghi xen giữa, client chỉ tải lại lần sau
+    etag = system.get_sort_log_etag(request.args)
+    if etag and etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag); response.headers['Cache-Control'] = 'no-cache'
+        return response
+    data, status_code = system.get_sort_log_data(request.args)
+    if status_code != 200:
+        return jsonify(data), status_code
+    response = jsonify(data)
+    response.set_etag(etag); response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/sort_events')
+@requires_auth
+def get_sort_events():
+    response_data, status_code = system.get_sort_events(request.args)
+    return jsonify(response_data), status_code
+
+@app.route('/api/sort_events/summary')
+@requires_auth
+def get_sort_events_summary():
+    response_data, status_code = system.get_sort_events_summary(request.args)
+    return jsonify(response_data), status_code
 
 @app.route('/update_config', methods=['POST'])
 @requires_auth
@@ -149,6 +172,36 @@ def api_mock_gpio():
     response_data, status_code = system.mock_gpio_sensor(payload)
     return jsonify(response_data), status_code
 
+@app.route('/metrics')
+@requires_auth
+def metrics():
+    """Metric độ trễ từng chặng + counter (định dạng text Prometheus)"""
+    return Response(system.get_metrics_text(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/perf')
+@requires_auth
+def api_perf():
+    response_data, status_code = system.get_perf_summary()
+    return jsonify(response_data), status_code
+
+@app.route('/api/locks')
+@requires_auth
+def api_locks():
+    response_data, status_code = system.get_lock_report(request.args)
+    return jsonify(response_data), status_code
+
+@app.route('/api/vps/stats')
+@requires_auth
+def api_vps_stats():
+    response_data, status_code = system.get_vps_stats()
+    return jsonify(response_data), status_code
+
+@app.route('/api/log_stats')
+@requires_auth
+def api_log_stats():
+    """Thống kê pipeline log bất đồng bộ (record bị bỏ / bị gộp)"""
+    return jsonify(get_logging_stats())
+
 # ==================================================
 # ROUTE WEBSOCKET (Lấy từ app_god.py)
 # ==================================================
@@ -168,7 +221,7 @@ def ws_route(ws):
         initial_state = system.get_full_state()
         if initial_state:
             initial_state["auth_enabled"] = AUTH_ENABLED # Thêm trạng thái auth
-            ws.send(json.dumps({"type": "state_update", "state": initial_state}))
+            ws.send(json.dumps({"type": "state_update", "ts": time.time(), "state": initial_state}))
     except Exception as e:
         logging.warning(f"[WS] Lỗi gửi state ban đầu: {e}")
         system.remove_ws_client(ws); return
@@ -195,19 +248,26 @@ if __name__ == "__main__":
         # 1. Khởi động TẤT CẢ các luồng nền của SortingSystem (camera, sensors, logic, v.v.)
         #    Chúng sẽ chạy trong background (daemon=True)
         threading.Thread(target=system.run, name="SystemMainLoop", daemon=True).start()
+        if getattr(system, "handoff_from", None):
+            # Chuyển giao nóng: tiến trình cũ giữ cổng web tới khi nhận "commit" rồi thoát
+            system.handoff_done.wait()
+            if not system.main_loop_running: raise SystemExit(1)
+            if system.handoff_peer_pid and not wait_for_exit(system.handoff_peer_pid):
+                logging.warning(f"[HANDOFF] Tiến trình cũ (pid {system.handoff_peer_pid}) chưa thoát, cổng {PORT} có thể còn bận.")
 
         logging.info("=========================================")
         logging.info("    HỆ THỐNG PHÂN LOẠI SẴN SÀNG (MODULAR)")
-        logging.info(f"    GPIO Mode: {'REAL' if isinstance(system.gpio, RealGPIO) else 'MOCK'}")
-        logging.info(f"    API State: http://<IP_CUA_PI>:3000")
+        if SPLIT_PROCESS: logging.info("    GPIO Mode: tiến trình điều khiển riêng (APP_SPLIT_PROCESS)")
+        else: logging.info(f"    GPIO Mode: {'REAL' if isinstance(system.gpio, RealGPIO) else 'MOCK'}")
+        logging.info(f"    API State: http://<IP_CUA_PI>:{PORT}")
         if AUTH_ENABLED:
-            logging.info(f"    Truy cập: http://<IP_CUA_PI>:3000 (User: {USERNAME} / Pass: {PASSWORD})")
+            logging.info(f"    Truy cập: http://<IP_CUA_PI>:{PORT} (User: {USERNAME} / Pass: {PASSWORD})")
         else:
-            logging.info("    Truy cập: http://<IP_CUA_PI>:3000 (KHÔNG yêu cầu đăng nhập)")
+            logging.info(f"    Truy cập: http://<IP_CUA_PI>:{PORT} (KHÔNG yêu cầu đăng nhập)")
         logging.info("=========================================")
         
         # 2. Khởi động Flask web server (chạy ở luồng chính)
-        app.run(host='0.0.0.0', port=3000, debug=False, use_reloader=False)
+        app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
 
     except KeyboardInterrupt:
         logging.info("\n[MAIN] Dừng hệ thống (Ctrl+C)...")
@@ -215,4 +275,7 @@ if __name__ == "__main__":
         logging.critical(f"[CRITICAL] Lỗi khởi động hệ thống: {main_e}", exc_info=True)
     finally:
         # 3. Dọn dẹp
-        system.stop()
\ No newline at end of file
+        system.stop()
+        log_stats = get_logging_stats()
+        if log_stats.get("dropped") or log_stats.get("suppressed"):
+            logging.info(f"[LOG] Đã bỏ {log_stats['dropped']} record (hàng đợi đầy), gộp {log_stats['suppressed']} cảnh báo lặp lại.")
\ No newline at end of file
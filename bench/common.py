@@ -0,0 +1,47 @@
+# pi/bench/common.py
+import os
+import json
+import platform
+import subprocess
+from typing import Iterable, List, Optional
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Phân vị có nội suy tuyến tính trên dãy đã sắp xếp"""
+    if not sorted_values: return None
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos); hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def latency_summary(values: Iterable[float]) -> dict:
+    """count/mean/p50/p90/p99/max (ms) của 1 dãy thời gian (giây)"""
+    values = sorted(values)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+    return {"count": len(values), "mean": ms(sum(values) / len(values)),
+            "p50": ms(percentile(values, 0.50)), "p90": ms(percentile(values, 0.90)),
+            "p99": ms(percentile(values, 0.99)), "max": ms(values[-1])}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment_meta() -> dict:
+    return {"git": git_revision(), "python": platform.python_version(), "machine": platform.machine(),
+            "cpu_count": os.cpu_count()}
+
+
+def write_json(result: dict, path: Optional[str] = None):
+    """JSON sort_keys để diff được giữa các phiên bản (path=None -> stdout)"""
+    text = json.dumps(result, indent=2, sort_keys=True, ensure_ascii=False)
+    if path:
+        with open(path, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else:
+        print(text)
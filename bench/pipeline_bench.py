@@ -0,0 +1,236 @@
+# pi/bench/pipeline_bench.py
+"""
+Benchmark end-to-end: SortingSystem (MockGPIO + frame tổng hợp từ core.simulator) với N kiện/giây,
+đo thời gian tới lúc gọi RELAY_ON(push_pin) trong sorting_process.
+
+Các mốc thời gian được ghi bằng cách bọc MockGPIO (set_input_state / output) và queue_journal.record:
+  edge_to_relay : cạnh xuống sensor làn -> RELAY_ON(push_pin)   (gồm settle_delay cấu hình)
+  overhead      : edge_to_relay - settle_delay                   (phần do luồng / khóa / hàng đợi)
+  qr_to_job     : frame đầu tiên có QR -> Job được đưa vào hàng chờ
+                  (chế độ gantry: gồm cả thời gian kiện chạy tới sensor cổng + stability_delay)
+  qr_to_relay   : frame đầu tiên có QR -> RELAY_ON(push_pin)      (gồm thời gian băng chuyền chạy)
+Kèm số Job bị rơi (kiện có QR nhưng không có Job / không được đẩy / timeout) và mức dùng CPU.
+
+    python -m bench.pipeline_bench --mode gantry --rate 0.5 --parcels 30 --out pipeline.json
+    python -m bench.pipeline_bench --mode both --rate 0.5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+from bench.common import environment_meta, latency_summary, write_json
+from core.locks import thread_label
+from core.simulator import ConveyorSimulator, SimConfig, start_sim_system, stop_sim_system
+
+MODES = ("gantry", "camera_trigger")
+
+
+class PipelineRecorder:
+    """Bọc MockGPIO và queue_journal của 1 SortingSystem để ghi mốc thời gian (time.time())"""
+    def __init__(self, system):
+        self.system = system
+        self.inputs: List[tuple] = []   # (ts, pin, level)
+        self.outputs: List[tuple] = []  # (ts, pin, value)
+        self.jobs: List[tuple] = []     # (ts, lane_index)
+        gpio = system.gpio; journal = system.queue_journal
+        self._orig = (gpio.set_input_state, gpio.output, journal.record)
+        set_input, output, record = self._orig
+
+        def set_input_state(pin, level):
+            self.inputs.append((time.time(), pin, level))
+            return set_input(pin, level)
+
+        def output_wrapper(pin, value):
+            self.outputs.append((time.time(), pin, value))
+            return output(pin, value)
+
+        def record_wrapper(kind, **fields):
+            if kind == "job_push": self.jobs.append((time.time(), fields["job"]["lane_index"]))
+            return record(kind, **fields)
+
+        gpio.set_input_state = set_input_state; gpio.output = output_wrapper; journal.record = record_wrapper
+
+    def detach(self):
+        gpio = self.system.gpio
+        for name in ("set_input_state", "output"): gpio.__dict__.pop(name, None)
+        self.system.queue_journal.__dict__.pop("record", None)
+
+
+class ThreadCpuSampler:
+    """Lấy mẫu CPU từng luồng qua /proc/self/task (Linux); gộp luồng tạm theo tên hàm"""
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.available = os.path.isdir("/proc/self/task")
+        self.ticks = os.sysconf("SC_CLK_TCK") if self.available else 100
+        self._last: Dict[int, tuple] = {} # native_id -> (nhãn, tổng tick)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="BenchCpuSampler", daemon=True)
+
+    def _read(self, native_id: int) -> Optional[int]:
+        try:
+            with open(f"/proc/self/task/{native_id}/stat", "r") as f: stat = f.read()
+        except OSError:
+            return None
+        fields = stat[stat.rindex(")") + 2:].split()
+        return int(fields[11]) + int(fields[12]) # utime + stime
+
+    def _sample(self):
+        for t in threading.enumerate():
+            if t.native_id is None: continue
+            ticks = self._read(t.native_id)
+            if ticks is not None: self._last[t.native_id] = (thread_label(t.name), ticks)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval): self._sample()
+
+    def start(self):
+        if not self.available: return
+        self._sample(); self._baseline = dict(self._last)
+        self._thread.start()
+
+    def stop(self) -> Dict[str, float]:
+        """Giây CPU theo nhãn luồng trong khoảng start() -> stop()"""
+        if not self.available: return {}
+        self._stop.set(); self._thread.join(); self._sample()
+        usage: Dict[str, float] = {}
+        for native_id, (label, ticks) in self._last.items():
+            base = self._baseline.get(native_id, (label, 0))[1]
+            if label == "BenchCpuSampler": continue
+            usage[label] = usage.get(label, 0.0) + (ticks - base) / self.ticks
+        return {k: round(v, 3) for k, v in sorted(usage.items(), key=lambda kv: kv[1], reverse=True) if v > 0}
+
+
+def _attribute(sim: ConveyorSimulator, recorder: PipelineRecorder, settle_delay: float, relay_on_value) -> dict:
+    """Ghép mốc thời gian với từng kiện có QR đi vào làn phân loại"""
+    with sim.system.state_lock:
+        lanes = [dict(l) for l in sim.system.system_state["lanes"]]
+    edge_to_relay, overhead, qr_to_job, qr_to_relay = [], [], [], []
+    no_job = no_edge = no_relay = 0
+    claimed_relays = set(); jobs = sorted(recorder.jobs); used_jobs = set()
+
+    for parcel in sim.parcels:
+        if parcel.target == sim.ng_index or not parcel.code: continue
+        lane = lanes[parcel.target]
+        sensor_pin, push_pin = lane.get("sensor_pin"), lane.get("push_pin")
+        win_start, win_end = parcel.windows.get(parcel.target, (None, None))
+
+        # Job của kiện phải được tạo sau khi QR xuất hiện và trước khi kiện tới sensor làn
+        job_ts = None
+        deadline = win_start if win_start is not None else float("inf")
+        for i, (ts, lane_index) in enumerate(jobs):
+            if i in used_jobs or lane_index != parcel.target: continue
+            if parcel.first_frame_ts is None or ts < parcel.first_frame_ts: continue
+            if ts <= deadline: used_jobs.add(i); job_ts = ts
+            break
+        if job_ts is None: no_job += 1
+        else: qr_to_job.append(job_ts - parcel.first_frame_ts)
+
+        if win_start is None: no_edge += 1; continue
+        edge_ts = next((ts for ts, pin, level in recorder.inputs
+                        if pin == sensor_pin and level == 0 and win_start - 0.02 <= ts <= win_end), None)
+        if edge_ts is None: no_edge += 1; continue
+        relay = next(((i, ts) for i, (ts, pin, value) in enumerate(recorder.outputs)
+                      if i not in claimed_relays and pin == push_pin and value == relay_on_value
+                      and edge_ts <= ts <= win_end + settle_delay + 1.0), None)
+        if relay is None: no_relay += 1; continue
+        claimed_relays.add(relay[0]); relay_ts = relay[1]
+        edge_to_relay.append(relay_ts - edge_ts); overhead.append(max(0.0, relay_ts - edge_ts - settle_delay))
+        if parcel.first_frame_ts is not None: qr_to_relay.append(relay_ts - parcel.first_frame_ts)
+
+    return {
+        "latency_ms": {"edge_to_relay": latency_summary(edge_to_relay), "overhead": latency_summary(overhead),
+                       "qr_to_job": latency_summary(qr_to_job), "qr_to_relay": latency_summary(qr_to_relay)},
+        "dropped": {"no_job": no_job, "no_edge": no_edge, "no_relay": no_relay},
+    }
+
+
+def run_mode(mode: str, rate_pps: float, num_parcels: int, seed: Optional[int] = None,
+             config_path: Optional[str] = None, belt_speed: float = 0.5) -> dict:
+    """Chạy 1 chế độ trong tiến trình hiện tại (chế độ trigger được chọn lúc SortingSystem khởi động)"""
+    system, workdir = start_sim_system(config_path, {"use_sensor_entry_gantry": mode == "gantry"})
+    from core.system import ACTIVE_LOW
+    recorder = PipelineRecorder(system)
+    sampler = ThreadCpuSampler()
+    try:
+        with system.state_lock: timing = dict(system.system_state["timing_config"])
+        settle_delay = timing.get("settle_delay", 0.2)
+        sim = ConveyorSimulator(system, SimConfig(belt_speed=belt_speed, ng_ratio=0.0, seed=seed))
+        wall_start = time.perf_counter(); cpu_start = os.times()
+        sampler.start()
+        report = sim.run(num_parcels, rate_pps * 60.0)
+        threads_cpu = sampler.stop()
+        wall = time.perf_counter() - wall_start; cpu_end = os.times()
+        user, sys_time = cpu_end.user - cpu_start.user, cpu_end.system - cpu_start.system
+
+        result = _attribute(sim, recorder, settle_delay, system.gpio.LOW if ACTIVE_LOW else system.gpio.HIGH)
+        result["dropped"].update({"timeouts": report["timeouts"], "missed": report["missed"],
+                                  "wrong_lane": report["wrong_lane"]})
+        result.update({
+            "mode": mode, "rate_pps": rate_pps, "parcels": num_parcels, "settle_delay_s": settle_delay,
+            "accuracy": report["accuracy"], "late": report["late"],
+            "cpu": {"wall_s": round(wall, 3), "user_s": round(user, 3), "system_s": round(sys_time, 3),
+                    "percent_of_one_core": round((user + sys_time) / wall * 100, 1) if wall > 0 else None,
+                    "by_thread_s": threads_cpu},
+        })
+        return result
+    finally:
+        recorder.detach()
+        stop_sim_system(system, workdir)
+
+
+def _run_in_subprocess(mode: str, args) -> dict:
+    cmd = [sys.executable, "-m", "bench.pipeline_bench", "--mode", mode, "--rate", str(args.rate),
+           "--parcels", str(args.parcels), "--belt-speed", str(args.belt_speed)]
+    if args.seed is not None: cmd += ["--seed", str(args.seed)]
+    if args.config: cmd += ["--config", args.config]
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run(cmd, capture_output=True, text=True, cwd=base_dir, check=True).stdout
+    return json.loads(out)["modes"][mode]
+
+
+def compare(old: dict, new: dict) -> List[str]:
+    lines = []
+    for mode, cur in new["modes"].items():
+        prev = old.get("modes", {}).get(mode)
+        if not prev: lines.append(f"{mode}: (mới)"); continue
+        for key in ("edge_to_relay", "overhead", "qr_to_job"):
+            a, b = prev["latency_ms"][key], cur["latency_ms"][key]
+            lines.append(f"{mode} {key}: p50 {a['p50']} -> {b['p50']} ms, p99 {a['p99']} -> {b['p99']} ms")
+        dropped = lambda r: sum(v for k, v in r["dropped"].items() if k != "wrong_lane")
+        lines.append(f"{mode} dropped: {dropped(prev)} -> {dropped(cur)}, "
+                     f"cpu {prev['cpu']['percent_of_one_core']}% -> {cur['cpu']['percent_of_one_core']}%")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark trigger -> RELAY_ON dưới tải tổng hợp")
+    parser.add_argument("--mode", choices=MODES + ("both",), default="both")
+    parser.add_argument("--rate", type=float, default=0.5, help="Số kiện/giây")
+    parser.add_argument("--parcels", type=int, default=30)
+    parser.add_argument("--belt-speed", type=float, default=0.5, help="m/s")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--config", default=None, help="config.json nguồn (mặc định: config hiện tại)")
+    parser.add_argument("--out", help="Ghi kết quả JSON ra file (mặc định: stdout)")
+    parser.add_argument("--compare", help="File JSON của lần chạy trước để so sánh")
+    args = parser.parse_args(argv)
+
+    if args.mode == "both":
+        # Mỗi chế độ 1 tiến trình riêng: đường dẫn config/log của core.system cố định lúc import
+        modes = {mode: _run_in_subprocess(mode, args) for mode in MODES}
+    else:
+        modes = {args.mode: run_mode(args.mode, args.rate, args.parcels, args.seed, args.config, args.belt_speed)}
+    result = {"meta": environment_meta(), "modes": modes}
+    write_json(result, args.out)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f: old = json.load(f)
+        print("\n".join(compare(old, result)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# pi/bench/qr_bench.py
+"""
+Benchmark giải mã QR (core/qr.py) trên 1 thư mục frame đã gán nhãn.
+
+Thư mục corpus gồm các ảnh + labels.json:
+    {"0001_blur.png": {"codes": ["SP001"], "tags": ["blur"]},
+     "0002_empty.png": {"codes": [], "tags": ["empty"]}, ...}
+`codes` rỗng = băng chuyền trống / kiện không QR (mọi mã đọc ra đều là đọc sai).
+
+Mỗi backend (pipeline = scan_qr_from_frame, và từng backend trong core.qr.DECODE_ORDER) được chạy trên
+toàn bộ corpus -> tỉ lệ giải mã, số lần đọc sai, phân vị độ trễ, frame/s trên 1 core, thống kê theo tag.
+Kết quả ghi ra JSON (sort_keys) để diff giữa các phiên bản.
+
+    python -m bench.qr_bench --generate bench/corpus      # Sinh corpus tổng hợp (khi chưa có ảnh thật)
+    python -m bench.qr_bench bench/corpus --out qr_bench.json
+    python -m bench.qr_bench bench/corpus --compare qr_bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from bench.common import environment_meta, latency_summary, write_json
+from core.qr import DECODE_ORDER, PYZBAR, decode_with, render_qr_frame, scan_qr_from_frame, to_gray
+
+LABELS_FILE = "labels.json"
+PIPELINE = "pipeline"
+
+
+# ===========================================
+# SINH CORPUS TỔNG HỢP
+# ===========================================
+
+def _qr_box(code: Optional[str], box_size: int) -> np.ndarray:
+    return render_qr_frame(code, (box_size, box_size), box_size=box_size)
+
+def _compose(boxes, frame_size=(480, 640), background=40) -> np.ndarray:
+    """Đặt các hộp QR (BGR vuông) lên nền băng chuyền, xếp ngang cách đều"""
+    h, w = frame_size
+    frame = np.full((h, w, 3), background, np.uint8)
+    slot = w // max(1, len(boxes))
+    for i, box in enumerate(boxes):
+        bh, bw = box.shape[:2]
+        y = (h - bh) // 2; x = i * slot + (slot - bw) // 2
+        frame[y:y + bh, x:x + bw] = box
+    return frame
+
+def _rotate(frame: np.ndarray, angle: float) -> np.ndarray:
+    h, w = frame.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(frame, m, (w, h), borderValue=(40, 40, 40))
+
+def _glare(frame: np.ndarray, rng: random.Random, strength: float) -> np.ndarray:
+    h, w = frame.shape[:2]
+    mask = np.zeros((h, w), np.float32)
+    center = (w // 2 + rng.randint(-60, 60), h // 2 + rng.randint(-60, 60))
+    cv2.ellipse(mask, center, (rng.randint(40, 90), rng.randint(25, 60)), rng.randint(0, 180), 0, 360, 1.0, -1)
+    mask = cv2.GaussianBlur(mask, (0, 0), 15)[..., None]
+    out = frame.astype(np.float32) * (1 - mask * strength) + 255 * mask * strength
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+def _motion_blur(frame: np.ndarray, length: int) -> np.ndarray:
+    kernel = np.zeros((length, length), np.float32); kernel[length // 2, :] = 1.0 / length
+    return cv2.filter2D(frame, -1, kernel)
+
+def generate_corpus(out_dir: str, per_variant: int = 5, seed: int = 1) -> int:
+    """Sinh corpus phủ các tình huống: nét, mờ, mờ chuyển động, lóa, xoay, mã nhỏ, nhiều mã, băng trống"""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    codes = ["SP001", "SP002", "SP003", "SP004"]
+    labels = {}
+
+    def variants(code):
+        other = rng.choice([c for c in codes if c != code])
+        yield "clean", [code], _compose([_qr_box(code, 240)])
+        yield "blur", [code], cv2.GaussianBlur(_compose([_qr_box(code, 240)]), (0, 0), rng.uniform(1.5, 3.5))
+        yield "motion_blur", [code], _motion_blur(_compose([_qr_box(code, 240)]), rng.choice([7, 11, 15]))
+        yield "glare", [code], _glare(_compose([_qr_box(code, 240)]), rng, rng.uniform(0.5, 0.9))
+        yield "rotation", [code], _rotate(_compose([_qr_box(code, 240)]), rng.uniform(10, 80))
+        yield "small", [code], _compose([_qr_box(code, rng.choice([60, 80, 100]))])
+        yield "multi", [code, other], _compose([_qr_box(code, 200), _qr_box(other, 200)])
+        yield "empty", [], np.full((480, 640, 3), 40, np.uint8)
+        yield "no_code", [], _compose([_qr_box(None, 240)])
+
+    index = 0
+    for _ in range(per_variant):
+        code = rng.choice(codes)
+        for tag, expected, frame in variants(code):
+            index += 1
+            name = f"{index:04d}_{tag}.png"
+            cv2.imwrite(os.path.join(out_dir, name), frame)
+            labels[name] = {"codes": expected, "tags": [tag]}
+    with open(os.path.join(out_dir, LABELS_FILE), "w", encoding="utf-8") as f:
+        json.dump(labels, f, indent=2, sort_keys=True)
+    return index
+
+
+# ===========================================
+# CHẠY BENCHMARK
+# ===========================================
+
+def load_corpus(corpus_dir: str) -> List[dict]:
+    with open(os.path.join(corpus_dir, LABELS_FILE), "r", encoding="utf-8") as f:
+        labels = json.load(f)
+    items = []
+    for name in sorted(labels):
+        frame = cv2.imread(os.path.join(corpus_dir, name))
+        if frame is None:
+            print(f"Bỏ qua ảnh không đọc được: {name}", file=sys.stderr); continue
+        label = labels[name]
+        items.append({"name": name, "frame": frame, "codes": list(label.get("codes", [])),
+                      "tags": list(label.get("tags", []))})
+    return items
+
+def _decoder(backend: str):
+    if backend == PIPELINE:
+        return lambda frame: scan_qr_from_frame(frame)[0]
+    return lambda frame: decode_with(backend, to_gray(frame))
+
+def bench_backend(backend: str, items: List[dict], repeats: int = 3) -> dict:
+    decode = _decoder(backend)
+    decode(items[0]["frame"]) # Làm nóng (khởi tạo thư viện) - không tính giờ
+    latencies = []; results: Dict[str, Optional[str]] = {}
+    wall_start = time.perf_counter(); cpu_start = time.process_time()
+    for _ in range(repeats):
+        for item in items:
+            t0 = time.perf_counter()
+            data = decode(item["frame"])
+            latencies.append(time.perf_counter() - t0)
+            results[item["name"]] = data
+    wall = time.perf_counter() - wall_start; cpu = time.process_time() - cpu_start
+
+    tags: Dict[str, dict] = {}
+    misses = []; false_reads = []
+    for item in items:
+        data = results[item["name"]]
+        ok = bool(data) and data in item["codes"]
+        false = bool(data) and data not in item["codes"]
+        for key in ["all"] + item["tags"]:
+            t = tags.setdefault(key, {"frames": 0, "with_code": 0, "decoded": 0, "false_reads": 0})
+            t["frames"] += 1; t["with_code"] += bool(item["codes"])
+            t["decoded"] += ok; t["false_reads"] += false
+        if item["codes"] and not ok: misses.append(item["name"])
+        if false: false_reads.append({"frame": item["name"], "read": data})
+    for t in tags.values():
+        t["decode_rate"] = round(t["decoded"] / t["with_code"], 4) if t["with_code"] else None
+    totals = tags.pop("all")
+
+    runs = len(latencies)
+    latency = latency_summary(latencies); latency.pop("count")
+    return {
+        **totals,
+        "latency_ms": latency,
+        "fps_wall": round(runs / wall, 1) if wall > 0 else None,
+        "fps_per_core": round(runs / cpu, 1) if cpu > 0 else None, # Số frame / 1 giây CPU
+        "by_tag": tags,
+        "misses": misses,
+        "false_read_frames": false_reads,
+    }
+
+def run_bench(corpus_dir: str, backends: Optional[List[str]] = None, repeats: int = 3, threads: int = 1) -> dict:
+    cv2.setNumThreads(threads) # Mặc định 1 luồng -> fps_per_core phản ánh đúng 1 core
+    items = load_corpus(corpus_dir)
+    if not items: raise ValueError(f"Corpus rỗng: {corpus_dir}")
+    backends = backends or [PIPELINE] + list(DECODE_ORDER)
+    return {
+        "meta": {
+            **environment_meta(), "opencv": cv2.__version__, "pyzbar": PYZBAR,
+            "cv2_threads": threads, "corpus": os.path.abspath(corpus_dir), "frames": len(items),
+            "repeats": repeats, "decode_order": list(DECODE_ORDER),
+        },
+        "backends": {name: bench_backend(name, items, repeats) for name in backends},
+    }
+
+def compare(old: dict, new: dict) -> List[str]:
+    """Các dòng so sánh tỉ lệ giải mã / đọc sai / p50 / fps giữa 2 lần chạy"""
+    lines = []
+    for name, cur in new["backends"].items():
+        prev = old.get("backends", {}).get(name)
+        if not prev:
+            lines.append(f"{name}: (mới)"); continue
+        delta = lambda a, b: f"{b}" if a is None or b is None else f"{a} -> {b} ({b - a:+.4g})"
+        lines.append(f"{name}: decode_rate {delta(prev['decode_rate'], cur['decode_rate'])}, "
+                     f"false_reads {delta(prev['false_reads'], cur['false_reads'])}, "
+                     f"p50_ms {delta(prev['latency_ms']['p50'], cur['latency_ms']['p50'])}, "
+                     f"fps_per_core {delta(prev['fps_per_core'], cur['fps_per_core'])}")
+        fixed = sorted(set(prev["misses"]) - set(cur["misses"])); broken = sorted(set(cur["misses"]) - set(prev["misses"]))
+        if fixed: lines.append(f"  + đọc được thêm: {', '.join(fixed)}")
+        if broken: lines.append(f"  - không còn đọc được: {', '.join(broken)}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark giải mã QR trên corpus frame đã gán nhãn")
+    parser.add_argument("corpus", help="Thư mục ảnh + labels.json")
+    parser.add_argument("--generate", action="store_true", help="Sinh corpus tổng hợp vào thư mục `corpus` rồi thoát")
+    parser.add_argument("--per-variant", type=int, default=5, help="Số ảnh mỗi tình huống khi --generate")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", action="append", help=f"Chỉ chạy backend này (lặp lại được): {PIPELINE}, {', '.join(DECODE_ORDER)}")
+    parser.add_argument("--repeats", type=int, default=3, help="Số lượt chạy corpus mỗi backend")
+    parser.add_argument("--threads", type=int, default=1, help="cv2.setNumThreads")
+    parser.add_argument("--out", help="Ghi kết quả JSON ra file (mặc định: stdout)")
+    parser.add_argument("--compare", help="File JSON của lần chạy trước để so sánh")
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        count = generate_corpus(args.corpus, args.per_variant, args.seed)
+        print(f"Đã sinh {count} frame vào {args.corpus}")
+        return 0
+
+    unknown = [b for b in args.backend or [] if b != PIPELINE and b not in DECODE_ORDER]
+    if unknown: parser.error(f"backend không có: {', '.join(unknown)}")
+    result = run_bench(args.corpus, args.backend, args.repeats, args.threads)
+    write_json(result, args.out)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f: old = json.load(f)
+        print("\n".join(compare(old, result)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
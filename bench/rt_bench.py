@@ -0,0 +1,167 @@
+# pi/bench/rt_bench.py
+"""
+Đo jitter của luồng điều khiển trước / sau khi bật hồ sơ thời gian thực (core/rt.py, timing_config.rt_enabled).
+
+Mỗi hồ sơ chạy SortingSystem (MockGPIO + core.simulator) trong 1 tiến trình riêng, kèm tải nền giống thực tế:
+  encode  : cv2.imencode JPEG liên tục (như /video_feed)
+  state   : deepcopy + json.dumps state (như luồng broadcast) - giữ GIL
+  garbage : tạo đối tượng có vòng tham chiếu, giữ 1 cửa sổ trượt -> GC thế hệ 2 quét heap lớn
+Ghi mẫu thô của loop_wake_delay_seconds (lane_monitor / gantry / sort_cycle) và gc_pause_seconds.
+
+    python -m bench.rt_bench --profile both --parcels 20 --out rt.json
+    python -m bench.rt_bench --profile both --compare rt.json
+"""
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from bench.common import environment_meta, latency_summary, write_json
+from core import rt
+from core.simulator import ConveyorSimulator, SimConfig, start_sim_system, stop_sim_system
+
+PROFILES = ("off", "on")
+LOADS = ("encode", "state", "garbage")
+
+
+class SampleRecorder:
+    """Bọc observe() của các histogram core.rt để giữ mẫu thô (phân vị chính xác hơn bucket)"""
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self._orig = {}
+        for hist, label in ((rt.LOOP_WAKE, "loop"), (rt.GC_PAUSE, "generation")):
+            self._orig[hist] = hist.observe
+            hist.observe = self._wrap(hist, label)
+
+    def _wrap(self, hist, label):
+        orig = hist.observe; prefix = "wake" if hist is rt.LOOP_WAKE else "gc_gen"
+        def observe(value, **labels):
+            self.samples.setdefault(f"{prefix}:{labels.get(label, '')}", []).append(value)
+            orig(value, **labels)
+        return observe
+
+    def detach(self):
+        for hist, orig in self._orig.items(): hist.observe = orig
+
+
+class BackgroundLoad:
+    def __init__(self, system, kinds=LOADS):
+        self.system = system
+        self.kinds = kinds
+        self.iterations = {k: 0 for k in kinds}
+        self._stop_event = threading.Event()
+        self._threads = [threading.Thread(target=getattr(self, f"_{k}"), name=f"Load-{k}", daemon=True) for k in kinds]
+
+    def start(self):
+        for t in self._threads: t.start()
+
+    def stop(self):
+        self._stop_event.set()
+        for t in self._threads: t.join(2)
+
+    def _encode(self):
+        frame = np.random.default_rng(1).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+        while not self._stop_event.is_set():
+            cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70]); self.iterations["encode"] += 1
+
+    def _state(self):
+        while not self._stop_event.is_set():
+            state = self.system.get_full_state() or {}
+            json.dumps(copy.deepcopy({"state": state, "history": [state] * 20})); self.iterations["state"] += 1
+            time.sleep(0.005)
+
+    def _garbage(self):
+        window = []
+        while not self._stop_event.is_set():
+            node = {"id": self.iterations["garbage"], "payload": list(range(50))}
+            node["self"] = node # Vòng tham chiếu: chỉ GC mới thu hồi được
+            window.append(node)
+            if len(window) > 200000: del window[:1000]
+            self.iterations["garbage"] += 1
+            if self.iterations["garbage"] % 500 == 0: time.sleep(0.001)
+
+
+def run_profile(profile: str, num_parcels: int, rate_ppm: float, loads=LOADS, config_path: Optional[str] = None,
+                priority: int = 50, gc_threshold: Optional[List[int]] = None) -> dict:
+    overrides = {"rt_enabled": profile == "on", "rt_priority": priority}
+    if gc_threshold: overrides["rt_gc_threshold"] = gc_threshold
+    system, workdir = start_sim_system(config_path, overrides)
+    recorder = SampleRecorder(); load = BackgroundLoad(system, loads)
+    try:
+        sim = ConveyorSimulator(system, SimConfig(ng_ratio=0.0, seed=1))
+        load.start()
+        report = sim.run(num_parcels, rate_ppm)
+        load.stop()
+        return {
+            "profile": profile, "parcels": num_parcels, "rate_ppm": rate_ppm, "loads": dict(load.iterations),
+            "accuracy": report["accuracy"], "late": report["late"],
+            "rt_profile": rt.profile_status(),
+            "latency_ms": {k: latency_summary(v) for k, v in sorted(recorder.samples.items())},
+        }
+    finally:
+        load.stop(); recorder.detach()
+        stop_sim_system(system, workdir)
+
+
+def _run_in_subprocess(profile: str, args) -> dict:
+    cmd = [sys.executable, "-m", "bench.rt_bench", "--profile", profile, "--parcels", str(args.parcels),
+           "--rate", str(args.rate), "--priority", str(args.priority), "--loads", ",".join(args.loads)]
+    if args.gc_threshold: cmd += ["--gc-threshold", ",".join(map(str, args.gc_threshold))]
+    if args.config: cmd += ["--config", args.config]
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run(cmd, capture_output=True, text=True, cwd=base_dir, check=True).stdout
+    return json.loads(out)["profiles"][profile]
+
+
+def compare(old: dict, new: dict) -> List[str]:
+    lines = []
+    for profile, cur in new["profiles"].items():
+        prev = old.get("profiles", {}).get(profile)
+        if not prev: lines.append(f"{profile}: (mới)"); continue
+        for key, b in cur["latency_ms"].items():
+            a = prev["latency_ms"].get(key)
+            if a: lines.append(f"{profile} {key}: p50 {a['p50']} -> {b['p50']} ms, p99 {a['p99']} -> {b['p99']} ms, max {a['max']} -> {b['max']} ms")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Jitter luồng sensor/relay trước/sau hồ sơ thời gian thực")
+    parser.add_argument("--profile", choices=PROFILES + ("both",), default="both")
+    parser.add_argument("--parcels", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=20.0, help="Số kiện/phút")
+    parser.add_argument("--priority", type=int, default=50, help="rt_priority (SCHED_FIFO) khi --profile on")
+    parser.add_argument("--loads", type=lambda s: [x for x in s.split(",") if x], default=list(LOADS),
+                        help=f"Tải nền, phân tách bằng dấu phẩy: {','.join(LOADS)}")
+    parser.add_argument("--gc-threshold", type=lambda s: [int(x) for x in s.split(",")], default=None,
+                        help="rt_gc_threshold khi --profile on, vd: 2000,10,100")
+    parser.add_argument("--config", default=None, help="config.json nguồn (mặc định: config hiện tại)")
+    parser.add_argument("--out", help="Ghi kết quả JSON ra file (mặc định: stdout)")
+    parser.add_argument("--compare", help="File JSON của lần chạy trước để so sánh")
+    args = parser.parse_args(argv)
+    unknown = [k for k in args.loads if k not in LOADS]
+    if unknown: parser.error(f"tải không có: {', '.join(unknown)}")
+
+    if args.profile == "both":
+        # gc.freeze / affinity / SCHED_FIFO không hoàn tác được -> mỗi hồ sơ 1 tiến trình
+        profiles = {p: _run_in_subprocess(p, args) for p in PROFILES}
+    else:
+        profiles = {args.profile: run_profile(args.profile, args.parcels, args.rate, args.loads, args.config,
+                                                  args.priority, args.gc_threshold)}
+    result = {"meta": environment_meta(), "profiles": profiles}
+    write_json(result, args.out)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f: old = json.load(f)
+        print("\n".join(compare(old, result)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+# pi/bench/vps_stub.py
+"""
+VPS giả cho test / đo core/uploader.py: nhận POST multipart (batch / state / frame) như /api/pi/update.
+
+  - ghi lại mọi POST hợp lệ (requests), sự kiện theo thứ tự nhận, bỏ sự kiện trùng (`boot`, `seq`)
+  - fail = True  -> trả 503 (giả lập VPS lỗi / mất mạng); delay -> chờ trước khi trả lời (RTT cao)
+  - kiểm tra header X-API-Key (api_key=None: không kiểm tra)
+
+    python -m bench.vps_stub --port 3902 --api-key secret     # Rồi đặt vps_config.url = http://<ip>:3902/api/pi/update
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+
+def parse_form(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """Trường multipart/form-data (có frame) hoặc x-www-form-urlencoded -> {tên: bytes}"""
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return {k: v[0].encode() for k, v in parse_qs(body.decode()).items()}
+    message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name: fields[name] = part.get_payload(decode=True) or b""
+    return fields
+
+
+class VPSStub:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, api_key: Optional[str] = None):
+        self.api_key = api_key
+        self.fail = False
+        self.delay = 0.0
+        self.requests: List[dict] = []   # {"ts", "events", "state", "frame_bytes"}
+        self.events: List[dict] = []     # Sự kiện đã nhận (không trùng (boot, seq))
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self._seen = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+
+            def _reply(self, code: int, body: bytes = b"ok"):
+                self.send_response(code); self.send_header("Content-Length", str(len(body))); self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if stub.delay: time.sleep(stub.delay)
+                if stub.api_key is not None and self.headers.get("X-API-Key") != stub.api_key:
+                    return self._reply(401, b"bad key")
+                if stub.fail:
+                    with stub.lock: stub.rejected += 1
+                    return self._reply(503, b"unavailable")
+                fields = parse_form(self.headers.get("Content-Type", ""), body)
+                events = json.loads(fields["batch"])["events"] if "batch" in fields else []
+                state = json.loads(fields["state"]) if "state" in fields else None
+                with stub.lock:
+                    stub.requests.append({"ts": time.time(), "events": events, "state": state,
+                                          "frame_bytes": len(fields.get("frame", b""))})
+                    for event in events:
+                        key = (event.get("boot"), event.get("seq"))
+                        if key in stub._seen: continue
+                        stub._seen.add(key); stub.events.append(event)
+                self._reply(200)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}/api/pi/update"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="VPSStub", daemon=True)
+
+    def start(self) -> "VPSStub":
+        self._thread.start(); return self
+
+    def stop(self):
+        self.server.shutdown(); self.server.server_close()
+
+    def events_of(self, event_type: str) -> List[dict]:
+        with self.lock: return [e for e in self.events if e["type"] == event_type]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VPS giả nhận dữ liệu từ core/uploader.py")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=3902)
+    parser.add_argument("--api-key", help="Giá trị X-API-Key bắt buộc (mặc định: không kiểm tra)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Giây chờ trước mỗi phản hồi (giả lập RTT)")
+    args = parser.parse_args(argv)
+    stub = VPSStub(args.host, args.port, args.api_key); stub.delay = args.delay
+    stub.start()
+    print(f"VPS giả: {stub.url} (Ctrl+C để dừng)")
+    last = 0
+    try:
+        while True:
+            time.sleep(5)
+            with stub.lock: n, frames = len(stub.requests), sum(1 for r in stub.requests if r["frame_bytes"])
+            print(f"{n - last} POST / 5s - tổng {n} POST, {len(stub.events)} sự kiện, {frames} frame")
+            last = n
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
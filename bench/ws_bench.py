@@ -0,0 +1,350 @@
+# pi/bench/ws_bench.py
+"""
+Benchmark WebSocket: nhiều dashboard giả (1 phần cố tình đọc chậm) nối vào /ws của app.py.
+
+Đo theo 2 pha (baseline chỉ 1 client điều khiển, rồi có tải):
+  - độ trễ nhận state_update / log (dựa trên `ts` lúc server gửi) cho client nhanh và client chậm
+  - CPU của tiến trình server (/proc/<pid>/stat, khi server chạy trên cùng máy)
+  - độ giật vòng lặp sensor làn: histogram loop_tick_seconds{loop="lane_monitor"} lấy từ /metrics
+  - khóa broadcast_lock (nếu server bật APP_LOCK_PROFILE=1)
+Trong cả 2 pha, sensor làn được kích hoạt đều đặn qua /api/mock_gpio (chế độ Auto-Test) để luồng
+sensor thực sự gọi broadcast_log - đúng đường đi bị chặn khi client chậm làm send() treo.
+
+    python -m bench.ws_bench --clients 200 --slow 10 --duration 15 --out ws.json
+    python -m bench.ws_bench --server http://pi.local:3000 --clients 50   # Server có sẵn (không có CPU server)
+"""
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import socket
+import struct
+import tempfile
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from bench.common import environment_meta, latency_summary, write_json
+from core.metrics import Histogram
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TICK_METRIC = "pi_sorter_loop_tick_seconds"
+
+
+# ===========================================
+# CLIENT WEBSOCKET TỐI GIẢN (stdlib)
+# ===========================================
+
+class WSClient:
+    """Client RFC 6455 tối giản: bắt tay, gửi frame text có mask, đọc frame (không hỗ trợ nén)"""
+    def __init__(self, host: str, port: int, path: str = "/ws", auth: Optional[Tuple[str, str]] = None,
+                 rcvbuf: Optional[int] = None, timeout: float = 10.0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if rcvbuf: self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf) # Phải đặt trước connect
+        self.sock.settimeout(timeout)
+        self.sock.connect((host, port))
+        key = base64.b64encode(os.urandom(16)).decode()
+        headers = [f"GET {path} HTTP/1.1", f"Host: {host}:{port}", "Upgrade: websocket", "Connection: Upgrade",
+                   f"Sec-WebSocket-Key: {key}", "Sec-WebSocket-Version: 13"]
+        if auth: headers.append("Authorization: Basic " + base64.b64encode(f"{auth[0]}:{auth[1]}".encode()).decode())
+        self.sock.sendall(("\r\n".join(headers) + "\r\n\r\n").encode())
+        self._buf = b""
+        while b"\r\n\r\n" not in self._buf:
+            chunk = self.sock.recv(4096)
+            if not chunk: raise ConnectionError("Server đóng kết nối khi bắt tay")
+            self._buf += chunk
+        head, self._buf = self._buf.split(b"\r\n\r\n", 1)
+        if b" 101 " not in head.split(b"\r\n", 1)[0]:
+            raise ConnectionError(head.split(b"\r\n", 1)[0].decode(errors="replace"))
+        self.sock.settimeout(None)
+        self._send_lock = threading.Lock()
+
+    def _read_exact(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            chunk = self.sock.recv(max(4096, n - len(self._buf)))
+            if not chunk: raise ConnectionError("Mất kết nối")
+            self._buf += chunk
+        data, self._buf = self._buf[:n], self._buf[n:]
+        return data
+
+    def _send_frame(self, opcode: int, payload: bytes):
+        header = bytes([0x80 | opcode]); n = len(payload)
+        if n < 126: header += bytes([0x80 | n])
+        elif n < 65536: header += bytes([0x80 | 126]) + struct.pack("!H", n)
+        else: header += bytes([0x80 | 127]) + struct.pack("!Q", n)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        with self._send_lock: self.sock.sendall(header + mask + masked)
+
+    def send_json(self, data: dict):
+        self._send_frame(0x1, json.dumps(data).encode())
+
+    def recv(self) -> Optional[str]:
+        """Đọc 1 message text (tự trả lời ping); None khi server đóng"""
+        message = b""
+        while True:
+            b0, b1 = self._read_exact(2)
+            opcode = b0 & 0x0F; n = b1 & 0x7F
+            if n == 126: n = struct.unpack("!H", self._read_exact(2))[0]
+            elif n == 127: n = struct.unpack("!Q", self._read_exact(8))[0]
+            if b1 & 0x80: mask = self._read_exact(4)
+            payload = self._read_exact(n)
+            if b1 & 0x80: payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode == 0x8: return None
+            if opcode == 0x9: self._send_frame(0xA, payload); continue
+            if opcode == 0xA: continue
+            message += payload
+            if b0 & 0x80: return message.decode("utf-8", errors="replace")
+
+    def close(self):
+        try: self._send_frame(0x8, struct.pack("!H", 1000))
+        except OSError: pass
+        try: self.sock.close()
+        except OSError: pass
+
+
+class DashboardClient(threading.Thread):
+    """Dashboard giả: đọc liên tục (nhanh) hoặc mỗi `read_delay` giây 1 message (chậm, buffer nhận nhỏ)"""
+    def __init__(self, index: int, host: str, port: int, auth=None, read_delay: float = 0.0):
+        super().__init__(name=f"WSClient-{index}", daemon=True)
+        self.host, self.port, self.auth, self.read_delay = host, port, auth, read_delay
+        self.slow = read_delay > 0
+        self.samples: Dict[str, List[float]] = {"state_update": [], "log": []}
+        self.messages = 0; self.error: Optional[str] = None
+        self.connected = threading.Event()
+        self.recording = False
+        self._stop_event = threading.Event()
+        self.ws: Optional[WSClient] = None
+
+    def run(self):
+        try:
+            self.ws = WSClient(self.host, self.port, auth=self.auth, rcvbuf=4096 if self.slow else None)
+            self.connected.set()
+            while not self._stop_event.is_set():
+                text = self.ws.recv()
+                if text is None: self.error = "closed"; break
+                now = time.time(); self.messages += 1
+                if self.recording:
+                    try: data = json.loads(text)
+                    except ValueError: continue
+                    ts = data.get("ts")
+                    if ts and data.get("type") in self.samples: self.samples[data["type"]].append(now - ts)
+                if self.slow: time.sleep(self.read_delay)
+        except Exception as e:
+            if not self._stop_event.is_set(): self.error = str(e) or type(e).__name__
+        finally:
+            self.connected.set()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.ws: self.ws.close()
+
+
+# ===========================================
+# SERVER / SỐ LIỆU
+# ===========================================
+
+def _http(base_url: str, path: str, auth=None, payload: Optional[dict] = None, timeout: float = 5.0):
+    req = urllib.request.Request(base_url + path, data=json.dumps(payload).encode() if payload is not None else None,
+                                 headers={"Content-Type": "application/json"} if payload is not None else {})
+    if auth: req.add_header("Authorization", "Basic " + base64.b64encode(f"{auth[0]}:{auth[1]}".encode()).decode())
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return resp.read().decode()
+
+def start_local_server(port: int, lock_profile: bool = False):
+    """Chạy app.py trong thư mục tạm (bản sao config, camera synthetic, MockGPIO) - trả về (proc, workdir)"""
+    workdir = tempfile.mkdtemp(prefix="pi_wsbench_")
+    os.makedirs(os.path.join(workdir, "config"))
+    for src in (os.path.join(BASE_DIR, "config", "config.json"), os.path.join(BASE_DIR, "config.json")):
+        if os.path.exists(src): shutil.copy(src, os.path.join(workdir, "config", "config.json")); break
+    env = dict(os.environ, APP_CONFIG_DIR=os.path.join(workdir, "config"), APP_LOG_DIR=workdir,
+               APP_PORT=str(port), APP_CAMERA_SOURCE="synthetic", APP_AUTH_ENABLED="false",
+               APP_LOCK_PROFILE="1" if lock_profile else "0")
+    stderr = open(os.path.join(workdir, "server.err"), "w")
+    proc = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "app.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=stderr)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None: raise RuntimeError(f"Server thoát sớm, xem {workdir}/server.err")
+        try:
+            _http(f"http://127.0.0.1:{port}", "/api/perf"); return proc, workdir
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.3)
+    proc.kill(); raise RuntimeError("Server không phản hồi sau 30s")
+
+def stop_local_server(proc, workdir: str):
+    proc.terminate()
+    try: proc.wait(10)
+    except subprocess.TimeoutExpired: proc.kill()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def _proc_cpu_seconds(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f: stat = f.read()
+    except OSError:
+        return None
+    fields = stat[stat.rindex(")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def parse_histogram(text: str, name: str, labels: str) -> Tuple[Tuple[float, ...], List[int]]:
+    """Lấy bucket (không cộng dồn) của 1 series histogram trong text Prometheus"""
+    cumulative = []
+    prefix = f"{name}_bucket{{{labels},le=\""
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            le, value = line[len(prefix):].split('"} ')
+            cumulative.append((float("inf") if le == "+Inf" else float(le), int(float(value))))
+    bounds = tuple(b for b, _ in cumulative if b != float("inf"))
+    counts = [c - (cumulative[i - 1][1] if i else 0) for i, (_, c) in enumerate(cumulative)]
+    return bounds, counts
+
+def tick_summary(before: Tuple[tuple, List[int]], after: Tuple[tuple, List[int]]) -> dict:
+    """p50/p99 thời gian 1 vòng lặp sensor trong khoảng giữa 2 lần đọc /metrics"""
+    bounds, counts_after = after
+    counts_before = before[1] if before[1] else [0] * len(counts_after)
+    if not bounds: return {"count": 0}
+    counts = [a - b for a, b in zip(counts_after, counts_before)]
+    total = sum(counts); hist = Histogram("tick", "", buckets=bounds)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    over = lambda limit: sum(c for b, c in zip(bounds + (float("inf"),), counts) if b > limit)
+    return {"count": total, "p50_ms": ms(hist.quantile(counts, total, 0.50)), "p99_ms": ms(hist.quantile(counts, total, 0.99)),
+            "over_10ms": over(0.01), "over_50ms": over(0.05)}
+
+
+class Stimulus(threading.Thread):
+    """Bật/tắt sensor làn qua /api/mock_gpio theo chu kỳ (chỉ khi server dùng MockGPIO)"""
+    def __init__(self, base_url: str, auth, lane_index: int = 0, interval: float = 0.25):
+        super().__init__(name="Stimulus", daemon=True)
+        self.base_url, self.auth, self.lane_index, self.interval = base_url, auth, lane_index, interval
+        self.sent = 0; self.errors = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                _http(self.base_url, "/api/mock_gpio", self.auth, {"lane_index": self.lane_index}); self.sent += 1
+            except (urllib.error.URLError, OSError):
+                self.errors += 1
+
+    def stop(self):
+        self._stop_event.set(); self.join()
+
+
+def run_phase(name: str, base_url: str, auth, pid: Optional[int], duration: float,
+              clients: List[DashboardClient]) -> dict:
+    metrics_before = parse_histogram(_http(base_url, "/metrics", auth), TICK_METRIC, 'loop="lane_monitor"')
+    try: _http(base_url, "/api/locks?reset=1", auth)
+    except (urllib.error.URLError, OSError): pass
+    cpu_before = _proc_cpu_seconds(pid) if pid else None
+    for c in clients: c.recording = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    wall = time.perf_counter() - start
+    for c in clients: c.recording = False
+    cpu_after = _proc_cpu_seconds(pid) if pid else None
+    metrics_after = parse_histogram(_http(base_url, "/metrics", auth), TICK_METRIC, 'loop="lane_monitor"')
+
+    result = {"name": name, "duration_s": round(wall, 2),
+              "clients": {"fast": sum(not c.slow for c in clients), "slow": sum(c.slow for c in clients),
+                          "errors": sum(1 for c in clients if c.error)},
+              "lane_tick": tick_summary(metrics_before, metrics_after)}
+    for kind in ("fast", "slow"):
+        group = [c for c in clients if c.slow == (kind == "slow")]
+        if not group: continue
+        result[f"{kind}_latency_ms"] = {t: latency_summary(v for c in group for v in c.samples[t])
+                                        for t in ("state_update", "log")}
+    if cpu_before is not None and cpu_after is not None:
+        result["server_cpu_percent"] = round((cpu_after - cpu_before) / wall * 100, 1)
+    try:
+        locks = json.loads(_http(base_url, "/api/locks", auth))
+        broadcast = next((l for l in locks.get("locks", []) if l["name"] == "broadcast_lock"), None)
+        if broadcast:
+            result["broadcast_lock"] = {k: broadcast[k] for k in ("acquisitions", "contended", "wait_max_ms",
+                                                                  "wait_max_thread", "hold_avg_ms", "hold_max_ms")}
+    except (urllib.error.URLError, OSError, ValueError):
+        pass
+    for c in clients:
+        for samples in c.samples.values(): samples.clear()
+    return result
+
+
+def run_bench(base_url: str, num_clients: int, num_slow: int, duration: float, slow_delay: float = 1.0,
+              auth=None, pid: Optional[int] = None, stimulus_interval: float = 0.25) -> dict:
+    url = urlparse(base_url); host, port = url.hostname, url.port or 80
+    control = DashboardClient(0, host, port, auth); control.start(); control.connected.wait(10)
+    if control.error: raise RuntimeError(f"Không kết nối được /ws: {control.error}")
+
+    stimulus = None
+    try:
+        _http(base_url, "/api/mock_gpio", auth, {"lane_index": 0, "state": 1})
+        control.ws.send_json({"action": "toggle_auto_test", "enabled": True})
+        stimulus = Stimulus(base_url, auth, interval=stimulus_interval); stimulus.start()
+    except urllib.error.HTTPError:
+        pass # Không phải MockGPIO -> không giả lập sensor (tránh đẩy relay thật)
+
+    phases = []
+    try:
+        phases.append(run_phase("baseline", base_url, auth, pid, duration, [control]))
+        clients = [DashboardClient(i + 1, host, port, auth, read_delay=slow_delay if i < num_slow else 0.0)
+                   for i in range(num_clients)]
+        connect_start = time.perf_counter()
+        for c in clients: c.start()
+        for c in clients: c.connected.wait(10)
+        connect_s = time.perf_counter() - connect_start
+        try:
+            loaded = run_phase("loaded", base_url, auth, pid, duration, [control] + clients)
+            loaded["connect_s"] = round(connect_s, 2)
+            phases.append(loaded)
+        finally:
+            for c in clients: c.stop()
+    finally:
+        if stimulus:
+            stimulus.stop()
+            try: control.ws.send_json({"action": "toggle_auto_test", "enabled": False})
+            except OSError: pass
+        control.stop()
+    return {"meta": {**environment_meta(), "server": base_url, "clients": num_clients, "slow_clients": num_slow,
+                     "slow_read_delay_s": slow_delay, "duration_s": duration,
+                     "stimulus_events": stimulus.sent if stimulus else 0},
+            "phases": {p["name"]: p for p in phases}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark broadcast WebSocket với nhiều dashboard giả")
+    parser.add_argument("--clients", type=int, default=100, help="Số client thêm vào ở pha có tải")
+    parser.add_argument("--slow", type=int, default=5, help="Số client trong đó đọc chậm")
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="Client chậm: giây chờ giữa 2 lần đọc")
+    parser.add_argument("--duration", type=float, default=15.0, help="Thời gian mỗi pha (giây)")
+    parser.add_argument("--stimulus-interval", type=float, default=0.25, help="Chu kỳ bật/tắt sensor giả (giây)")
+    parser.add_argument("--server", help="URL server có sẵn (mặc định: tự chạy app.py cục bộ)")
+    parser.add_argument("--port", type=int, default=3901, help="Cổng cho server cục bộ")
+    parser.add_argument("--user"); parser.add_argument("--password")
+    parser.add_argument("--lock-profile", action="store_true", help="Bật APP_LOCK_PROFILE cho server cục bộ")
+    parser.add_argument("--out", help="Ghi kết quả JSON ra file (mặc định: stdout)")
+    args = parser.parse_args(argv)
+    if args.slow > args.clients: parser.error("--slow không được lớn hơn --clients")
+
+    auth = (args.user, args.password) if args.user else None
+    proc = workdir = None
+    if args.server:
+        base_url = args.server.rstrip("/")
+    else:
+        proc, workdir = start_local_server(args.port, args.lock_profile)
+        base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        result = run_bench(base_url, args.clients, args.slow, args.duration, args.slow_delay, auth,
+                           proc.pid if proc else None, args.stimulus_interval)
+    finally:
+        if proc: stop_local_server(proc, workdir)
+    write_json(result, args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
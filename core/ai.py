@@ -1,23 +1,15 @@
 # core/ai.py
-import cv2
-import numpy as np
-from typing import Tuple, Optional
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Tuple, Optional
 import logging
 
-YOLO_AVAILABLE = False
-DEEPSORT_AVAILABLE = False
+if TYPE_CHECKING:
+    import numpy as np
 
-try:
-    from ultralytics import YOLO
-    YOLO_AVAILABLE = True
-except ImportError:
-    pass
-
-try:
-    from deep_sort_realtime.deepsort_tracker import DeepSort
-    DEEPSORT_AVAILABLE = True
-except ImportError:
-    pass
+# Chỉ kiểm tra gói có cài hay không; ultralytics (torch) / deep_sort_realtime được import lúc tạo AIDetector
+# (mất nhiều giây trên Pi - không để chặn khởi động khi enable_ai = false)
+YOLO_AVAILABLE = find_spec("ultralytics") is not None
+DEEPSORT_AVAILABLE = find_spec("deep_sort_realtime") is not None
 
 class AIDetector:
     def __init__(self, model_path: str, ai_config: dict):
@@ -31,6 +23,7 @@ class AIDetector:
             return
 
         try:
+            from ultralytics import YOLO
             self.model = YOLO(model_path)
             self._init_tracker(ai_config)
             logging.info(f"[AI] Loaded {model_path}")
@@ -42,6 +35,7 @@ class AIDetector:
         if not DEEPSORT_AVAILABLE or not ai_config.get('enable_deepsort', False):
             return
         try:
+            from deep_sort_realtime.deepsort_tracker import DeepSort
             self.tracker = DeepSort(
                 max_age=ai_config.get('deepsort_max_age', 30),
                 n_init=ai_config.get('deepsort_n_init', 3),
@@ -50,7 +44,7 @@ class AIDetector:
         except Exception as e:
             logging.error(f"[DEEPSORT] Init failed: {e}")
 
-    def detect(self, frame: np.ndarray) -> Tuple[int, Optional[str], Optional[int]]:
+    def detect(self, frame: "np.ndarray") -> Tuple[int, Optional[str], Optional[int]]:
         if not self.enabled or self.model is None:
             return -1, None, None
 
@@ -73,12 +67,23 @@ class AIDetector:
             if best:
                 track_id = best.track_id
 
+        class_name, _ = self._best_class(result)
+        if class_name is None:
+            return -1, None, None
+
+        lane_idx = self.lane_map.get(class_name, -1)
+        return lane_idx, class_name, track_id
+
+    def classify(self, image: "np.ndarray") -> Tuple[Optional[str], float]:
+        """Chỉ lấy lớp tốt nhất (không cập nhật DeepSORT) - dùng cho ảnh cắt theo track của luồng tracker"""
+        if not self.enabled or self.model is None:
+            return None, 0.0
+        return self._best_class(self.model.predict(image, conf=self.min_conf, verbose=False)[0])
+
+    def _best_class(self, result) -> Tuple[Optional[str], float]:
         high_conf = result.boxes.conf > self.min_conf
         if not high_conf.any():
-            return -1, None, None
+            return None, 0.0
         best_idx = result.boxes.conf[high_conf].argmax()
         cls_id = int(result.boxes.cls[high_conf][best_idx])
-        class_name = result.names[cls_id].upper()
-
-        lane_idx = self.lane_map.get(class_name, -1)
-        return lane_idx, class_name, track_id
\ No newline at end of file
+        return result.names[cls_id].upper(), float(result.boxes.conf[high_conf][best_idx])
\ No newline at end of file
@@ -0,0 +1,117 @@
+# pi/core/config_store.py
+import json
+import time
+import copy
+import threading
+from typing import Optional
+from .utils import write_file_atomic
+
+
+class ConfigStore:
+    """
+    Lưu config.json theo kiểu "chỉ ghi khi có thay đổi".
+    - submit() chỉ ghi nhận bản config mới nhất + tăng version (không đụng file).
+    - Luồng lưu gom các lần submit liên tiếp (debounce) rồi ghi 1 lần duy nhất,
+      nguyên tử (file tạm + fsync + os.replace), và bỏ qua nếu nội dung không đổi.
+    """
+    def __init__(self, path: str, debounce: float = 0.5, max_delay: float = 5.0):
+        self.path = path
+        self.debounce = debounce        # Chờ yên lặng bao lâu sau lần submit cuối
+        self.max_delay = max_delay      # Không hoãn quá lâu nếu submit liên tục
+
+        self.version = 0                # Tăng mỗi lần submit
+        self.saved_version = 0          # Version đã nằm trên đĩa
+        self.write_count = 0
+        self.skip_count = 0
+        self.last_error: Optional[str] = None
+
+        self._pending: Optional[dict] = None
+        self._first_dirty_at = 0.0
+        self._last_dirty_at = 0.0
+        self._lock = threading.Lock()
+        self._dirty_event = threading.Event()
+        self._last_text = self._read_current_text()
+
+    def _read_current_text(self) -> Optional[str]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def serialize(config_data: dict) -> str:
+        return json.dumps(config_data, indent=4)
+
+    # ===========================================
+    # GHI NHẬN THAY ĐỔI
+    # ===========================================
+
+    def submit(self, config_data: dict) -> int:
+        """Đánh dấu config đã đổi (rẻ, gọi được trong request API)"""
+        snapshot = copy.deepcopy(config_data)
+        now = time.monotonic()
+        with self._lock:
+            if not self.is_dirty():
+                self._first_dirty_at = now
+            self._last_dirty_at = now
+            self._pending = snapshot
+            self.version += 1
+            version = self.version
+        self._dirty_event.set()
+        return version
+
+    def is_dirty(self) -> bool:
+        return self.version != self.saved_version
+
+    def wait_dirty(self, timeout: float = 1.0) -> bool:
+        if not self._dirty_event.wait(timeout): return False
+        with self._lock:
+            if self.is_dirty(): return True
+            self._dirty_event.clear()
+            return False
+
+    def ready_to_flush(self, now: Optional[float] = None) -> bool:
+        """Hết thời gian debounce (hoặc đã hoãn quá max_delay)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self.is_dirty(): return False
+            return (now - self._last_dirty_at >= self.debounce
+                    or now - self._first_dirty_at >= self.max_delay)
+
+    # ===========================================
+    # GHI FILE
+    # ===========================================
+
+    def flush(self) -> bool:
+        """Ghi bản config mới nhất nếu khác nội dung trên đĩa. Trả về True nếu đã ghi file."""
+        with self._lock:
+            if not self.is_dirty(): return False
+            pending = self._pending; version = self.version
+            self._dirty_event.clear()
+        text = self.serialize(pending)
+        if text == self._last_text:
+            self.skip_count += 1
+            self._mark_saved(version)
+            return False
+        try:
+            write_file_atomic(self.path, text)
+        except Exception as e:
+            self.last_error = str(e)
+            self._dirty_event.set() # Giữ trạng thái dirty để thử lại
+            raise
+        self._last_text = text
+        self.write_count += 1
+        self.last_error = None
+        self._mark_saved(version)
+        return True
+
+    def _mark_saved(self, version: int):
+        with self._lock:
+            self.saved_version = max(self.saved_version, version)
+            if self.is_dirty(): self._dirty_event.set() # Có submit mới trong lúc ghi
+
+    def write_now(self, config_data: dict) -> bool:
+        """Ghi ngay (dùng khi tạo file config mặc định lúc khởi động)"""
+        self.submit(config_data)
+        return self.flush()
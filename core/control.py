@@ -0,0 +1,327 @@
+# pi/core/control.py
+"""
+Chế độ tách tiến trình (APP_SPLIT_PROCESS=1).
+
+- Tiến trình điều khiển (python -m core.control): SortingSystem đầy đủ - GPIO, hàng chờ, relay, camera, AI, VPS.
+  ControlServer nhận lệnh qua Unix socket, đẩy message WS (state/log) sang tiến trình web và ghi frame
+  mới nhất vào shared memory (core/ipc.py).
+- Tiến trình web (app.py): SystemProxy thay cho SortingSystem, cùng các hàm mà route đang gọi nhưng qua RPC.
+  Encode JPEG cho /video_feed, HTTP và gửi WS tới từng client chạy ở đây, không còn tranh GIL với vòng sensor/relay.
+SystemProxy tự khởi động (và khởi động lại nếu chết) tiến trình điều khiển.
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import socket
+import logging
+import argparse
+import functools
+import threading
+import subprocess
+from typing import Optional
+
+from .ipc import KIND_EVENT, KIND_REQUEST, KIND_RESPONSE, SharedFrame, recv_json, recv_packet, send_json, send_packet
+from .frames import CapturedFrame
+from .system import BASE_DIR, LOG_DIR
+
+SPLIT_PROCESS = os.environ.get("APP_SPLIT_PROCESS", "false").strip().lower() in {"1", "true", "yes", "on"}
+CONTROL_SOCKET = os.environ.get("APP_CONTROL_SOCKET", os.path.join(LOG_DIR, "control.sock"))
+FRAME_SHM_NAME = os.environ.get("APP_FRAME_SHM", "pi_qr_frame")
+CONTROL_LOG_FILE = os.path.join(LOG_DIR, "control.log")
+
+# Các hàm SortingSystem được gọi từ route của app.py
+RPC_METHODS = (
+    "get_full_state", "get_config_for_json", "get_sort_log_etag", "get_sort_log_data",
+    "get_sort_events", "get_sort_events_summary", "update_config", "reset_maintenance_mode",
+    "reset_queues", "mock_gpio_sensor", "get_metrics_text", "get_perf_summary", "get_lock_report",
+    "get_vps_stats", "handle_ws_message",
+)
+PEER_SEND_TIMEOUT = 2.0   # Tiến trình web treo -> bỏ kết nối sự kiện, không giữ broadcast_lock lâu
+FRAME_PUBLISH_FPS = 30.0
+STATUS_CACHE_TTL = 0.5
+
+
+# ===========================================
+# TIẾN TRÌNH ĐIỀU KHIỂN
+# ===========================================
+
+class _EventPeer:
+    """
+    Đại diện tiến trình web trong system.ws_clients: broadcast thread/broadcast_log gọi send() như với 1 WS.
+    Kết nối chỉ dùng để ghi (không recv), giữ timeout PEER_SEND_TIMEOUT: web treo -> send() lỗi sau tối đa 2s,
+    broadcast bỏ peer này (đóng kết nối, web tự nối lại).
+    """
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self.lock = threading.Lock()
+        conn.settimeout(PEER_SEND_TIMEOUT)
+
+    def send(self, message: str):
+        with self.lock:
+            try: send_packet(self.conn, KIND_EVENT, message.encode("utf-8"))
+            except OSError: # Gồm socket.timeout - packet có thể đã ghi dở, không dùng lại kết nối
+                self.close(); raise
+
+    def close(self):
+        try: self.conn.close()
+        except OSError: pass
+
+
+class ControlServer:
+    def __init__(self, system, socket_path: str = CONTROL_SOCKET, shm_name: str = FRAME_SHM_NAME):
+        self.system = system
+        self.socket_path = socket_path
+        self.frames = SharedFrame(shm_name, create=True)
+        self.shutdown_event = threading.Event()
+        self._sock: Optional[socket.socket] = None
+
+    def start(self):
+        if os.path.exists(self.socket_path): os.remove(self.socket_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.socket_path); self._sock.listen(16)
+        threading.Thread(target=self._accept_loop, name="ControlAccept", daemon=True).start()
+        threading.Thread(target=self._publish_frames, name="FramePublisher", daemon=True).start()
+        logging.info(f"[CONTROL] Đang nghe lệnh tại {self.socket_path}, frame -> shm '{self.frames.name}'")
+
+    def stop(self):
+        try: self._sock.close()
+        except Exception: pass
+        if os.path.exists(self.socket_path): os.remove(self.socket_path)
+        self.frames.close()
+
+    def _accept_loop(self):
+        while not self.shutdown_event.is_set():
+            try: conn, _ = self._sock.accept()
+            except OSError: break
+            threading.Thread(target=self._serve, args=(conn,), name="ControlConn", daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        try:
+            while True:
+                kind, request = recv_json(conn)
+                if kind != KIND_REQUEST: continue
+                method = request.get("method")
+                if method == "subscribe": # Từ giờ kết nối này chỉ dùng để đẩy sự kiện, _EventPeer giữ kết nối
+                    self.system.add_ws_client(_EventPeer(conn)); conn = None; return
+                try: response = {"result": self._dispatch(method, request.get("args") or [])}
+                except Exception as e:
+                    logging.error(f"[CONTROL] Lỗi xử lý lệnh '{method}': {e}", exc_info=True)
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                send_json(conn, KIND_RESPONSE, response)
+        except (ConnectionError, OSError, ValueError): pass
+        finally:
+            if conn is not None: conn.close()
+
+    def _dispatch(self, method, args):
+        if method == "status":
+            return {"running": self.system.main_loop_running, "maintenance": self.system.error_manager.is_maintenance(),
+                    "fps": self.system.fps_value}
+        if method == "shutdown":
+            self.shutdown_event.set(); return True
+        if method not in RPC_METHODS: raise ValueError(f"Lệnh không hỗ trợ: {method}")
+        return getattr(self.system, method)(*args)
+
+    def _publish_frames(self):
+        """Chép frame mới nhất vào shared memory (tối đa FRAME_PUBLISH_FPS lần/giây)"""
+        last_seq = 0; warned = False
+        while not self.shutdown_event.is_set():
+            frame, seq = self.system.get_latest_frame("ipc", reject_stale=False, after_seq=last_seq, copy=False)
+            if frame is not None:
+                if not self.frames.write(frame, seq, self.system.fps_value) and not warned:
+                    logging.warning(f"[CONTROL] Frame {frame.shape} vượt kích thước shared memory, không gửi sang web.")
+                    warned = True
+                last_seq = seq
+            else:
+                self.frames.set_fps(self.system.fps_value)
+            time.sleep(1.0 / FRAME_PUBLISH_FPS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiến trình điều khiển (GPIO/hàng chờ/relay) cho chế độ tách tiến trình")
+    parser.add_argument("--socket", default=CONTROL_SOCKET)
+    parser.add_argument("--shm", default=FRAME_SHM_NAME)
+    parser.add_argument("--parent-pid", type=int, default=None, help="Tự dừng khi tiến trình web này chết")
+    args = parser.parse_args(argv)
+
+    from .system import SortingSystem
+    from .logging_setup import setup_logging, stop_logging
+    os.makedirs(LOG_DIR, exist_ok=True)
+    setup_logging(CONTROL_LOG_FILE, queue_size=int(os.environ.get("APP_LOG_QUEUE_SIZE", "10000")),
+                  rate_limit_interval=float(os.environ.get("APP_LOG_RATE_LIMIT", "5.0")))
+
+    system = SortingSystem()
+    system.system_state["auth_enabled"] = os.environ.get("APP_AUTH_ENABLED", "false").strip().lower() in {"1", "true", "yes", "on"}
+    server = ControlServer(system, args.socket, args.shm)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: server.shutdown_event.set())
+    server.start()
+    threading.Thread(target=system.run, name="SystemMainLoop", daemon=True).start()
+    try:
+        while not server.shutdown_event.wait(1.0):
+            if not system.main_loop_running: break
+            if args.parent_pid and os.getppid() != args.parent_pid:
+                logging.warning("[CONTROL] Tiến trình web đã thoát, dừng tiến trình điều khiển."); break
+    finally:
+        logging.info("[CONTROL] Dừng tiến trình điều khiển...")
+        system.stop()
+        server.stop()
+        stop_logging()
+    return 0
+
+
+# ===========================================
+# TIẾN TRÌNH WEB
+# ===========================================
+
+def _plain(arg):
+    """request.args (MultiDict) -> dict thường (giá trị đầu tiên mỗi khóa) để serialize JSON"""
+    return dict(arg.items()) if hasattr(arg, "items") else arg
+
+
+class _RemoteErrorManager:
+    def __init__(self, proxy: "SystemProxy"):
+        self.proxy = proxy
+
+    def is_maintenance(self):
+        return self.proxy.status().get("maintenance", False)
+
+
+class SystemProxy:
+    """Thay SortingSystem trong tiến trình web: các hàm route -> RPC, frame -> shared memory, WS phát tại chỗ"""
+    def __init__(self, socket_path: str = CONTROL_SOCKET, shm_name: str = FRAME_SHM_NAME, spawn: bool = True):
+        self.socket_path = socket_path
+        self.shm_name = shm_name
+        self.spawn = spawn
+        self.system_state = {"auth_enabled": False}
+        self.ws_clients = set()
+        self.ws_lock = threading.Lock()
+        self.broadcast_lock = threading.Lock()
+        self.main_loop_running = True
+        self.error_manager = _RemoteErrorManager(self)
+        self.process: Optional[subprocess.Popen] = None
+        self._pool: "queue.LifoQueue[socket.socket]" = queue.LifoQueue()
+        self._frames: Optional[SharedFrame] = None
+        self._status = {}; self._status_ts = 0.0
+
+    def __getattr__(self, name):
+        if name in RPC_METHODS: return functools.partial(self.call, name)
+        raise AttributeError(name)
+
+    def _connect(self, timeout: float = 10.0) -> socket.socket:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(timeout); conn.connect(self.socket_path)
+        return conn
+
+    def call(self, method, *args):
+        try: conn = self._pool.get_nowait()
+        except queue.Empty: conn = self._connect()
+        try:
+            send_json(conn, KIND_REQUEST, {"method": method, "args": [_plain(a) for a in args]})
+            _, response = recv_json(conn)
+        except Exception:
+            conn.close(); raise
+        self._pool.put(conn)
+        if "error" in response: raise RuntimeError(f"[CONTROL] {method}: {response['error']}")
+        return response["result"]
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        if now - self._status_ts > STATUS_CACHE_TTL:
+            try: self._status = self.call("status")
+            except Exception: self._status = {"running": False, "maintenance": False, "fps": 0.0}
+            self._status_ts = now
+        return self._status
+
+    # --- Camera (shared memory) ---
+    def _frame_slot(self) -> Optional[SharedFrame]:
+        if self._frames is None:
+            try: self._frames = SharedFrame(self.shm_name)
+            except FileNotFoundError: return None
+        return self._frames
+
+    @property
+    def fps_value(self) -> float:
+        slot = self._frame_slot()
+        return slot.fps() if slot else 0.0
+
+    def get_latest_frame(self, consumer, reject_stale=True, after_seq=None, kind="bgr", copy=True):
+        slot = self._frame_slot()
+        frame, seq = slot.read(after_seq) if slot else (None, 0) # read() luôn trả bản sao
+        if frame is not None and kind == "gray": frame = CapturedFrame(frame).gray()
+        return frame, seq
+
+    # --- WebSocket (client nằm ở tiến trình web) ---
+    def add_ws_client(self, ws):
+        with self.ws_lock: self.ws_clients.add(ws)
+        logging.info(f"[WS] Client kết nối. Tổng: {len(self.ws_clients)}")
+
+    def remove_ws_client(self, ws):
+        with self.ws_lock: self.ws_clients.discard(ws)
+        logging.info(f"[WS] Client ngắt kết nối. Còn lại: {len(self.ws_clients)}")
+
+    def _event_loop(self):
+        """Nhận message WS đã serialize từ tiến trình điều khiển và phát cho các client"""
+        while self.main_loop_running:
+            try:
+                conn = self._connect(); send_json(conn, KIND_REQUEST, {"method": "subscribe"}); conn.settimeout(None)
+                while self.main_loop_running:
+                    kind, payload = recv_packet(conn)
+                    if kind != KIND_EVENT: continue
+                    message = payload.decode("utf-8")
+                    with self.ws_lock: clients_to_send = list(self.ws_clients)
+                    with self.broadcast_lock:
+                        for client in clients_to_send:
+                            try: client.send(message)
+                            except Exception: self.remove_ws_client(client)
+            except (ConnectionError, OSError) as e:
+                if self.main_loop_running:
+                    logging.warning(f"[CONTROL] Mất kết nối sự kiện tới tiến trình điều khiển: {e}. Thử lại...")
+                    time.sleep(1.0)
+
+    # --- Vòng đời ---
+    def _spawn(self):
+        cmd = [sys.executable, "-m", "core.control", "--socket", self.socket_path, "--shm", self.shm_name, "--parent-pid", str(os.getpid())]
+        # Phiên riêng: Ctrl+C ở terminal chỉ tới tiến trình web, web sẽ dừng tiến trình điều khiển qua lệnh "shutdown"
+        self.process = subprocess.Popen(cmd, cwd=BASE_DIR, start_new_session=True)
+        logging.info(f"[CONTROL] Đã khởi động tiến trình điều khiển (PID {self.process.pid}).")
+
+    def _wait_ready(self, timeout: float = 30.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self.main_loop_running:
+            try: self._connect(1.0).close(); return True
+            except OSError: time.sleep(0.2)
+        return False
+
+    def run(self):
+        """Thay SortingSystem.run: khởi động + giám sát tiến trình điều khiển, chuyển tiếp sự kiện WS"""
+        if self.spawn: self._spawn()
+        if not self._wait_ready():
+            logging.critical(f"[CONTROL] Tiến trình điều khiển không phản hồi tại {self.socket_path}.")
+        threading.Thread(target=self._event_loop, name="ControlEvents", daemon=True).start()
+        while self.main_loop_running:
+            time.sleep(1.0)
+            if self.process and self.process.poll() is not None and self.main_loop_running:
+                logging.error(f"[CONTROL] Tiến trình điều khiển đã thoát (mã {self.process.returncode}). Khởi động lại...")
+                if self._frames: self._frames.close(); self._frames = None # Tiến trình mới tạo lại ô shared memory
+                self._spawn(); self._wait_ready()
+
+    def stop(self):
+        if not self.main_loop_running: return
+        self.main_loop_running = False
+        try: self.call("shutdown")
+        except Exception: pass
+        if self.process:
+            try: self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                logging.warning("[CONTROL] Tiến trình điều khiển không tự dừng, gửi SIGTERM.")
+                self.process.terminate()
+                try: self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired: self.process.kill()
+        while not self._pool.empty(): self._pool.get_nowait().close()
+        if self._frames: self._frames.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
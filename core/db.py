@@ -0,0 +1,327 @@
+# pi/core/db.py
+import sqlite3
+import threading
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Tuple, Optional, List, Any
+
+# Cột của bảng sort_events (1 dòng / vật phẩm)
+SORT_EVENT_COLUMNS = (
+    "job_id", "entry_ts", "lane_index", "lane_name", "source", "status",
+    "decode_latency", "sensor_ts", "actuation_ts", "done_ts", "outcome"
+)
+
+
+def open_connection(db_path: str) -> sqlite3.Connection:
+    """Mở kết nối SQLite ở chế độ WAL (đọc/ghi đồng thời, ít fsync hơn)"""
+    conn = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# Bảng tổng hợp (rollup) theo độ phân giải: (tên bảng, cột bucket).
+# sort_log chính là rollup theo ngày (giữ nguyên schema cũ).
+ROLLUP_TABLES = {
+    "hour": ("sort_rollup_hour", "bucket"),
+    "day": ("sort_log", "date"),
+    "week": ("sort_rollup_week", "bucket"),
+}
+
+def rollup_buckets(when: datetime) -> Dict[str, str]:
+    """Khóa bucket của 1 thời điểm cho từng độ phân giải (tuần bắt đầu từ thứ Hai)"""
+    return {
+        "hour": when.strftime('%Y-%m-%d %H:00'),
+        "day": when.strftime('%Y-%m-%d'),
+        "week": (when - timedelta(days=when.weekday())).strftime('%Y-%m-%d'),
+    }
+
+def rollup_query_key(granularity: Optional[str] = "day", since: Optional[float] = None,
+                     until: Optional[float] = None) -> Tuple[str, Optional[str], Optional[str]]:
+    """Tham số truy vấn rollup đã chuẩn hóa (granularity, bucket since, bucket until): cùng khóa = cùng kết quả"""
+    granularity = granularity or "day"
+    if granularity not in ROLLUP_TABLES:
+        raise ValueError(f"granularity phải là một trong {sorted(ROLLUP_TABLES)}")
+    bucket = lambda ts: rollup_buckets(datetime.fromtimestamp(ts))[granularity] if ts is not None else None
+    return granularity, bucket(since), bucket(until)
+
+def init_schema(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sort_log (
+        date TEXT, lane_name TEXT, count INTEGER DEFAULT 0,
+        PRIMARY KEY (date, lane_name)
+    )""")
+    for table, col in (ROLLUP_TABLES["hour"], ROLLUP_TABLES["week"]):
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {col} TEXT, lane_name TEXT, count INTEGER DEFAULT 0,
+            PRIMARY KEY ({col}, lane_name)
+        )""")
+    # Lần đầu nâng cấp: dựng rollup tuần từ dữ liệu ngày sẵn có
+    if conn.execute("SELECT 1 FROM sort_rollup_week LIMIT 1").fetchone() is None:
+        conn.execute("""
+        INSERT INTO sort_rollup_week (bucket, lane_name, count)
+        SELECT date(date, '-' || ((CAST(strftime('%w', date) AS INTEGER) + 6) % 7) || ' days') AS week,
+               lane_name, SUM(count)
+        FROM sort_log GROUP BY week, lane_name""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sort_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT, entry_ts REAL, lane_index INTEGER, lane_name TEXT,
+        source TEXT, status TEXT, decode_latency REAL,
+        sensor_ts REAL, actuation_ts REAL, done_ts REAL, outcome TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sort_events_ts ON sort_events (entry_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sort_events_lane_ts ON sort_events (lane_name, entry_ts)")
+    conn.commit()
+
+
+class SortLogWriter:
+    """
+    Luồng ghi CSDL duy nhất cho sort_log (+ rollup giờ/tuần) và sort_events.
+    Giữ 1 kết nối WAL lâu dài, cộng dồn số đếm / sự kiện trong RAM và ghi theo lô
+    (mỗi `flush_interval` giây hoặc khi đủ `max_pending` sự kiện).
+    `data_version` tăng sau mỗi lô ghi thành công (dùng làm ETag cho API).
+    """
+    def __init__(self, db_path: str, flush_interval: float = 1.0, max_pending: int = 50,
+                 hour_retention_days: float = 31.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.hour_retention_days = hour_retention_days # sort_rollup_hour chỉ giữ ngần này ngày (ngày/tuần giữ hết)
+        self._next_prune = 0.0
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[Tuple[str, str, str], int] = {} # (granularity, bucket, lane) -> n
+        self._pending_rows: List[tuple] = []
+        self._pending_events = 0
+        self._lock = threading.Lock()        # Bảo vệ bộ đệm RAM
+        self._write_lock = threading.Lock()  # Tuần tự hóa ghi trên kết nối
+        self._wake = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.flush_count = 0
+        self.last_flush_error = None
+        self.instance_id = uuid.uuid4().hex[:8]
+        self.data_version = 0
+        self.count_version = 0 # Tăng mỗi lần increment(): tổng (CSDL + bộ đệm) chỉ đổi khi số này đổi
+
+    def open(self):
+        with self._write_lock:
+            if self._conn is not None: return
+            self._conn = open_connection(self.db_path)
+            init_schema(self._conn)
+
+    def start(self):
+        if self._running: return
+        self.open()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="DBWriterThread", daemon=True)
+        self._thread.start()
+        logging.info(f"[DB] Luồng ghi CSDL (WAL) đã khởi động (flush {self.flush_interval}s / {self.max_pending} sự kiện).")
+
+    def stop(self):
+        """Dừng luồng ghi, flush phần còn lại và đóng kết nối"""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.flush()
+        with self._write_lock:
+            if self._conn is not None:
+                try: self._conn.close()
+                except Exception: pass
+                self._conn = None
+        logging.info(f"[DB] Đã dừng luồng ghi CSDL (tổng {self.flush_count} lô).")
+
+    def increment(self, lane_name: str, n: int = 1, when: Optional[datetime] = None):
+        """Cộng dồn số đếm trong RAM cho mọi rollup (không I/O, an toàn gọi trong state_lock)"""
+        buckets = rollup_buckets(when or datetime.now())
+        with self._lock:
+            for granularity, bucket in buckets.items():
+                key = (granularity, bucket, lane_name)
+                self._pending[key] = self._pending.get(key, 0) + n
+            self._pending_events += 1
+            self.count_version += 1
+            if self._pending_events >= self.max_pending:
+                self._wake.set()
+
+    def log_event(self, event: Dict[str, Any]):
+        """Thêm 1 dòng sort_events vào bộ đệm (append-only)"""
+        row = tuple(event.get(col) for col in SORT_EVENT_COLUMNS)
+        with self._lock:
+            self._pending_rows.append(row)
+            self._pending_events += 1
+            if self._pending_events >= self.max_pending:
+                self._wake.set()
+
+    def pending_snapshot(self, granularity: str = "day") -> Dict[Tuple[str, str], int]:
+        with self._lock:
+            return {(bucket, lane): n for (g, bucket, lane), n in self._pending.items() if g == granularity}
+
+    def query_rollup(self, granularity: Optional[str] = "day", since: Optional[float] = None,
+                     until: Optional[float] = None) -> Dict[str, Dict[str, int]]:
+        """Như query_sort_rollup nhưng cộng cả số đếm chưa ghi (khớp chính xác bộ đếm lane, không trễ 1 lô)"""
+        granularity, lo, hi = rollup_query_key(granularity, since, until)
+        with self._write_lock: # Không có lô nào đang ghi giữa lúc chụp bộ đệm và đọc CSDL (đọc rollup rất nhanh)
+            pending = self.pending_snapshot(granularity)
+            data = query_sort_rollup(self.db_path, granularity, since, until)
+        for (bucket, lane), n in pending.items():
+            if (lo is None or bucket >= lo) and (hi is None or bucket <= hi):
+                lanes = data.setdefault(bucket, {}); lanes[lane] = lanes.get(lane, 0) + n
+        return dict(sorted(data.items()))
+
+    def _prune_hour_rollup(self):
+        """Gọi trong transaction của flush: xóa rollup giờ cũ hơn hour_retention_days (tối đa 1 lần / giờ)"""
+        now = time.monotonic()
+        if self.hour_retention_days <= 0 or now < self._next_prune: return
+        self._next_prune = now + 3600
+        table, col = ROLLUP_TABLES["hour"]
+        cutoff = rollup_buckets(datetime.now() - timedelta(days=self.hour_retention_days))["hour"]
+        deleted = self._conn.execute(f"DELETE FROM {table} WHERE {col} < ?", (cutoff,)).rowcount
+        if deleted: logging.info(f"[DB] Đã xóa {deleted} dòng {table} cũ hơn {cutoff}.")
+
+    def flush(self) -> int:
+        """Ghi bộ đệm xuống CSDL trong 1 transaction. Trả về số dòng đã ghi."""
+        # Giữ _write_lock từ lúc lấy bộ đệm tới lúc commit / trả lại: người đọc (query_rollup) không thấy lô "mất tích"
+        with self._write_lock:
+            with self._lock:
+                if not self._pending and not self._pending_rows: return 0
+                batch = self._pending; rows = self._pending_rows; events = self._pending_events
+                self._pending = {}; self._pending_rows = []; self._pending_events = 0
+            try:
+                if self._conn is None:
+                    raise sqlite3.OperationalError("Kết nối CSDL chưa được mở")
+                with self._conn:
+                    for granularity, (table, col) in ROLLUP_TABLES.items():
+                        values = [(bucket, lane, n) for (g, bucket, lane), n in batch.items() if g == granularity]
+                        if not values: continue
+                        self._conn.executemany(f"""
+                        INSERT INTO {table} ({col}, lane_name, count) VALUES (?, ?, ?)
+                        ON CONFLICT({col}, lane_name) DO UPDATE SET count = count + excluded.count
+                        """, values)
+                    if rows:
+                        self._conn.executemany(
+                            f"INSERT INTO sort_events ({', '.join(SORT_EVENT_COLUMNS)}) "
+                            f"VALUES ({', '.join('?' * len(SORT_EVENT_COLUMNS))})", rows)
+                    self._prune_hour_rollup()
+            except Exception as e:
+                # Trả lại bộ đệm (trước các số đếm / sự kiện mới) để thử lại ở lô sau, không mất số đếm
+                with self._lock:
+                    for key, n in batch.items():
+                        self._pending[key] = self._pending.get(key, 0) + n
+                    self._pending_rows[:0] = rows
+                    self._pending_events += events
+                self.last_flush_error = str(e)
+                logging.error(f"[DB] Lỗi khi ghi lô sort_log ({len(batch)} dòng, {len(rows)} sự kiện): {e}")
+                return 0
+            self.flush_count += 1
+            self.data_version += 1
+            self.last_flush_error = None
+            return len(batch) + len(rows)
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._running: break
+            self.flush()
+
+
+# ===========================================
+# TRUY VẤN ROLLUP (sort_log / giờ / tuần)
+# ===========================================
+
+def query_sort_rollup(db_path: str, granularity: str = "day", since: Optional[float] = None,
+                      until: Optional[float] = None) -> Dict[str, Dict[str, int]]:
+    """Đọc {bucket: {lane_name: count}} từ bảng rollup; `until` bao gồm cả bucket chứa nó"""
+    granularity, lo, hi = rollup_query_key(granularity, since, until)
+    table, col = ROLLUP_TABLES[granularity]
+    where, params = [], []
+    if lo is not None: where.append(f"{col} >= ?"); params.append(lo)
+    if hi is not None: where.append(f"{col} <= ?"); params.append(hi)
+    sql = f"SELECT {col}, lane_name, count FROM {table}"
+    if where: sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {col} ASC"
+
+    conn = open_connection(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    output_data: Dict[str, Dict[str, int]] = {}
+    for bucket, lane_name, count in rows:
+        output_data.setdefault(bucket, {})[lane_name] = count
+    return output_data
+
+# ===========================================
+# TRUY VẤN sort_events (dùng kết nối đọc riêng, không chặn luồng ghi)
+# ===========================================
+
+SUMMARY_GROUPS = {"lane": "lane_name", "source": "source", "outcome": "outcome"}
+
+def _time_filter(since: Optional[float], until: Optional[float], lane: Optional[str] = None):
+    where, params = [], []
+    if since is not None: where.append("entry_ts >= ?"); params.append(since)
+    if until is not None: where.append("entry_ts < ?"); params.append(until)
+    if lane: where.append("lane_name = ?"); params.append(lane)
+    return where, params
+
+def query_sort_events(db_path: str, since: Optional[float] = None, until: Optional[float] = None,
+                      lane: Optional[str] = None, outcome: Optional[str] = None,
+                      before_id: Optional[int] = None, limit: int = 100) -> Dict[str, Any]:
+    """Phân trang kiểu keyset (mới nhất trước): trang sau dùng `before_id = next_before_id`"""
+    limit = max(1, min(int(limit), 1000))
+    where, params = _time_filter(since, until, lane)
+    if outcome: where.append("outcome = ?"); params.append(outcome)
+    if before_id is not None: where.append("id < ?"); params.append(int(before_id))
+    sql = f"SELECT id, {', '.join(SORT_EVENT_COLUMNS)} FROM sort_events"
+    if where: sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"; params.append(limit)
+
+    conn = open_connection(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    events = [dict(zip(("id",) + SORT_EVENT_COLUMNS, row)) for row in rows]
+    next_before_id = events[-1]["id"] if len(events) == limit else None
+    return {"events": events, "next_before_id": next_before_id}
+
+def summarize_sort_events(db_path: str, since: Optional[float] = None, until: Optional[float] = None,
+                          lane: Optional[str] = None, group_by: str = "lane") -> Dict[str, Any]:
+    """Tổng hợp theo lane/source/outcome: số lượng và độ trễ trung bình/lớn nhất"""
+    if group_by not in SUMMARY_GROUPS:
+        raise ValueError(f"group_by phải là một trong {sorted(SUMMARY_GROUPS)}")
+    col = SUMMARY_GROUPS[group_by]
+    where, params = _time_filter(since, until, lane)
+    sql = f"""
+    SELECT {col}, COUNT(*),
+           AVG(decode_latency), MAX(decode_latency),
+           AVG(sensor_ts - entry_ts), MAX(sensor_ts - entry_ts),
+           AVG(actuation_ts - sensor_ts), MAX(actuation_ts - sensor_ts),
+           MIN(entry_ts), MAX(entry_ts)
+    FROM sort_events"""
+    if where: sql += " WHERE " + " AND ".join(where)
+    sql += f" GROUP BY {col} ORDER BY {col}"
+
+    conn = open_connection(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    groups = []
+    for key, count, dec_avg, dec_max, travel_avg, travel_max, act_avg, act_max, first_ts, last_ts in rows:
+        groups.append({
+            group_by: key, "count": count,
+            "decode_latency_avg": dec_avg, "decode_latency_max": dec_max,
+            "travel_time_avg": travel_avg, "travel_time_max": travel_max,
+            "actuation_latency_avg": act_avg, "actuation_latency_max": act_max,
+            "first_ts": first_ts, "last_ts": last_ts
+        })
+    return {"group_by": group_by, "since": since, "until": until, "groups": groups,
+            "total": sum(g["count"] for g in groups)}
@@ -0,0 +1,63 @@
+# core/frames.py
+"""
+Frame camera kèm các phép chuyển đổi lười (tính 1 lần cho mỗi frame, dùng chung cho mọi consumer).
+
+Camera có thể trả về BGR (mặc định của cv2), YUYV thô hoặc JPEG thô (camera_settings.pixel_format):
+  - gray(): ảnh xám cho bộ giải mã QR. YUYV -> lấy thẳng kênh Y; MJPEG -> imdecode chỉ giải kênh sáng.
+  - bgr(): ảnh màu cho AI / stream video. Chỉ chuyển đổi khi có consumer cần màu.
+Mảng trả về dùng chung giữa các luồng nên bị khóa ghi (writeable=False); cần vẽ lên thì copy.
+"""
+import threading
+
+import numpy as np
+
+PIXEL_FORMATS = ("bgr", "yuyv", "mjpeg")
+
+
+def _readonly(arr):
+    arr.flags.writeable = False
+    return arr
+
+
+class CapturedFrame:
+    """1 frame từ nguồn camera (`raw` theo `pixel_format`), kích thước (h, w) cần cho YUYV thô"""
+    __slots__ = ("raw", "pixel_format", "size", "_gray", "_bgr", "_lock")
+
+    def __init__(self, raw: np.ndarray, pixel_format: str = "bgr", size=None):
+        self.raw = raw
+        self.pixel_format = pixel_format
+        self.size = size
+        self._gray = None
+        self._bgr = _readonly(raw) if pixel_format == "bgr" else None # bgr() trả thẳng raw -> cũng khóa ghi
+        self._lock = threading.Lock()
+
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            with self._lock:
+                if self._gray is None: self._gray = _readonly(self._to_gray())
+        return self._gray
+
+    def bgr(self) -> np.ndarray:
+        if self._bgr is None:
+            with self._lock:
+                if self._bgr is None: self._bgr = _readonly(self._to_bgr())
+        return self._bgr
+
+    def view(self, kind: str = "bgr") -> np.ndarray:
+        return self.gray() if kind == "gray" else self.bgr()
+
+    def _yuyv(self):
+        h, w = self.size
+        return self.raw.reshape(h, w, 2)
+
+    def _to_gray(self):
+        import cv2
+        if self.pixel_format == "yuyv": return np.ascontiguousarray(self._yuyv()[:, :, 0]) # Kênh Y = ảnh xám
+        if self.pixel_format == "mjpeg": return cv2.imdecode(self.raw, cv2.IMREAD_GRAYSCALE)
+        frame = self.bgr()
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    def _to_bgr(self):
+        import cv2
+        if self.pixel_format == "yuyv": return cv2.cvtColor(self._yuyv(), cv2.COLOR_YUV2BGR_YUYV)
+        return cv2.imdecode(self.raw, cv2.IMREAD_COLOR)
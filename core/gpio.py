@@ -63,6 +63,15 @@ class MockGPIO(GPIOProvider):
     def set_input(self, pin, state):
         self.pin_states[pin] = self.HIGH if state else self.LOW
 
+    def set_input_state(self, pin, logical_state):
+        """Đặt mức logic cho chân input (1 = HIGH/không kích hoạt, 0 = LOW/kích hoạt)"""
+        self.set_input(pin, logical_state)
+        return self.input(pin)
+
+    def toggle_input_state(self, pin):
+        """Đảo mức chân input, trả về mức mới"""
+        return self.set_input_state(pin, 0 if self.input(pin) == self.HIGH else 1)
+
     def cleanup(self): pass
 
 def get_gpio_provider() -> GPIOProvider:
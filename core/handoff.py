@@ -0,0 +1,143 @@
+# pi/core/handoff.py
+"""
+Chuyển giao nóng sang tiến trình mới khi triển khai phiên bản mới.
+Hàng chờ không bị mất và relay không bị reset.
+
+    APP_HANDOFF=1 python app.py   # Tiến trình mới: nạp model + import camera trước, rồi nhận trạng thái
+
+Giao thức dùng Unix socket HANDOFF_SOCKET (logs/handoff.sock) và khung JSON của core/ipc.py:
+  new -> old  {"op": "hello"}   old -> {"ok", "pid", "lane_ids"}
+  new -> old  {"op": "freeze"}  old dừng xử lý sensor / tạo Job, chờ chu trình đẩy đang chạy xong,
+                                nhả camera, dừng journal -> {"ok", "state"}
+  new:  áp dụng state (hàng chờ, count, mức relay), chạy luồng sensor/camera của mình
+  new -> old  {"op": "commit"}  old dừng KHÔNG cleanup GPIO (relay giữ nguyên mức) rồi thoát
+Nếu mất kết nối hoặc nhận "abort" trước commit, tiến trình cũ chạy tiếp như bình thường.
+Cửa sổ chuyển = từ lúc freeze đến lúc luồng sensor mới chạy (log [HANDOFF], /api/perf startup_ms.handoff_window).
+"""
+import os
+import signal
+import socket
+import logging
+import threading
+import time
+from typing import Optional
+
+from .ipc import KIND_REQUEST, KIND_RESPONSE, recv_json, send_json
+
+
+class HandoffServer:
+    """Chạy trong tiến trình đang điều khiển: chờ tiến trình mới xin chuyển giao"""
+    def __init__(self, system, socket_path: str):
+        self.system = system
+        self.socket_path = socket_path
+        self._sock: Optional[socket.socket] = None
+        self._inode = None
+
+    def start(self):
+        if os.path.exists(self.socket_path): os.remove(self.socket_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.socket_path); self._sock.listen(1)
+        self._inode = os.stat(self.socket_path).st_ino
+        threading.Thread(target=self._accept_loop, name="HandoffServer", daemon=True).start()
+        logging.info(f"[HANDOFF] Sẵn sàng chuyển giao tại {self.socket_path}")
+
+    def stop(self):
+        try: self._sock.close()
+        except Exception: pass
+        try: # Tiến trình mới có thể đã tạo socket cùng đường dẫn -> chỉ xóa socket của mình
+            if os.stat(self.socket_path).st_ino == self._inode: os.remove(self.socket_path)
+        except OSError: pass
+
+    def _accept_loop(self):
+        while self.system.main_loop_running:
+            try: conn, _ = self._sock.accept()
+            except OSError: break
+            with conn: self._serve(conn) # 1 lần chuyển giao tại 1 thời điểm
+
+    def _serve(self, conn: socket.socket):
+        frozen = False
+        try:
+            while True:
+                _, request = recv_json(conn)
+                op = request.get("op")
+                if op == "hello":
+                    with self.system.state_lock: lane_ids = [ln.get("id") for ln in self.system.system_state["lanes"]]
+                    send_json(conn, KIND_RESPONSE, {"ok": True, "pid": os.getpid(), "lane_ids": lane_ids})
+                elif op == "freeze":
+                    state = self.system.freeze_for_handoff(); frozen = True
+                    send_json(conn, KIND_RESPONSE, {"ok": True, "state": state})
+                elif op == "commit" and frozen:
+                    send_json(conn, KIND_RESPONSE, {"ok": True})
+                    frozen = False
+                    self.system.finish_handoff()
+                    return
+                elif op == "abort":
+                    break
+                else:
+                    send_json(conn, KIND_RESPONSE, {"ok": False, "error": f"Lệnh không hợp lệ: {op}"})
+        except (ConnectionError, OSError, ValueError) as e:
+            if frozen: logging.warning(f"[HANDOFF] Mất kết nối với tiến trình mới: {e}")
+        except Exception as e:
+            logging.error(f"[HANDOFF] Lỗi chuyển giao: {e}", exc_info=True)
+            try: send_json(conn, KIND_RESPONSE, {"ok": False, "error": str(e)})
+            except OSError: pass
+        if frozen: self.system.resume_after_handoff()
+
+
+class HandoffClient:
+    """Chạy trong tiến trình mới: xin trạng thái rồi báo tiến trình cũ thoát"""
+    def __init__(self, socket_path: str, timeout: float = 10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self.peer_pid = None
+
+    def connect(self) -> bool:
+        """False nếu không có tiến trình cũ (khởi động bình thường)"""
+        if not os.path.exists(self.socket_path): return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try: sock.connect(self.socket_path)
+        except OSError:
+            sock.close(); return False
+        self._sock = sock
+        self.peer_pid = self._call("hello")["pid"]
+        return True
+
+    def _call(self, op: str) -> dict:
+        send_json(self._sock, KIND_REQUEST, {"op": op})
+        _, response = recv_json(self._sock)
+        if not response.get("ok"): raise RuntimeError(response.get("error") or f"Tiến trình cũ từ chối '{op}'")
+        return response
+
+    def freeze(self) -> dict:
+        return self._call("freeze")["state"]
+
+    def commit(self):
+        self._call("commit")
+        self.close()
+
+    def abort(self):
+        try: send_json(self._sock, KIND_REQUEST, {"op": "abort"})
+        except OSError: pass
+        self.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close(); self._sock = None
+
+
+def exit_process():
+    """Thoát như Ctrl+C để app.py chạy các bước dọn dẹp của nó"""
+    os.kill(os.getpid(), signal.SIGINT)
+
+
+def wait_for_exit(pid: Optional[int], timeout: float = 10.0) -> bool:
+    """Chờ tiến trình cũ thoát hẳn (nhả cổng web). True nếu đã thoát"""
+    deadline = time.monotonic() + timeout
+    while pid and time.monotonic() < deadline:
+        try: os.kill(pid, 0)
+        except ProcessLookupError: return True
+        except PermissionError: pass
+        time.sleep(0.05)
+    return not pid
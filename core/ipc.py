@@ -0,0 +1,107 @@
+# pi/core/ipc.py
+"""
+Kênh trao đổi giữa tiến trình điều khiển (GPIO/hàng chờ/relay) và tiến trình web (xem core/control.py).
+
+- Unix socket: mỗi gói = len (uint32) + kind (1 byte) + dữ liệu.
+    KIND_REQUEST / KIND_RESPONSE: JSON {"id", "method", "args"} / {"id", "result" | "error"}
+    KIND_EVENT: chuỗi message WS đã serialize sẵn (state_update / log) -> tiến trình web chỉ việc phát lại
+- SharedFrame: 1 ô shared memory chứa frame camera mới nhất (seqlock: bộ đếm lẻ = đang ghi),
+  để /video_feed đọc frame mà không cần gửi ảnh qua socket.
+"""
+import json
+import socket
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+PACKET_HEADER = struct.Struct("<IB")
+KIND_REQUEST, KIND_RESPONSE, KIND_EVENT = b"Q"[0], b"R"[0], b"E"[0]
+MAX_PACKET = 64 * 1024 * 1024
+
+
+def send_packet(sock: socket.socket, kind: int, payload: bytes):
+    sock.sendall(PACKET_HEADER.pack(len(payload), kind) + payload)
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk: raise ConnectionError("Socket đã đóng")
+        buf += chunk
+    return bytes(buf)
+
+def recv_packet(sock: socket.socket) -> Tuple[int, bytes]:
+    length, kind = PACKET_HEADER.unpack(_recv_exact(sock, PACKET_HEADER.size))
+    if length > MAX_PACKET: raise ConnectionError(f"Gói tin quá lớn: {length} byte")
+    return kind, _recv_exact(sock, length)
+
+def send_json(sock: socket.socket, kind: int, obj):
+    send_packet(sock, kind, json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8"))
+
+def recv_json(sock: socket.socket):
+    kind, payload = recv_packet(sock)
+    return kind, json.loads(payload.decode("utf-8"))
+
+
+# ===========================================
+# FRAME QUA SHARED MEMORY
+# ===========================================
+
+FRAME_HEADER = struct.Struct("<QQIIId") # seqlock, frame_seq, h, w, c, fps
+MAX_FRAME_BYTES = 1920 * 1080 * 3
+
+
+class SharedFrame:
+    """1 ô frame trong shared memory: 1 tiến trình ghi (create=True), nhiều tiến trình đọc"""
+    def __init__(self, name: str, create: bool = False, max_bytes: int = MAX_FRAME_BYTES):
+        self.name = name
+        self.owner = create
+        if create:
+            try: # Ô cũ còn sót lại (tiến trình trước bị kill)
+                stale = shared_memory.SharedMemory(name=name); stale.close(); stale.unlink()
+            except FileNotFoundError: pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=FRAME_HEADER.size + max_bytes)
+            FRAME_HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, 0, 0, 0.0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            try: resource_tracker.unregister(self.shm._name, "shared_memory") # Bên đọc không sở hữu ô nhớ: không unlink khi thoát
+            except Exception: pass
+        self.max_bytes = self.shm.size - FRAME_HEADER.size
+        self._gen = 0
+
+    def write(self, frame: np.ndarray, seq: int, fps: float = 0.0) -> bool:
+        if frame.nbytes > self.max_bytes or frame.ndim not in (2, 3): return False
+        h, w = frame.shape[:2]; c = frame.shape[2] if frame.ndim == 3 else 1
+        self._gen += 1 # Lẻ: đang ghi
+        struct.pack_into("<Q", self.shm.buf, 0, self._gen)
+        dst = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=FRAME_HEADER.size)
+        np.copyto(dst, frame, casting="unsafe")
+        self._gen += 1
+        FRAME_HEADER.pack_into(self.shm.buf, 0, self._gen, seq, h, w, c, fps)
+        return True
+
+    def set_fps(self, fps: float):
+        struct.pack_into("<d", self.shm.buf, FRAME_HEADER.size - 8, fps)
+
+    def fps(self) -> float:
+        return FRAME_HEADER.unpack_from(self.shm.buf, 0)[5]
+
+    def read(self, after_seq: Optional[int] = None, retries: int = 3) -> Tuple[Optional[np.ndarray], int]:
+        """(bản sao frame, seq); frame None nếu chưa có frame / chưa có frame mới hơn after_seq"""
+        for _ in range(retries):
+            gen, seq, h, w, c, _fps = FRAME_HEADER.unpack_from(self.shm.buf, 0)
+            if gen & 1: time.sleep(0.001); continue
+            if seq == 0 or (after_seq is not None and seq <= after_seq): return None, seq
+            shape = (h, w, c) if c > 1 else (h, w)
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=FRAME_HEADER.size).copy()
+            if struct.unpack_from("<Q", self.shm.buf, 0)[0] == gen: return frame, seq
+        return None, after_seq or 0
+
+    def close(self):
+        try:
+            self.shm.close()
+            if self.owner: self.shm.unlink()
+        except (FileNotFoundError, BufferError): pass
@@ -0,0 +1,211 @@
+# pi/core/journal.py
+import os
+import json
+import time
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple
+from .utils import write_file_atomic
+
+# Các thao tác được ghi vào journal
+#   job_push  {"job": {...}}      -> processing_queue.append(job)
+#   job_pop   {"job_id", "reason"} -> xóa Job có job_id (match / ng_pass / timeout)
+#   job_reset {}                  -> processing_queue.clear()
+#   qr_push   {"lane": idx}       -> qr_queue.append(idx)
+#   qr_pop    {}                  -> qr_queue.pop(0)
+#   qr_reset  {}                  -> qr_queue.clear()
+#   lane_remap {"map", "ng"}      -> đổi lane index trong cả 2 hàng chờ (cấu hình lanes đổi nóng)
+
+SnapshotProvider = Callable[[], Tuple[list, list, int]]
+
+
+def apply_op(record: dict, qr_queue: list, processing_queue: list):
+    """Áp dụng 1 thao tác journal lên hàng chờ (dùng khi replay)"""
+    op = record.get("op")
+    if op == "job_push":
+        processing_queue.append(record["job"])
+    elif op == "job_pop":
+        job_id = record.get("job_id")
+        for i, job in enumerate(processing_queue):
+            if job.get("job_id") == job_id:
+                del processing_queue[i]; break
+    elif op == "job_reset":
+        processing_queue.clear()
+    elif op == "qr_push":
+        qr_queue.append(record["lane"])
+    elif op == "qr_pop":
+        if qr_queue: qr_queue.pop(0)
+    elif op == "qr_reset":
+        qr_queue.clear()
+    elif op == "lane_remap":
+        mapping, ng = record["map"], record.get("ng", -1)
+        qr_queue[:] = [remap_lane_index(idx, mapping, ng) for idx in qr_queue]
+        for job in processing_queue: job["lane_index"] = remap_lane_index(job["lane_index"], mapping, ng)
+
+
+def remap_lane_index(index: int, mapping: List[int], ng: int) -> int:
+    """Index cũ -> index mới theo `mapping`; index không còn (làn bị xóa / NG cũ) -> `ng`"""
+    return mapping[index] if 0 <= index < len(mapping) else ng
+
+
+class QueueJournal:
+    """
+    Journal append-only cho processing_queue / qr_queue.
+    Mỗi thao tác là 1 dòng JSON có số thứ tự `s`; luồng nền gom các dòng và fsync
+    theo lô (tối đa 1 lần / `fsync_interval` giây). Sau `compact_every` thao tác,
+    trạng thái được chụp thành snapshot và journal được rút gọn.
+    """
+    def __init__(self, journal_path: str, snapshot_path: str,
+                 fsync_interval: float = 0.02, compact_every: int = 500):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.snapshot_provider: Optional[SnapshotProvider] = None
+
+        self.seq = 0
+        self._buffer: List[str] = []
+        self._ops_since_snapshot = 0
+        self._lock = threading.Lock()          # Bảo vệ seq + bộ đệm
+        self._file_lock = threading.Lock()     # Tuần tự hóa ghi file / compaction
+        self._file = None
+        self._wake = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.fsync_count = 0
+
+    # ===========================================
+    # GHI
+    # ===========================================
+
+    def record(self, op: str, **fields) -> int:
+        """Thêm 1 thao tác (gọi BÊN TRONG khóa hàng chờ tương ứng để giữ đúng thứ tự)"""
+        with self._lock:
+            self.seq += 1
+            self._buffer.append(json.dumps({"s": self.seq, "op": op, **fields}, ensure_ascii=False))
+            self._ops_since_snapshot += 1
+            seq = self.seq
+        self._wake.set()
+        return seq
+
+    def sync(self):
+        """Ghi bộ đệm xuống journal và fsync (1 lần cho cả lô)"""
+        with self._file_lock:
+            self._write_buffer_locked()
+
+    def _write_buffer_locked(self):
+        with self._lock:
+            if not self._buffer: return
+            lines = self._buffer; self._buffer = []
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsync_count += 1
+
+    def start(self):
+        if self._running: return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="QueueJournalThread", daemon=True)
+        self._thread.start()
+        logging.info(f"[JOURNAL] Luồng journal hàng chờ đã khởi động (fsync mỗi {self.fsync_interval}s, compact sau {self.compact_every} thao tác).")
+
+    def stop(self):
+        """Dừng luồng nền, chụp snapshot cuối và đóng file"""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        try:
+            self.compact()
+        except Exception as e:
+            logging.error(f"[JOURNAL] Lỗi compaction khi dừng: {e}")
+            self.sync()
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close(); self._file = None
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(1.0)
+            if not self._running: break
+            self._wake.clear()
+            time.sleep(self.fsync_interval) # Gom thêm thao tác vào cùng 1 lần fsync
+            try:
+                self.sync()
+                if self._ops_since_snapshot >= self.compact_every:
+                    self.compact()
+            except Exception as e:
+                logging.error(f"[JOURNAL] Lỗi ghi journal hàng chờ: {e}")
+                time.sleep(0.5)
+
+    # ===========================================
+    # SNAPSHOT / COMPACTION
+    # ===========================================
+
+    def compact(self):
+        """Chụp snapshot (qua snapshot_provider) rồi chỉ giữ lại các dòng mới hơn snapshot"""
+        if self.snapshot_provider is None: return
+        with self._file_lock:
+            self._write_buffer_locked()
+            qr_queue, processing_queue, snap_seq = self.snapshot_provider()
+            self.write_snapshot(qr_queue, processing_queue, snap_seq)
+
+            # Các thao tác xảy ra sau khi chụp (seq > snap_seq) phải được giữ lại
+            self._write_buffer_locked()
+            if self._file is not None:
+                self._file.close(); self._file = None
+            tail = [line for line in self._read_journal_lines() if line.get("s", 0) > snap_seq]
+            write_file_atomic(self.journal_path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in tail))
+            with self._lock:
+                self._ops_since_snapshot = len(tail) + len(self._buffer)
+
+    def write_snapshot(self, qr_queue: list, processing_queue: list, seq: int):
+        write_file_atomic(self.snapshot_path, json.dumps({
+            "seq": seq, "ts": time.time(),
+            "qr_queue": list(qr_queue), "processing_queue": list(processing_queue)
+        }, ensure_ascii=False))
+
+    # ===========================================
+    # REPLAY
+    # ===========================================
+
+    def _read_journal_lines(self) -> List[dict]:
+        records = []
+        if not os.path.exists(self.journal_path): return records
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line: continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Dòng cuối bị cắt ngang do mất điện: bỏ qua phần còn lại
+                    logging.warning("[JOURNAL] Bỏ qua dòng journal hỏng (ghi dở khi mất điện).")
+                    break
+        return records
+
+    def replay(self) -> Tuple[list, list]:
+        """Dựng lại (qr_queue, processing_queue) từ snapshot + journal; cập nhật seq"""
+        qr_queue, processing_queue, snap_seq = [], [], 0
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    snap = json.load(f)
+                qr_queue = list(snap.get("qr_queue", []))
+                processing_queue = list(snap.get("processing_queue", []))
+                snap_seq = int(snap.get("seq", 0))
+            except Exception as e:
+                logging.error(f"[JOURNAL] Lỗi đọc snapshot hàng chờ: {e}. Chỉ dùng journal.")
+        last_seq = snap_seq; applied = 0
+        for record in self._read_journal_lines():
+            s = record.get("s", 0)
+            if s <= snap_seq: continue
+            apply_op(record, qr_queue, processing_queue)
+            last_seq = max(last_seq, s); applied += 1
+        with self._lock:
+            self.seq = max(self.seq, last_seq)
+            self._ops_since_snapshot = applied
+        return qr_queue, processing_queue
@@ -0,0 +1,119 @@
+# pi/core/locks.py
+import os
+import re
+import time
+import threading
+from typing import Dict, Optional
+from .metrics import METRICS
+
+# Bật bằng APP_LOCK_PROFILE=1 (mặc định tắt: dùng threading.Lock gốc, không tốn chi phí)
+LOCK_PROFILE_ENABLED = os.environ.get("APP_LOCK_PROFILE", "false").strip().lower() in {"1", "true", "yes", "on"}
+
+LOCK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+LOCK_WAIT = METRICS.histogram("lock_wait_seconds", "Thời gian chờ lấy khóa", labelnames=("lock", "thread"), buckets=LOCK_BUCKETS)
+LOCK_HOLD = METRICS.histogram("lock_hold_seconds", "Thời gian giữ khóa", labelnames=("lock", "thread"), buckets=LOCK_BUCKETS)
+
+_ANON_THREAD_RE = re.compile(r"^Thread-\d+(?: \((.+)\))?$")
+
+
+def thread_label(name: str) -> str:
+    """Gộp các luồng tạm (vd: 'Thread-12 (sorting_process)') theo tên hàm để số nhãn không tăng mãi"""
+    m = _ANON_THREAD_RE.match(name)
+    if not m: return name
+    return m.group(1) or "Thread"
+
+
+class InstrumentedLock:
+    """
+    Thay thế threading.Lock, ghi lại thời gian chờ / giữ khóa và luồng đang giữ.
+    Thống kê được cập nhật khi ĐANG giữ khóa gốc nên không cần khóa phụ;
+    histogram (LOCK_WAIT / LOCK_HOLD có khóa riêng) chỉ ghi SAU khi nhả khóa để không kéo dài thời gian giữ.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._holder: Optional[str] = None
+        self._acquired_at = 0.0
+        self._wait = 0.0 # Thời gian chờ của lần acquire hiện tại, ghi vào LOCK_WAIT lúc release
+        self._stats_lock = threading.Lock() # Chỉ dùng cho lần acquire thất bại (không giữ khóa gốc)
+        self.reset()
+
+    def reset(self):
+        self.acquisitions = 0; self.contended = 0; self.failed = 0
+        self.wait_total = 0.0; self.wait_max = 0.0; self.wait_max_thread = None
+        self.hold_total = 0.0; self.hold_max = 0.0; self.hold_max_thread = None
+        self.wait_by_thread: Dict[str, float] = {}
+        self.hold_by_thread: Dict[str, float] = {}
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        acquired = self._lock.acquire(False)
+        contended = not acquired
+        if not acquired and blocking:
+            acquired = self._lock.acquire(True, timeout)
+        if not acquired:
+            with self._stats_lock: self.failed += 1
+            return False
+
+        now = time.perf_counter(); wait = now - start
+        thread_name = thread_label(threading.current_thread().name)
+        self._holder = thread_name; self._acquired_at = now; self._wait = wait
+        self.acquisitions += 1
+        if contended: self.contended += 1
+        self.wait_total += wait
+        self.wait_by_thread[thread_name] = self.wait_by_thread.get(thread_name, 0.0) + wait
+        if wait > self.wait_max: self.wait_max = wait; self.wait_max_thread = thread_name
+        return True
+
+    def release(self):
+        hold = time.perf_counter() - self._acquired_at
+        thread_name = self._holder or "?"; wait = self._wait
+        self.hold_total += hold
+        self.hold_by_thread[thread_name] = self.hold_by_thread.get(thread_name, 0.0) + hold
+        if hold > self.hold_max: self.hold_max = hold; self.hold_max_thread = thread_name
+        self._holder = None
+        self._lock.release()
+        LOCK_WAIT.observe(wait, lock=self.name, thread=thread_name)
+        LOCK_HOLD.observe(hold, lock=self.name, thread=thread_name)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def report(self) -> dict:
+        holder = self._holder; acquired_at = self._acquired_at
+        n = self.acquisitions or 1
+        top = lambda d: [{"thread": t, "total_ms": round(v * 1000, 3)}
+                         for t, v in sorted(dict(d).items(), key=lambda kv: kv[1], reverse=True)[:5]]
+        return {
+            "name": self.name,
+            "acquisitions": self.acquisitions, "contended": self.contended, "failed": self.failed,
+            "contention_ratio": round(self.contended / n, 4),
+            "wait_avg_ms": round(self.wait_total / n * 1000, 4), "wait_max_ms": round(self.wait_max * 1000, 3),
+            "wait_max_thread": self.wait_max_thread,
+            "hold_avg_ms": round(self.hold_total / n * 1000, 4), "hold_max_ms": round(self.hold_max * 1000, 3),
+            "hold_max_thread": self.hold_max_thread,
+            "holder": holder,
+            "held_for_ms": round((time.perf_counter() - acquired_at) * 1000, 3) if holder else None,
+            "top_waiters": top(self.wait_by_thread), "top_holders": top(self.hold_by_thread),
+        }
+
+
+def make_lock(name: str):
+    """threading.Lock thường, hoặc InstrumentedLock nếu bật APP_LOCK_PROFILE"""
+    return InstrumentedLock(name) if LOCK_PROFILE_ENABLED else threading.Lock()
+
+
+def lock_report(locks: Dict[str, object], reset: bool = False) -> dict:
+    """Báo cáo các khóa, sắp theo tổng thời gian chờ (khóa gây jitter nhiều nhất lên đầu)"""
+    rows = [lock.report() for lock in locks.values() if isinstance(lock, InstrumentedLock)]
+    rows.sort(key=lambda r: r["wait_avg_ms"] * r["acquisitions"], reverse=True)
+    if reset:
+        for lock in locks.values():
+            if isinstance(lock, InstrumentedLock):
+                with lock._lock: lock.reset()
+    return {"enabled": LOCK_PROFILE_ENABLED, "locks": rows}
@@ -0,0 +1,134 @@
+# pi/core/logging_setup.py
+import queue
+import atexit
+import logging
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional, Tuple
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] (%(threadName)s) %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
+
+
+class DropCountingQueueHandler(QueueHandler):
+    """
+    QueueHandler cho luồng nóng: chỉ đưa record vào hàng đợi (không format, không I/O).
+    Hàng đợi có giới hạn; khi đầy thì bỏ record và đếm số lượng bị bỏ.
+    Lưu ý: args được format ở luồng ghi log, nên chỉ truyền giá trị bất biến (int, str...).
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock() # Nhiều luồng cùng ghi log khi hàng đợi đầy
+
+    def prepare(self, record):
+        # Không gọi self.format() như QueueHandler mặc định: việc format để QueueListener làm
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock: self.dropped += 1
+
+
+RATE_LIMITED = {"ratelimit": True} # logging.warning(..., extra=RATE_LIMITED): cho phép RateLimitFilter gộp
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Gộp các WARNING lặp lại (cùng mẫu message) - chỉ với log tự đăng ký bằng extra=RATE_LIMITED
+    (vd: camera retry, QR không rõ). Log theo từng Job (TIMEOUT, không khớp...) không bị gộp.
+    Mỗi mẫu chỉ được ghi 1 lần / `interval` giây; số lần bị gộp được nối vào lần ghi kế tiếp.
+    ERROR/CRITICAL không bị giới hạn.
+    """
+    def __init__(self, interval: float = 5.0, max_level: int = logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.max_level = max_level
+        self.suppressed_total = 0
+        self._last_emit: Dict[Tuple[str, int], float] = {}
+        self._suppressed: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if (self.interval <= 0 or not getattr(record, "ratelimit", False)
+                or record.levelno > self.max_level or record.levelno < logging.WARNING):
+            return True
+        key = (str(record.msg), record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_emit.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                self.suppressed_total += 1
+                return False
+            self._last_emit[key] = now
+            skipped = self._suppressed.pop(key, 0)
+        if skipped:
+            record.msg = f"{record.msg} (đã gộp {skipped} lần lặp lại)"
+        return True
+
+
+_queue_handler: Optional[DropCountingQueueHandler] = None
+_rate_filter: Optional[RateLimitFilter] = None
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(log_file: str, level: int = logging.INFO, queue_size: int = 10000,
+                  rate_limit_interval: float = 5.0, max_bytes: int = 2_000_000,
+                  backup_count: int = 5) -> QueueListener:
+    """
+    Cài logging bất đồng bộ cho root logger:
+    luồng gọi -> DropCountingQueueHandler -> hàng đợi -> QueueListener -> file xoay vòng + console
+    """
+    global _queue_handler, _rate_filter, _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT)
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = DropCountingQueueHandler(log_queue)
+    _rate_filter = RateLimitFilter(interval=rate_limit_interval)
+    _queue_handler.addFilter(_rate_filter)
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Ghi nốt các record còn trong hàng đợi rồi dừng luồng ghi log"""
+    global _listener
+    if _listener is None: return
+    listener, _listener = _listener, None
+    listener.stop()
+    for h in listener.handlers:
+        try: h.close()
+        except Exception: pass
+
+
+def get_logging_stats() -> dict:
+    """Thống kê pipeline log (số record bị bỏ / bị gộp, độ dài hàng đợi)"""
+    if _queue_handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "dropped": _queue_handler.dropped,
+        "suppressed": _rate_filter.suppressed_total if _rate_filter else 0,
+        "queue_size": _queue_handler.queue.qsize(),
+        "queue_max": _queue_handler.queue.maxsize,
+    }
@@ -0,0 +1,195 @@
+# pi/core/metrics.py
+import time
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Bucket cố định (giây): đủ mịn cho decode/actuation (ms) lẫn thời gian chờ băng chuyền (s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Các chặng của pipeline (nhãn `stage`)
+#   capture    : camera.read()
+#   decode     : scan_qr_from_frame() / scan_qr_in_regions() (Job.decode_latency = lần giải mã tạo ra Job đó)
+#   detect     : AIDetector.detect() / classify() (source=TRACK: chạy trong luồng tracker)
+#   track      : tách nền + ghép track cho 1 frame (threads/tracker.py)
+#   job        : ghép cặp Job (lấy QR từ hàng chờ / chạy AI / dựng Job), không gồm giải mã QR
+#   queue_wait : Job nằm trong hàng chờ tới khi sensor làn kích hoạt
+#   actuation  : sensor làn -> RELAY_ON(push)
+#   sort       : toàn bộ sorting_process
+#   end_to_end : vào cổng -> hoàn tất
+STAGES = ("capture", "decode", "detect", "track", "job", "queue_wait", "actuation", "sort", "end_to_end")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name; self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(k, "")) for k in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Histogram bucket cố định: observe() chỉ là 1 bisect + vài phép cộng dưới khóa"""
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name; self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [counts theo bucket (+Inf ở cuối), sum, count, max]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if value is None or value < 0: return
+        key = tuple(str(labels.get(k, "")) for k in self.labelnames)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+            series[0][idx] += 1
+            series[1] += value; series[2] += 1
+            if value > series[3]: series[3] = value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], list]:
+        with self._lock:
+            return {k: [list(v[0]), v[1], v[2], v[3]] for k, v in self._series.items()}
+
+    def quantile(self, counts: List[int], total: int, q: float) -> Optional[float]:
+        """Ước lượng phân vị từ bucket (nội suy tuyến tính trong bucket)"""
+        if total <= 0: return None
+        rank = q * total; cumulative = 0; lower = 0.0
+        for i, c in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if c and cumulative + c >= rank:
+                return lower + (upper - lower) * ((rank - cumulative) / c)
+            cumulative += c; lower = upper
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total_sum, count, _) in sorted(self.snapshot().items()):
+            cumulative = 0
+            labels = _format_labels(self.labelnames, key)
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{labels} {total_sum:.6f}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "pi_sorter"):
+        self.prefix = prefix
+        self.started_at = time.time()
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", help_text, labelnames, buckets))
+
+    def render_prometheus(self) -> str:
+        """Xuất toàn bộ metric theo định dạng text của Prometheus (0.0.4)"""
+        with self._lock: metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics: lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """Tóm tắt JSON: mỗi histogram -> count/avg/p50/p95/p99/max (ms), mỗi counter -> giá trị"""
+        with self._lock: metrics = list(self._metrics.values())
+        out = {"uptime_s": round(time.time() - self.started_at, 1), "histograms": {}, "counters": {}}
+        for metric in metrics:
+            short = metric.name[len(self.prefix) + 1:]
+            if isinstance(metric, Histogram):
+                rows = []
+                for key, (counts, total_sum, count, max_value) in sorted(metric.snapshot().items()):
+                    row = dict(zip(metric.labelnames, key))
+                    row.update({
+                        "count": count,
+                        "avg_ms": round(total_sum / count * 1000, 2) if count else None,
+                        "p50_ms": _ms(_clamp(metric.quantile(counts, count, 0.50), max_value)),
+                        "p95_ms": _ms(_clamp(metric.quantile(counts, count, 0.95), max_value)),
+                        "p99_ms": _ms(_clamp(metric.quantile(counts, count, 0.99), max_value)),
+                        "max_ms": round(max_value * 1000, 2),
+                    })
+                    rows.append(row)
+                out["histograms"][short] = rows
+            else:
+                out["counters"][short] = [
+                    {**dict(zip(metric.labelnames, key)), "value": value}
+                    for key, value in sorted(metric.snapshot().items())
+                ]
+        return out
+
+
+def _clamp(value: Optional[float], upper: float) -> Optional[float]:
+    return min(value, upper) if value is not None else None
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+# ===========================================
+# REGISTRY DÙNG CHUNG CHO TOÀN HỆ THỐNG
+# ===========================================
+METRICS = MetricsRegistry()
+
+STAGE_LATENCY = METRICS.histogram(
+    "stage_latency_seconds", "Thời gian mỗi chặng pipeline (capture -> decode -> job -> sensor -> actuation)",
+    labelnames=("stage", "lane", "source"))
+FRAMES_TOTAL = METRICS.counter("frames_total", "Số frame camera đã đọc", labelnames=("result",))
+QR_DECODES_TOTAL = METRICS.counter("qr_decodes_total", "Số lần quét QR theo kết quả", labelnames=("result",))
+JOBS_TOTAL = METRICS.counter("jobs_total", "Số Job đã tạo", labelnames=("lane", "source"))
+SORT_OUTCOMES_TOTAL = METRICS.counter("sort_outcomes_total", "Kết quả xử lý Job", labelnames=("lane", "source", "outcome"))
+FRAME_AGE = METRICS.histogram("frame_age_seconds", "Tuổi frame (chụp -> được dùng) theo consumer", labelnames=("consumer",))
+STALE_FRAMES_TOTAL = METRICS.counter("stale_frames_total", "Số lần frame bị từ chối vì quá cũ", labelnames=("consumer",))
+# Thời gian xử lý 1 vòng lặp giám sát (không tính sleep) - tăng vọt khi bị chặn bởi khóa / broadcast
+LOOP_TICK_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LOOP_TICK = METRICS.histogram("loop_tick_seconds", "Thời gian xử lý 1 vòng lặp (không tính sleep)",
+                              labelnames=("loop",), buckets=LOOP_TICK_BUCKETS)
+
+
+def observe_stage(stage: str, seconds: Optional[float], lane: str = "", source: str = ""):
+    """Ghi 1 mẫu thời gian cho chặng `stage` (bỏ qua nếu không tính được)"""
+    if seconds is None: return
+    STAGE_LATENCY.observe(seconds, stage=stage, lane=lane, source=source)
@@ -1,33 +1,118 @@
 # core/qr.py
 import cv2
-try:
-    from pyzbar import pyzbar
-    PYZBAR = True
-except ImportError:
-    PYZBAR = False
+import numpy as np
+import time
+import logging
+from importlib.util import find_spec
+from .metrics import observe_stage, QR_DECODES_TOTAL
+
+# pyzbar (nạp libzbar qua ctypes) chỉ được import ở lần giải mã đầu tiên
+PYZBAR = find_spec("pyzbar") is not None
+_pyzbar = None
 
 def scan_qr_from_frame(frame):
     if frame is None:
         return None, None
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    if gray.mean() < 10:
-        return None, None
+    start = time.perf_counter()
+    data, source = _decode(frame)
+    observe_stage("decode", time.perf_counter() - start, source="QR")
+    QR_DECODES_TOTAL.inc(result="hit" if data else "miss")
+    return data, source
+
+def scan_qr_in_regions(frame, regions, pad=0.15):
+    """
+    Chỉ giải mã trong các vùng kiện `regions` [(x, y, w, h)] (nới thêm `pad` mỗi phía) -> chi phí theo diện tích kiện.
+    regions=None: quét cả frame như scan_qr_from_frame; regions=[]: không có kiện -> không giải mã
+    (ParcelTracker.regions() định kỳ trả None để vẫn quét cả frame).
+    Trả về (data, source, box): box = vùng chứa mã (None nếu quét cả frame / không đọc được).
+    """
+    if regions is None:
+        data, source = scan_qr_from_frame(frame)
+        return data, source, None
+    if frame is None or not regions:
+        return None, None, None
+    start = time.perf_counter()
+    gray = to_gray(frame); h, w = gray.shape[:2]
+    data, source, hit_box = None, None, None
+    for box in regions:
+        x, y, bw, bh = box; px, py = int(bw * pad), int(bh * pad)
+        x0, y0, x1, y1 = max(0, x - px), max(0, y - py), min(w, x + bw + px), min(h, y + bh + py)
+        if x1 - x0 < 16 or y1 - y0 < 16: continue
+        data, source = _decode(np.ascontiguousarray(gray[y0:y1, x0:x1]))
+        if data:
+            hit_box = box; break
+    observe_stage("decode", time.perf_counter() - start, source="QR_REGION")
+    QR_DECODES_TOTAL.inc(result="hit" if data else "miss")
+    return data, source, hit_box
+
+# ===========================================
+# BACKEND GIẢI MÃ
+# ===========================================
+# Mỗi backend nhận ảnh xám, trả về chuỗi QR (hoặc None). Tên backend = `source` trả về cho caller.
+# scan_qr_from_frame thử lần lượt theo DECODE_ORDER; thêm backend mới bằng register_decoder().
+
+def _decode_pyzbar(gray):
+    global _pyzbar
+    if _pyzbar is None:
+        try:
+            from pyzbar import pyzbar as _pyzbar
+        except (ImportError, OSError) as e: # Thiếu libzbar: bỏ backend, dùng các backend còn lại
+            logging.error(f"[QR] Không nạp được pyzbar ({e}), chuyển sang backend khác.")
+            if "Pyzbar" in DECODE_ORDER: DECODE_ORDER.remove("Pyzbar")
+            return None
+    decoded = _pyzbar.decode(gray)
+    if not decoded: return None
+    return decoded[0].data.decode('utf-8', errors='ignore').strip('\x00')
+
+def _decode_cv2(gray):
+    detector = cv2.QRCodeDetector()
+    retval, _, _ = detector.detectAndDecode(gray)
+    return retval or None
 
-    data = None
-    source = None
+DECODER_BACKENDS = {}
+DECODE_ORDER = []
 
-    if PYZBAR:
-        decoded = pyzbar.decode(gray)
-        if decoded:
-            raw = decoded[0].data
-            data = raw.decode('utf-8', errors='ignore').strip('\x00')
-            source = "Pyzbar"
+def register_decoder(name, func, first=False):
+    """Đăng ký backend giải mã `func(gray) -> str | None` (first=True: thử trước các backend sẵn có)"""
+    DECODER_BACKENDS[name] = func
+    if name in DECODE_ORDER: DECODE_ORDER.remove(name)
+    DECODE_ORDER.insert(0, name) if first else DECODE_ORDER.append(name)
+
+if PYZBAR: register_decoder("Pyzbar", _decode_pyzbar)
+register_decoder("CV2", _decode_cv2)
+
+def to_gray(frame):
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+def decode_with(name, gray):
+    """Chạy đúng 1 backend trên ảnh xám (dùng cho benchmark)"""
+    data = DECODER_BACKENDS[name](gray)
+    return data.strip() if data else None
+
+def _decode(frame):
+    gray = to_gray(frame)
+    if gray.mean() < 10:
+        return None, None
 
-    if not data:
-        detector = cv2.QRCodeDetector()
-        retval, _, _ = detector.detectAndDecode(gray)
-        if retval:
-            data = retval
-            source = "CV2"
+    for name in DECODE_ORDER:
+        data = decode_with(name, gray)
+        if data:
+            return data, name
+    return None, None
 
-    return (data.strip() if data else None), source
\ No newline at end of file
+def render_qr_frame(code, frame_size=(480, 640), box_size=240, background=40):
+    """
+    Tạo frame BGR giả lập 1 kiện hàng giữa băng chuyền: hộp sáng có QR `code` (code=None: kiện không có QR).
+    Dùng cho simulator / nguồn camera tổng hợp.
+    """
+    h, w = frame_size
+    gray = np.full((h, w), background, np.uint8)
+    box = np.full((box_size, box_size), 200, np.uint8)
+    if code:
+        qr_size = box_size - 40
+        qr = cv2.QRCodeEncoder.create().encode(code)
+        qr = cv2.resize(qr, (qr_size, qr_size), interpolation=cv2.INTER_NEAREST)
+        box[20:20 + qr_size, 20:20 + qr_size] = qr
+    y, x = (h - box_size) // 2, (w - box_size) // 2
+    gray[y:y + box_size, x:x + box_size] = box
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
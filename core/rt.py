@@ -0,0 +1,111 @@
+# pi/core/rt.py
+"""
+Hồ sơ runtime thời gian thực cho các luồng sensor/relay (opt-in: timing_config.rt_enabled = true).
+
+- rt_control_cpus: core dành riêng cho luồng điều khiển (mặc định: core cuối). Mọi luồng khác của tiến trình
+  (camera, encode JPEG, AI, web, log...) bị dời sang rt_other_cpus (mặc định: các core còn lại).
+- Luồng điều khiển (lane monitor, gantry, SysWorker chạy sorting_process) ghim vào rt_control_cpus và chạy
+  SCHED_FIFO mức rt_priority nếu được phép (root / CAP_SYS_NICE / RLIMIT_RTPRIO), không thì giữ SCHED_OTHER.
+- rt_switch_interval: sys.setswitchinterval - luồng điều khiển chờ GIL ngắn hơn khi luồng khác đang bận CPU.
+- Sau khi khởi động: gc.freeze() (đối tượng lúc khởi động không bị quét lại) + gc.set_threshold(*rt_gc_threshold).
+Thay đổi các khóa rt_* cần khởi động lại. So sánh trước/sau: loop_wake_delay_seconds, gc_pause_seconds
+(/api/perf, /metrics) hoặc `python -m bench.rt_bench`.
+"""
+import gc
+import os
+import sys
+import time
+import logging
+import threading
+from typing import List, Optional
+
+from .metrics import METRICS, LOOP_TICK_BUCKETS
+
+# Ngủ lâu hơn yêu cầu = jitter lập lịch (GC, tranh GIL, core bị luồng khác chiếm)
+LOOP_WAKE = METRICS.histogram("loop_wake_delay_seconds", "Thời gian ngủ vượt quá yêu cầu (jitter lập lịch)",
+                              labelnames=("loop",), buckets=LOOP_TICK_BUCKETS)
+GC_PAUSE = METRICS.histogram("gc_pause_seconds", "Thời gian mỗi lần Python GC chạy",
+                             labelnames=("generation",), buckets=LOOP_TICK_BUCKETS)
+
+_profile = {"enabled": False, "control_cpus": [], "other_cpus": [], "priority": 0,
+            "fifo_roles": [], "fifo_denied": None, "gc_frozen": 0, "gc_threshold": None}
+_local = threading.local()
+_gc_started: Optional[float] = None
+
+
+def timed_sleep(seconds: float, loop: str):
+    """time.sleep + ghi độ trễ thức dậy vào loop_wake_delay_seconds{loop}"""
+    start = time.perf_counter()
+    time.sleep(seconds)
+    LOOP_WAKE.observe(max(0.0, time.perf_counter() - start - seconds), loop=loop)
+
+
+def _on_gc(phase, info):
+    global _gc_started
+    if phase == "start": _gc_started = time.perf_counter()
+    elif _gc_started is not None:
+        GC_PAUSE.observe(time.perf_counter() - _gc_started, generation=str(info.get("generation", "")))
+        _gc_started = None
+
+def install_gc_monitor():
+    if _on_gc not in gc.callbacks: gc.callbacks.append(_on_gc)
+
+
+def _split_cpus(timing: dict):
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    control = [c for c in (timing.get("rt_control_cpus") or available[-1:]) if c in available]
+    other = [c for c in (timing.get("rt_other_cpus") or [c for c in available if c not in control]) if c in available]
+    return control, other
+
+
+def apply_process_profile(timing: dict) -> dict:
+    """Gọi 1 lần trong system.run(), TRƯỚC khi khởi động các luồng nền"""
+    if not timing.get("rt_enabled", False): return profile_status()
+    _profile["enabled"] = True
+    _profile["priority"] = int(timing.get("rt_priority", 0) or 0)
+    sys.setswitchinterval(float(timing.get("rt_switch_interval", 0.001)))
+    control, other = _split_cpus(timing)
+    if control and other:
+        _profile["control_cpus"], _profile["other_cpus"] = control, other
+        # Dời mọi luồng hiện có khỏi core điều khiển; luồng tạo sau kế thừa affinity của luồng tạo ra nó
+        for tid in os.listdir("/proc/self/task"):
+            try: os.sched_setaffinity(int(tid), other)
+            except OSError: pass
+        logging.info(f"[RT] Core điều khiển: {control}, các luồng khác: {other}")
+    else:
+        logging.warning(f"[RT] Chỉ có {len(control) + len(other)} core khả dụng, bỏ qua ghim CPU (vẫn áp dụng ưu tiên + GC).")
+    return profile_status()
+
+
+def enter_control_thread(role: str):
+    """Gọi ở đầu luồng điều khiển (chỉ có tác dụng 1 lần mỗi luồng)"""
+    if not _profile["enabled"] or getattr(_local, "applied", False): return
+    _local.applied = True
+    if _profile["control_cpus"]:
+        try: os.sched_setaffinity(0, _profile["control_cpus"])
+        except OSError as e: logging.warning(f"[RT] {role}: không ghim được CPU: {e}")
+    if _profile["priority"] > 0 and hasattr(os, "sched_setscheduler"):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(_profile["priority"]))
+            if role not in _profile["fifo_roles"]: _profile["fifo_roles"].append(role)
+        except OSError as e:
+            if _profile["fifo_denied"] is None:
+                logging.warning(f"[RT] Không được phép dùng SCHED_FIFO ({e}); cần root/CAP_SYS_NICE hoặc RLIMIT_RTPRIO. Giữ SCHED_OTHER.")
+            _profile["fifo_denied"] = str(e)
+
+
+def finish_startup(timing: dict):
+    """Gọi sau khi các luồng nền đã khởi động: đóng băng heap lúc khởi động + chỉnh ngưỡng GC"""
+    if not _profile["enabled"]: return
+    threshold: List[int] = list(timing.get("rt_gc_threshold") or [])
+    if timing.get("rt_gc_freeze", True) and hasattr(gc, "freeze"):
+        gc.collect(); gc.freeze()
+        _profile["gc_frozen"] = gc.get_freeze_count()
+    if len(threshold) == 3:
+        gc.set_threshold(*(int(t) for t in threshold))
+    _profile["gc_threshold"] = list(gc.get_threshold())
+    logging.info(f"[RT] gc.freeze: {_profile['gc_frozen']} đối tượng, ngưỡng GC: {_profile['gc_threshold']}")
+
+
+def profile_status() -> dict:
+    return dict(_profile, fifo_roles=list(_profile["fifo_roles"]))
@@ -0,0 +1,390 @@
+# pi/core/simulator.py
+"""
+Mô phỏng băng chuyền (sự kiện rời rạc, chạy theo thời gian thực) để load-test logic phân loại
+mà không cần băng chuyền thật.
+
+- Kiện hàng đến theo tốc độ cấu hình (đều hoặc Poisson), chạy với vận tốc belt_speed qua:
+  camera QR (camera_pos) -> sensor gác cổng (entry_pos) -> sensor các làn (lane_positions).
+- Cạnh sensor được bơm vào MockGPIO kèm nhiễu dội (bounce).
+- Frame QR tổng hợp được ghi vào system.latest_frame (system.external_frames = True).
+- Mỗi sự kiện sort (qua system.sort_event_listeners) được đối chiếu với kiện hàng thật sự
+  đang nằm trước sensor làn đó -> đúng làn / sai làn / đẩy trễ / bỏ sót.
+
+Chạy độc lập (dùng bản sao config hiện tại trong thư mục tạm):
+    python -m core.simulator --rate 30 --parcels 40
+    python -m core.simulator --search
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .frames import CapturedFrame
+from .gpio import MockGPIO
+from .qr import render_qr_frame
+
+FRAME_SIZE = (480, 640)
+
+
+class SimConfig:
+    """Thông số vật lý của băng chuyền mô phỏng (mét, giây)"""
+    def __init__(self, belt_speed: float = 0.5, parcel_length: float = 0.25,
+                 camera_pos: float = 0.0, entry_pos: float = 0.4,
+                 lane_positions: Optional[List[float]] = None, first_lane_pos: float = 1.0,
+                 lane_spacing: float = 0.6, rate_ppm: float = 30.0, arrival: str = "uniform",
+                 ng_ratio: float = 0.1, bounce_max: int = 2, bounce_interval: Tuple[float, float] = (0.0005, 0.002),
+                 frame_fps: float = 30.0, push_grace: float = 0.05, settle_time: float = 2.0,
+                 seed: Optional[int] = None):
+        self.belt_speed = belt_speed
+        self.parcel_length = parcel_length
+        self.camera_pos = camera_pos
+        self.entry_pos = entry_pos
+        self.lane_positions = lane_positions
+        self.first_lane_pos = first_lane_pos
+        self.lane_spacing = lane_spacing
+        self.rate_ppm = rate_ppm
+        self.arrival = arrival               # "uniform" | "poisson"
+        self.ng_ratio = ng_ratio             # Tỉ lệ kiện không đọc được QR (-> NG)
+        self.bounce_max = bounce_max         # Số lần dội tối đa mỗi cạnh
+        self.bounce_interval = bounce_interval
+        self.frame_fps = frame_fps
+        self.push_grace = push_grace         # Cho phép đẩy trễ tối đa (s) sau khi kiện rời sensor
+        self.settle_time = settle_time       # Chờ thêm sau khi kiện cuối rời băng chuyền
+        self.seed = seed
+
+
+class Parcel:
+    def __init__(self, parcel_id: int, target: int, code: Optional[str], t_arrive: float):
+        self.id = parcel_id
+        self.target = target        # Làn mong muốn (NG_LANE_INDEX nếu không đọc được)
+        self.code = code            # Nội dung QR (None -> không có QR)
+        self.t_arrive = t_arrive    # Lúc đầu kiện chạm camera_pos
+        self.windows: Dict[int, Tuple[float, float]] = {} # lane_index -> (bắt đầu che, hết che) sensor
+        self.first_frame_ts: Optional[float] = None # Lúc frame đầu tiên có kiện này được ghi ra
+        self.result: Optional[str] = None
+        self.actuation_delay: Optional[float] = None
+
+
+class _Sensor:
+    """Sensor quang (active-low) có đếm số kiện đang che + nhiễu dội ở mỗi cạnh"""
+    def __init__(self, sim: "ConveyorSimulator", pin: int):
+        self.sim = sim; self.pin = pin; self.covered = 0
+
+    def cover(self, now: float):
+        self.covered += 1
+        if self.covered == 1: self._edge(now, 0)
+
+    def uncover(self, now: float):
+        self.covered = max(0, self.covered - 1)
+        if self.covered == 0: self._edge(now, 1)
+
+    def _edge(self, now: float, level: int):
+        rng = self.sim.rng; t = now
+        for _ in range(rng.randint(0, self.sim.cfg.bounce_max)):
+            self.sim.schedule(t, lambda: self.sim.gpio.set_input_state(self.pin, level))
+            t += rng.uniform(*self.sim.cfg.bounce_interval)
+            self.sim.schedule(t, lambda: self.sim.gpio.set_input_state(self.pin, 1 - level))
+            t += rng.uniform(*self.sim.cfg.bounce_interval)
+        # Mức cuối cùng theo số kiện thực sự đang che
+        self.sim.schedule(t, lambda: self.sim.gpio.set_input_state(self.pin, 0 if self.covered else 1))
+
+
+class ConveyorSimulator:
+    def __init__(self, system, cfg: Optional[SimConfig] = None):
+        if not isinstance(system.gpio, MockGPIO):
+            raise RuntimeError("Simulator chỉ chạy được với MockGPIO.")
+        from .system import SENSOR_ENTRY_MOCK_PIN
+        self.system = system
+        self.cfg = cfg or SimConfig()
+        self.gpio = system.gpio
+        self.rng = random.Random(self.cfg.seed)
+
+        with system.state_lock:
+            lanes = [dict(l) for l in system.system_state["lanes"]]
+            timing = dict(system.system_state["timing_config"])
+        self.ng_index = system.NG_LANE_INDEX
+        self.use_gantry = timing.get("use_sensor_entry_gantry", False)
+        self.push_cycle = timing.get("cycle_delay", 0.3) + timing.get("settle_delay", 0.2) * 2
+        self.sort_lanes = [i for i, l in enumerate(lanes) if l.get("sensor_pin") is not None and i != self.ng_index]
+        self.lane_codes = {i: lanes[i].get("id") for i in self.sort_lanes}
+        positions = self.cfg.lane_positions or [self.cfg.first_lane_pos + k * self.cfg.lane_spacing
+                                                for k in range(len(self.sort_lanes))]
+        self.lane_pos = dict(zip(self.sort_lanes, positions))
+        self.lane_sensors = {i: _Sensor(self, lanes[i]["sensor_pin"]) for i in self.sort_lanes}
+        self.entry_sensor = _Sensor(self, SENSOR_ENTRY_MOCK_PIN)
+
+        self._events: List[Tuple[float, int, Callable]] = []
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._in_view: List[Parcel] = []
+        self.parcels: List[Parcel] = []
+        self.sort_events: List[dict] = []
+        self._frames = {}
+        self._blank = CapturedFrame(np.full(FRAME_SIZE + (3,), 40, np.uint8)) # Băng chuyền trống (cùng nền với render_qr_frame)
+
+    # ===========================================
+    # HÀNG ĐỢI SỰ KIỆN
+    # ===========================================
+
+    def schedule(self, when: float, action: Callable):
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._events, (when, self._seq, action))
+
+    def _run_until(self, deadline: float):
+        while True:
+            with self._lock:
+                if not self._events or self._events[0][0] > deadline: break
+                when, _, action = self._events[0]
+            delay = when - time.time()
+            if delay > 0:
+                time.sleep(min(delay, 0.005)); continue
+            with self._lock: heapq.heappop(self._events)
+            action()
+        remaining = deadline - time.time()
+        if remaining > 0: time.sleep(remaining)
+
+    # ===========================================
+    # FRAME TỔNG HỢP
+    # ===========================================
+
+    def _frame_for(self, code: Optional[str]) -> CapturedFrame:
+        """Frame có QR `code`, hoặc 1 kiện hàng không có QR (code=None) - có cache (kể cả ảnh xám đã chuyển)"""
+        if code in self._frames: return self._frames[code]
+        frame = CapturedFrame(render_qr_frame(code, FRAME_SIZE))
+        self._frames[code] = frame
+        return frame
+
+    def _frame_tick(self, end_time: float):
+        now = time.time()
+        parcel = self._in_view[0] if self._in_view else None
+        frame = self._frame_for(parcel.code) if parcel else self._blank
+        with self.system.frame_lock:
+            self.system.latest_frame = frame
+            self.system.latest_frame_ts = time.monotonic()
+            self.system.latest_frame_seq += 1
+        if parcel and parcel.first_frame_ts is None: parcel.first_frame_ts = now
+        self.system.fps_value = self.cfg.frame_fps
+        if now < end_time:
+            self.schedule(now + 1.0 / self.cfg.frame_fps, lambda: self._frame_tick(end_time))
+
+    # ===========================================
+    # KIỆN HÀNG
+    # ===========================================
+
+    def _schedule_parcel(self, parcel: Parcel):
+        v = self.cfg.belt_speed; length = self.cfg.parcel_length; t0 = parcel.t_arrive
+        at = lambda pos: t0 + (pos - self.cfg.camera_pos) / v
+
+        self.schedule(t0, lambda: self._in_view.append(parcel))
+        self.schedule(t0 + length / v, lambda: self._in_view.remove(parcel))
+        if self.use_gantry:
+            self.schedule(at(self.cfg.entry_pos), lambda: self.entry_sensor.cover(time.time()))
+            self.schedule(at(self.cfg.entry_pos) + length / v, lambda: self.entry_sensor.uncover(time.time()))
+        # Kiện đi qua các sensor làn cho tới làn đích (bị đẩy ra), kiện NG đi hết băng chuyền
+        for i in self.sort_lanes:
+            start = at(self.lane_pos[i]); end = start + length / v
+            parcel.windows[i] = (start, end)
+            sensor = self.lane_sensors[i]
+            self.schedule(start, lambda s=sensor: s.cover(time.time()))
+            self.schedule(end, lambda s=sensor: s.uncover(time.time()))
+            if i == parcel.target: break
+
+    def _on_sort_event(self, job, lane_index, lane_name, outcome, actuation_ts):
+        self.sort_events.append({
+            "outcome": outcome, "lane_index": lane_index, "sensor_ts": job.get("sensor_time"),
+            "entry_ts": job.get("entry_time"), "actuation_ts": actuation_ts
+        })
+
+    def run(self, num_parcels: int = 30, rate_ppm: Optional[float] = None) -> dict:
+        """Chạy 1 lượt mô phỏng và trả về báo cáo"""
+        rate = rate_ppm or self.cfg.rate_ppm
+        interval = 60.0 / rate
+        min_gap = self.cfg.parcel_length / self.cfg.belt_speed * 1.2 # Kiện không chồng lên nhau
+
+        self.parcels = []; self.sort_events = []; self._in_view = []
+        start = time.time() + 0.5; t = start
+        targets = self.sort_lanes
+        for n in range(num_parcels):
+            if self.rng.random() < self.cfg.ng_ratio or not targets:
+                target, code = self.ng_index, None
+            else:
+                target = self.rng.choice(targets); code = self.lane_codes[target]
+            parcel = Parcel(n, target, code, t)
+            self.parcels.append(parcel); self._schedule_parcel(parcel)
+            gap = self.rng.expovariate(1.0 / interval) if self.cfg.arrival == "poisson" else interval
+            t += max(gap, min_gap)
+
+        last_pos = max(self.lane_pos.values(), default=self.cfg.entry_pos)
+        end_time = t + (last_pos - self.cfg.camera_pos + self.cfg.parcel_length) / self.cfg.belt_speed
+        self.schedule(start, lambda: self._frame_tick(end_time))
+
+        self.system.sort_event_listeners.append(self._on_sort_event)
+        try:
+            self._run_until(end_time + self.cfg.settle_time)
+        finally:
+            self.system.sort_event_listeners.remove(self._on_sort_event)
+            with self.system.frame_lock:
+                self.system.latest_frame = self._blank
+        report = evaluate(self.parcels, self.sort_events, self.ng_index, self.cfg.push_grace, self.push_cycle)
+        report.update({"rate_ppm": round(rate, 1), "arrival": self.cfg.arrival,
+                       "mode": "gantry" if self.use_gantry else "camera_trigger"})
+        return report
+
+
+def evaluate(parcels: List[Parcel], sort_events: List[dict], ng_index: int,
+             push_grace: float = 0.05, push_cycle: float = 0.0, match_tolerance: float = 0.1) -> dict:
+    """Đối chiếu sự kiện sort với vị trí thực của kiện hàng"""
+    def parcel_at(lane_index: int, ts: float) -> Optional[Parcel]:
+        best = None
+        for p in parcels:
+            for i, (start, end) in p.windows.items():
+                if i != lane_index: continue
+                if start - match_tolerance <= ts <= end + match_tolerance:
+                    if best is None or abs(start - ts) < abs(best[1] - ts): best = (p, start)
+        return best[0] if best else None
+
+    timeouts = 0; last_push: Dict[int, float] = {}; collisions = 0
+    for ev in sorted(sort_events, key=lambda e: e.get("sensor_ts") or 0):
+        outcome = ev["outcome"]
+        if outcome == "timeout":
+            timeouts += 1; continue
+        if ev.get("sensor_ts") is None: continue
+        if outcome == "ng_pass": continue # Job NG bị tiêu thụ, kiện vẫn đi thẳng trên băng chuyền
+        lane_index = ev["lane_index"]
+        p = parcel_at(lane_index, ev["sensor_ts"])
+        if p is None or p.result is not None: continue
+        if p.target != lane_index:
+            p.result = "wrong_lane"; continue
+        act = ev.get("actuation_ts")
+        if act is not None:
+            start, end = p.windows[lane_index]
+            p.actuation_delay = act - start
+            prev = last_push.get(lane_index)
+            if prev is not None and act - prev < push_cycle:
+                collisions += 1; p.result = "late"; last_push[lane_index] = act; continue # Piston chưa thu về
+            last_push[lane_index] = act
+            if act > end + push_grace:
+                p.result = "late"; continue
+        p.result = "correct"
+
+    counts = {"correct": 0, "wrong_lane": 0, "late": 0, "missed": 0}
+    for p in parcels:
+        # Không bị đẩy ở làn nào: đúng nếu là kiện NG (đi thẳng tới cuối băng chuyền)
+        if p.result is None: p.result = "correct" if p.target == ng_index else "missed"
+        counts[p.result] += 1
+    delays = sorted(p.actuation_delay for p in parcels if p.actuation_delay is not None)
+    total = len(parcels)
+    return {
+        "parcels": total, **counts, "timeouts": timeouts, "pusher_collisions": collisions,
+        "accuracy": round(counts["correct"] / total, 4) if total else None,
+        "actuation_delay_ms": {
+            "p50": round(delays[len(delays) // 2] * 1000, 1) if delays else None,
+            "max": round(delays[-1] * 1000, 1) if delays else None,
+        },
+        "sustainable": total > 0 and counts["correct"] == total and timeouts == 0,
+        "failures": [{"parcel": p.id, "target": p.target, "result": p.result} for p in parcels if p.result != "correct"],
+    }
+
+
+def find_max_rate(sim: ConveyorSimulator, num_parcels: int = 30, start_ppm: float = 20.0,
+                  limit_ppm: float = 600.0, tolerance_ppm: float = 5.0) -> dict:
+    """Tìm số kiện/phút lớn nhất mà mọi kiện vẫn vào đúng làn (tăng dần rồi chia đôi)"""
+    trials = []
+    def trial(rate):
+        sim.system.reset_queues()
+        report = sim.run(num_parcels, rate)
+        trials.append(report)
+        logging.info(f"[SIM] {rate:.1f} kiện/phút -> đúng {report['correct']}/{report['parcels']}, timeout {report['timeouts']}")
+        return report["sustainable"]
+
+    good, bad = 0.0, None; rate = start_ppm
+    while rate <= limit_ppm:
+        if trial(rate): good = rate; rate *= 1.5
+        else: bad = rate; break
+    if bad is None:
+        return {"max_sustainable_ppm": round(good, 1), "limited_by_search": True, "trials": trials}
+    while bad - good > tolerance_ppm:
+        mid = (good + bad) / 2
+        if trial(mid): good = mid
+        else: bad = mid
+    return {"max_sustainable_ppm": round(good, 1), "limited_by_search": False, "trials": trials}
+
+
+# ===========================================
+# CHẠY ĐỘC LẬP
+# ===========================================
+
+def start_sim_system(config_path: Optional[str] = None, timing_overrides: Optional[dict] = None,
+                     log_level: int = logging.WARNING, job_triggers: bool = True):
+    """
+    Khởi động SortingSystem (MockGPIO, frame ngoài, không gửi VPS) trên bản sao config trong thư mục tạm
+    để không ghi vào CSDL / config thật. Trả về (system, workdir).
+    """
+    workdir = tempfile.mkdtemp(prefix="pi_sim_")
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    src_config = config_path or next((p for p in (os.path.join(base_dir, "config", "config.json"),
+                                                  os.path.join(base_dir, "config.json")) if os.path.exists(p)), None)
+    os.makedirs(os.path.join(workdir, "config"))
+    dst_config = os.path.join(workdir, "config", "config.json")
+    if src_config: shutil.copy(src_config, dst_config)
+    if timing_overrides:
+        config = {}
+        if src_config:
+            with open(dst_config, "r", encoding="utf-8") as f: config = json.load(f)
+        config.setdefault("timing_config", {}).update(timing_overrides)
+        with open(dst_config, "w", encoding="utf-8") as f: json.dump(config, f, indent=4)
+    os.environ["APP_CONFIG_DIR"] = os.path.join(workdir, "config")
+    os.environ["APP_LOG_DIR"] = workdir
+    logging.basicConfig(level=log_level, format="%(asctime)s [%(levelname)s] (%(threadName)s) %(message)s")
+
+    from .system import SortingSystem
+    system = SortingSystem()
+    system.external_frames = True
+    system.job_triggers_enabled = job_triggers # False: Job được bơm trực tiếp (vd: core/trace.py replay)
+    system.system_state["vps_config"] = {"url": ""} # Không gửi dữ liệu mô phỏng lên VPS
+    threading.Thread(target=system.run, name="SystemMainLoop", daemon=True).start()
+    time.sleep(1.5)
+    return system, workdir
+
+
+def stop_sim_system(system, workdir: str):
+    system.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mô phỏng băng chuyền để đo thông lượng phân loại")
+    parser.add_argument("--rate", type=float, default=30.0, help="Số kiện/phút")
+    parser.add_argument("--parcels", type=int, default=30, help="Số kiện mỗi lượt")
+    parser.add_argument("--search", action="store_true", help="Tìm số kiện/phút tối đa")
+    parser.add_argument("--arrival", choices=["uniform", "poisson"], default="uniform")
+    parser.add_argument("--belt-speed", type=float, default=0.5, help="m/s")
+    parser.add_argument("--ng-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--config", default=None, help="config.json nguồn (mặc định: config hiện tại)")
+    args = parser.parse_args(argv)
+
+    system, workdir = start_sim_system(args.config)
+    try:
+        sim = ConveyorSimulator(system, SimConfig(belt_speed=args.belt_speed, arrival=args.arrival,
+                                                  ng_ratio=args.ng_ratio, seed=args.seed))
+        result = find_max_rate(sim, args.parcels, start_ppm=args.rate) if args.search else sim.run(args.parcels, args.rate)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        stop_sim_system(system, workdir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,46 @@
 # pi/core/system.py
-import cv2
 import time
 import json
 import os
 import logging
 import threading
-import sqlite3
 import copy
 import uuid
-from datetime import datetime
+import importlib
 from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 # Import các thành phần cốt lõi
 from .gpio import get_gpio_provider, GPIOProvider, MockGPIO, RealGPIO
 from .ai import AIDetector, YOLO_AVAILABLE, DEEPSORT_AVAILABLE
-from .qr import scan_qr_from_frame
-from .utils import canon_id
+from .utils import canon_id, match_source, parse_ts
+from .journal import QueueJournal, remap_lane_index
+from .config_store import ConfigStore
+from .locks import make_lock, lock_report, LOCK_PROFILE_ENABLED
+from .metrics import METRICS, observe_stage, SORT_OUTCOMES_TOTAL, FRAME_AGE, STALE_FRAMES_TOTAL
+from .trace import NULL_TRACE, open_trace
+from .rt import apply_process_profile, enter_control_thread, finish_startup, install_gc_monitor, profile_status, timed_sleep
+from .frames import CapturedFrame
+from .db import SortLogWriter, query_sort_events, summarize_sort_events, rollup_query_key
 
 
-# Import các luồng (threads)
-from threads import (
-    camera, lane, gantry, qr_scanner, camera_trigger,
-    vps, broadcast, config_save, test_utils
-)
+# Import các luồng (threads) - camera/qr_scanner/camera_trigger/vps (cv2, requests) được import
+# trong run() sau khi GPIO và sensor đã chạy (xem _startup_stage)
+from threads import lane, gantry, broadcast, config_save, test_utils, tracker
 
 # Thư mục và đường dẫn (Lấy từ app_god.py)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-CONFIG_DIR = os.path.join(BASE_DIR, "config")
-LOG_DIR = os.path.join(BASE_DIR, "logs")
+CONFIG_DIR = os.environ.get("APP_CONFIG_DIR", os.path.join(BASE_DIR, "config"))
+LOG_DIR = os.environ.get("APP_LOG_DIR", os.path.join(BASE_DIR, "logs"))
+LOG_FILE = os.path.join(LOG_DIR, "system.log")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
 DATABASE_FILE = os.path.join(LOG_DIR, "sort_log.db")
-QUEUE_STATE_FILE = os.path.join(LOG_DIR, "queue_state.json")
+QUEUE_STATE_FILE = os.path.join(LOG_DIR, "queue_state.json") # (Định dạng cũ, chỉ dùng để chuyển đổi)
+QUEUE_JOURNAL_FILE = os.path.join(LOG_DIR, "queue_journal.log")
+QUEUE_SNAPSHOT_FILE = os.path.join(LOG_DIR, "queue_snapshot.json")
+# Chuyển giao nóng (core/handoff.py): APP_HANDOFF=1 -> tiến trình mới nhận trạng thái từ tiến trình đang chạy
+HANDOFF_SOCKET = os.environ.get("APP_HANDOFF_SOCKET", os.path.join(LOG_DIR, "handoff.sock"))
+HANDOFF_ON_START = os.environ.get("APP_HANDOFF", "false").strip().lower() in {"1", "true", "yes", "on"}
 
 # Hằng số (Lấy từ app_god.py)
 ACTIVE_LOW = True
@@ -65,24 +75,31 @@ class ErrorManager:
 class SortingSystem:
     def __init__(self):
         logging.info("[SYSTEM] Khởi tạo SortingSystem...")
+        self.init_started = time.perf_counter()
+        self.startup_timings = {} # Giai đoạn khởi động -> ms (log + /api/perf)
         self.main_loop_running = True
         self.gpio: GPIOProvider = get_gpio_provider()
         
         # Hàng chờ và Khóa (Locks)
         self.qr_queue = [] # (Dùng cho v2)
         self.processing_queue = [] # Hàng chờ chính
-        self.qr_queue_lock = threading.Lock()
-        self.processing_queue_lock = threading.Lock()
-        self.state_lock = threading.Lock()
-        self.frame_lock = threading.Lock()
-        self.database_lock = threading.Lock()
-        self.config_file_lock = threading.Lock()
-        self.test_seq_lock = threading.Lock() # Cho test tuần tự
+        self.qr_queue_lock = make_lock("qr_queue_lock")
+        self.processing_queue_lock = make_lock("processing_queue_lock")
+        self.state_lock = make_lock("state_lock")
+        self.frame_lock = make_lock("frame_lock")
+        self.database_lock = make_lock("database_lock")
+        self.config_file_lock = make_lock("config_file_lock")
+        self.test_seq_lock = make_lock("test_seq_lock") # Cho test tuần tự
+        self.reconfig_lock = make_lock("reconfig_lock") # Tuần tự hóa các lần áp dụng config nóng
 
         # Quản lý WebSocket Clients
         self.ws_clients = set()
-        self.ws_lock = threading.Lock()
-        self.broadcast_lock = threading.Lock()
+        self.ws_lock = make_lock("ws_lock")
+        self.broadcast_lock = make_lock("broadcast_lock")
+        # Bảng các khóa (cho /api/locks khi bật APP_LOCK_PROFILE)
+        self.locks = {n: getattr(self, n) for n in (
+            "state_lock", "frame_lock", "processing_queue_lock", "qr_queue_lock", "database_lock",
+            "config_file_lock", "test_seq_lock", "reconfig_lock", "ws_lock", "broadcast_lock")}
 
         # Trạng thái hệ thống (Lấy từ app_god.py)
         self.system_state = {
@@ -96,11 +113,45 @@ class SortingSystem:
         self.executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="SysWorker")
 
         # Trạng thái camera và AI
-        self.latest_frame = None
+        self.latest_frame = None     # CapturedFrame (ndarray BGR ghi thẳng được bọc lại ở get_latest_frame)
+        self.latest_frame_ts = 0.0   # time.monotonic() lúc chụp frame
+        self.latest_frame_seq = 0    # Tăng mỗi frame mới (consumer bỏ qua frame đã xử lý)
+        self.max_frame_age = 1.0     # Frame cũ hơn (giây) bị từ chối khi tạo Job
+        self.external_frames = False # True: frame do nguồn ngoài ghi vào (vd: core/simulator.py), không mở camera
         self.fps_value = 0.0
         self.ai_detector: Optional[AIDetector] = None # Dùng class AIDetector từ core/ai.py
+        self.parcel_tracker = None # core.tracking.ParcelTracker (luồng TrackerThread, khi bật enable_tracker)
+        self.tracker_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TrackerAI") # YOLO ảnh cắt của tracker (tách khỏi SysWorker)
+        self.vps_uploader = None # core.uploader.VPSUploader (luồng VPSUpdateThread)
         self.NG_LANE_INDEX = -1
         self.NG_LANE_NAME = "Hàng NG"
+        self.sort_event_listeners = [] # fn(job, lane_index, lane_name, outcome, actuation_ts) - vd: simulator
+        self.trace = NULL_TRACE      # Ghi trace sensor/Job (core/trace.py), bật bằng timing_config.trace_record
+        self.job_triggers_enabled = True # False: không chạy luồng tạo Job (Job được bơm từ trace khi phát lại)
+
+        # Đổi config nóng (update_config): luồng camera / tạo Job tự thoát khi generation tương ứng tăng
+        self.camera_thread: Optional[threading.Thread] = None
+        self.camera_generation = 0
+        self.trigger_threads = []
+        self.trigger_generation = 0
+        self.lanes_version = 0 # Tăng mỗi lần đổi bảng lanes (luồng sensor đồng bộ lại trạng thái)
+        self.ai_generation = 0 # Lần nạp model mới nhất (bỏ kết quả nạp cũ hơn)
+        self.lane_thread: Optional[threading.Thread] = None
+
+        # Chuyển giao nóng (core/handoff.py)
+        self.owns_gpio = False         # False: stop() không cleanup GPIO / không ghi journal (chưa nhận hoặc đã chuyển giao)
+        self.handoff_from = HANDOFF_SOCKET if HANDOFF_ON_START else None # Nhận trạng thái từ tiến trình cũ khi run()
+        self.handoff_socket = HANDOFF_SOCKET
+        self.handoff_server = None
+        self.handoff_exit = None       # Gọi sau khi đã chuyển giao (mặc định: SIGINT cho chính tiến trình)
+        self.handoff_frozen = False    # True: luồng sensor / tạo Job tạm dừng (xem handoff_hold)
+        self.handoff_acks = set()
+        self.handoff_state_loaded = False
+        self.handoff_done = threading.Event() # app.py chờ sự kiện này trước khi mở cổng web
+        self.handoff_peer_pid = None
+        self.active_sorts = 0          # Số chu trình đẩy đang chạy
+        self.conveyor_restart_at = 0.0 # Mốc (time.time) băng chuyền tự chạy lại (restart_conveyor_after_delay)
+        self.conveyor_restart_skipped = False # Hết giờ chạy lại băng chuyền đúng lúc đang chuyển giao
 
         # Trạng thái hàng chờ và sensor (Lấy từ app_god.py)
         self.queue_head_since = 0.0
@@ -118,9 +169,31 @@ class SortingSystem:
         self.SENSOR_PINS = []
         self.RELAY_CONVEYOR_PIN = None
 
+        # Lưu config khi có thay đổi (debounce + ghi nguyên tử)
+        self.config_store = ConfigStore(CONFIG_FILE)
+
         # Tải config ban đầu
         self._load_local_config()
 
+        # Luồng ghi CSDL (WAL, ghi theo lô) - mở ở _init_database()
+        with self.state_lock:
+            cfg_timing = self.system_state['timing_config']
+            self.config_store.debounce = cfg_timing.get('config_save_debounce', 0.5)
+            self.config_store.max_delay = cfg_timing.get('config_save_max_delay', 5.0)
+            self.sort_log_writer = SortLogWriter(
+                DATABASE_FILE,
+                flush_interval=cfg_timing.get('db_flush_interval', 1.0),
+                max_pending=cfg_timing.get('db_flush_max_events', 50)
+            )
+            # Journal hàng chờ (chống mất Job khi mất điện) - replay ở _load_queues_on_startup()
+            self.queue_journal = QueueJournal(
+                QUEUE_JOURNAL_FILE, QUEUE_SNAPSHOT_FILE,
+                fsync_interval=cfg_timing.get('journal_fsync_interval', 0.02),
+                compact_every=cfg_timing.get('journal_compact_every', 500)
+            )
+        self.queue_journal.snapshot_provider = self._queue_snapshot
+        self._startup_stage("init", self.init_started)
+
     # ===========================================
     # CÁC HÀM QUẢN LÝ GPIO (Lấy từ app_god.py)
     # ===========================================
@@ -165,12 +238,16 @@ class SortingSystem:
     # CÁC HÀM LOGIC CỐT LÕI (Lấy từ app_god.py)
     # ===========================================
 
-    def sorting_process(self, lane_index, job_id="N/A"): 
+    def sorting_process(self, lane_index, job_id="N/A", job=None): 
         """Chu trình đẩy/thả vật lý (Lấy từ app_god.py)"""
         job_id_log_prefix = f"[JobID {job_id}]"
         
         lane_name = ""; push_pin, pull_pin = None, None
         is_sorting_lane = False
+        outcome = "error"; actuation_ts = None
+        sort_start = time.perf_counter()
+        enter_control_thread("sort")
+        with self.state_lock: self.active_sorts += 1 # Chuyển giao nóng chờ các chu trình đang chạy xong
         try:
             with self.state_lock:
                 if not (0 <= lane_index < len(self.system_state["lanes"])):
@@ -185,81 +262,140 @@ class SortingSystem:
                     logging.error(f"[SORT] {job_id_log_prefix} Lane {lane_name} (index {lane_index}) chưa được cấu hình đủ chân relay.")
                     lane["status"] = "Lỗi Config"
                     self.broadcast_log("error", f"{job_id_log_prefix} Lane {lane_name} thiếu cấu hình chân relay.")
+                    outcome = "config_error"
                     return
                 lane["status"] = "Đang phân loại..." if is_sorting_lane else "Đang đi thẳng..."
             
+            outcome = "aborted"
             if not is_sorting_lane:
                 self.broadcast_log("info", f"{job_id_log_prefix} Vật phẩm đi thẳng qua {lane_name}")
+                outcome = "passed"
             if is_sorting_lane:
                 self.broadcast_log("info", f"{job_id_log_prefix} Bắt đầu chu trình đẩy {lane_name}")
                 self.RELAY_OFF(pull_pin)
                 with self.state_lock: self.system_state["lanes"][lane_index]["relay_grab"] = 0
-                time.sleep(settle_delay);
+                timed_sleep(settle_delay, "sort_cycle")
                 if not self.main_loop_running: return
                 self.RELAY_ON(push_pin)
+                actuation_ts = time.time()
                 with self.state_lock: self.system_state["lanes"][lane_index]["relay_push"] = 1
-                time.sleep(delay);
+                timed_sleep(delay, "sort_cycle")
                 if not self.main_loop_running: return
                 self.RELAY_OFF(push_pin)
                 with self.state_lock: self.system_state["lanes"][lane_index]["relay_push"] = 0
-                time.sleep(settle_delay);
+                timed_sleep(settle_delay, "sort_cycle")
                 if not self.main_loop_running: return
                 self.RELAY_ON(pull_pin)
                 with self.state_lock: self.system_state["lanes"][lane_index]["relay_grab"] = 1
+                outcome = "sorted"
 
         except Exception as e:
+            outcome = "error"
             logging.error(f"[SORT] {job_id_log_prefix} Lỗi trong sorting_process (lane {lane_name}): {e}")
             self.error_manager.trigger_maintenance(f"Lỗi sorting_process (Lane {lane_name}): {e}")
         finally:
-            with self.state_lock:
-                if 0 <= lane_index < len(self.system_state["lanes"]):
-                    lane = self.system_state["lanes"][lane_index]
-                    if lane_name and lane["status"] != "Lỗi Config":
-                        lane["count"] += 1
-                        log_type = "sort" if is_sorting_lane else "pass"
-                        self.broadcast_log(log_type, "", data={"name": lane_name, "count": lane['count']})
-                        self.log_sort_count(lane_index, lane_name)
-                        if lane["status"] != "Lỗi Config":
-                            lane["status"] = "Sẵn sàng"
-            if lane_name:
-                msg = f"Hoàn tất chu trình cho {lane_name}" if is_sorting_lane else f"Hoàn tất đếm vật phẩm đi thẳng qua {lane_name}"
-                self.broadcast_log("info", f"{job_id_log_prefix} {msg}")
+            try:
+                with self.state_lock:
+                    if 0 <= lane_index < len(self.system_state["lanes"]):
+                        lane = self.system_state["lanes"][lane_index]
+                        if lane_name and lane["status"] != "Lỗi Config":
+                            lane["count"] += 1
+                            log_type = "sort" if is_sorting_lane else "pass"
+                            self.broadcast_log(log_type, "", data={"name": lane_name, "count": lane['count']})
+                            self.log_sort_count(lane_index, lane_name)
+                            if lane["status"] != "Lỗi Config":
+                                lane["status"] = "Sẵn sàng"
+                source = (job or {}).get("source") or ""
+                observe_stage("sort", time.perf_counter() - sort_start, lane=lane_name, source=source)
+                if job is not None:
+                    self.log_sort_event(job, lane_index, lane_name, outcome, actuation_ts=actuation_ts)
+                if lane_name:
+                    msg = f"Hoàn tất chu trình cho {lane_name}" if is_sorting_lane else f"Hoàn tất đếm vật phẩm đi thẳng qua {lane_name}"
+                    self.broadcast_log("info", f"{job_id_log_prefix} {msg}")
             
-            stop_conveyor = False
-            use_gantry = False
-            with self.state_lock:
-                cfg_timing = self.system_state['timing_config']
-                stop_conveyor = cfg_timing.get('stop_conveyor_on_entry', False)
-                use_gantry = cfg_timing.get('use_sensor_entry_gantry', False)
+                stop_conveyor = False
+                use_gantry = False
+                with self.state_lock:
+                    cfg_timing = self.system_state['timing_config']
+                    stop_conveyor = cfg_timing.get('stop_conveyor_on_entry', False)
+                    use_gantry = cfg_timing.get('use_sensor_entry_gantry', False)
             
-            if use_gantry and stop_conveyor:
-                qr_count = 0; entry_count = 0
-                with self.qr_queue_lock: qr_count = len(self.qr_queue)
-                with self.processing_queue_lock: entry_count = len(self.processing_queue)
+                if use_gantry and stop_conveyor:
+                    qr_count = 0; entry_count = 0
+                    with self.qr_queue_lock: qr_count = len(self.qr_queue)
+                    with self.processing_queue_lock: entry_count = len(self.processing_queue)
                     
-                if qr_count == 0 and entry_count == 0:
-                     logging.info(f"[CONVEYOR] {job_id_log_prefix} Hoàn tất xử lý, không còn vật. Khởi động lại băng chuyền.")
-                     self.CONVEYOR_RUN()
-                else:
-                     logging.info(f"[CONVEYOR] {job_id_log_prefix} Hoàn tất xử lý. Băng chuyền VẪN DỪNG (còn {qr_count} QR, {entry_count} vật).")
+                    if qr_count == 0 and entry_count == 0:
+                         logging.info(f"[CONVEYOR] {job_id_log_prefix} Hoàn tất xử lý, không còn vật. Khởi động lại băng chuyền.")
+                         self.CONVEYOR_RUN()
+                    else:
+                         logging.info(f"[CONVEYOR] {job_id_log_prefix} Hoàn tất xử lý. Băng chuyền VẪN DỪNG (còn {qr_count} QR, {entry_count} vật).")
+            finally: # Không để lỗi ở trên làm rò bộ đếm (freeze_for_handoff chờ active_sorts == 0)
+                with self.state_lock: self.active_sorts -= 1
+
+    def get_latest_frame(self, consumer, reject_stale=True, after_seq=None, kind="bgr", copy=True):
+        """
+        Lấy frame mới nhất + seq, đồng thời ghi metric tuổi frame cho `consumer`.
+        - reject_stale: trả về None nếu frame cũ hơn max_frame_age (camera bị treo / đang retry).
+        - after_seq: trả về None (không copy) nếu chưa có frame mới hơn seq này.
+        - kind: "bgr" (màu) | "gray" (xám, cho giải mã QR). Chuyển đổi được tính 1 lần / frame (core/frames.py).
+        - copy=False: trả về mảng dùng chung (chỉ đọc) - consumer không được vẽ lên frame.
+        """
+        with self.frame_lock:
+            frame = self.latest_frame
+            if frame is None:
+                return None, self.latest_frame_seq
+            seq = self.latest_frame_seq
+            if after_seq is not None and seq <= after_seq:
+                return None, seq
+            if not isinstance(frame, CapturedFrame): # Simulator / code cũ ghi thẳng ndarray BGR: bọc 1 lần cho mỗi frame
+                frame = self.latest_frame = CapturedFrame(frame)
+            age = time.monotonic() - self.latest_frame_ts
+            if reject_stale and age > self.max_frame_age:
+                frame = None
+        FRAME_AGE.observe(age, consumer=consumer)
+        if frame is None:
+            STALE_FRAMES_TOTAL.inc(consumer=consumer)
+            logging.warning("[CAMERA] Frame quá cũ (%.2fs > %.2fs), %s bỏ qua.", age, self.max_frame_age, consumer)
+            return None, seq
+        frame = frame.view(kind)
+        return (frame.copy() if copy else frame), seq
+
+    def qr_regions(self):
+        """Vùng giải mã QR cho luồng quét: vùng kiện của tracker (None = cả frame, khi tắt tracker / tracker_qr_regions)"""
+        parcel_tracker = self.parcel_tracker
+        if parcel_tracker is None: return None
+        with self.state_lock:
+            if not self.system_state.get('ai_config', {}).get('tracker_qr_regions', True): return None
+        return parcel_tracker.regions()
 
     def run_ai_detection(self, ng_lane_index):
         """Thực thi AI (Lấy từ app_god.py, nhưng dùng class AIDetector)"""
-        if not self.ai_detector or not self.ai_detector.enabled:
+        detector = self.ai_detector
+        if not detector or not detector.enabled:
             return ng_lane_index, None, None
 
-        frame_copy = None
-        with self.frame_lock:
-            if self.latest_frame is not None:
-                frame_copy = self.latest_frame.copy()
-                
+        # Luồng tracker đã phân loại kiện đang ở cổng vào -> chỉ tra cứu, không chạy lại model
+        parcel_tracker = self.parcel_tracker
+        track = parcel_tracker.at_entry() if parcel_tracker is not None else None
+        if track is not None and track.ai_class:
+            lane_index = detector.lane_map.get(track.ai_class, -1)
+            logging.info(f"[AI] Track #{track.track_id} tại cổng: '{track.ai_class}' -> Lane {lane_index} (không chạy lại model)")
+            return (lane_index, track.ai_class, track.track_id) if lane_index != -1 else (ng_lane_index, None, None)
+
+        frame_copy, _ = self.get_latest_frame("ai")
         if frame_copy is None:
-            logging.warning("[AI] Không có frame camera để nhận diện.")
+            logging.warning("[AI] Không có frame camera (mới) để nhận diện.")
             return ng_lane_index, None, None
         
         try:
             # AIDetector.detect đã bao gồm logic của YOLOv8 và DeepSORT
-            lane_index, class_name, track_id = self.ai_detector.detect(frame_copy)
+            detect_start = time.perf_counter()
+            lane_index, class_name, track_id = detector.detect(frame_copy)
+            observe_stage("detect", time.perf_counter() - detect_start, source="AI")
+            if track is not None:
+                parcel_tracker.set_class(track, class_name)
+                track_id = track.track_id
             
             if lane_index != -1:
                 logging.info(f"[AI] Phát hiện: '{class_name}' -> Lane {lane_index} (Track ID: {track_id if track_id else 'N/A'})")
@@ -274,7 +410,10 @@ class SortingSystem:
     def restart_conveyor_after_delay(self, delay_seconds):
         """Luồng phụ cho băng chuyền (Lấy từ app_god.py)"""
         try:
+            self.conveyor_restart_at = time.time() + delay_seconds
             time.sleep(delay_seconds)
+            if self.handoff_frozen: # Tiến trình mới nhận lịch chạy lại này; chuyển giao bị hủy -> resume_after_handoff chạy
+                self.conveyor_restart_skipped = True; return
             logging.info(f"[CONVEYOR] Hết thời gian {delay_seconds}s. Tự động KHỞI ĐỘNG băng chuyền.")
             self.CONVEYOR_RUN()
         except Exception as e:
@@ -284,45 +423,157 @@ class SortingSystem:
     # KHỞI TẠO & VÒNG LẶP CHÍNH
     # ===========================================
     
+    def _startup_stage(self, name, stage_start):
+        """Ghi thời gian 1 giai đoạn khởi động, trả về mốc bắt đầu giai đoạn kế tiếp"""
+        now = time.perf_counter()
+        self.startup_timings[name] = round((now - stage_start) * 1000, 1)
+        logging.info(f"[STARTUP] {name}: {self.startup_timings[name]} ms")
+        return now
+
+    def _ai_lane_map(self, ai_cfg, lane_ids):
+        """Map class name (từ AI) sang lane index (từ config)"""
+        lane_id_to_index_map = {canon_id(lane_id): i for i, lane_id in enumerate(lane_ids) if lane_id}
+        lane_map = {}
+        for class_name, lane_id in ai_cfg.get('ai_class_to_id_map', {}).items():
+            canon_lane_id = canon_id(lane_id)
+            if canon_lane_id in lane_id_to_index_map:
+                lane_map[class_name.upper()] = lane_id_to_index_map[canon_lane_id]
+                logging.info(f"[AI] Đã map Class '{class_name.upper()}' -> Lane ID '{lane_id}' (index {lane_map[class_name.upper()]})")
+            else:
+                logging.warning(f"[AI] Lỗi map: Lane ID '{lane_id}' (cho class '{class_name}') không tồn tại.")
+        return lane_map
+
+    def _load_ai_detector(self, ai_cfg, lane_ids):
+        """Tạo AIDetector theo ai_cfg (chậm: import torch + nạp model). Trả về None nếu AI tắt / lỗi"""
+        if not ai_cfg.get('enable_ai', False): return None
+        if not YOLO_AVAILABLE:
+            logging.error("[AI] Config bật AI, nhưng 'ultralytics' chưa được cài đặt.")
+            return None
+        model_path = ai_cfg.get('model_path', 'yolov8n.pt')
+        if not os.path.exists(model_path):
+            logging.error(f"[AI] Lỗi: Không tìm thấy file model tại '{model_path}'.")
+            return None
+        detector = AIDetector(model_path, ai_cfg)
+        if detector.enabled: detector.lane_map = self._ai_lane_map(ai_cfg, lane_ids)
+        return detector
+
+    def _init_ai(self):
+        """Nạp model AI (Lấy từ app_god.py, nhưng dùng class AIDetector) - giai đoạn khởi động cuối cùng"""
+        with self.state_lock:
+            ai_cfg = dict(self.system_state['ai_config'])
+            lane_ids = [lane.get('id') for lane in self.system_state['lanes']]
+        # Gán sau khi map xong: luồng trigger không thấy detector dở dang
+        self.ai_detector = self._load_ai_detector(ai_cfg, lane_ids)
+        if not self.ai_detector or not self.ai_detector.enabled:
+            logging.warning("[AI] Tính năng AI hiện đang TẮT (do config hoặc lỗi).")
+
+    def _find_ng_lane(self, lanes):
+        for i, lane_state in enumerate(lanes):
+            if canon_id(lane_state.get("id")) == "NG":
+                return i, lane_state.get("name", "Hàng NG")
+        return -1, "Hàng NG"
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, args=(self,), name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def _start_job_triggers(self, use_gantry_logic, sensor_side=True, camera_side=True):
+        """Khởi động luồng tạo Job theo chế độ v1/v2 (giữ handle để đổi chế độ nóng - xem _switch_trigger_mode)"""
+        if not self.job_triggers_enabled: return
+        if use_gantry_logic and sensor_side:
+            logging.info("[MAIN] Đang khởi động ở chế độ: Sensor Gantry (v2 Logic).")
+            self.trigger_threads.append(self._start_thread(gantry.start_gantry_trigger_thread, "GantryTriggerThread"))
+        if use_gantry_logic and camera_side:
+            from threads import qr_scanner # cv2
+            self.trigger_threads.append(self._start_thread(qr_scanner.start_qr_scanner_thread, "QRScannerThread"))
+        elif camera_side:
+            from threads import camera_trigger # cv2
+            logging.info("[MAIN] Đang khởi động ở chế độ: Camera Trigger (v1 Logic).")
+            self.trigger_threads.append(self._start_thread(camera_trigger.start_camera_trigger_thread, "CameraTriggerThread"))
+
     def run(self):
-        """Hàm này được gọi 1 LẦN DUY NHẤT bởi web/app.py để khởi động các luồng nền"""
+        """
+        Hàm này được gọi 1 LẦN DUY NHẤT bởi web/app.py để khởi động các luồng nền.
+        Khởi động theo giai đoạn, phần an toàn vật lý trước: gpio -> queue -> sensors -> camera -> services -> ai
+        (cv2 / requests / model YOLO chỉ được nạp sau khi relay đã reset và sensor đã được giám sát).
+        Chuyển giao nóng (APP_HANDOFF=1): queue -> warm (AI + cv2) -> handoff (nhận trạng thái + GPIO) -> sensors -> ...
+        """
+        handoff = None
         try:
             logging.info("[SYSTEM] Bắt đầu chạy các luồng nền...")
-            self._init_database()
-            self._load_queues_on_startup()
-            self._setup_gpio() # Setup chân cắm
-            self.reset_all_relays_to_default() # Reset vật lý
+            stage_start = time.perf_counter()
+            handoff = self._connect_handoff()
+            if handoff is None:
+                self._setup_gpio() # Setup chân cắm
+                self.reset_all_relays_to_default() # Reset vật lý
+                self.owns_gpio = True
+                stage_start = self._startup_stage("gpio", stage_start)
 
+            self._init_database()
+            if handoff is None: self._load_queues_on_startup()
             # Xác định NG Lane
             with self.state_lock:
-                for i, lane in enumerate(self.system_state["lanes"]):
-                    if canon_id(lane.get("id")) == "NG":
-                        self.NG_LANE_INDEX = i
-                        self.NG_LANE_NAME = lane.get("name", "Hàng NG")
-                        break
+                self.NG_LANE_INDEX, self.NG_LANE_NAME = self._find_ng_lane(self.system_state["lanes"])
             logging.info(f"[SYSTEM] Đã cấu hình hàng NG tại index: {self.NG_LANE_INDEX} ({self.NG_LANE_NAME})")
-
-            # Khởi động các luồng chung
-            threading.Thread(target=camera.start_camera_thread, args=(self,), name="CameraThread", daemon=True).start()
-            threading.Thread(target=lane.start_lane_monitor_thread, args=(self,), name="LaneSensorThread", daemon=True).start()
-            threading.Thread(target=broadcast.start_broadcast_state_thread, args=(self,), name="BroadcastThread", daemon=True).start()
-            threading.Thread(target=config_save.start_periodic_config_save_thread, args=(self,), name="ConfigSaveThread", daemon=True).start()
-            threading.Thread(target=vps.start_vps_thread, args=(self,), name="VPSUpdateThread", daemon=True).start()
-            
-            # Khởi động luồng logic có điều kiện (v1 hoặc v2)
-            use_gantry_logic = False
             with self.state_lock:
+                self.trace = open_trace(os.path.join(LOG_DIR, "traces"), self.system_state, self.NG_LANE_INDEX, SENSOR_ENTRY_PIN)
+            if self.trace.enabled: self.sort_event_listeners.append(self.trace.sort)
+            stage_start = self._startup_stage("queue", stage_start)
+
+            if handoff is not None:
+                # Phần chậm chạy trước, trong lúc tiến trình cũ vẫn điều khiển
+                self._init_ai()
+                for mod in ("threads.camera", "threads.qr_scanner", "threads.camera_trigger"): importlib.import_module(mod) # Nạp cv2 trước
+                stage_start = self._startup_stage("warm", stage_start)
+                window_start = stage_start
+                if not self._take_over(handoff): return
+                stage_start = self._startup_stage("handoff", stage_start)
+
+            install_gc_monitor()
+            with self.state_lock:
+                rt_timing = dict(self.system_state["timing_config"])
                 use_gantry_logic = self.system_state['timing_config'].get('use_sensor_entry_gantry', False)
-
-            if use_gantry_logic:
-                logging.info("[MAIN] Đang khởi động ở chế độ: Sensor Gantry (v2 Logic).")
-                threading.Thread(target=gantry.start_gantry_trigger_thread, args=(self,), name="GantryTriggerThread", daemon=True).start()
-                threading.Thread(target=qr_scanner.start_qr_scanner_thread, args=(self,), name="QRScannerThread", daemon=True).start()
-            else:
-                logging.info("[MAIN] Đang khởi động ở chế độ: Camera Trigger (v1 Logic).")
-                threading.Thread(target=camera_trigger.start_camera_trigger_thread, args=(self,), name="CameraTriggerThread", daemon=True).start()
+            apply_process_profile(rt_timing)
+            self.lane_thread = self._start_thread(lane.start_lane_monitor_thread, "LaneSensorThread")
+            if not self.job_triggers_enabled:
+                logging.info("[MAIN] Chế độ phát lại trace: không khởi động luồng tạo Job.")
+            self._start_job_triggers(use_gantry_logic, camera_side=False)
+            stage_start = self._startup_stage("sensors", stage_start)
+            if handoff is not None:
+                self.startup_timings["handoff_window"] = round((stage_start - window_start) * 1000, 1)
+                logging.info(f"[HANDOFF] Cửa sổ chuyển giao (freeze -> sensor chạy): {self.startup_timings['handoff_window']} ms")
+
+            from threads import camera
+            self.camera_thread = self._start_thread(camera.start_camera_thread, "CameraThread")
+            self._start_thread(tracker.start_tracker_thread, "TrackerThread")
+            self._start_job_triggers(use_gantry_logic, sensor_side=False)
+            stage_start = self._startup_stage("camera", stage_start)
+            if handoff is not None:
+                try: handoff.commit()
+                except Exception as e: logging.warning(f"[HANDOFF] Lỗi gửi commit (tiến trình cũ đã thoát?): {e}")
+                self.handoff_peer_pid = handoff.peer_pid
+            self.handoff_done.set()
+
+            from threads import vps
+            from .handoff import HandoffServer
+            self._start_thread(broadcast.start_broadcast_state_thread, "BroadcastThread")
+            self._start_thread(config_save.start_periodic_config_save_thread, "ConfigSaveThread")
+            self._start_thread(vps.start_vps_thread, "VPSUpdateThread")
+            try:
+                self.handoff_server = HandoffServer(self, self.handoff_socket); self.handoff_server.start()
+            except OSError as e:
+                logging.warning(f"[HANDOFF] Không mở được socket chuyển giao {self.handoff_socket}: {e}")
+            stage_start = self._startup_stage("services", stage_start)
+
+            if handoff is None:
+                self._init_ai()
+                self._startup_stage("ai", stage_start)
                 
-            logging.info("[SYSTEM] Tất cả các luồng nền đã được khởi động.")
+            total_ms = round((time.perf_counter() - self.init_started) * 1000, 1)
+            self.startup_timings["total"] = total_ms
+            logging.info(f"[SYSTEM] Tất cả các luồng nền đã được khởi động ({total_ms} ms kể từ khi khởi tạo).")
+            finish_startup(rt_timing)
             
             # Giữ luồng này chạy (hoặc có thể kết thúc nếu các luồng con là daemon)
             while self.main_loop_running:
@@ -331,24 +582,172 @@ class SortingSystem:
         except Exception as main_e:
             logging.critical(f"[CRITICAL] Lỗi nghiêm trọng trong system.run: {main_e}", exc_info=True)
             self.error_manager.trigger_maintenance(f"Lỗi vòng lặp chính: {main_e}")
+            if handoff is not None and not self.owns_gpio: handoff.abort()
         finally:
+            self.handoff_done.set()
             self.stop()
             
     def stop(self):
         if not self.main_loop_running: return
         logging.info("\n🛑 [SHUTDOWN] Dừng hệ thống...")
         self.main_loop_running = False
-        self.save_queues_on_shutdown()
+        if self.handoff_server is not None: self.handoff_server.stop()
+        if self.owns_gpio: self.save_queues_on_shutdown()
+        else: logging.info("[SHUTDOWN] Hàng chờ / GPIO không thuộc tiến trình này (chuyển giao), bỏ qua lưu hàng chờ.")
+        try:
+            with self.config_file_lock:
+                if self.config_store.flush(): logging.info("[SHUTDOWN] Đã lưu config chưa ghi.")
+        except Exception as e:
+            logging.error(f"[SHUTDOWN] Lỗi lưu config: {e}")
+        logging.info("[SHUTDOWN] Đang flush CSDL...")
+        self.sort_log_writer.stop()
+        self.trace.close()
         logging.info("[SHUTDOWN] Đang tắt ThreadPoolExecutor...")
         self.executor.shutdown(wait=False)
-        logging.info("[SHUTDOWN] Đang cleanup GPIO...")
-        try:
-            self.gpio.cleanup()
-            logging.info("✅ [SHUTDOWN] GPIO cleaned up.")
-        except Exception as clean_e:
-            logging.warning(f"[SHUTDOWN] Lỗi khi cleanup GPIO: {clean_e}")
+        self.tracker_executor.shutdown(wait=False)
+        if not self.owns_gpio:
+            logging.info("[SHUTDOWN] Giữ nguyên mức relay (không cleanup GPIO).")
+        else:
+            logging.info("[SHUTDOWN] Đang cleanup GPIO...")
+            try:
+                self.gpio.cleanup()
+                logging.info("✅ [SHUTDOWN] GPIO cleaned up.")
+            except Exception as clean_e:
+                logging.warning(f"[SHUTDOWN] Lỗi khi cleanup GPIO: {clean_e}")
         logging.info("👋 [SHUTDOWN] Tạm biệt!")
 
+    # ===========================================
+    # CHUYỂN GIAO NÓNG SANG TIẾN TRÌNH MỚI (core/handoff.py)
+    # ===========================================
+
+    def handoff_hold(self):
+        """Gọi ở đầu mỗi vòng lặp sensor / tạo Job: True = đang chuyển giao, bỏ qua vòng này"""
+        if not self.handoff_frozen: return False
+        self.handoff_acks.add(threading.current_thread().name)
+        return True
+
+    def freeze_for_handoff(self, timeout=3.0):
+        """(Tiến trình cũ) Dừng sensor / tạo Job, chờ chu trình đẩy xong, nhả camera + journal, trả về trạng thái"""
+        logging.warning("[HANDOFF] Tiến trình mới xin chuyển giao. Tạm dừng sensor / tạo Job...")
+        freeze_start = time.perf_counter()
+        self.handoff_acks = set(); self.handoff_frozen = True
+        loops = {t.name for t in [self.lane_thread] + self.trigger_threads if t is not None and t.is_alive()}
+        deadline = time.monotonic() + timeout
+        while not (loops <= self.handoff_acks and self.active_sorts == 0):
+            if time.monotonic() > deadline:
+                self.handoff_frozen = False; self._run_skipped_conveyor_restart()
+                raise RuntimeError(f"Hết {timeout}s chờ dừng (luồng: {sorted(loops - self.handoff_acks)}, đang đẩy: {self.active_sorts})")
+            time.sleep(0.002)
+        if self.camera_thread is not None: # v4l2 không mở được ở 2 tiến trình cùng lúc
+            self.camera_generation += 1
+            self.camera_thread.join(timeout=5.0)
+        self.queue_journal.stop() # Snapshot cuối; từ đây tiến trình mới ghi journal
+        with self.qr_queue_lock:
+            with self.processing_queue_lock:
+                with self.state_lock:
+                    lanes = self.system_state["lanes"]
+                    state = {
+                        "lane_ids": [ln.get("id") for ln in lanes],
+                        "lanes": [{k: ln.get(k) for k in ("count", "status", "relay_grab", "relay_push", "sensor_reading")} for ln in lanes],
+                        "qr_queue": list(self.qr_queue), "processing_queue": [dict(j) for j in self.processing_queue],
+                        "queue_head_since": self.queue_head_since, "journal_seq": self.queue_journal.seq,
+                        "last_sensor_trigger_time": list(self.last_sensor_trigger_time),
+                        "sensor_entry_reading": self.system_state.get("sensor_entry_reading", 1),
+                        "last_entry_sensor_state": self.last_entry_sensor_state,
+                        "last_entry_sensor_trigger_time": self.last_entry_sensor_trigger_time,
+                        "relays": {str(pin): self.gpio.input(pin) for pin in set(self.RELAY_PINS) if pin is not None},
+                        "conveyor_restart_in": max(0.001 if self.conveyor_restart_skipped else 0.0, self.conveyor_restart_at - time.time()),
+                    }
+        logging.info(f"[HANDOFF] Đã dừng sau {(time.perf_counter() - freeze_start) * 1000:.1f} ms: "
+                     f"{len(state['processing_queue'])} Job, {len(state['qr_queue'])} QR.")
+        return state
+
+    def resume_after_handoff(self):
+        """(Tiến trình cũ) Tiến trình mới bỏ dở -> tiếp tục điều khiển"""
+        from threads import camera
+        logging.warning("[HANDOFF] Chuyển giao bị hủy, tiếp tục điều khiển.")
+        self.queue_journal.start()
+        if self.camera_thread is not None and not self.camera_thread.is_alive():
+            self.camera_thread = self._start_thread(camera.start_camera_thread, "CameraThread")
+        self.handoff_frozen = False
+        self._run_skipped_conveyor_restart()
+
+    def _run_skipped_conveyor_restart(self):
+        """Lịch chạy lại băng chuyền bị bỏ qua lúc đang chuyển giao (tiến trình mới không nhận) -> chạy ngay"""
+        if not self.conveyor_restart_skipped: return
+        self.conveyor_restart_skipped = False
+        logging.info("[CONVEYOR] Chuyển giao bị hủy: chạy lại băng chuyền theo lịch đã bỏ qua.")
+        self.CONVEYOR_RUN()
+
+    def finish_handoff(self):
+        """(Tiến trình cũ) Tiến trình mới đã nhận GPIO: dừng, giữ nguyên relay, rồi thoát"""
+        from .handoff import exit_process
+        logging.warning("[HANDOFF] Đã chuyển giao cho tiến trình mới. Dừng tiến trình này (giữ nguyên relay).")
+        self.owns_gpio = False
+        self.stop()
+        (self.handoff_exit or exit_process)()
+
+    def _connect_handoff(self):
+        if not self.handoff_from: return None
+        from .handoff import HandoffClient
+        client = HandoffClient(self.handoff_from)
+        try:
+            if client.connect():
+                logging.info(f"[HANDOFF] Đã kết nối tiến trình đang chạy (pid {client.peer_pid}). Nạp trước model / camera...")
+                return client
+        except Exception as e:
+            logging.warning(f"[HANDOFF] Không bắt tay được với tiến trình cũ: {e}")
+            client.close()
+        logging.info("[HANDOFF] Không có tiến trình nào để nhận chuyển giao, khởi động bình thường.")
+        return None
+
+    def _take_over(self, handoff):
+        """(Tiến trình mới) Nhận trạng thái + GPIO. False nếu tiến trình cũ từ chối (nó vẫn điều khiển)"""
+        try:
+            state = handoff.freeze()
+        except Exception as e:
+            logging.error(f"[HANDOFF] Tiến trình cũ không chuyển giao được: {e}. Dừng, tiến trình cũ tiếp tục điều khiển.")
+            handoff.abort()
+            return False
+        self._setup_gpio() # setup(OUT) không đổi mức đang xuất -> relay giữ nguyên
+        self.owns_gpio = True
+
+        with self.state_lock:
+            lanes = self.system_state["lanes"]
+            new_index = {canon_id(ln.get("id")): i for i, ln in enumerate(lanes)}
+        mapping = [new_index.get(canon_id(lane_id), self.NG_LANE_INDEX) for lane_id in state["lane_ids"]]
+        qr_queue = [remap_lane_index(idx, mapping, self.NG_LANE_INDEX) for idx in state["qr_queue"]]
+        processing_queue = [dict(job, lane_index=remap_lane_index(job["lane_index"], mapping, self.NG_LANE_INDEX))
+                            for job in state["processing_queue"]]
+        with self.qr_queue_lock:
+            with self.processing_queue_lock:
+                with self.state_lock:
+                    self.qr_queue = qr_queue
+                    self.processing_queue = processing_queue
+                    self.queue_head_since = state.get("queue_head_since", 0.0) if processing_queue else 0.0
+                    self.last_sensor_trigger_time = [0.0] * len(lanes)
+                    for old_i, lane_id in enumerate(state["lane_ids"]):
+                        i = new_index.get(canon_id(lane_id))
+                        if i is None: continue
+                        lanes[i].update(state["lanes"][old_i])
+                        self.last_sensor_trigger_time[i] = state["last_sensor_trigger_time"][old_i]
+                    self.system_state["sensor_entry_reading"] = state.get("sensor_entry_reading", 1)
+                    self.last_entry_sensor_state = state.get("last_entry_sensor_state", 1)
+                    self.last_entry_sensor_trigger_time = state.get("last_entry_sensor_trigger_time", 0.0)
+                    self.system_state["queue_indices"] = [j["lane_index"] for j in processing_queue]
+                    self.system_state["entry_queue_size"] = len(processing_queue)
+                    self.queue_journal.seq = state.get("journal_seq", 0)
+        for pin, level in state.get("relays", {}).items():
+            if int(pin) in self.RELAY_PINS: self.gpio.output(int(pin), level)
+        if state.get("conveyor_restart_in"):
+            self.executor.submit(self.restart_conveyor_after_delay, state["conveyor_restart_in"])
+        self.handoff_state_loaded = True
+
+        self.queue_journal.compact() # Snapshot của trạng thái vừa nhận, rồi ghi journal như bình thường
+        self.queue_journal.start()
+        logging.info(f"[HANDOFF] Đã nhận {len(processing_queue)} Job, {len(qr_queue)} QR, {len(state.get('relays', {}))} relay.")
+        return True
+
     # ===========================================
     # CÁC HÀM CONFIG VÀ DATABASE (Lấy từ app_god.py)
     # ===========================================
@@ -356,51 +755,122 @@ class SortingSystem:
     def _init_database(self):
         with self.database_lock:
             try:
-                conn = sqlite3.connect(DATABASE_FILE)
-                cursor = conn.cursor()
-                cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sort_log (
-                    date TEXT, lane_name TEXT, count INTEGER DEFAULT 0,
-                    PRIMARY KEY (date, lane_name)
-                )""")
-                conn.commit(); conn.close()
+                self.sort_log_writer.start()
                 logging.info(f"[DB] Đã khởi tạo CSDL SQLite tại '{DATABASE_FILE}' thành công.")
             except Exception as e:
                 logging.critical(f"[CRITICAL] Không thể khởi tạo CSDL SQLite: {e}")
                 self.error_manager.trigger_maintenance(f"Lỗi khởi tạo CSDL SQLite: {e}")
 
     def log_sort_count(self, lane_index, lane_name):
-        """Ghi log đếm vào CSDL (Lấy từ app_god.py)"""
-        with self.database_lock:
-            try:
-                today = datetime.now().strftime('%Y-%m-%d')
-                conn = sqlite3.connect(DATABASE_FILE)
-                cursor = conn.cursor()
-                cursor.execute("""
-                INSERT INTO sort_log (date, lane_name, count) VALUES (?, ?, 1)
-                ON CONFLICT(date, lane_name) DO UPDATE SET count = count + 1
-                """, (today, lane_name))
-                conn.commit(); conn.close()
-            except Exception as e:
-                logging.error(f"[DB] Lỗi khi ghi log đếm vào SQLite: {e}")
+        """Ghi log đếm (chỉ cộng dồn trong RAM, luồng DBWriter ghi theo lô)"""
+        try:
+            self.sort_log_writer.increment(lane_name)
+        except Exception as e:
+            logging.error(f"[DB] Lỗi khi ghi log đếm: {e}")
 
-    def get_sort_log_data(self):
-        """Lấy dữ liệu log cho API (Lấy từ app_god.py)"""
-        output_data = {}
-        with self.database_lock:
-            try:
-                conn = sqlite3.connect(DATABASE_FILE)
-                cursor = conn.cursor()
-                cursor.execute("SELECT date, lane_name, count FROM sort_log ORDER BY date ASC")
-                rows = cursor.fetchall()
-                conn.close()
-                for date, lane_name, count in rows:
-                    if date not in output_data: output_data[date] = {}
-                    output_data[date][lane_name] = count
-            except Exception as e:
-                logging.error(f"[API] Lỗi khi đọc /api/sort_log từ SQLite: {e}")
-                return {"error": str(e)}
-        return output_data
+    def log_sort_event(self, job, lane_index, lane_name, outcome, actuation_ts=None):
+        """Ghi 1 sự kiện vào sort_events (qua bộ đệm của luồng DBWriter) + metric từng chặng"""
+        source = job.get("source") or match_source(job.get("status"))
+        entry_ts = job.get("entry_time"); sensor_ts = job.get("sensor_time"); done_ts = time.time()
+        try:
+            self.sort_log_writer.log_event({
+                "job_id": job.get("job_id"), "entry_ts": entry_ts,
+                "lane_index": lane_index, "lane_name": lane_name,
+                "source": source, "status": job.get("status"),
+                "decode_latency": job.get("decode_latency"), "sensor_ts": sensor_ts,
+                "actuation_ts": actuation_ts, "done_ts": done_ts, "outcome": outcome
+            })
+        except Exception as e:
+            logging.error(f"[DB] Lỗi khi ghi sự kiện sort_events: {e}")
+
+        SORT_OUTCOMES_TOTAL.inc(lane=lane_name, source=source, outcome=outcome)
+        for listener in list(self.sort_event_listeners):
+            try: listener(job, lane_index, lane_name, outcome, actuation_ts)
+            except Exception as e: logging.error(f"[SORT] Lỗi trong sort_event_listener: {e}")
+        if entry_ts and sensor_ts:
+            observe_stage("queue_wait", sensor_ts - entry_ts, lane=lane_name, source=source)
+        if sensor_ts and actuation_ts:
+            observe_stage("actuation", actuation_ts - sensor_ts, lane=lane_name, source=source)
+        if entry_ts:
+            observe_stage("end_to_end", done_ts - entry_ts, lane=lane_name, source=source)
+
+    def get_perf_summary(self):
+        """API /api/perf: tóm tắt histogram + counter (JSON)"""
+        parcel_tracker = self.parcel_tracker
+        return ({**METRICS.summary(), "rt_profile": profile_status(), "startup_ms": dict(self.startup_timings),
+                 "tracker": parcel_tracker.stats() if parcel_tracker is not None else None}, 200)
+
+    def get_vps_stats(self):
+        """API /api/vps/stats: RTT, số request đang gửi, tốc độ upload, fps / chất lượng frame hiện tại"""
+        uploader = self.vps_uploader
+        if uploader is None: return ({"enabled": False}, 200)
+        return ({"enabled": True, "url": uploader.url, **uploader.status()}, 200)
+
+    def get_lock_report(self, params=None):
+        """API /api/locks: thời gian chờ / giữ khóa theo từng khóa và luồng"""
+        reset = str((params or {}).get('reset', '')).lower() in {"1", "true", "yes"}
+        report = lock_report(self.locks, reset=reset)
+        if not LOCK_PROFILE_ENABLED:
+            report["message"] = "Chưa bật đo khóa. Khởi động lại với APP_LOCK_PROFILE=1."
+        return (report, 200)
+
+    def get_metrics_text(self):
+        """API /metrics: định dạng text Prometheus"""
+        return METRICS.render_prometheus()
+
+    def get_sort_events(self, params):
+        """API /api/sort_events: danh sách sự kiện có phân trang"""
+        try:
+            data = query_sort_events(
+                DATABASE_FILE,
+                since=parse_ts(params.get('since')), until=parse_ts(params.get('until')),
+                lane=params.get('lane') or None, outcome=params.get('outcome') or None,
+                before_id=params.get('before_id') or None, limit=params.get('limit') or 100
+            )
+            return (data, 200)
+        except ValueError as e:
+            return ({"error": str(e)}, 400)
+        except Exception as e:
+            logging.error(f"[API] Lỗi khi đọc /api/sort_events: {e}")
+            return ({"error": str(e)}, 500)
+
+    def get_sort_events_summary(self, params):
+        """API /api/sort_events/summary: tổng hợp theo lane/source/outcome"""
+        try:
+            data = summarize_sort_events(
+                DATABASE_FILE,
+                since=parse_ts(params.get('since')), until=parse_ts(params.get('until')),
+                lane=params.get('lane') or None, group_by=params.get('group_by') or "lane"
+            )
+            return (data, 200)
+        except ValueError as e:
+            return ({"error": str(e)}, 400)
+        except Exception as e:
+            logging.error(f"[API] Lỗi khi đọc /api/sort_events/summary: {e}")
+            return ({"error": str(e)}, 500)
+
+    def get_sort_log_data(self, params=None):
+        """API /api/sort_log: rollup (since/until/granularity) + số đếm chưa ghi, không giữ database_lock"""
+        params = params or {}
+        try:
+            return (self.sort_log_writer.query_rollup(params.get('granularity'), since=parse_ts(params.get('since')),
+                                                      until=parse_ts(params.get('until'))), 200)
+        except ValueError as e:
+            return ({"error": str(e)}, 400)
+        except Exception as e:
+            logging.error(f"[API] Lỗi khi đọc /api/sort_log từ SQLite: {e}")
+            return ({"error": str(e)}, 500)
+
+    def get_sort_log_etag(self, params=None):
+        """ETag cho /api/sort_log: đổi khi số đếm đổi hoặc tham số truy vấn (đã chuẩn hóa) khác. None: tham số sai"""
+        params = params or {}
+        try:
+            query_key = "|".join(str(v or "") for v in rollup_query_key(
+                params.get('granularity'), parse_ts(params.get('since')), parse_ts(params.get('until'))))
+        except ValueError:
+            return None
+        writer = self.sort_log_writer
+        return f"{writer.instance_id}-{writer.count_version}-{uuid.uuid5(uuid.NAMESPACE_URL, query_key).hex[:8]}"
 
     def _ensure_lane_ids(self, lanes_list):
         """(Lấy từ app_god.py)"""
@@ -420,6 +890,11 @@ class SortingSystem:
             "min_confidence": 0.6, "yolo_iou": 0.45, "yolo_augment": False, "yolo_half": False,
             "enable_deepsort": True, "deepsort_max_age": 30, "deepsort_n_init": 3,
             "deepsort_max_iou_distance": 0.7,
+            # Theo dõi kiện liên tục (threads/tracker.py): trigger tra track ở vạch cổng thay vì chạy YOLO
+            "enable_tracker": False, "tracker_scale": 0.25, "tracker_min_area": 0.01, "tracker_diff_threshold": 25,
+            "tracker_entry_line": 0.5, "tracker_axis": "x", "tracker_max_misses": 5,
+            "tracker_qr_regions": True, # Chỉ giải mã QR trong vùng kiện đang theo dõi
+            "tracker_full_scan_every": 10, # ...nhưng cứ N frame quét cả frame 1 lần (0 = không)
             "ai_class_to_id_map": { "APPLE": "SP001", "ORANGE": "SP002" }
         }
         default_timing_config = {
@@ -428,9 +903,23 @@ class SortingSystem:
             "pending_trigger_timeout": 0.5, "RELAY_CONVEYOR_PIN": None,
             "stop_conveyor_on_entry": False, "stability_delay": 0.25,
             "stop_conveyor_on_qr": False, "conveyor_stop_delay_qr": 2.0,
-            "qr_debounce_time": 3.0, "use_sensor_entry_gantry": False
+            "qr_debounce_time": 3.0, "use_sensor_entry_gantry": False,
+            "db_flush_interval": 1.0, "db_flush_max_events": 50,
+            "journal_fsync_interval": 0.02, "journal_compact_every": 500,
+            "config_save_debounce": 0.5, "config_save_max_delay": 5.0,
+            "max_frame_age": 1.0,
+            "trace_record": False, "trace_max_mb": 20, "trace_keep_files": 5,
+            # Hồ sơ thời gian thực cho luồng sensor/relay (core/rt.py) - cần khởi động lại khi đổi
+            "rt_enabled": False, "rt_control_cpus": None, "rt_other_cpus": None, "rt_priority": 50,
+            "rt_switch_interval": 0.001, "rt_gc_freeze": True, "rt_gc_threshold": [5000, 20, 100]
+        }
+        default_camera_settings = {
+            "auto_exposure": False, "brightness": 128, "contrast": 32,
+            # Nguồn frame: v4l2 (camera thật) | file | images | synthetic; playback_speed 0 = nhanh nhất
+            "source": "v4l2", "source_path": "", "playback_speed": 1.0, "source_loop": True,
+            # Định dạng xin từ V4L2: bgr (cv2 tự chuyển) | yuyv | mjpeg (QR đọc thẳng kênh sáng, BGR chỉ tạo khi cần)
+            "pixel_format": "bgr"
         }
-        default_camera_settings = { "auto_exposure": False, "brightness": 128, "contrast": 32 }
         default_lanes_config = [
             {"id": "SP001", "name": "Phân loại A", "sensor_pin": 5, "push_pin": 11, "pull_pin": 12},
             {"id": "SP002", "name": "Phân loại B", "sensor_pin": 16, "push_pin": 13, "pull_pin": 8},
@@ -469,28 +958,11 @@ class SortingSystem:
         # Áp dụng config vào self.system_state và các biến
         lanes_config = loaded_config['lanes_config']
         num_lanes = len(lanes_config)
-        new_system_lanes = []
-        self.RELAY_PINS = []; self.SENSOR_PINS = []
-        
-        if SENSOR_ENTRY_PIN: self.SENSOR_PINS.append(SENSOR_ENTRY_PIN)
-        if isinstance(self.gpio, MockGPIO) and SENSOR_ENTRY_MOCK_PIN:
-            self.SENSOR_PINS.append(SENSOR_ENTRY_MOCK_PIN)
-            
         self.RELAY_CONVEYOR_PIN = loaded_config['timing_config'].get('RELAY_CONVEYOR_PIN')
+        self.max_frame_age = loaded_config['timing_config'].get('max_frame_age', 1.0)
         if self.RELAY_CONVEYOR_PIN:
-            self.RELAY_PINS.append(self.RELAY_CONVEYOR_PIN)
             logging.info(f"[CONFIG] Đã cấu hình Relay Băng chuyền tại pin: {self.RELAY_CONVEYOR_PIN}")
-
-        for i, lane_cfg in enumerate(lanes_config):
-            new_system_lanes.append({
-                "name": lane_cfg.get("name", f"Lane {i+1}"), "id": lane_cfg.get("id", f"LANE_{i+1}"),
-                "status": "Sẵn sàng", "count": 0, "sensor_pin": lane_cfg.get("sensor_pin"),
-                "push_pin": lane_cfg.get("push_pin"), "pull_pin": lane_cfg.get("pull_pin"),
-                "sensor_reading": 1, "relay_grab": 0, "relay_push": 0
-            })
-            if lane_cfg.get("sensor_pin") is not None: self.SENSOR_PINS.append(lane_cfg["sensor_pin"])
-            if lane_cfg.get("push_pin") is not None: self.RELAY_PINS.append(lane_cfg["push_pin"])
-            if lane_cfg.get("pull_pin") is not None: self.RELAY_PINS.append(lane_cfg["pull_pin"])
+        new_system_lanes, self.SENSOR_PINS, self.RELAY_PINS = self._build_lane_table(lanes_config, self.RELAY_CONVEYOR_PIN)
 
         self.last_sensor_state = [1] * num_lanes; self.last_sensor_trigger_time = [0.0] * num_lanes
         self.auto_test_last_state = [1] * num_lanes; self.auto_test_last_trigger = [0.0] * num_lanes
@@ -504,42 +976,33 @@ class SortingSystem:
             self.system_state['ai_config'] = loaded_config['ai_config']
             self.system_state['camera_settings'] = loaded_config['camera_settings']
         
-        # Khởi tạo AI (Lấy từ app_god.py, nhưng dùng class AIDetector)
-        ai_cfg = loaded_config['ai_config']
-        if ai_cfg.get('enable_ai', False):
-            if not YOLO_AVAILABLE:
-                logging.error("[AI] Config bật AI, nhưng 'ultralytics' chưa được cài đặt.")
-            else:
-                model_path = ai_cfg.get('model_path', 'yolov8n.pt')
-                if not os.path.exists(model_path):
-                    logging.error(f"[AI] Lỗi: Không tìm thấy file model tại '{model_path}'.")
-                else:
-                    self.ai_detector = AIDetector(model_path, ai_cfg)
-                    if self.ai_detector.enabled:
-                        # Map class name (từ AI) sang lane index (từ config)
-                        lane_id_to_index_map = {canon_id(lane['id']): i for i, lane in enumerate(lanes_config) if lane.get('id')}
-                        ai_class_map_config = ai_cfg.get('ai_class_to_id_map', {})
-                        
-                        for class_name, lane_id in ai_class_map_config.items():
-                            canon_lane_id = canon_id(lane_id)
-                            if canon_lane_id in lane_id_to_index_map:
-                                lane_index = lane_id_to_index_map[canon_lane_id]
-                                self.ai_detector.lane_map[class_name.upper()] = lane_index
-                                logging.info(f"[AI] Đã map Class '{class_name.upper()}' -> Lane ID '{lane_id}' (index {lane_index})")
-                            else:
-                                logging.warning(f"[AI] Lỗi map: Lane ID '{lane_id}' (cho class '{class_name}') không tồn tại.")
-        
-        if not self.ai_detector or not self.ai_detector.enabled:
-            logging.warning("[AI] Tính năng AI hiện đang TẮT (do config hoặc lỗi).")
-            
         logging.info(f"[CONFIG] Loaded {num_lanes} lanes config.")
         logging.info(f"[CONFIG] Sensor Entry Pin (Real/Mock): {SENSOR_ENTRY_PIN} / {SENSOR_ENTRY_MOCK_PIN}")
 
+    def _build_lane_table(self, lanes_config, conveyor_pin):
+        """lanes_config -> (system_state['lanes'], SENSOR_PINS, RELAY_PINS)"""
+        lanes = []; sensor_pins = []; relay_pins = []
+        if SENSOR_ENTRY_PIN: sensor_pins.append(SENSOR_ENTRY_PIN)
+        if isinstance(self.gpio, MockGPIO) and SENSOR_ENTRY_MOCK_PIN:
+            sensor_pins.append(SENSOR_ENTRY_MOCK_PIN)
+        if conveyor_pin: relay_pins.append(conveyor_pin)
+
+        for i, lane_cfg in enumerate(lanes_config):
+            lanes.append({
+                "name": lane_cfg.get("name", f"Lane {i+1}"), "id": lane_cfg.get("id", f"LANE_{i+1}"),
+                "status": "Sẵn sàng", "count": 0, "sensor_pin": lane_cfg.get("sensor_pin"),
+                "push_pin": lane_cfg.get("push_pin"), "pull_pin": lane_cfg.get("pull_pin"),
+                "sensor_reading": 1, "relay_grab": 0, "relay_push": 0
+            })
+            if lane_cfg.get("sensor_pin") is not None: sensor_pins.append(lane_cfg["sensor_pin"])
+            if lane_cfg.get("push_pin") is not None: relay_pins.append(lane_cfg["push_pin"])
+            if lane_cfg.get("pull_pin") is not None: relay_pins.append(lane_cfg["pull_pin"])
+        return lanes, sensor_pins, relay_pins
+
     def _save_config_to_file(self, config_data):
-        """Hàm trợ giúp để lưu file config"""
+        """Hàm trợ giúp để lưu file config (ghi nguyên tử, bỏ qua nếu không đổi)"""
         try:
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(config_data, f, indent=4)
+            self.config_store.write_now(config_data)
             return True
         except Exception as e:
             logging.error(f"[CONFIG] Không thể tạo/lưu file config: {e}")
@@ -557,81 +1020,106 @@ class SortingSystem:
             self.gpio.setwarnings(False)
             logging.info(f"[GPIO] Đã đặt chế độ chân cắm là: {loaded_gpio_mode}")
             
-            active_sensor_pins = list(set([pin for pin in self.SENSOR_PINS if pin is not None]))
-            active_relay_pins = list(set([pin for pin in self.RELAY_PINS if pin is not None]))
-            
-            logging.info(f"[GPIO] Setup SENSOR pins: {active_sensor_pins}")
-            for pin in active_sensor_pins:
-                try: self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
-                except Exception as e:
-                    logging.critical(f"[CRITICAL] Lỗi cấu hình chân SENSOR {pin}: {e}.")
-                    self.error_manager.trigger_maintenance(f"Lỗi cấu hình chân SENSOR {pin}: {e}")
-                    raise
-            
-            logging.info(f"[GPIO] Setup RELAY pins: {active_relay_pins}")
-            for pin in active_relay_pins:
-                try: self.gpio.setup(pin, self.gpio.OUT)
-                except Exception as e:
-                    logging.critical(f"[CRITICAL] Lỗi cấu hình chân RELAY {pin}: {e}.")
-                    self.error_manager.trigger_maintenance(f"Lỗi cấu hình chân RELAY {pin}: {e}")
-                    raise
+            self._setup_pins(self.SENSOR_PINS, self.RELAY_PINS)
         else:
             logging.info("[GPIO] Chạy ở chế độ Mock, bỏ qua setup vật lý.")
 
+    def _setup_pins(self, sensor_pins, relay_pins):
+        """Cấu hình chân SENSOR (IN, PUD_UP) và RELAY (OUT) - chỉ với GPIO thật"""
+        if not isinstance(self.gpio, RealGPIO): return
+        active_sensor_pins = list(set([pin for pin in sensor_pins if pin is not None]))
+        active_relay_pins = list(set([pin for pin in relay_pins if pin is not None]))
+        
+        logging.info(f"[GPIO] Setup SENSOR pins: {active_sensor_pins}")
+        for pin in active_sensor_pins:
+            try: self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+            except Exception as e:
+                logging.critical(f"[CRITICAL] Lỗi cấu hình chân SENSOR {pin}: {e}.")
+                self.error_manager.trigger_maintenance(f"Lỗi cấu hình chân SENSOR {pin}: {e}")
+                raise
+        
+        logging.info(f"[GPIO] Setup RELAY pins: {active_relay_pins}")
+        for pin in active_relay_pins:
+            try: self.gpio.setup(pin, self.gpio.OUT)
+            except Exception as e:
+                logging.critical(f"[CRITICAL] Lỗi cấu hình chân RELAY {pin}: {e}.")
+                self.error_manager.trigger_maintenance(f"Lỗi cấu hình chân RELAY {pin}: {e}")
+                raise
+
+    def _queue_snapshot(self):
+        """Bản sao nhất quán của 2 hàng chờ + seq journal (mọi record() đều nằm trong khóa hàng chờ)"""
+        with self.qr_queue_lock:
+            with self.processing_queue_lock:
+                return list(self.qr_queue), [dict(j) for j in self.processing_queue], self.queue_journal.seq
+
+    def push_job(self, job):
+        """Đưa 1 Job có sẵn vào cuối hàng chờ chính (vd: Job phát lại từ trace - core/trace.py)"""
+        now = time.time()
+        with self.processing_queue_lock:
+            self.processing_queue.append(job)
+            self.queue_journal.record("job_push", job=job)
+            if len(self.processing_queue) == 1: self.queue_head_since = now
+            current_queue_indices = [j["lane_index"] for j in self.processing_queue]
+        with self.state_lock:
+            self.system_state["queue_indices"] = current_queue_indices
+            self.system_state["entry_queue_size"] = len(current_queue_indices)
+        self.trace.job(job)
+
     def save_queues_on_shutdown(self):
-        """(Lấy từ app_god.py)"""
+        """Chụp snapshot cuối của hàng chờ và đóng journal"""
         logging.info("[SHUTDOWN] Đang lưu trạng thái hàng chờ...")
         try:
-            queue_data = {}
-            with self.qr_queue_lock:
-                queue_data['qr_queue'] = list(self.qr_queue)
-            with self.processing_queue_lock:
-                queue_data['processing_queue'] = list(self.processing_queue)
-            
-            if not queue_data['qr_queue'] and not queue_data['processing_queue']:
-                logging.info("[SHUTDOWN] Hàng chờ trống, không cần lưu.")
-                if os.path.exists(QUEUE_STATE_FILE): os.remove(QUEUE_STATE_FILE)
-                return
-
-            with open(QUEUE_STATE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(queue_data, f)
-            logging.info(f"[SHUTDOWN] Đã lưu {len(queue_data['qr_queue'])} QR, {len(queue_data['processing_queue'])} Job.")
+            self.queue_journal.stop()
+            with self.qr_queue_lock: qr_count = len(self.qr_queue)
+            with self.processing_queue_lock: job_count = len(self.processing_queue)
+            logging.info(f"[SHUTDOWN] Đã lưu snapshot {qr_count} QR, {job_count} Job.")
         except Exception as e:
             logging.error(f"[SHUTDOWN] Lỗi không thể lưu hàng chờ: {e}")
 
     def _load_queues_on_startup(self):
-        """(Lấy từ app_god.py)"""
-        if os.path.exists(QUEUE_STATE_FILE):
-            logging.warning(f"[STARTUP] Phát hiện file {QUEUE_STATE_FILE}. Đang khôi phục...")
-            try:
+        """Khôi phục hàng chờ từ snapshot + journal (hoặc file queue_state.json cũ)"""
+        start = time.monotonic()
+        qr_queue, processing_queue = [], []
+        try:
+            if os.path.exists(QUEUE_STATE_FILE):
+                logging.warning(f"[STARTUP] Phát hiện file {QUEUE_STATE_FILE} (định dạng cũ). Đang chuyển sang journal...")
                 with open(QUEUE_STATE_FILE, 'r', encoding='utf-8') as f:
                     queue_data = json.load(f)
-                
-                with self.qr_queue_lock:
-                    self.qr_queue = queue_data.get('qr_queue', [])
-                with self.processing_queue_lock:
-                    self.processing_queue = queue_data.get('processing_queue', [])
-                    if self.processing_queue:
-                        self.queue_head_since = time.time()
-                
-                logging.info(f"[STARTUP] Đã khôi phục {len(self.qr_queue)} QR, {len(self.processing_queue)} Job.")
-                
-                with self.state_lock:
-                        self.system_state["queue_indices"] = [j["lane_index"] for j in self.processing_queue]
-                        self.system_state["entry_queue_size"] = len(self.processing_queue)
-                        for job in self.processing_queue:
-                            lane_idx = job.get('lane_index')
-                            if 0 <= lane_idx < len(self.system_state['lanes']):
-                                 self.system_state['lanes'][lane_idx]['status'] = "Đang chờ vật (Tải lại)"
+                qr_queue = queue_data.get('qr_queue', [])
+                processing_queue = queue_data.get('processing_queue', [])
+                try: os.remove(QUEUE_STATE_FILE)
+                except Exception as e: logging.error(f"[STARTUP] Lỗi xóa file {QUEUE_STATE_FILE}: {e}")
+            else:
+                qr_queue, processing_queue = self.queue_journal.replay()
+        except Exception as e:
+            logging.error(f"[STARTUP] Lỗi khôi phục hàng chờ: {e}.")
+            qr_queue, processing_queue = [], []
 
-            except Exception as e:
-                logging.error(f"[STARTUP] Lỗi khôi phục hàng chờ: {e}.")
-                self.qr_queue = []; self.processing_queue = []
-            
-            try: os.remove(QUEUE_STATE_FILE)
-            except Exception as e: logging.error(f"[STARTUP] Lỗi xóa file {QUEUE_STATE_FILE}: {e}")
+        with self.qr_queue_lock:
+            self.qr_queue = qr_queue
+        with self.processing_queue_lock:
+            self.processing_queue = processing_queue
+            if self.processing_queue:
+                self.queue_head_since = time.time()
+
+        if qr_queue or processing_queue:
+            logging.info(f"[STARTUP] Đã khôi phục {len(qr_queue)} QR, {len(processing_queue)} Job ({(time.monotonic() - start) * 1000:.1f} ms).")
+            with self.state_lock:
+                self.system_state["queue_indices"] = [j["lane_index"] for j in processing_queue]
+                self.system_state["entry_queue_size"] = len(processing_queue)
+                for job in processing_queue:
+                    lane_idx = job.get('lane_index')
+                    if 0 <= lane_idx < len(self.system_state['lanes']):
+                        self.system_state['lanes'][lane_idx]['status'] = "Đang chờ vật (Tải lại)"
         else:
-            logging.info("[STARTUP] Không có file trạng thái hàng chờ. Bắt đầu mới.")
+            logging.info("[STARTUP] Không có Job tồn đọng trong journal. Bắt đầu mới.")
+
+        # Snapshot mới từ trạng thái vừa khôi phục rồi bắt đầu ghi journal
+        try:
+            self.queue_journal.compact()
+        except Exception as e:
+            logging.error(f"[STARTUP] Lỗi compaction journal hàng chờ: {e}")
+        self.queue_journal.start()
 
     # ===========================================
     # CÁC HÀM HỖ TRỢ API & WEBSOCKET
@@ -649,6 +1137,7 @@ class SortingSystem:
         """Gửi log tới tất cả client (Lấy từ app_god.py)"""
         log_data = {
             'timestamp': time.strftime('%H:%M:%S'),
+            'ts': time.time(),
             'log_type': log_type,
             'message': message,
             'data': data or {}
@@ -704,8 +1193,142 @@ class SortingSystem:
             }
         return config_data
 
+    # ===========================================
+    # ÁP DỤNG CONFIG NÓNG (không khởi động lại tiến trình)
+    # ===========================================
+
+    def _apply_lanes_config(self, lanes_config, timeout=5.0):
+        """
+        Đổi bảng lanes nguyên tử, hàng chờ vẫn chạy: chân mới được setup TRƯỚC khi đổi bảng, Job/QR đang chờ
+        được map lại theo lane ID (làn bị xóa -> NG, có ghi journal), relay không còn dùng được nhả SAU khi đổi.
+        Chờ (tối đa `timeout` giây) các chu trình đẩy đang chạy xong rồi mới đổi.
+        """
+        new_lanes, sensor_pins, relay_pins = self._build_lane_table(lanes_config, self.RELAY_CONVEYOR_PIN)
+        self._setup_pins([p for p in sensor_pins if p not in self.SENSOR_PINS],
+                         [p for p in relay_pins if p not in self.RELAY_PINS])
+        new_index = {canon_id(ln["id"]): i for i, ln in enumerate(new_lanes)}
+        ng_index, ng_name = self._find_ng_lane(new_lanes)
+
+        deadline = time.monotonic() + timeout
+        while True: # Chu trình đẩy đang chạy giữ lane_index theo bảng cũ -> chỉ đổi bảng khi active_sorts == 0
+            with self.qr_queue_lock: # Thứ tự khóa giống _queue_snapshot: qr -> processing -> state
+                with self.processing_queue_lock:
+                    with self.state_lock:
+                        if self.active_sorts == 0:
+                            old_lanes = self.system_state["lanes"]
+                            mapping = [new_index.get(canon_id(ln.get("id")), ng_index) for ln in old_lanes]
+                            old_by_id = {canon_id(ln.get("id")): ln for ln in old_lanes}
+                            fresh_lanes = [] # Làn mới / đổi chân relay -> đưa relay về mặc định
+                            for lane_state in new_lanes:
+                                old = old_by_id.get(canon_id(lane_state["id"]))
+                                if old is None: fresh_lanes.append(lane_state); continue
+                                lane_state["count"] = old.get("count", 0)
+                                if (old.get("push_pin"), old.get("pull_pin")) == (lane_state["push_pin"], lane_state["pull_pin"]):
+                                    for key in ("status", "relay_grab", "relay_push"): lane_state[key] = old.get(key, lane_state[key])
+                                else: fresh_lanes.append(lane_state)
+                            self.system_state["lanes"] = new_lanes
+                            released_relays = [p for p in set(self.RELAY_PINS) if p not in relay_pins]
+                            self.SENSOR_PINS, self.RELAY_PINS = sensor_pins, relay_pins
+                            self.NG_LANE_INDEX, self.NG_LANE_NAME = ng_index, ng_name
+                            self.lanes_version += 1
+
+                            self.qr_queue[:] = [remap_lane_index(idx, mapping, ng_index) for idx in self.qr_queue]
+                            for job in self.processing_queue:
+                                job["lane_index"] = remap_lane_index(job["lane_index"], mapping, ng_index)
+                            self.queue_journal.record("lane_remap", map=mapping, ng=ng_index)
+                            current_queue_indices = [j["lane_index"] for j in self.processing_queue]
+                            self.system_state["queue_indices"] = current_queue_indices
+                            self.system_state["entry_queue_size"] = len(current_queue_indices)
+                            break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Hết {timeout}s chờ chu trình đẩy xong để đổi lanes (đang đẩy: {self.active_sorts})")
+            time.sleep(0.002)
+
+        for pin in released_relays: self.RELAY_OFF(pin)
+        for lane_state in fresh_lanes:
+            if lane_state["pull_pin"] is not None: self.RELAY_ON(lane_state["pull_pin"])
+            if lane_state["push_pin"] is not None: self.RELAY_OFF(lane_state["push_pin"])
+            with self.state_lock:
+                lane_state["relay_grab"] = 1 if lane_state["pull_pin"] is not None else 0
+                lane_state["relay_push"] = 0
+        if self.ai_detector is not None and self.ai_detector.enabled:
+            with self.state_lock: ai_cfg = dict(self.system_state['ai_config'])
+            self.ai_detector.lane_map = self._ai_lane_map(ai_cfg, [ln["id"] for ln in new_lanes])
+        logging.info(f"[CONFIG] Đã áp dụng {len(new_lanes)} lanes (map lại hàng chờ: {mapping}, NG: {ng_index}). Nhả relay: {released_relays}")
+
+    def _apply_conveyor_pin(self, new_pin):
+        """Chuyển relay băng chuyền sang chân mới: chân mới chạy trước, chân cũ nhả sau"""
+        old_pin = self.RELAY_CONVEYOR_PIN
+        self._setup_pins([], [new_pin])
+        self.RELAY_CONVEYOR_PIN = new_pin
+        self.RELAY_PINS = [p for p in self.RELAY_PINS if p != old_pin] + ([new_pin] if new_pin else [])
+        self.CONVEYOR_RUN()
+        if old_pin is not None and old_pin != new_pin and old_pin not in self.RELAY_PINS: self.RELAY_OFF(old_pin)
+        logging.info(f"[CONFIG] Relay Băng chuyền: {old_pin} -> {new_pin}")
+
+    def _switch_trigger_mode(self, use_gantry_logic, timeout=2.0):
+        """Đổi v1 (Camera Trigger) <-> v2 (Gantry + QR Scanner): dừng luồng tạo Job cũ rồi khởi động luồng mới"""
+        if self.camera_thread is None: return # run() chưa khởi động luồng -> sẽ đọc chế độ mới
+        self.trigger_generation += 1; generation = self.trigger_generation
+        old_threads, self.trigger_threads = self.trigger_threads, []
+        for thread in old_threads: thread.join(timeout=timeout)
+        stuck = [t for t in old_threads if t.is_alive()]
+        if stuck: # Không chạy 2 bộ tạo Job song song: chờ luồng cũ thoát ở nền rồi mới khởi động luồng mới
+            self.trigger_threads = stuck
+            logging.warning(f"[CONFIG] Luồng tạo Job cũ chưa dừng sau {timeout}s ({[t.name for t in stuck]}), chờ ở nền.")
+            threading.Thread(target=self._start_triggers_after, args=(stuck, generation, use_gantry_logic),
+                             name="TriggerSwitchThread", daemon=True).start()
+            return
+        self._start_switched_triggers(use_gantry_logic)
+
+    def _start_triggers_after(self, old_threads, generation, use_gantry_logic):
+        for thread in old_threads: thread.join()
+        with self.reconfig_lock:
+            if generation != self.trigger_generation or not self.main_loop_running: return # Đã đổi chế độ lần nữa
+            self.trigger_threads = [t for t in self.trigger_threads if t.is_alive()]
+            self._start_switched_triggers(use_gantry_logic)
+        logging.info("[CONFIG] Luồng tạo Job cũ đã dừng, đã khởi động luồng mới.")
+
+    def _start_switched_triggers(self, use_gantry_logic):
+        if not use_gantry_logic: # Hàng chờ QR tạm chỉ dùng cho v2
+            with self.qr_queue_lock:
+                self.qr_queue.clear()
+                self.queue_journal.record("qr_reset")
+        self._start_job_triggers(use_gantry_logic)
+
+    def _restart_camera(self):
+        """Mở lại camera với camera_settings mới (chạy nền; consumer bỏ qua frame cũ trong lúc chờ)"""
+        from threads import camera
+        with self.reconfig_lock:
+            if self.camera_thread is None or not self.main_loop_running: return
+            self.camera_generation += 1
+            self.camera_thread.join(timeout=5.0) # Luồng cũ nhả thiết bị trước (v4l2 không mở 2 lần được)
+            self.camera_thread = self._start_thread(camera.start_camera_thread, "CameraThread")
+        self.broadcast_log("info", "Camera đã được mở lại với cài đặt mới.")
+
+    def _reload_ai(self, generation):
+        """Nạp model mới ở nền; chỉ đổi sang detector mới khi đã nạp xong (lỗi -> giữ detector cũ)"""
+        with self.state_lock:
+            ai_cfg = dict(self.system_state['ai_config'])
+            lane_ids = [ln.get('id') for ln in self.system_state['lanes']]; lanes_version = self.lanes_version
+        load_start = time.perf_counter()
+        detector = self._load_ai_detector(ai_cfg, lane_ids)
+        with self.reconfig_lock:
+            if generation != self.ai_generation:
+                logging.info("[AI] Bỏ model vừa nạp (đã có cấu hình AI mới hơn).")
+                return
+            if ai_cfg.get('enable_ai', False) and (detector is None or not detector.enabled):
+                self.broadcast_log("error", "Không nạp được model AI mới, vẫn dùng cấu hình AI cũ.")
+                return
+            if detector is not None and lanes_version != self.lanes_version: # Lanes đổi trong lúc nạp model
+                with self.state_lock: lane_ids = [ln.get('id') for ln in self.system_state['lanes']]
+                detector.lane_map = self._ai_lane_map(ai_cfg, lane_ids)
+            self.ai_detector = detector
+        state = "BẬT" if detector is not None else "TẮT"
+        self.broadcast_log("success", f"AI đã được áp dụng ({state}, {time.perf_counter() - load_start:.1f}s).")
+
     def update_config(self, new_config_data):
-        """Xử lý API /update_config (Lấy từ app_god.py)"""
+        """Xử lý API /update_config (Lấy từ app_god.py) - lanes/camera/AI/chân băng chuyền/chế độ v1-v2 áp dụng nóng"""
         if not new_config_data:
             return ({"error": "Thiếu dữ liệu JSON"}, 400)
         logging.info(f"[CONFIG] Nhận config mới từ API (POST): {new_config_data}")
@@ -717,26 +1340,26 @@ class SortingSystem:
 
         config_to_save = {}
         restart_required = False
+        ai_changed = camera_changed = mode_changed = conveyor_changed = False
+        lanes_config = None
 
         with self.state_lock:
             # Xử lý AI
             current_ai_config = self.system_state.get('ai_config', {})
             if new_ai_config is not None and new_ai_config != current_ai_config:
-                logging.warning("[CONFIG] Cài đặt AI đã thay đổi. Cần khởi động lại.")
-                self.broadcast_log("warn", "Cài đặt AI đã đổi. Cần khởi động lại!")
+                logging.info("[CONFIG] Cài đặt AI đã thay đổi. Nạp lại model ở nền.")
                 current_ai_config.update(new_ai_config)
                 self.system_state['ai_config'] = current_ai_config
-                restart_required = True
+                ai_changed = True
             config_to_save['ai_config'] = current_ai_config.copy()
             
             # Xử lý Camera
             current_camera_settings = self.system_state.get('camera_settings', {})
             if new_camera_settings is not None and new_camera_settings != current_camera_settings:
-                logging.warning("[CONFIG] Cài đặt Camera đã thay đổi. Cần khởi động lại.")
-                self.broadcast_log("warn", "Cài đặt Camera đã đổi. Cần khởi động lại!")
+                logging.info("[CONFIG] Cài đặt Camera đã thay đổi. Mở lại camera.")
                 current_camera_settings.update(new_camera_settings)
                 self.system_state['camera_settings'] = current_camera_settings
-                restart_required = True
+                camera_changed = True
             config_to_save['camera_settings'] = current_camera_settings.copy()
 
             # Xử lý Timing
@@ -747,14 +1370,13 @@ class SortingSystem:
             # Cập nhật timing
             current_timing.update(new_timing_config)
             self.system_state['timing_config'] = current_timing
+            self.max_frame_age = current_timing.get('max_frame_age', 1.0)
             
-            # Kiểm tra thay đổi cần restart
-            if current_timing.get('RELAY_CONVEYOR_PIN') != self.RELAY_CONVEYOR_PIN:
-                restart_required = True; logging.warning("[CONFIG] Chân Relay Băng chuyền đổi. Cần restart.")
+            # Kiểm tra thay đổi cần áp dụng nóng / restart
+            conveyor_changed = current_timing.get('RELAY_CONVEYOR_PIN') != self.RELAY_CONVEYOR_PIN
             if current_timing.get('gpio_mode', 'BOARD') != current_gpio_mode:
                 restart_required = True; logging.warning("[CONFIG] Chế độ GPIO đổi. Cần restart.")
-            if current_timing.get('use_sensor_entry_gantry', False) != current_use_gantry:
-                restart_required = True; logging.warning("[CONFIG] Logic (v1/v2) đổi. Cần restart.")
+            mode_changed = current_timing.get('use_sensor_entry_gantry', False) != current_use_gantry
             
             config_to_save['timing_config'] = current_timing.copy()
 
@@ -762,9 +1384,6 @@ class SortingSystem:
             if new_lanes_config is not None:
                 lanes_config = self._ensure_lane_ids(new_lanes_config)
                 config_to_save['lanes_config'] = lanes_config
-                restart_required = True
-                logging.warning("[CONFIG] Cấu hình lanes đã thay đổi. Cần khởi động lại ứng dụng.")
-                self.broadcast_log("warn", "Cấu hình Lanes đã đổi. Cần khởi động lại!")
             else:
                 config_to_save['lanes_config'] = [
                     {"id": l.get('id'), "name": l['name'], "sensor_pin": l.get('sensor_pin'),
@@ -773,16 +1392,33 @@ class SortingSystem:
                 ]
 
         try:
-            with self.config_file_lock:
-                self._save_config_to_file(config_to_save)
+            applied = []
+            with self.reconfig_lock:
+                if lanes_config is not None:
+                    self._apply_lanes_config(lanes_config); applied.append("lanes")
+                if conveyor_changed:
+                    self._apply_conveyor_pin(config_to_save['timing_config'].get('RELAY_CONVEYOR_PIN')); applied.append("conveyor")
+                if mode_changed:
+                    self._switch_trigger_mode(config_to_save['timing_config'].get('use_sensor_entry_gantry', False)); applied.append("trigger_mode")
+                if ai_changed:
+                    self.ai_generation += 1
+                    threading.Thread(target=self._reload_ai, args=(self.ai_generation,), name="AIReloadThread", daemon=True).start()
+                    applied.append("ai")
+            if camera_changed:
+                threading.Thread(target=self._restart_camera, name="CameraReloadThread", daemon=True).start()
+                applied.append("camera")
+
+            # Chỉ đánh dấu thay đổi; ConfigSaveThread gom các lần cập nhật và ghi file ngoài khóa
+            self.config_store.submit(config_to_save)
             
             msg = "Đã lưu config. "
-            if restart_required: msg += "Vui lòng khởi động lại hệ thống để áp dụng thay đổi."
+            if applied: msg += f"Đã áp dụng ngay: {', '.join(applied)}. "
+            if restart_required: msg += "Vui lòng khởi động lại hệ thống để áp dụng chế độ GPIO mới."
             else: msg += "Các thay đổi về timing đã được áp dụng."
             logging.info(f"[CONFIG] {msg}")
             self.broadcast_log("info", msg)
             
-            return ({"message": msg, "config": config_to_save, "restart_required": restart_required}, 200)
+            return ({"message": msg, "config": config_to_save, "restart_required": restart_required, "applied": applied}, 200)
 
         except Exception as e:
             logging.error(f"[ERROR] Không thể lưu config (POST): {e}")
@@ -837,8 +1473,10 @@ class SortingSystem:
             self.error_manager.reset()
             with self.qr_queue_lock:
                 self.qr_queue.clear()
+                self.queue_journal.record("qr_reset")
             with self.processing_queue_lock:
                 self.processing_queue.clear()
+                self.queue_journal.record("job_reset")
                 self.queue_head_since = 0.0
             
             self.last_entry_sensor_state = 1
@@ -861,8 +1499,10 @@ class SortingSystem:
         try:
             with self.qr_queue_lock:
                 self.qr_queue.clear()
+                self.queue_journal.record("qr_reset")
             with self.processing_queue_lock:
                 self.processing_queue.clear()
+                self.queue_journal.record("job_reset")
                 self.queue_head_since = 0.0
                 current_queue_for_log = []
 
@@ -0,0 +1,289 @@
+# pi/core/trace.py
+"""
+Ghi / phát lại trace cảm biến để tái hiện lỗi phân loại một cách tất định.
+
+File trace (nhị phân, little-endian):
+    MAGIC (8 byte) | độ dài metadata (uint32) | metadata JSON (config làn + timing, NG index...)
+    rồi các bản ghi RECORD = (t: float64 giây từ lúc bắt đầu - time.monotonic, kind: uint8,
+                              value: uint8, ref: int16, payload_len: uint16) + payload
+  SENSOR : value = mức logic đọc được, ref = chân sensor       (16 byte / lần chuyển trạng thái)
+  JOB    : ref = lane_index, payload = JSON Job (job_id, status, source...)
+  SORT   : value = mã kết quả (OUTCOMES), ref = lane_index, payload = job_id
+
+Bật ghi bằng timing_config.trace_record = true (file ở logs/traces/, xoay vòng theo trace_max_mb).
+Phát lại qua MockGPIO (tốc độ 1x hoặc nhanh hơn), so sánh kết quả với lúc ghi:
+    python -m core.trace info logs/traces/trace-20250101-080000-001.bin
+    python -m core.trace replay logs/traces/trace-20250101-080000-001.bin --speed 5
+"""
+import os
+import sys
+import json
+import time
+import struct
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+MAGIC = b"PITRACE1"
+META_LEN = struct.Struct("<I")
+RECORD = struct.Struct("<dBBhH")
+
+KIND_SENSOR, KIND_JOB, KIND_SORT = 1, 2, 3
+KIND_NAMES = {KIND_SENSOR: "sensor", KIND_JOB: "job", KIND_SORT: "sort"}
+OUTCOMES = ("sorted", "passed", "ng_pass", "timeout", "aborted", "error", "config_error")
+UNKNOWN_OUTCOME = 255
+
+# Các khóa timing tính bằng giây: chia cho `speed` khi phát lại nhanh để giữ nguyên thứ tự sự kiện
+TIME_KEYS = ("cycle_delay", "settle_delay", "sensor_debounce", "push_delay", "queue_head_timeout",
+             "pending_trigger_timeout", "stability_delay")
+JOB_FIELDS = ("job_id", "lane_index", "status", "source", "track_id")
+
+
+class NullTrace:
+    """Không ghi gì (mặc định khi tắt trace_record)"""
+    enabled = False
+    path = None
+
+    def sensor(self, pin, level): pass
+    def job(self, job): pass
+    def sort(self, job, lane_index, lane_name, outcome, actuation_ts=None): pass
+    def close(self): pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class TraceRecorder:
+    """Ghi trace vào file (có buffer, flush mỗi `flush_interval` giây, xoay vòng khi vượt `max_bytes`)"""
+    enabled = True
+
+    def __init__(self, trace_dir: str, metadata: dict, max_bytes: int = 20 * 1024 * 1024,
+                 keep_files: int = 5, flush_interval: float = 1.0):
+        self.trace_dir = trace_dir
+        self.metadata = metadata
+        self.max_bytes = max_bytes
+        self.keep_files = keep_files
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._seq = 0
+        self.path: Optional[str] = None
+        os.makedirs(trace_dir, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        while True: # trace-<giờ bắt đầu>-<số thứ tự xoay vòng>.bin -> sắp xếp theo tên = theo thời gian
+            self._seq += 1
+            path = os.path.join(self.trace_dir, f"trace-{stamp}-{self._seq:03d}.bin")
+            if not os.path.exists(path): break
+        meta = json.dumps(dict(self.metadata, started_at=time.time()), ensure_ascii=False).encode("utf-8")
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + META_LEN.pack(len(meta)) + meta)
+        self.path = path
+        self._t0 = time.monotonic(); self._last_flush = self._t0
+        self._prune()
+
+    def _prune(self):
+        files = sorted(f for f in os.listdir(self.trace_dir) if f.startswith("trace-") and f.endswith(".bin"))
+        for name in files[:-self.keep_files] if self.keep_files > 0 else []:
+            try: os.remove(os.path.join(self.trace_dir, name))
+            except OSError: pass
+
+    def _write(self, kind: int, value: int, ref: int, payload: bytes = b""):
+        with self._lock:
+            if self._file is None: return
+            now = time.monotonic()
+            self._file.write(RECORD.pack(now - self._t0, kind, value, ref, len(payload)) + payload)
+            self.records += 1
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush(); self._last_flush = now
+                if self._file.tell() >= self.max_bytes:
+                    self._file.close(); self._open()
+
+    def sensor(self, pin, level):
+        self._write(KIND_SENSOR, 1 if level else 0, int(pin))
+
+    def job(self, job):
+        payload = json.dumps({k: job.get(k) for k in JOB_FIELDS}, ensure_ascii=False).encode("utf-8")
+        self._write(KIND_JOB, 0, int(job.get("lane_index", -1)), payload)
+
+    def sort(self, job, lane_index, lane_name, outcome, actuation_ts=None):
+        code = OUTCOMES.index(outcome) if outcome in OUTCOMES else UNKNOWN_OUTCOME
+        self._write(KIND_SORT, code, int(lane_index), str(job.get("job_id", "")).encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            if self._file is None: return
+            self._file.close(); self._file = None
+
+
+def open_trace(trace_dir: str, system_state: dict, ng_lane_index: int, entry_pin: int):
+    """TraceRecorder nếu timing_config.trace_record bật, ngược lại NULL_TRACE"""
+    timing = system_state.get("timing_config", {})
+    if not timing.get("trace_record", False):
+        return NULL_TRACE
+    lanes = [{k: lane.get(k) for k in ("id", "name", "sensor_pin", "push_pin", "pull_pin")}
+             for lane in system_state.get("lanes", [])]
+    metadata = {"version": 1, "timing_config": dict(timing), "lanes_config": lanes,
+                "ng_lane_index": ng_lane_index, "entry_pin": entry_pin}
+    try:
+        recorder = TraceRecorder(trace_dir, metadata, max_bytes=int(float(timing.get("trace_max_mb", 20)) * 1024 * 1024),
+                                 keep_files=int(timing.get("trace_keep_files", 5)))
+    except OSError as e:
+        logging.error(f"[TRACE] Không mở được file trace: {e}")
+        return NULL_TRACE
+    logging.info(f"[TRACE] Đang ghi trace sensor vào {recorder.path}")
+    return recorder
+
+
+def read_trace(path: str) -> Tuple[dict, List[tuple]]:
+    """Đọc file trace -> (metadata, [(t, kind, value, ref, payload_bytes), ...]); bỏ qua bản ghi cuối bị cắt dở"""
+    with open(path, "rb") as f: data = f.read()
+    if not data.startswith(MAGIC): raise ValueError(f"Không phải file trace: {path}")
+    pos = len(MAGIC)
+    (meta_len,) = META_LEN.unpack_from(data, pos); pos += META_LEN.size
+    metadata = json.loads(data[pos:pos + meta_len].decode("utf-8")); pos += meta_len
+    records = []
+    while pos + RECORD.size <= len(data):
+        t, kind, value, ref, n = RECORD.unpack_from(data, pos)
+        if pos + RECORD.size + n > len(data): break
+        payload = data[pos + RECORD.size:pos + RECORD.size + n]
+        records.append((t, kind, value, ref, payload)); pos += RECORD.size + n
+    return metadata, records
+
+
+def expected_outcomes(records: List[tuple]) -> List[dict]:
+    out = []
+    for t, kind, value, ref, payload in records:
+        if kind == KIND_SORT:
+            out.append({"t": t, "job_id": payload.decode("utf-8"), "lane_index": ref,
+                        "outcome": OUTCOMES[value] if value < len(OUTCOMES) else "unknown"})
+    return out
+
+
+# ===========================================
+# PHÁT LẠI
+# ===========================================
+
+class TraceReplayer:
+    """Bơm trace vào 1 SortingSystem (MockGPIO, không chạy luồng tạo Job) theo đúng nhịp thời gian"""
+    def __init__(self, system, metadata: dict, records: List[tuple], speed: float = 1.0):
+        from .gpio import MockGPIO
+        from .system import SENSOR_ENTRY_MOCK_PIN
+        if not isinstance(system.gpio, MockGPIO):
+            raise RuntimeError("Chỉ phát lại được với MockGPIO.")
+        self.system = system
+        self.records = records
+        self.speed = speed if speed > 0 else 1.0
+        self.pin_map = {metadata.get("entry_pin"): SENSOR_ENTRY_MOCK_PIN} if metadata.get("entry_pin") is not None else {}
+        self.events: List[dict] = []
+        self._t0 = 0.0
+
+    def _on_sort_event(self, job, lane_index, lane_name, outcome, actuation_ts):
+        self.events.append({"t": (time.monotonic() - self._t0) * self.speed, "job_id": job.get("job_id"),
+                            "lane_index": lane_index, "outcome": outcome})
+
+    def run(self, settle: Optional[float] = None) -> dict:
+        with self.system.state_lock: timing = dict(self.system.system_state["timing_config"])
+        if settle is None: # Chờ Job cuối cùng kịp timeout hoặc hoàn tất chu trình đẩy
+            settle = timing.get("queue_head_timeout", 15.0) + timing.get("cycle_delay", 0.3) + 2 * timing.get("settle_delay", 0.2) + 0.5
+        self.system.sort_event_listeners.append(self._on_sort_event)
+        self._t0 = time.monotonic()
+        try:
+            for t, kind, value, ref, payload in self.records:
+                delay = self._t0 + t / self.speed - time.monotonic()
+                if delay > 0: time.sleep(delay)
+                if kind == KIND_SENSOR:
+                    self.system.gpio.set_input_state(self.pin_map.get(ref, ref), value)
+                elif kind == KIND_JOB:
+                    job = json.loads(payload.decode("utf-8"))
+                    job["entry_time"] = time.time()
+                    self.system.push_job(job)
+            time.sleep(settle)
+        finally:
+            self.system.sort_event_listeners.remove(self._on_sort_event)
+        return compare_outcomes(expected_outcomes(self.records), self.events)
+
+
+def compare_outcomes(expected: List[dict], actual: List[dict]) -> dict:
+    """Đối chiếu kết quả từng Job (theo job_id) giữa lúc ghi và lúc phát lại"""
+    actual_by_job = {}
+    for e in actual: actual_by_job.setdefault(e["job_id"], e)
+    mismatches = []; timing_diffs = []; matched = 0
+    for e in expected:
+        got = actual_by_job.pop(e["job_id"], None)
+        if got is None:
+            mismatches.append({"job_id": e["job_id"], "expected": e["outcome"], "lane_index": e["lane_index"], "replay": None})
+        elif (got["outcome"], got["lane_index"]) != (e["outcome"], e["lane_index"]):
+            mismatches.append({"job_id": e["job_id"], "expected": e["outcome"], "lane_index": e["lane_index"],
+                               "replay": got["outcome"], "replay_lane_index": got["lane_index"]})
+        else:
+            matched += 1; timing_diffs.append(got["t"] - e["t"])
+    extra = [{"job_id": e["job_id"], "replay": e["outcome"], "lane_index": e["lane_index"]} for e in actual_by_job.values()]
+    timing_diffs.sort()
+    return {
+        "expected": len(expected), "replayed": len(actual), "matched": matched,
+        "identical": not mismatches and not extra,
+        "mismatches": mismatches, "unexpected": extra,
+        # Lệch thời điểm hoàn tất (quy về thời gian gốc) - so sánh hiệu năng giữa 2 phiên bản
+        "timing_diff_ms": {
+            "p50": round(timing_diffs[len(timing_diffs) // 2] * 1000, 1) if timing_diffs else None,
+            "max_abs": round(max(abs(d) for d in timing_diffs) * 1000, 1) if timing_diffs else None,
+        },
+    }
+
+
+def replay_config(metadata: dict, speed: float) -> dict:
+    """Config cho lần phát lại: làn + timing lúc ghi, các khóa thời gian chia theo `speed`"""
+    timing = dict(metadata.get("timing_config", {}))
+    for key in TIME_KEYS:
+        if isinstance(timing.get(key), (int, float)): timing[key] = timing[key] / speed
+    timing["trace_record"] = False
+    return {"timing_config": timing, "lanes_config": metadata.get("lanes_config", [])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Xem / phát lại trace sensor")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="Tóm tắt trace")
+    info.add_argument("trace")
+    info.add_argument("--records", action="store_true", help="In từng bản ghi")
+    rep = sub.add_parser("replay", help="Phát lại trace qua MockGPIO và so sánh kết quả")
+    rep.add_argument("trace")
+    rep.add_argument("--speed", type=float, default=1.0, help="1.0 = thời gian thực, 5 = nhanh gấp 5")
+    args = parser.parse_args(argv)
+
+    metadata, records = read_trace(args.trace)
+    if args.command == "info":
+        counts = {}
+        for r in records:
+            name = KIND_NAMES.get(r[1], str(r[1])); counts[name] = counts.get(name, 0) + 1
+        print(json.dumps({"started_at": metadata.get("started_at"), "duration_s": round(records[-1][0], 3) if records else 0,
+                          "records": counts, "lanes": metadata.get("lanes_config")}, ensure_ascii=False, indent=2))
+        if args.records:
+            for t, kind, value, ref, payload in records:
+                print(f"{t:10.4f} {KIND_NAMES.get(kind, kind):6} ref={ref:<4} value={value:<3} {payload.decode('utf-8', errors='replace')}")
+        return 0
+
+    from .simulator import start_sim_system, stop_sim_system
+    workdir = tempfile.mkdtemp(prefix="pi_trace_")
+    config_path = os.path.join(workdir, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f: json.dump(replay_config(metadata, args.speed), f, indent=4)
+    system, sim_dir = start_sim_system(config_path, job_triggers=False)
+    try:
+        result = TraceReplayer(system, metadata, records, args.speed).run()
+        result["speed"] = args.speed
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        stop_sim_system(system, sim_dir)
+        os.remove(config_path); os.rmdir(workdir)
+    return 0 if result["identical"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# core/tracking.py
+"""
+Theo dõi kiện hàng liên tục (luồng threads/tracker.py chạy theo tốc độ camera, trên ảnh xám thu nhỏ).
+
+  BlobSegmenter : trừ nền (băng chuyền) -> các vùng sáng/tối khác nền = kiện hàng (không cần model)
+  ParcelTracker : ghép vùng giữa các frame theo IoU / khoảng cách tâm -> track_id ổn định cho mỗi kiện,
+                  gắn QR đọc được và lớp AI (YOLO chạy 1 lần / track trên ảnh cắt, không chạy lúc trigger)
+
+Trigger (gantry / camera) chỉ tra at_entry(): track đang nằm trên vạch cổng vào, tính sẵn ở mỗi update -> O(1).
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+Box = Tuple[int, int, int, int] # x, y, w, h (toạ độ frame gốc)
+
+
+def iou(a: Box, b: Box) -> float:
+    ax2, ay2, bx2, by2 = a[0] + a[2], a[1] + a[3], b[0] + b[2], b[1] + b[3]
+    iw = min(ax2, bx2) - max(a[0], b[0]); ih = min(ay2, by2) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0: return 0.0
+    inter = iw * ih
+    return inter / float(a[2] * a[3] + b[2] * b[3] - inter)
+
+
+def center(box: Box) -> Tuple[float, float]:
+    return box[0] + box[2] / 2.0, box[1] + box[3] / 2.0
+
+
+class BlobSegmenter:
+    """Tách kiện khỏi nền băng chuyền bằng trừ nền trên ảnh thu nhỏ (`scale`)"""
+    def __init__(self, scale: float = 0.25, min_area: float = 0.01, diff_threshold: int = 25, alpha: float = 0.05,
+                 max_foreground: float = 0.6):
+        self.scale = scale
+        self.min_area = min_area             # Tỉ lệ diện tích frame tối thiểu của 1 kiện
+        self.max_foreground = max_foreground # Vượt tỉ lệ này -> coi là nền thay đổi
+        self.diff_threshold = diff_threshold
+        self.alpha = alpha                   # Tốc độ học nền ở vùng trống
+        self.background: Optional[np.ndarray] = None
+        self.ready = False                   # Nền chắc chắn là băng chuyền trống (chưa -> QR quét cả frame)
+        self._kernel = np.ones((3, 3), np.uint8)
+
+    def segment(self, gray: np.ndarray) -> List[Box]:
+        import cv2
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if self.background is None or self.background.shape != small.shape:
+            self.background = small.astype(np.float32) # Frame đầu tiên (có kiện thì vùng "ma" tự sửa bên dưới)
+            self.ready = float(small.std()) < self.diff_threshold
+            return []
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        _, mask = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self._kernel, iterations=2)
+        if cv2.countNonZero(mask) > self.max_foreground * small.size:
+            # Gần cả khung hình khác nền = đổi ánh sáng / phơi sáng, không phải kiện -> học lại nền
+            self.background = small.astype(np.float32)
+            self.ready = float(small.std()) < self.diff_threshold
+            return []
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(mask)
+        min_px = self.min_area * small.size
+        empty = cv2.bitwise_not(mask)
+        belt = cv2.mean(small, mask=empty)[0] if cv2.countNonZero(empty) else None
+        boxes = []
+        for i in range(1, n):
+            x, y, w, h, area = stats[i]
+            if area < min_px: continue
+            roi, comp = small[y:y + h, x:x + w], labels[y:y + h, x:x + w] == i
+            pixels = roi[comp]
+            if belt is not None and abs(float(pixels.mean()) - belt) < self.diff_threshold and pixels.std() < self.diff_threshold:
+                # Vùng "ma": nền cũ có kiện (vd. frame đầu tiên), giờ là băng chuyền trống -> sửa nền ngay
+                self.background[y:y + h, x:x + w][comp] = pixels; self.ready = True; continue
+            boxes.append((int(round(x / self.scale)), int(round(y / self.scale)), int(round(w / self.scale)), int(round(h / self.scale))))
+        # Nền học nhanh ở vùng trống, rất chậm dưới kiện (kiện đứng yên lúc dừng băng chuyền không bị "nuốt" ngay)
+        cv2.accumulateWeighted(small, self.background, self.alpha, mask=empty)
+        cv2.accumulateWeighted(small, self.background, self.alpha * 0.02, mask=mask)
+        return boxes
+
+
+class Track:
+    def __init__(self, track_id: int, box: Box, ts: float):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = ts
+        self.last_seen = ts
+        self.hits = 1
+        self.misses = 0
+        self.qr: Optional[str] = None
+        self.ai_class: Optional[str] = None
+        self.ai_conf = 0.0
+        self.ai_tries = 0
+        self.velocity = (0, 0) # Độ dời tâm (px / frame) ở lần cập nhật gần nhất
+
+    def to_dict(self) -> dict:
+        return {"track_id": self.track_id, "box": list(self.box), "age": round(self.last_seen - self.first_seen, 3),
+                "hits": self.hits, "qr": self.qr, "ai_class": self.ai_class, "ai_conf": round(self.ai_conf, 3)}
+
+
+class ParcelTracker:
+    """
+    Ghép vùng kiện giữa các frame (IoU, rồi khoảng cách tâm khi kiện chạy nhanh hơn kích thước của nó).
+    - n_init: số frame liên tiếp để xác nhận track (lọc nhiễu); max_misses: số frame mất dấu trước khi xóa.
+    - entry_line: vị trí vạch cổng vào (tỉ lệ 0..1 theo trục `axis` "x"/"y" của frame).
+    - full_scan_every: cứ N lần regions() thì 1 lần trả None (quét QR cả frame) để không bỏ sót kiện
+      mà bộ tách nền không thấy (kể cả khi băng chuyền "trống").
+    """
+    def __init__(self, entry_line: float = 0.5, axis: str = "x", iou_threshold: float = 0.2,
+                 n_init: int = 2, max_misses: int = 5, max_ai_tries: int = 3, full_scan_every: int = 10):
+        self.entry_line = entry_line
+        self.axis = 0 if axis == "x" else 1
+        self.iou_threshold = iou_threshold
+        self.n_init = n_init
+        self.max_misses = max_misses
+        self.max_ai_tries = max_ai_tries
+        self.full_scan_every = full_scan_every
+        self._region_calls = 0
+        self.tracks: Dict[int, Track] = {}
+        self._next_id = 1
+        self._entry: Optional[Track] = None
+        self._pending_qr: Optional[Tuple[str, float]] = None # QR đọc được trước khi tracker thấy kiện
+        self._lock = threading.Lock()
+        self.ready = True # Luồng tracker chép BlobSegmenter.ready vào đây
+        self.frames = 0
+        self.ai_runs = 0
+
+    def _match(self, boxes: List[Box]):
+        pairs = []
+        for tid, track in self.tracks.items():
+            tcx, tcy = center(track.box); diag = (track.box[2] ** 2 + track.box[3] ** 2) ** 0.5
+            for bi, box in enumerate(boxes):
+                overlap = iou(track.box, box)
+                if overlap >= self.iou_threshold:
+                    pairs.append((1.0 + overlap, tid, bi))
+                else:
+                    bcx, bcy = center(box); dist = ((bcx - tcx) ** 2 + (bcy - tcy) ** 2) ** 0.5
+                    if dist < diag: pairs.append((1.0 - dist / diag, tid, bi))
+        pairs.sort(reverse=True)
+        used_tracks, used_boxes = set(), set()
+        for _, tid, bi in pairs:
+            if tid in used_tracks or bi in used_boxes: continue
+            used_tracks.add(tid); used_boxes.add(bi)
+            yield tid, bi
+
+    def update(self, boxes: List[Box], frame_shape: Tuple[int, int], ts: Optional[float] = None):
+        ts = time.monotonic() if ts is None else ts
+        with self._lock:
+            self.frames += 1
+            matched_tracks, matched_boxes = set(), set()
+            for tid, bi in self._match(boxes):
+                track = self.tracks[tid]
+                (ox, oy), (nx, ny) = center(track.box), center(boxes[bi])
+                track.velocity = (int(round(nx - ox)), int(round(ny - oy)))
+                track.box = boxes[bi]; track.last_seen = ts; track.hits += 1; track.misses = 0
+                matched_tracks.add(tid); matched_boxes.add(bi)
+            for tid in [tid for tid in self.tracks if tid not in matched_tracks]:
+                track = self.tracks[tid]; track.misses += 1
+                if track.misses > self.max_misses: del self.tracks[tid]
+            for bi, box in enumerate(boxes):
+                if bi in matched_boxes: continue
+                track = self.tracks[self._next_id] = Track(self._next_id, box, ts); self._next_id += 1
+                if self._pending_qr and ts - self._pending_qr[1] <= 1.0:
+                    track.qr = self._pending_qr[0]; self._pending_qr = None
+
+            # Tính sẵn track trên vạch cổng vào cho at_entry()
+            line = self.entry_line * frame_shape[1 - self.axis]
+            entry, best = None, None
+            for track in self.tracks.values():
+                if track.hits < self.n_init or track.misses: continue
+                start, size = track.box[self.axis], track.box[self.axis + 2]
+                if start <= line <= start + size:
+                    dist = abs(start + size / 2.0 - line)
+                    if best is None or dist < best: entry, best = track, dist
+            self._entry = entry
+
+    def at_entry(self) -> Optional[Track]:
+        """Track đang nằm trên vạch cổng vào (None nếu không có kiện nào)"""
+        return self._entry
+
+    def regions(self) -> Optional[List[Box]]:
+        """
+        Vùng các kiện đang thấy (kể cả track chưa xác nhận) - cho scan_qr_in_regions. Vùng lấy từ frame trước nên
+        được nới thêm 1 bước dời của kiện theo hướng chạy. None: quét cả frame (chưa có nền tin cậy / định kỳ).
+        """
+        if not self.ready: return None
+        with self._lock:
+            self._region_calls += 1
+            if self.full_scan_every and self._region_calls % self.full_scan_every == 0: return None
+            regions = []
+            for t in self.tracks.values():
+                if t.misses: continue
+                (x, y, w, h), (vx, vy) = t.box, t.velocity
+                regions.append((x + min(0, vx), y + min(0, vy), w + abs(vx), h + abs(vy)))
+            return regions
+
+    def attach_qr(self, data: str, ts: Optional[float] = None, box: Optional[Box] = None) -> Optional[Track]:
+        """
+        Gắn mã QR vừa đọc cho kiện: track chứa vùng `box` nơi đọc được mã, nếu không thì kiện ở cổng vào /
+        kiện vừa thấy gần nhất (chưa có kiện nào -> gắn cho track mới kế tiếp).
+        """
+        with self._lock:
+            track = None
+            if box is not None:
+                track = max((t for t in self.tracks.values() if iou(t.box, box) > 0), key=lambda t: iou(t.box, box), default=None)
+            track = track or self._entry or max((t for t in self.tracks.values() if not t.misses), key=lambda t: t.last_seen, default=None)
+            if track is not None: track.qr = data
+            else: self._pending_qr = (data, time.monotonic() if ts is None else ts)
+            return track
+
+    def pending_classification(self) -> Optional[Track]:
+        """Track đã xác nhận nhưng chưa có lớp AI (ưu tiên kiện vào khung hình trước)"""
+        with self._lock:
+            return min((t for t in self.tracks.values() if t.hits >= self.n_init and not t.misses
+                        and t.ai_class is None and t.ai_tries < self.max_ai_tries),
+                       key=lambda t: t.first_seen, default=None)
+
+    def set_class(self, track: Track, class_name: Optional[str], conf: float = 0.0):
+        with self._lock:
+            track.ai_tries += 1; self.ai_runs += 1
+            if class_name: track.ai_class, track.ai_conf = class_name, conf
+
+    def stats(self) -> dict:
+        with self._lock:
+            entry = self._entry
+            return {"frames": self.frames, "active": len(self.tracks), "tracks_total": self._next_id - 1,
+                    "ai_runs": self.ai_runs, "ready": self.ready, "at_entry": entry.to_dict() if entry else None}
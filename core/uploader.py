@@ -0,0 +1,370 @@
+# pi/core/uploader.py
+"""
+Gửi dữ liệu lên VPS theo sự kiện, có bộ đệm đĩa khi mất mạng (store-and-forward).
+
+Mỗi POST (multipart, header X-API-Key) tới vps_config.url gồm:
+  batch : JSON {"events": [{"boot", "seq", "ts", "type", "data"}, ...]}
+            type "state" : các khóa state đã đổi so với lần trước (lần đầu = toàn bộ state)
+                 "sort"  : 1 sự kiện phân loại (job_id, lane, outcome, ...)
+  state : state đầy đủ (JSON) - chỉ ở POST đầu tiên và POST đầu sau khi nối lại (tương thích endpoint cũ)
+  frame : ảnh JPEG (POST riêng, batch rỗng) - khi khung hình thay đổi hoặc có sự kiện sort
+Mất mạng / VPS lỗi 5xx: sự kiện được ghi vào Spool (thư mục *.jsonl, tối đa spool_max_mb, bỏ segment cũ nhất
+khi đầy); nối lại -> gửi bù theo lô (catchup_batch sự kiện / POST) trước sự kiện mới. Frame không vào spool
+(chỉ là ảnh xem trực tiếp). `seq` tăng dần trong 1 lần chạy, `boot` khác nhau giữa các lần chạy (spool giữ sự
+kiện của lần trước với boot cũ): VPS bỏ sự kiện trùng theo cặp (boot, seq) khi gửi lại sau mất mạng / mất điện.
+
+Gửi song song (tối đa max_in_flight request cùng lúc, dùng chung 1 Session / pool kết nối):
+  - 1 làn sự kiện (luồng run()): tuần tự để giữ thứ tự; sự kiện đến trong lúc chờ VPS được gộp vào lô sau
+  - max_in_flight - 1 làn frame (luồng VPSFrame-*): lấy frame MỚI NHẤT lúc tới lượt gửi (không xếp hàng frame cũ)
+LinkEstimator đo RTT / thông lượng và chỉnh fps + chất lượng JPEG của frame theo băng thông còn lại.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+
+from .utils import write_file_atomic
+
+
+class Spool:
+    """Hàng đợi sự kiện trên đĩa: các segment JSONL (1 dòng / sự kiện), tổng dung lượng <= max_bytes"""
+    def __init__(self, directory: str, max_bytes: int = 20 * 1024 * 1024, segment_bytes: int = 256 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.offset_path = os.path.join(directory, "offset")
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(f[:-6]) for f in os.listdir(directory) if f.endswith(".jsonl") and f[:-6].isdigit())
+        self.offset = 0 # Số dòng đã gửi của segment cũ nhất
+        try:
+            with open(self.offset_path, encoding="utf-8") as f: self.offset = int(f.read().strip() or 0)
+        except (OSError, ValueError): pass
+        self.pending = sum(self._count(n) for n in self.segments) - (self.offset if self.segments else 0)
+
+    def _path(self, n: int) -> str:
+        return os.path.join(self.directory, f"{n:010d}.jsonl")
+
+    def _count(self, n: int) -> int:
+        with open(self._path(n), "rb") as f: return sum(1 for _ in f)
+
+    def _save_offset(self):
+        write_file_atomic(self.offset_path, str(self.offset))
+
+    def append(self, events: List[dict]):
+        if not events: return
+        if not self.segments or os.path.getsize(self._path(self.segments[-1])) >= self.segment_bytes:
+            self.segments.append(self.segments[-1] + 1 if self.segments else 1)
+        with open(self._path(self.segments[-1]), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events))
+        self.pending += len(events)
+        self._trim()
+
+    def _trim(self):
+        total = sum(os.path.getsize(self._path(n)) for n in self.segments)
+        while total > self.max_bytes and len(self.segments) > 1:
+            n = self.segments.pop(0)
+            lost = self._count(n) - self.offset; total -= os.path.getsize(self._path(n))
+            os.remove(self._path(n))
+            self.pending -= lost; self.dropped += lost; self.offset = 0; self._save_offset()
+            logging.warning(f"[VPS_UPDATE] Spool đầy, bỏ {lost} sự kiện cũ nhất.")
+
+    def peek(self, limit: int) -> Tuple[List[dict], int]:
+        """Tối đa `limit` sự kiện cũ nhất (chưa xóa) + số dòng đã đọc (truyền cho commit)"""
+        if not self.segments: return [], 0
+        events, lines = [], 0
+        with open(self._path(self.segments[0]), encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if i < self.offset: continue
+                if lines >= limit: break
+                lines += 1
+                try: events.append(json.loads(line))
+                except ValueError: pass # Dòng ghi dở lúc mất điện
+        return events, lines
+
+    def commit(self, lines: int):
+        """Đánh dấu `lines` dòng đầu (từ peek) đã gửi xong; segment gửi hết thì xóa"""
+        if not self.segments or not lines: return
+        self.offset += lines; self.pending -= lines
+        if self.offset >= self._count(self.segments[0]):
+            os.remove(self._path(self.segments.pop(0))); self.offset = 0
+        self._save_offset()
+
+
+class LinkEstimator:
+    """
+    RTT / thông lượng các POST tới VPS, và fps + chất lượng JPEG của frame (tăng cộng / giảm nhân, như AIMD).
+      RTT nền     : RTT nhỏ nhất của các POST nhỏ (< SMALL_POST_BYTES, gần như không tốn thời gian truyền)
+      băng thông  : lớn nhất của byte / (RTT - RTT nền) trên các POST frame (trong `window` giây)
+      RTT dự kiến của 1 frame = RTT nền + kích thước / băng thông; phần vượt = thời gian xếp hàng
+      nghẽn (lỗi, xếp hàng > max(50ms, RTT nền), hoặc frame x fps vượt ~80% băng thông)
+        -> giảm chất lượng JPEG trước, chạm min_quality mới giảm fps
+      thông (gần như không xếp hàng) -> tăng fps trước, đủ max_fps mới tăng lại chất lượng
+    """
+    SMALL_POST_BYTES = 4096
+
+    def __init__(self, max_fps: float, quality: int = 70, min_fps: float = 0.2, min_quality: int = 30,
+                 max_in_flight: int = 3, window: float = 10.0):
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.fps = max_fps
+        self.max_quality = quality
+        self.min_quality = min(min_quality, quality)
+        self.quality = quality
+        self.max_in_flight = max_in_flight
+        self.window = window
+        self.in_flight = 0
+        self.rtt: Optional[float] = None       # EWMA mọi POST (giây)
+        self.last_rtt: Optional[float] = None
+        self.base_rtt: Optional[float] = None  # RTT nền
+        self.bandwidth: Optional[float] = None # Byte/giây
+        self._small = deque()                  # (monotonic, rtt) các POST nhỏ
+        self._frames = deque()                 # (monotonic, rtt, bytes) các POST frame
+        self._sent = deque()                   # (monotonic, bytes) đã gửi thành công
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock: self.in_flight += 1
+
+    def end(self, nbytes: int, rtt: float, ok: bool, frame_bytes: int = 0):
+        """Kết thúc 1 request; frame_bytes > 0: request gửi frame -> điều chỉnh fps / chất lượng"""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.last_rtt = rtt
+                self.rtt = rtt if self.rtt is None else self.rtt * 0.8 + rtt * 0.2
+                self._sent.append((now, nbytes))
+                if nbytes < self.SMALL_POST_BYTES: self._small.append((now, rtt))
+                if frame_bytes: self._frames.append((now, rtt, nbytes))
+            for samples in (self._sent, self._small, self._frames):
+                while samples and now - samples[0][0] > self.window: samples.popleft()
+            # Hết mẫu trong cửa sổ -> giữ ước lượng cũ
+            if self._small: self.base_rtt = min(r for _, r in self._small)
+            base = self.base_rtt or 0.0 # Chưa có POST nhỏ: coi cả RTT là truyền (ước lượng băng thông thấp, an toàn)
+            if self._frames: self.bandwidth = max(n / max(r - base, 1e-3) for _, r, n in self._frames)
+            if frame_bytes: self._adapt(ok, rtt, nbytes, frame_bytes)
+
+    def _adapt(self, ok: bool, rtt: float, nbytes: int, frame_bytes: int):
+        base = self.base_rtt or 0.0
+        queued = rtt - base - (nbytes / self.bandwidth if self.bandwidth else 0.0)
+        over_budget = self.bandwidth is not None and frame_bytes * self.fps > 0.8 * self.bandwidth
+        if not ok or queued > max(0.05, base) or over_budget:
+            if self.quality > self.min_quality: self.quality = max(self.min_quality, self.quality - 10)
+            else: self.fps = max(self.min_fps, self.fps * 0.7)
+        elif queued < 0.02 + 0.25 * base:
+            if self.fps < self.max_fps: self.fps = min(self.max_fps, self.fps + 0.25)
+            else: self.quality = min(self.max_quality, self.quality + 5)
+
+    def upload_rate(self) -> float:
+        """Byte/giây đã gửi thành công trong `window` giây gần nhất"""
+        now = time.monotonic()
+        with self._lock:
+            while self._sent and now - self._sent[0][0] > self.window: self._sent.popleft()
+            return sum(n for _, n in self._sent) / self.window
+
+    def status(self) -> dict:
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        upload = self.upload_rate()
+        with self._lock:
+            return {"rtt_ms": ms(self.rtt), "rtt_last_ms": ms(self.last_rtt), "rtt_min_ms": ms(self.base_rtt),
+                    "in_flight": self.in_flight, "max_in_flight": self.max_in_flight,
+                    "upload_kbps": round(upload * 8 / 1000, 1),
+                    "bandwidth_kbps": round(self.bandwidth * 8 / 1000, 1) if self.bandwidth is not None else None,
+                    "frame_fps": round(self.fps, 2), "jpeg_quality": self.quality}
+
+
+class VPSUploader:
+    """
+    Gom sự kiện (push_event / on_sort từ các luồng khác) và delta state, gửi lên VPS (run()).
+    get_state() -> dict | None, get_frame() -> ndarray BGR | None (không bị sửa, không cần copy).
+    """
+    def __init__(self, url: str, api_key: str, spool_dir: str, get_state: Callable[[], Optional[dict]],
+                 get_frame: Optional[Callable] = None, state_interval: float = 0.5, frame_max_fps: float = 2.0,
+                 frame_change: float = 4.0, catchup_batch: int = 200, spool_max_mb: float = 20.0,
+                 timeout: float = 3.0, max_in_flight: int = 3, jpeg_quality: int = 70, session=None):
+        self.url = url
+        self.headers = {'X-API-Key': api_key}
+        self.get_state = get_state
+        self.get_frame = get_frame
+        self.state_interval = state_interval
+        self.frame_change = frame_change       # Chênh lệch độ sáng trung bình (0-255) tối thiểu để gửi frame mới
+        self.catchup_batch = catchup_batch
+        self.timeout = timeout
+        self.max_in_flight = max(2, int(max_in_flight)) # >= 1 làn sự kiện + 1 làn frame
+        self.link = LinkEstimator(frame_max_fps, int(jpeg_quality), max_in_flight=self.max_in_flight)
+        self.spool = Spool(spool_dir, max_bytes=int(spool_max_mb * 1024 * 1024))
+        self.session = session
+        self.boot_id = uuid.uuid4().hex[:12] # seq bắt đầu lại từ 1 mỗi lần chạy (không dựa vào đồng hồ: Pi chưa có NTP)
+        self.seq = 0
+        self.online = True
+        self.stats = {"posts": 0, "events_sent": 0, "frames_sent": 0, "bytes_sent": 0, "failures": 0, "spooled": 0}
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._frame_cond = threading.Condition(self._lock)
+        self._last_state: Optional[dict] = None
+        self._need_snapshot = True
+        self._frame_due = False
+        self._last_frame_at = 0.0
+        self._last_signature = None
+        self._retry_at = 0.0
+        self._backoff = 1.0
+
+    # --- Nguồn sự kiện (gọi từ luồng khác) ---
+    def push_event(self, event_type: str, data: dict):
+        with self._lock:
+            self.seq += 1
+            self._events.append({"boot": self.boot_id, "seq": self.seq, "ts": time.time(), "type": event_type, "data": data})
+            if event_type == "sort": self._frame_due = True; self._frame_cond.notify()
+        self._wake.set()
+
+    def on_sort(self, job, lane_index, lane_name, outcome, actuation_ts):
+        """Dùng làm SortingSystem.sort_event_listeners"""
+        self.push_event("sort", {"job_id": job.get("job_id"), "lane_index": lane_index, "lane": lane_name,
+                                 "outcome": outcome, "status": job.get("status"), "entry_ts": job.get("entry_time"),
+                                 "actuation_ts": actuation_ts})
+
+    # --- Vòng gửi ---
+    def run(self, is_running: Callable[[], bool]):
+        if self.session is None:
+            import requests # Chỉ nạp khi VPS được cấu hình (tốn thời gian khởi động trên Pi)
+            from requests.adapters import HTTPAdapter
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight) # Giữ sẵn 1 kết nối / làn
+            self.session.mount("http://", adapter); self.session.mount("https://", adapter)
+        if self.spool.pending:
+            logging.info(f"[VPS_UPDATE] Còn {self.spool.pending} sự kiện trong spool từ lần chạy trước, sẽ gửi bù.")
+        frame_lanes = self.max_in_flight - 1 if self.get_frame is not None and self.link.max_fps > 0 else 0
+        workers = [threading.Thread(target=self._frame_loop, args=(is_running,), name=f"VPSFrame-{i}", daemon=True)
+                   for i in range(frame_lanes)]
+        for worker in workers: worker.start()
+        next_state = 0.0
+        try:
+            while is_running():
+                self._wake.wait(self.state_interval); self._wake.clear()
+                if time.monotonic() >= next_state:
+                    self._queue_state_delta(); next_state = time.monotonic() + self.state_interval
+                self.flush()
+        finally:
+            with self._lock:
+                self._frame_cond.notify_all()
+                events = list(self._events); self._events.clear()
+            self._to_spool(events) # Sự kiện chưa kịp gửi lúc dừng -> gửi ở lần chạy sau
+            for worker in workers: worker.join(self.timeout + 1.0)
+
+    def _queue_state_delta(self):
+        state = self.get_state()
+        if state is None: return
+        last = self._last_state
+        delta = state if last is None else {k: v for k, v in state.items() if last.get(k) != v}
+        self._last_state = state
+        if delta: self.push_event("state", delta)
+
+    def flush(self):
+        """Làn sự kiện: gửi bù spool rồi các sự kiện mới (1 request / lần, giữ thứ tự)"""
+        with self._lock:
+            events = list(self._events); self._events.clear()
+        if not self.online:
+            self._to_spool(events); events = []
+            if time.monotonic() < self._retry_at: return
+
+        while self.spool.pending: # Gửi bù theo thứ tự trước sự kiện mới
+            batch, lines = self.spool.peek(self.catchup_batch)
+            if not lines: break
+            if not self._post(batch):
+                self._go_offline(events); return
+            self.spool.commit(lines)
+        if events and not self._post(events): self._go_offline(events)
+
+    def _to_spool(self, events):
+        if not events: return
+        try:
+            self.spool.append(events); self.stats["spooled"] += len(events)
+        except OSError as e:
+            logging.error(f"[VPS_UPDATE] Không ghi được spool ({e}), bỏ {len(events)} sự kiện.")
+
+    def _go_offline(self, events):
+        self._to_spool(events)
+        if self.online:
+            logging.warning(f"[VPS_UPDATE] Mất kết nối VPS, lưu sự kiện vào spool {self.spool.directory}.")
+        self.online = False; self._need_snapshot = True
+        self._retry_at = time.monotonic() + self._backoff
+        self._backoff = min(self._backoff * 2, 30.0)
+
+    # --- Làn frame ---
+    def _claim_frame_slot(self) -> Optional[bool]:
+        """Gọi khi giữ self._lock. Tới lượt gửi frame -> force (có sự kiện sort), chưa tới -> None"""
+        now = time.monotonic()
+        if not self.online or now - self._last_frame_at < 1.0 / self.link.fps: return None
+        force = self._frame_due; self._frame_due = False
+        self._last_frame_at = now # Giữ chỗ: làn khác chờ hết chu kỳ fps
+        return force
+
+    def _frame_loop(self, is_running: Callable[[], bool]):
+        while is_running():
+            with self._lock:
+                force = self._claim_frame_slot()
+                if force is None:
+                    wait = self._last_frame_at + 1.0 / self.link.fps - time.monotonic()
+                    self._frame_cond.wait(min(max(wait, 0.01), self.state_interval)); continue
+            try:
+                frame = self._frame_payload(force)
+                if frame is not None: self._post([], frame)
+            except Exception as e:
+                logging.error(f"[VPS_UPDATE] Lỗi gửi frame: {e}"); time.sleep(1)
+
+    def _frame_payload(self, force: bool) -> Optional[bytes]:
+        """Frame mới nhất lúc gọi (JPEG, chất lượng theo LinkEstimator); None nếu không đổi và không bị ép gửi"""
+        frame = self.get_frame()
+        if frame is None: return None
+        import cv2
+        signature = cv2.resize(frame, (32, 24), interpolation=cv2.INTER_AREA).astype("int16")
+        with self._lock:
+            changed = self._last_signature is None or float(abs(signature - self._last_signature).mean()) >= self.frame_change
+            if not (force or changed): return None
+            self._last_signature = signature
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.link.quality])
+        return buffer.tobytes() if ret else None
+
+    def _post(self, events: List[dict], frame: Optional[bytes] = None) -> bool:
+        """1 request; frame=None: làn sự kiện (cập nhật online / spool), có frame: làn frame (lỗi thì bỏ frame)"""
+        data = {"batch": json.dumps({"events": events}, ensure_ascii=False)}
+        if self._need_snapshot and frame is None:
+            state = self._last_state if self._last_state is not None else self.get_state()
+            if state is not None: data["state"] = json.dumps(state)
+        files = {'frame': ('frame.jpg', frame, 'image/jpeg')} if frame else None
+        nbytes = sum(len(v) for v in data.values()) + (len(frame) if frame else 0)
+        self.link.begin(); start = time.monotonic()
+        try:
+            response = self.session.post(self.url, data=data, files=files, headers=self.headers, timeout=self.timeout)
+        except Exception as e: # requests.exceptions.RequestException (requests nạp lười)
+            self.link.end(nbytes, time.monotonic() - start, False, len(frame) if frame else 0)
+            with self._lock: self.stats["failures"] += 1
+            if self.online and frame is None: logging.error(f"[VPS_UPDATE] Lỗi kết nối VPS: {e}")
+            return False
+        ok = response.status_code < 500 and response.status_code != 429
+        self.link.end(nbytes, time.monotonic() - start, ok, len(frame) if frame else 0)
+        if not ok:
+            with self._lock: self.stats["failures"] += 1
+            if self.online and frame is None:
+                logging.warning(f"[VPS_UPDATE] VPS báo lỗi: {response.status_code} - {response.text[:200]}")
+            return False
+        if response.status_code != 200: # 4xx: gửi lại cũng bị từ chối -> bỏ lô này
+            logging.warning(f"[VPS_UPDATE] VPS từ chối ({response.status_code}): {response.text[:200]}. Bỏ {len(events)} sự kiện.")
+        with self._lock:
+            self.stats["posts"] += 1; self.stats["events_sent"] += len(events); self.stats["bytes_sent"] += nbytes
+            if frame: self.stats["frames_sent"] += 1
+        if frame is None:
+            if not self.online: logging.info("[VPS_UPDATE] Đã nối lại VPS.")
+            self.online = True; self._need_snapshot = False; self._backoff = 1.0
+        return True
+
+    def status(self) -> dict:
+        with self._lock: stats = dict(self.stats)
+        return {**stats, **self.link.status(), "online": self.online,
+                "spool_pending": self.spool.pending, "spool_dropped": self.spool.dropped}
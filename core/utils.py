@@ -1,9 +1,11 @@
 # core/utils.py
+import os
 import unicodedata
 import re
 import threading
 import logging
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, Optional
 
 def canon_id(s: str) -> str:
     if not s:
@@ -15,6 +17,41 @@ def canon_id(s: str) -> str:
     s = re.sub(r"^(LOAI|LO)+", "", s)
     return s
 
+def match_source(job_status: str) -> str:
+    """Nguồn ghép cặp của Job: QR / AI / FALLBACK (cả 2 thất bại -> NG)"""
+    status = str(job_status or "")
+    if status.startswith("AI_MATCHED"): return "AI"
+    if status.startswith("QR_MATCHED"): return "QR"
+    return "FALLBACK"
+
+def parse_ts(value) -> Optional[float]:
+    """Đọc mốc thời gian từ query string: epoch (giây) hoặc ISO 8601 (giờ địa phương)"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        raise ValueError(f"Mốc thời gian không hợp lệ: {value}")
+
+def write_file_atomic(path: str, data: str):
+    """Ghi file an toàn khi mất điện: file tạm + fsync + os.replace + fsync thư mục"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try: os.fsync(dir_fd)
+        finally: os.close(dir_fd)
+    except OSError:
+        pass # Một số hệ điều hành không cho fsync thư mục
+
 class ThreadSafeDict:
     def __init__(self):
         self._data: Dict[str, Any] = {}
@@ -6,11 +6,8 @@ import logging
 from logging.handlers import RotatingFileHandler
 
 import threading
-import sqlite3 
 import copy     
 import uuid     
-from datetime import datetime 
-import requests
 import io      
 try:
     from ultralytics import YOLO
@@ -30,6 +27,10 @@ from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, render_template, Response, jsonify, request
 from flask_sock import Sock
 import unicodedata, re # (ĐÃ GIỮ NGUYÊN BẢN ĐÚNG)
+from core.db import SortLogWriter, rollup_query_key
+from core.config_store import ConfigStore
+from core.utils import parse_ts
+from core.uploader import VPSUploader
 
 
 
@@ -226,6 +227,8 @@ error_manager = ErrorManager()
 executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="TestWorker")
 database_lock = threading.Lock()
 config_file_lock = threading.Lock()
+sort_log_writer = SortLogWriter(DATABASE_FILE) # Ghi sort_log theo lô (WAL)
+config_store = ConfigStore(CONFIG_FILE) # Chỉ ghi config khi có thay đổi (nguyên tử)
 
 # =============================
 #       KHAI BÁO CHÂN GPIO
@@ -295,6 +298,7 @@ system_state = {
 state_lock = threading.Lock()
 main_loop_running = True
 latest_frame = None
+vps_uploader = None # VPSUploader (luồng vps_update_thread)
 frame_lock = threading.Lock()
 fps_value = 0.0
 
@@ -327,18 +331,7 @@ last_entry_sensor_trigger_time = 0.0 # (Từ v2)
 def init_database():
     with database_lock:
         try:
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sort_log (
-                date TEXT,
-                lane_name TEXT,
-                count INTEGER DEFAULT 0,
-                PRIMARY KEY (date, lane_name)
-            )
-            """)
-            conn.commit()
-            conn.close()
+            sort_log_writer.start()
             logging.info(f"[DB] Đã khởi tạo CSDL SQLite tại '{DATABASE_FILE}' thành công.")
         except Exception as e:
             logging.critical(f"[CRITICAL] Không thể khởi tạo CSDL SQLite: {e}")
@@ -481,8 +474,7 @@ def load_local_config():
         else:
             logging.warning("[CONFIG] Không có file config, dùng mặc định và tạo mới.")
             try:
-                with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(loaded_config, f, indent=4)
+                config_store.write_now(loaded_config)
             except Exception as e:
                 logging.error(f"[CONFIG] Không thể tạo file config mới: {e}")
 
@@ -593,35 +585,19 @@ def reset_all_relays_to_default():
     logging.info("[GPIO] Reset hoàn tất.")
 
 def periodic_config_save():
+    """Ghi config khi có thay đổi (debounce các lần update_config liên tiếp)"""
     while main_loop_running:
-        time.sleep(60)
-        if error_manager.is_maintenance(): continue
-        
-        config_to_save = {}
-        
+        if not config_store.wait_dirty(timeout=1.0): continue
+        while main_loop_running and not config_store.ready_to_flush():
+            time.sleep(0.05)
         try:
-            with state_lock:
-                config_to_save['timing_config'] = system_state['timing_config'].copy()
-                config_to_save['ai_config'] = system_state['ai_config'].copy()
-                config_to_save['camera_settings'] = system_state['camera_settings'].copy()
-                
-                current_lanes_config = []
-                for lane_state in system_state['lanes']:
-                    current_lanes_config.append({
-                        "id": lane_state['id'], "name": lane_state['name'],
-                        "sensor_pin": lane_state.get('sensor_pin'), 
-                        "push_pin": lane_state.get('push_pin'), 
-                        "pull_pin": lane_state.get('pull_pin')
-                    })
-                config_to_save['lanes_config'] = current_lanes_config
-            
             with config_file_lock:
-                with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(config_to_save, f, indent=4)
-            logging.info("[CONFIG] Đã tự động lưu config (timing, ai, lanes, camera).")
-
+                written = config_store.flush()
+            if written:
+                logging.info(f"[CONFIG] Đã lưu config (v{config_store.saved_version}).")
         except Exception as e:
-            logging.error(f"[CONFIG] Lỗi tự động lưu config: {e}") 
+            logging.error(f"[CONFIG] Lỗi lưu config: {e}")
+            time.sleep(1.0)
 
 # =============================
 #       LUỒNG CAMERA
@@ -706,23 +682,12 @@ def camera_capture_thread():
 #     LƯU LOG ĐẾM SẢN PHẨM
 # =============================
 def log_sort_count(lane_index, lane_name):
-    with database_lock:
-        try:
-            today = datetime.now().strftime('%Y-%m-%d')
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-            INSERT INTO sort_log (date, lane_name, count)
-            VALUES (?, ?, 1)
-            ON CONFLICT(date, lane_name) DO UPDATE SET
-                count = count + 1
-            """, (today, lane_name))
-            
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logging.error(f"[DB] Lỗi khi ghi log đếm vào SQLite: {e}")
+    # Chỉ cộng dồn trong RAM, luồng DBWriterThread sẽ ghi theo lô
+    try:
+        sort_log_writer.increment(lane_name)
+    except Exception as e:
+        logging.error(f"[DB] Lỗi khi ghi log đếm: {e}")
+    if vps_uploader is not None: vps_uploader.push_event("sort", {"lane_index": lane_index, "lane": lane_name})
 
 # =============================
 #     CHU TRÌNH PHÂN LOẠI
@@ -1717,68 +1682,19 @@ def requires_auth(f):
     return decorated
 
 def vps_update_thread():
-    global latest_frame, system_state, state_lock, frame_lock
-    
-    time.sleep(5)
-    logging.info(f"[VPS_UPDATE] Bắt đầu luồng gửi dữ liệu (Color 20FPS) lên {VPS_URL}")
-    
-    session = requests.Session()
-    headers = {'X-API-Key': PI_API_KEY}
-    
-    while main_loop_running:
-        try:
-            state_copy = None
-            frame_copy = None
-            
-            with state_lock:
-                state_copy = copy.deepcopy(system_state)
-            with frame_lock:
-                if latest_frame is not None:
-                    frame_copy = latest_frame.copy()
-            
-            if state_copy is None or frame_copy is None:
-                logging.warning("[VPS_UPDATE] Chưa có state hoặc frame, chờ 1s...")
-                time.sleep(1)
-                continue
+    """Gửi state / sự kiện sort / frame lên VPS theo sự kiện, có spool khi mất mạng (core/uploader.py)"""
+    global vps_uploader
 
-            state_json = json.dumps(state_copy)
-            
-            # === (TỐI ƯU) ===
-            # 1. KHÔNG chuyển sang đen trắng, giữ nguyên ảnh màu (frame_copy)
-            # 2. Nén ảnh MÀU với chất lượng 70 (cao hơn)
-            ret, buffer = cv2.imencode('.jpg', frame_copy, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            # === (HẾT TỐI ƯU) ===
-            
-            if not ret:
-                logging.warning("[VPS_UPDATE] Lỗi encode JPEG")
-                time.sleep(0.5)
-                continue
-            
-            frame_bytes = buffer.tobytes()
+    def get_state():
+        with state_lock: return copy.deepcopy(system_state)
 
-            files = {'frame': ('frame.jpg', frame_bytes, 'image/jpeg')}
-            data = {'state': state_json}
-            
-            response = session.post(
-                f"{VPS_URL}/api/pi/update",
-                files=files,
-                data=data,
-                headers=headers,
-                timeout=2.0
-            )
-            
-            if response.status_code != 200:
-                logging.warning(f"[VPS_UPDATE] VPS báo lỗi: {response.status_code} - {response.text}")
+    def get_frame():
+        with frame_lock: return latest_frame.copy() if latest_frame is not None else None
+
+    vps_uploader = VPSUploader(f"{VPS_URL}/api/pi/update", PI_API_KEY, os.path.join(LOG_DIR, "vps_spool"), get_state, get_frame)
+    logging.info(f"[VPS_UPDATE] Bắt đầu gửi dữ liệu theo sự kiện lên {VPS_URL}")
+    vps_uploader.run(lambda: main_loop_running)
 
-            # (TỐI ƯU) Giữ nguyên 20 FPS (ngủ 0.05s)
-            time.sleep(0.05) 
-            
-        except requests.exceptions.RequestException as e:
-            logging.error(f"[VPS_UPDATE] Lỗi kết nối VPS: {e}")
-            time.sleep(5)
-        except Exception as e:
-            logging.error(f"[VPS_UPDATE] Lỗi trong luồng: {e}")
-            time.sleep(1)
 def broadcast_state():
     last_state_str = ""
     while main_loop_running:
@@ -1896,27 +1812,28 @@ def get_config():
 @app.route('/api/sort_log')
 @requires_auth
 def get_sort_log():
-    output_data = {} 
+    # Đọc từ bảng rollup qua kết nối WAL riêng (không giữ database_lock), hỗ trợ ETag
+    # ETag theo tham số đã chuẩn hóa (bucket) + số lần đếm, dữ liệu gồm cả số đếm chưa ghi xuống CSDL
+    try:
+        granularity, since, until = (request.args.get('granularity') or "day",
+                                     parse_ts(request.args.get('since')), parse_ts(request.args.get('until')))
+        query_key = "-".join(str(v or "") for v in rollup_query_key(granularity, since, until))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    etag = f"{sort_log_writer.instance_id}-{sort_log_writer.count_version}-{query_key}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag); response.headers['Cache-Control'] = 'no-cache'
+        return response
+    try:
+        output_data = sort_log_writer.query_rollup(granularity, since=since, until=until)
+    except Exception as e:
+        logging.error(f"[API] Lỗi khi đọc /api/sort_log từ SQLite: {e}")
+        return jsonify({"error": str(e)}), 500
     
-    with database_lock:
-        try:
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT date, lane_name, count FROM sort_log ORDER BY date ASC")
-            rows = cursor.fetchall()
-            conn.close()
-            
-            for date, lane_name, count in rows:
-                if date not in output_data:
-                    output_data[date] = {}
-                output_data[date][lane_name] = count
-                
-        except Exception as e:
-            logging.error(f"[API] Lỗi khi đọc /api/sort_log từ SQLite: {e}")
-            return jsonify({"error": str(e)}), 500
-            
-    return jsonify(output_data)
+    response = jsonify(output_data)
+    response.set_etag(etag); response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/update_config', methods=['POST'])
@@ -2045,9 +1962,7 @@ def update_config():
             ]
 
     try:
-        with config_file_lock:
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(config_to_save, f, indent=4)
+        config_store.submit(config_to_save) # periodic_config_save sẽ ghi file
         
         msg = "Đã lưu config. "
         if restart_required: msg += "Vui lòng khởi động lại hệ thống để áp dụng thay đổi."
@@ -2369,6 +2284,14 @@ if __name__ == "__main__":
         
         save_queues_on_shutdown() 
         
+        try:
+            with config_file_lock: config_store.flush()
+        except Exception as e:
+            logging.error(f"Lỗi lưu config khi tắt: {e}")
+
+        logging.info("Đang flush CSDL...")
+        sort_log_writer.stop()
+        
         logging.info("Đang tắt ThreadPoolExecutor...")
         executor.shutdown(wait=False)
         logging.info("Đang cleanup GPIO...")
@@ -638,11 +638,20 @@ function resetQueueManual() {
     });
 }
 
+// Cache dữ liệu thống kê: chỉ tải lại khi server báo ETag đổi (304 -> dùng lại)
+let sortLogCache = { etag: null, query: null, data: null };
 function loadSortChart() {
-    _fetch("/api/sort_log")
+    const since = new Date(Date.now() - 6 * 24 * 3600 * 1000).toISOString().split('T')[0];
+    const query = `granularity=day&since=${since}`;
+    const headers = {};
+    if (sortLogCache.etag && sortLogCache.query === query) headers['If-None-Match'] = sortLogCache.etag;
+    _fetch(`/api/sort_log?${query}`, { headers, cache: 'no-store' })
         .then(res => {
+            if (res.status === 304) return sortLogCache.data;
             if (!res.ok) throw new Error(`HTTP error! status: ${res.status}`);
-            return res.json();
+            sortLogCache.etag = res.headers.get('ETag');
+            sortLogCache.query = query;
+            return res.json().then(data => (sortLogCache.data = data));
         })
         .then(data => {
             renderCharts(data);
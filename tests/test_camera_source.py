@@ -0,0 +1,101 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import cv2
+
+from core.frames import CapturedFrame
+from core.qr import render_qr_frame, scan_qr_from_frame
+from threads.camera import (ImageDirSource, PlaybackPacer, SyntheticSource, VideoFileSource,
+                            make_frame_source, parse_source_spec, replay)
+
+
+def write_clip(path, codes, fps=20.0):
+    """Video .avi (MJPG) ngắn: mỗi mã trong `codes` là 1 frame"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (640, 480))
+    for code in codes: writer.write(render_qr_frame(code))
+    writer.release()
+
+
+class TestFrameSources(unittest.TestCase):
+    def test_parse_source_spec(self):
+        self.assertEqual(parse_source_spec("v4l2:2"), {"source": "v4l2", "camera_index": 2})
+        self.assertEqual(parse_source_spec("file:/tmp/a.mp4"), {"source": "file", "source_path": "/tmp/a.mp4"})
+        self.assertEqual(parse_source_spec("synthetic:SP001,SP002"),
+                         {"source": "synthetic", "synthetic_codes": ["SP001", "SP002"]})
+        self.assertEqual(parse_source_spec("/tmp/missing.avi")["source"], "file")
+        self.assertEqual(parse_source_spec("0")["source"], "v4l2")
+
+    def test_image_dir_plays_once_then_eof(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            cv2.imwrite(os.path.join(tmp, "b.png"), render_qr_frame("SP002"))
+            cv2.imwrite(os.path.join(tmp, "a.png"), render_qr_frame("SP001"))
+            source = make_frame_source({"source": "images", "source_path": tmp, "source_loop": False})
+            self.assertIsInstance(source, ImageDirSource)
+            self.assertTrue(source.open())
+            stats = replay(source)
+            self.assertEqual(stats["frames"], 2)
+            self.assertEqual(stats["codes"], {"SP001": 1, "SP002": 1})
+            self.assertTrue(source.eof)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_video_file_capture_and_replay(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "clip.avi"); write_clip(path, ["SP001", "SP002", "SP003"])
+            source = make_frame_source({"source": "file", "source_path": path, "source_loop": False})
+            self.assertIsInstance(source, VideoFileSource)
+            self.assertTrue(source.open())
+            ret, frame = source.capture()  # capture() không bị thuộc tính VideoCapture che mất
+            self.assertTrue(ret); self.assertIsInstance(frame, CapturedFrame)
+            self.assertEqual(scan_qr_from_frame(frame.gray())[0], "SP001")
+            stats = replay(source)
+            self.assertEqual(stats["codes"], {"SP002": 1, "SP003": 1})
+            self.assertTrue(source.eof)
+            source.release()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_video_file_frames_loop_and_describe(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "clip.avi"); write_clip(path, ["SP001", "SP002", "SP003"], fps=12.0)
+            once = VideoFileSource(path)
+            self.assertTrue(once.open())
+            self.assertEqual(once.describe(), f"file {path}")
+            self.assertAlmostEqual(once.fps, 12.0)  # Nhịp phát lại theo fps của file
+            frames = 0
+            while once.read()[0]: frames += 1
+            self.assertEqual(frames, 3); self.assertTrue(once.eof)
+            once.release()
+
+            looped = VideoFileSource(path, loop=True)
+            self.assertTrue(looped.open())
+            codes = [scan_qr_from_frame(looped.capture()[1].gray())[0] for _ in range(7)]
+            self.assertEqual(codes, ["SP001", "SP002", "SP003"] * 2 + ["SP001"])  # Hết file -> quay lại đầu
+            self.assertFalse(looped.eof)
+            looped.release()
+            self.assertFalse(VideoFileSource(os.path.join(tmp, "missing.avi")).open())
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_synthetic_alternates_parcels_and_empty_belt(self):
+        source = SyntheticSource(["SP003"], hold_frames=2, gap_frames=1)
+        frames = [source.read()[1] for _ in range(3)]
+        self.assertEqual(scan_qr_from_frame(frames[0])[0], "SP003")
+        self.assertIsNone(scan_qr_from_frame(frames[2])[0])
+
+    def test_pacer_speed(self):
+        fast = PlaybackPacer(fps=10, speed=0)
+        start = time.monotonic()
+        for _ in range(20): fast.wait()
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertAlmostEqual(PlaybackPacer(fps=10, speed=2.0).interval, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+from core.config_store import ConfigStore
+
+
+class TestConfigStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "config.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_write_only_on_change(self):
+        store = ConfigStore(self.path)
+        self.assertFalse(store.flush()) # Chưa có gì thay đổi
+        self.assertTrue(store.write_now({"timing_config": {"a": 1}}))
+        mtime = os.stat(self.path).st_mtime_ns
+
+        store.submit({"timing_config": {"a": 1}}) # Nội dung giống hệt
+        self.assertFalse(store.flush())
+        self.assertFalse(store.is_dirty())
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+        self.assertEqual((store.write_count, store.skip_count), (1, 1))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_existing_file_is_not_rewritten(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(ConfigStore.serialize({"x": 1}))
+        store = ConfigStore(self.path)
+        store.submit({"x": 1})
+        self.assertFalse(store.flush())
+        self.assertEqual(store.write_count, 0)
+
+    def test_burst_is_debounced_to_latest(self):
+        store = ConfigStore(self.path, debounce=0.05, max_delay=1.0)
+        for i in range(10):
+            store.submit({"timing_config": {"n": i}})
+        self.assertTrue(store.wait_dirty(0.1))
+        self.assertFalse(store.ready_to_flush())
+        time.sleep(0.06)
+        self.assertTrue(store.ready_to_flush())
+        self.assertTrue(store.flush())
+        self.assertEqual(store.write_count, 1)
+        self.assertEqual(store.saved_version, 10)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {"timing_config": {"n": 9}})
+
+    def test_max_delay_bounds_debounce(self):
+        store = ConfigStore(self.path, debounce=10.0, max_delay=0.5)
+        store.submit({"a": 1})
+        now = time.monotonic()
+        self.assertFalse(store.ready_to_flush(now))
+        self.assertTrue(store.ready_to_flush(now + 0.6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from core.control import ControlServer, SystemProxy
+from core.ipc import KIND_EVENT, SharedFrame, recv_packet, send_packet
+
+
+class _FakeErrors:
+    def is_maintenance(self): return True
+
+
+class FakeSystem:
+    def __init__(self):
+        self.main_loop_running = True
+        self.error_manager = _FakeErrors()
+        self.fps_value = 12.5
+        self.ws_clients = set()
+        self.frame = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+
+    def add_ws_client(self, ws): self.ws_clients.add(ws)
+    def remove_ws_client(self, ws): self.ws_clients.discard(ws)
+    def get_latest_frame(self, consumer, reject_stale=True, after_seq=None, kind="bgr", copy=True):
+        return (None, 1) if after_seq == 1 else (self.frame.copy(), 1)
+    def get_sort_events(self, params): return {"lane": params.get("lane")}, 200
+    def update_config(self, data): raise ValueError("bad config")
+
+
+class TestIPC(unittest.TestCase):
+    def test_packet_round_trip(self):
+        a, b = socket.socketpair()
+        with a, b:
+            send_packet(a, KIND_EVENT, "xin chào".encode("utf-8"))
+            self.assertEqual(recv_packet(b), (KIND_EVENT, "xin chào".encode("utf-8")))
+
+    def test_shared_frame(self):
+        name = f"pi_qr_test_{os.getpid()}"
+        writer = SharedFrame(name, create=True, max_bytes=1024)
+        reader = SharedFrame(name)
+        try:
+            self.assertEqual(reader.read(), (None, 0))
+            frame = np.full((8, 10, 3), 7, np.uint8)
+            self.assertTrue(writer.write(frame, 5, fps=30.0))
+            got, seq = reader.read()
+            self.assertEqual(seq, 5); np.testing.assert_array_equal(got, frame)
+            self.assertEqual(reader.read(after_seq=5), (None, 5))
+            self.assertEqual(reader.fps(), 30.0)
+            self.assertFalse(writer.write(np.zeros((20, 20, 3), np.uint8), 6)) # Vượt kích thước ô nhớ
+        finally:
+            reader.close(); writer.close()
+
+
+class TestControlServer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.dir, "control.sock")
+        self.shm_name = f"pi_qr_ctl_{os.getpid()}"
+        self.system = FakeSystem()
+        self.server = ControlServer(self.system, self.socket_path, self.shm_name)
+        self.server.start()
+        self.proxy = SystemProxy(self.socket_path, self.shm_name, spawn=False)
+
+    def tearDown(self):
+        self.proxy.main_loop_running = False
+        while not self.proxy._pool.empty(): self.proxy._pool.get_nowait().close()
+        if self.proxy._frames: self.proxy._frames.close()
+        self.server.shutdown_event.set(); self.server.stop()
+        os.rmdir(self.dir)
+
+    def test_rpc_and_errors(self):
+        self.assertEqual(self.proxy.get_sort_events({"lane": "A"}), [{"lane": "A"}, 200])
+        with self.assertRaises(RuntimeError): self.proxy.update_config({})
+        self.assertTrue(self.proxy.error_manager.is_maintenance())
+        with self.assertRaises(AttributeError): self.proxy.sorting_process
+
+    def test_frames_and_events(self):
+        deadline = time.time() + 2
+        frame = None
+        while frame is None and time.time() < deadline:
+            frame, _ = self.proxy.get_latest_frame("video_feed"); time.sleep(0.02)
+        np.testing.assert_array_equal(frame, self.system.frame)
+        self.assertEqual(self.proxy.fps_value, 12.5)
+
+        received = []
+        class Client:
+            def send(self, msg): received.append(msg)
+        self.proxy.add_ws_client(Client())
+        threading.Thread(target=self.proxy._event_loop, daemon=True).start()
+        while not self.system.ws_clients and time.time() < deadline + 2: time.sleep(0.02)
+        for peer in list(self.system.ws_clients): peer.send('{"type": "log"}')
+        while not received and time.time() < deadline + 2: time.sleep(0.02)
+        self.assertEqual(received, ['{"type": "log"}'])
+
+    def test_stalled_subscriber_times_out_instead_of_blocking(self):
+        from core import control
+        from core.ipc import KIND_REQUEST, send_json
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); conn.connect(self.socket_path)
+        self.addCleanup(conn.close)
+        with unittest.mock.patch.object(control, "PEER_SEND_TIMEOUT", 0.2):
+            send_json(conn, KIND_REQUEST, {"method": "subscribe"})  # Không bao giờ đọc sự kiện
+            deadline = time.time() + 2
+            while not self.system.ws_clients and time.time() < deadline: time.sleep(0.02)
+        peer = next(iter(self.system.ws_clients))
+        start = time.time()
+        with self.assertRaises(OSError):
+            for _ in range(10000): peer.send("x" * 4096)
+        self.assertLess(time.time() - start, 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+# tests/test_db.py
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from core.db import SortLogWriter, query_sort_events, summarize_sort_events, query_sort_rollup
+
+JAN1 = datetime(2025, 1, 1, 9, 30)
+
+class TestSortLogWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "sort_log.db")
+        self.writer = SortLogWriter(self.db_path, flush_interval=60.0, max_pending=1000, hour_retention_days=0)
+        self.writer.open()
+
+    def tearDown(self):
+        self.writer.stop()
+        self.tmpdir.cleanup()
+
+    def _rows(self):
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT date, lane_name, count FROM sort_log ORDER BY lane_name").fetchall()
+        conn.close()
+        return rows
+
+    def test_increments_batched_until_flush(self):
+        for _ in range(3): self.writer.increment("A", when=JAN1)
+        self.writer.increment("B", when=JAN1)
+        self.assertEqual(self._rows(), [])
+        self.assertEqual(self.writer.pending_snapshot()[("2025-01-01", "A")], 3)
+
+        self.assertEqual(self.writer.flush(), 6) # 2 lane x (giờ, ngày, tuần)
+        self.assertEqual(self._rows(), [("2025-01-01", "A", 3), ("2025-01-01", "B", 1)])
+        self.assertEqual(self.writer.pending_snapshot(), {})
+
+    def test_failed_flush_requeues_batch(self):
+        self.writer.increment("A", when=JAN1)
+        self.writer.log_event({"job_id": "j1", "lane_name": "A"})
+        conn = self.writer._conn; self.writer._conn = None  # Lỗi CSDL tạm thời
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertIsNotNone(self.writer.last_flush_error)
+        self.writer.increment("A", when=JAN1)
+        self.assertEqual(self.writer.pending_snapshot()[("2025-01-01", "A")], 2)
+        self.assertEqual(self.writer._pending_events, 3)
+        self.writer._conn = conn
+        self.assertEqual(self.writer.flush(), 4)  # 3 rollup + 1 sự kiện
+        self.assertEqual(self._rows(), [("2025-01-01", "A", 2)])
+        self.assertEqual(query_sort_events(self.db_path)["events"][0]["job_id"], "j1")
+
+    def test_flush_accumulates_existing_rows(self):
+        self.writer.increment("A", when=JAN1); self.writer.flush()
+        self.writer.increment("A", n=4, when=JAN1); self.writer.flush()
+        self.assertEqual(self._rows(), [("2025-01-01", "A", 5)])
+
+    def test_wal_mode_and_flush_on_stop(self):
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0].lower(), "wal")
+        conn.close()
+        self.writer.start()
+        self.writer.increment("C", when=datetime(2025, 1, 2, 8, 0))
+        self.writer.stop()
+        self.assertEqual(self._rows(), [("2025-01-02", "C", 1)])
+
+    def test_rollups_by_granularity(self):
+        self.writer.increment("A", when=datetime(2024, 12, 30, 8, 5))  # Thứ Hai
+        self.writer.increment("A", when=datetime(2025, 1, 1, 8, 40))
+        self.writer.increment("B", when=datetime(2025, 1, 1, 9, 10))
+        version = self.writer.data_version
+        self.writer.flush()
+        self.assertEqual(self.writer.data_version, version + 1)
+
+        self.assertEqual(query_sort_rollup(self.db_path, "week"), {"2024-12-30": {"A": 2, "B": 1}})
+        self.assertEqual(query_sort_rollup(self.db_path, "day"),
+                         {"2024-12-30": {"A": 1}, "2025-01-01": {"A": 1, "B": 1}})
+        since = datetime(2025, 1, 1, 8, 59).timestamp(); until = datetime(2025, 1, 1, 9, 59).timestamp()
+        self.assertEqual(query_sort_rollup(self.db_path, "hour", since=since, until=until),
+                         {"2025-01-01 08:00": {"A": 1}, "2025-01-01 09:00": {"B": 1}})
+        with self.assertRaises(ValueError):
+            query_sort_rollup(self.db_path, "minute")
+
+    def test_query_includes_unflushed_counts(self):
+        self.writer.increment("A", when=JAN1); self.writer.flush()
+        version = self.writer.count_version
+        self.writer.increment("A", when=JAN1); self.writer.increment("B", when=datetime(2025, 1, 2, 8, 0))
+        self.assertEqual(self.writer.count_version, version + 2)
+        self.assertEqual(self.writer.query_rollup("day"), {"2025-01-01": {"A": 2}, "2025-01-02": {"B": 1}})
+        self.assertEqual(self.writer.query_rollup("day", until=JAN1.timestamp()), {"2025-01-01": {"A": 2}})
+        with self.assertRaises(ValueError):
+            self.writer.query_rollup("minute")
+
+    def test_hour_rollup_retention(self):
+        self.writer.hour_retention_days = 7
+        now = datetime.now()
+        self.writer.increment("A", when=JAN1); self.writer.increment("A", when=now)
+        self.writer.flush()
+        self.assertEqual(list(query_sort_rollup(self.db_path, "hour")), [now.strftime('%Y-%m-%d %H:00')])
+        self.assertIn("2025-01-01", query_sort_rollup(self.db_path, "day"))  # Ngày / tuần giữ nguyên
+
+    def test_week_rollup_backfilled_from_legacy_sort_log(self):
+        self.writer.stop()
+        legacy_path = os.path.join(self.tmpdir.name, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("CREATE TABLE sort_log (date TEXT, lane_name TEXT, count INTEGER DEFAULT 0, PRIMARY KEY (date, lane_name))")
+        conn.executemany("INSERT INTO sort_log VALUES (?, ?, ?)",
+                         [("2025-01-05", "A", 2), ("2025-01-06", "A", 3), ("2025-01-07", "A", 4)])
+        conn.commit(); conn.close()
+        self.writer = SortLogWriter(legacy_path); self.writer.open()
+        self.assertEqual(query_sort_rollup(legacy_path, "week"), {"2024-12-30": {"A": 2}, "2025-01-06": {"A": 7}})
+
+class TestSortEvents(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "sort_log.db")
+        self.writer = SortLogWriter(self.db_path, flush_interval=60.0, max_pending=1000)
+        self.writer.open()
+        for i in range(5):
+            lane = "A" if i % 2 == 0 else "B"
+            self.writer.log_event({
+                "job_id": f"job{i}", "entry_ts": 1000.0 + i, "lane_index": 0, "lane_name": lane,
+                "source": "QR" if lane == "A" else "AI", "status": "QR_MATCHED", "decode_latency": 0.01 * (i + 1),
+                "sensor_ts": 1002.0 + i, "actuation_ts": 1002.5 + i, "done_ts": 1003.0 + i, "outcome": "sorted"
+            })
+        self.writer.flush()
+
+    def tearDown(self):
+        self.writer.stop()
+        self.tmpdir.cleanup()
+
+    def test_keyset_pagination_newest_first(self):
+        page1 = query_sort_events(self.db_path, limit=2)
+        self.assertEqual([e["job_id"] for e in page1["events"]], ["job4", "job3"])
+        page2 = query_sort_events(self.db_path, limit=2, before_id=page1["next_before_id"])
+        self.assertEqual([e["job_id"] for e in page2["events"]], ["job2", "job1"])
+        page3 = query_sort_events(self.db_path, limit=2, before_id=page2["next_before_id"])
+        self.assertEqual([e["job_id"] for e in page3["events"]], ["job0"])
+        self.assertIsNone(page3["next_before_id"])
+
+    def test_time_range_and_lane_filter(self):
+        data = query_sort_events(self.db_path, since=1001.0, until=1004.0, lane="A")
+        self.assertEqual([e["job_id"] for e in data["events"]], ["job2"])
+
+    def test_summary_by_lane(self):
+        summary = summarize_sort_events(self.db_path, group_by="lane")
+        by_lane = {g["lane"]: g for g in summary["groups"]}
+        self.assertEqual(summary["total"], 5)
+        self.assertEqual(by_lane["A"]["count"], 3)
+        self.assertAlmostEqual(by_lane["B"]["travel_time_avg"], 2.0)
+        self.assertAlmostEqual(by_lane["B"]["actuation_latency_max"], 0.5)
+
+    def test_summary_rejects_unknown_group(self):
+        with self.assertRaises(ValueError):
+            summarize_sort_events(self.db_path, group_by="date; DROP TABLE sort_events")
+
+if __name__ == "__main__":
+    unittest.main()
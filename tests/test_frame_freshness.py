@@ -0,0 +1,43 @@
+import time
+import threading
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from core.system import SortingSystem
+from core.metrics import STALE_FRAMES_TOTAL
+
+
+class TestFrameFreshness(unittest.TestCase):
+    def setUp(self):
+        self.system = SimpleNamespace(
+            frame_lock=threading.Lock(), latest_frame=np.zeros((4, 4, 3), dtype=np.uint8),
+            latest_frame_ts=time.monotonic(), latest_frame_seq=1, max_frame_age=0.5
+        )
+
+    def get(self, *args, **kwargs):
+        return SortingSystem.get_latest_frame(self.system, *args, **kwargs)
+
+    def test_fresh_frame_is_copied(self):
+        frame, seq = self.get("test_fresh")
+        self.assertEqual(seq, 1)
+        self.assertIsNotNone(frame)
+        self.assertIsNot(frame, self.system.latest_frame)
+
+    def test_same_seq_is_skipped(self):
+        frame, seq = self.get("test_seq", after_seq=1)
+        self.assertIsNone(frame)
+        self.assertEqual(seq, 1)
+
+    def test_stale_frame_is_rejected(self):
+        self.system.latest_frame_ts = time.monotonic() - 2.0 # Camera treo 2s
+        frame, _ = self.get("test_stale")
+        self.assertIsNone(frame)
+        self.assertEqual(STALE_FRAMES_TOTAL.snapshot().get(("test_stale",)), 1)
+        frame, _ = self.get("test_stale_view", reject_stale=False)
+        self.assertIsNotNone(frame) # Stream video vẫn hiển thị frame cũ
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from core.frames import CapturedFrame
+from core.qr import render_qr_frame, scan_qr_from_frame
+from core.system import SortingSystem
+
+
+def to_yuyv(bgr):
+    """BGR -> YUYV thô như V4L2 trả về khi CONVERT_RGB=0 (h*w*2 byte)"""
+    yuv = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV)
+    packed = np.empty(bgr.shape[:2] + (2,), np.uint8)
+    packed[:, :, 0] = yuv[:, :, 0]
+    packed[:, 0::2, 1] = yuv[:, 0::2, 1]; packed[:, 1::2, 1] = yuv[:, 0::2, 2]
+    return packed.reshape(1, -1)
+
+
+class TestCapturedFrame(unittest.TestCase):
+    def setUp(self):
+        self.bgr = render_qr_frame("SP002")
+
+    def test_yuyv_luma_is_gray_frame(self):
+        frame = CapturedFrame(to_yuyv(self.bgr), "yuyv", (480, 640))
+        gray = frame.gray()
+        self.assertEqual(gray.shape, (480, 640))
+        self.assertLessEqual(int(np.abs(gray.astype(int) - cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)).max()), 1)
+        self.assertEqual(scan_qr_from_frame(gray)[0], "SP002")
+        self.assertEqual(frame.bgr().shape, (480, 640, 3))
+
+    def test_mjpeg_decodes_lazily(self):
+        _, jpeg = cv2.imencode(".jpg", self.bgr)
+        frame = CapturedFrame(jpeg, "mjpeg")
+        self.assertEqual(scan_qr_from_frame(frame.gray())[0], "SP002")
+        self.assertIsNone(frame._bgr)  # Chưa consumer nào cần màu
+        self.assertEqual(frame.bgr().shape, self.bgr.shape)
+
+    def test_conversion_is_shared_and_read_only(self):
+        frame = CapturedFrame(self.bgr)
+        self.assertIs(frame.gray(), frame.gray())
+        with self.assertRaises(ValueError): frame.gray()[0, 0] = 1
+        with self.assertRaises(ValueError): frame.bgr()[0, 0] = 1  # bgr() là chính raw
+
+    def test_ndarray_frame_wrapped_once(self):
+        system = SimpleNamespace(frame_lock=threading.Lock(), latest_frame=self.bgr,
+                                 latest_frame_ts=time.monotonic(), latest_frame_seq=1, max_frame_age=0.5)
+        get = lambda consumer, **kw: SortingSystem.get_latest_frame(system, consumer, **kw)
+        gray_a, _ = get("test_nd_a", kind="gray", copy=False)
+        gray_b, _ = get("test_nd_b", kind="gray", copy=False)
+        self.assertIs(gray_a, gray_b)  # Simulator ghi ndarray: ảnh xám vẫn tính 1 lần / frame
+        self.assertIsInstance(system.latest_frame, CapturedFrame)
+
+    def test_consumers_share_gray_of_same_seq(self):
+        system = SimpleNamespace(frame_lock=threading.Lock(), latest_frame=CapturedFrame(self.bgr),
+                                 latest_frame_ts=time.monotonic(), latest_frame_seq=1, max_frame_age=0.5)
+        get = lambda consumer, **kw: SortingSystem.get_latest_frame(system, consumer, **kw)
+        gray_a, _ = get("test_gray_a", kind="gray", copy=False)
+        gray_b, _ = get("test_gray_b", kind="gray", copy=False)
+        self.assertIs(gray_a, gray_b)
+        view, _ = get("test_view")
+        view[0, 0] = 255  # Stream video được vẽ lên bản sao của mình
+        self.assertIsNot(view, system.latest_frame.bgr())
+
+
+if __name__ == "__main__":
+    unittest.main()
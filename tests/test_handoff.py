@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from core import system as system_module
+
+LANES = [
+    {"id": "A", "name": "Loại A", "sensor_pin": 5, "push_pin": 11, "pull_pin": 12},
+    {"id": "B", "name": "Loại B", "sensor_pin": 16, "push_pin": 13, "pull_pin": 8},
+    {"id": "NG", "name": "NG", "sensor_pin": None, "push_pin": None, "pull_pin": None},
+]
+
+
+class TestHandoff(unittest.TestCase):
+    def setUp(self):
+        # Như test_reconfig: trỏ config/CSDL/journal của cả 2 "tiến trình" vào thư mục tạm
+        self.workdir = tempfile.mkdtemp()
+        paths = {name: os.path.join(self.workdir, os.path.basename(getattr(system_module, name))) for name in (
+            "CONFIG_FILE", "DATABASE_FILE", "QUEUE_STATE_FILE", "QUEUE_JOURNAL_FILE", "QUEUE_SNAPSHOT_FILE")}
+        self.patcher = mock.patch.multiple(system_module, LOG_DIR=self.workdir, **paths)
+        self.patcher.start()
+        with open(paths["CONFIG_FILE"], "w", encoding="utf-8") as f:
+            json.dump({"lanes_config": LANES, "timing_config": {"use_sensor_entry_gantry": False}}, f)
+        self.socket_path = os.path.join(self.workdir, "handoff.sock")
+        self.systems = []
+
+    def tearDown(self):
+        for system in self.systems: system.stop()
+        self.patcher.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _start(self, handoff_from=None):
+        system = system_module.SortingSystem()
+        system.external_frames = True
+        system.job_triggers_enabled = False
+        system.system_state["vps_config"] = {"url": ""}
+        system.handoff_socket = self.socket_path
+        system.handoff_from = handoff_from
+        system.handoff_exit = lambda: None
+        self.systems.append(system)
+        threading.Thread(target=system.run, daemon=True).start()
+        self.assertTrue(system.handoff_done.wait(5.0))
+        return system
+
+    def test_state_and_relays_survive_handoff(self):
+        old = self._start()
+        deadline = time.time() + 5
+        while old.handoff_server is None and time.time() < deadline: time.sleep(0.05)
+        for i, lane in enumerate((1, 0, 2)):
+            old.push_job({"job_id": f"j{i}", "lane_index": lane, "status": "QR_MATCHED", "entry_time": time.time()})
+        with old.state_lock: old.system_state["lanes"][1]["count"] = 5
+        on = old.gpio.LOW if system_module.ACTIVE_LOW else old.gpio.HIGH
+        old.gpio.output(13, on)  # Làn B đang đẩy lúc chuyển giao
+
+        new = self._start(handoff_from=self.socket_path)
+        self.assertTrue(new.main_loop_running)
+        self.assertTrue(new.owns_gpio)
+        self.assertEqual([j["job_id"] for j in new.processing_queue], ["j0", "j1", "j2"])
+        with new.state_lock:
+            self.assertEqual(new.system_state["lanes"][1]["count"], 5)
+            self.assertEqual(new.system_state["queue_indices"], [1, 0, 2])
+        self.assertEqual(new.gpio.input(13), on)
+        self.assertIn("handoff_window", new.startup_timings)
+
+        deadline = time.time() + 5
+        while old.main_loop_running and time.time() < deadline: time.sleep(0.05)
+        self.assertFalse(old.main_loop_running)
+        self.assertFalse(old.owns_gpio)
+        while new.handoff_server is None and time.time() < deadline: time.sleep(0.05)
+        self.assertTrue(os.path.exists(self.socket_path))  # Socket của tiến trình mới không bị xóa
+
+    def test_no_running_process_starts_normally(self):
+        system = self._start(handoff_from=self.socket_path)
+        self.assertTrue(system.main_loop_running)
+        self.assertTrue(system.owns_gpio)
+        self.assertNotIn("handoff_window", system.startup_timings)
+
+    def test_aborted_handoff_keeps_sort_counter_and_conveyor_restart(self):
+        system = self._start()
+        with mock.patch.object(system, "log_sort_event", side_effect=RuntimeError("db")):
+            with self.assertRaises(RuntimeError):
+                system.sorting_process(2, "j0", {"job_id": "j0", "lane_index": 2, "status": "NG"})
+        self.assertEqual(system.active_sorts, 0)
+
+        system.freeze_for_handoff()
+        with mock.patch.object(system, "CONVEYOR_RUN") as conveyor_run:
+            system.restart_conveyor_after_delay(0)
+            conveyor_run.assert_not_called()  # Đang chuyển giao: để tiến trình mới chạy lại
+            system.resume_after_handoff()  # Tiến trình mới bỏ dở
+            conveyor_run.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# tests/test_journal.py
+import os
+import tempfile
+import unittest
+from core.journal import QueueJournal
+
+class TestQueueJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.qr_queue, self.processing_queue = [], []
+        self.journal = self._new_journal()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _new_journal(self):
+        journal = QueueJournal(os.path.join(self.tmpdir.name, "queue_journal.log"),
+                               os.path.join(self.tmpdir.name, "queue_snapshot.json"), fsync_interval=0.0)
+        journal.snapshot_provider = lambda: (list(self.qr_queue), list(self.processing_queue), journal.seq)
+        return journal
+
+    def _push_job(self, job_id, lane):
+        job = {"job_id": job_id, "lane_index": lane}
+        self.processing_queue.append(job); self.journal.record("job_push", job=job)
+
+    def test_replay_without_clean_shutdown(self):
+        self._push_job("a", 0); self._push_job("b", 1); self._push_job("c", 2)
+        self.qr_queue.append(1); self.journal.record("qr_push", lane=1)
+        self.processing_queue.pop(1); self.journal.record("job_pop", job_id="b", reason="match")
+        self.journal.sync() # Mất điện ngay sau lần fsync này
+
+        qr_queue, processing_queue = self._new_journal().replay()
+        self.assertEqual(qr_queue, [1])
+        self.assertEqual([j["job_id"] for j in processing_queue], ["a", "c"])
+
+    def test_compaction_keeps_state_and_truncates(self):
+        for i in range(5): self._push_job(f"j{i}", i % 3)
+        self.processing_queue.clear(); self.journal.record("job_reset")
+        self._push_job("after", 1)
+        self.journal.compact()
+        with open(self.journal.journal_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "")
+
+        self._push_job("tail", 2)
+        self.journal.sync()
+        journal = self._new_journal()
+        _, processing_queue = journal.replay()
+        self.assertEqual([j["job_id"] for j in processing_queue], ["after", "tail"])
+        self.assertEqual(journal.seq, self.journal.seq)
+
+    def test_torn_last_line_is_ignored(self):
+        self._push_job("a", 0); self.journal.sync()
+        with open(self.journal.journal_path, "a", encoding="utf-8") as f:
+            f.write('{"s": 2, "op": "job_pu')
+        _, processing_queue = self._new_journal().replay()
+        self.assertEqual([j["job_id"] for j in processing_queue], ["a"])
+
+    def test_lane_remap_is_replayed(self):
+        self._push_job("a", 0); self._push_job("b", 2); self._push_job("ng", 3)
+        self.journal.record("qr_push", lane=1)
+        self.journal.record("lane_remap", map=[1, 0, 3, 2], ng=2) # Đổi chỗ A/B, NG lên trước C
+        self.journal.sync()
+        qr_queue, processing_queue = self._new_journal().replay()
+        self.assertEqual(qr_queue, [0])
+        self.assertEqual([j["lane_index"] for j in processing_queue], [1, 3, 2])
+
+if __name__ == "__main__":
+    unittest.main()
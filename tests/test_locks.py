@@ -0,0 +1,56 @@
+import time
+import threading
+import unittest
+from unittest import mock
+
+from core import locks
+from core.locks import InstrumentedLock, lock_report
+
+
+class TestInstrumentedLock(unittest.TestCase):
+    def test_records_wait_and_hold(self):
+        lock = InstrumentedLock("test_lock")
+        holding = threading.Event()
+
+        def holder():
+            with lock:
+                holding.set(); time.sleep(0.05)
+
+        t = threading.Thread(target=holder, name="HolderThread"); t.start()
+        holding.wait(1.0)
+        with lock: pass # Phải chờ HolderThread nhả khóa
+        t.join()
+
+        report = lock.report()
+        self.assertEqual(report["acquisitions"], 2)
+        self.assertEqual(report["contended"], 1)
+        self.assertEqual(report["hold_max_thread"], "HolderThread")
+        self.assertGreaterEqual(report["hold_max_ms"], 40)
+        self.assertEqual(report["wait_max_thread"], threading.current_thread().name)
+        self.assertGreaterEqual(report["wait_max_ms"], 20)
+        self.assertIsNone(report["holder"])
+
+    def test_non_blocking_failure_and_reset(self):
+        lock = InstrumentedLock("test_lock_2")
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.locked())
+        self.assertEqual(lock.report()["holder"], threading.current_thread().name)
+        result = []
+        t = threading.Thread(target=lambda: result.append(lock.acquire(blocking=False))); t.start(); t.join()
+        self.assertEqual(result, [False])
+        lock.release()
+        rows = lock_report({"a": lock, "b": threading.Lock()}, reset=True)["locks"]
+        self.assertEqual([r["failed"] for r in rows], [1])
+        self.assertEqual(lock.report()["acquisitions"], 0)
+
+    def test_histograms_observed_after_release(self):
+        lock = InstrumentedLock("test_lock_3")
+        seen = []
+        record = lambda value, **labels: seen.append((labels["lock"], lock.locked()))
+        with mock.patch.object(locks.LOCK_WAIT, "observe", record), mock.patch.object(locks.LOCK_HOLD, "observe", record):
+            with lock: self.assertEqual(seen, []) # Chưa ghi gì khi đang giữ khóa
+        self.assertEqual(seen, [("test_lock_3", False), ("test_lock_3", False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import queue
+import logging
+import unittest
+
+from core.logging_setup import RATE_LIMITED, DropCountingQueueHandler, RateLimitFilter
+
+
+class TestLoggingPipeline(unittest.TestCase):
+    def _make_logger(self, handler):
+        logger = logging.getLogger(f"test_logging_setup.{id(handler)}")
+        logger.propagate = False
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+        return logger
+
+    def test_enqueue_is_lazy_and_counts_drops(self):
+        q = queue.Queue(maxsize=2)
+        handler = DropCountingQueueHandler(q)
+        logger = self._make_logger(handler)
+        for i in range(5):
+            logger.info("[TEST] job %d", i)
+        self.assertEqual(handler.dropped, 3)
+        record = q.get_nowait()
+        self.assertEqual(record.msg, "[TEST] job %d") # Chưa format ở luồng gọi
+        self.assertEqual(record.getMessage(), "[TEST] job 0")
+
+    def test_rate_limit_collapses_repeated_warnings(self):
+        q = queue.Queue()
+        handler = DropCountingQueueHandler(q)
+        rate_filter = RateLimitFilter(interval=60.0)
+        handler.addFilter(rate_filter)
+        logger = self._make_logger(handler)
+        for i in range(10):
+            logger.warning("[QR_SCAN] Không rõ mã QR: %s", f"code{i}", extra=RATE_LIMITED)
+        logger.warning("[CAMERA] Mất camera (lần %d)", 1, extra=RATE_LIMITED)
+        logger.error("[ERR] %d", 1, extra=RATE_LIMITED); logger.error("[ERR] %d", 2, extra=RATE_LIMITED)
+        for i in range(3):
+            logger.warning("[JobID %s] TIMEOUT! Xóa Job cho %s", f"j{i}", "A") # Log theo Job: không gộp
+        self.assertEqual(q.qsize(), 7) # 1 QR + 1 camera + 2 error + 3 Job
+        self.assertEqual(rate_filter.suppressed_total, 9)
+        for _ in range(q.qsize()): q.get_nowait()
+
+        # Hết cửa sổ -> lần ghi kế tiếp mang số lần bị gộp
+        rate_filter._last_emit.clear()
+        logger.warning("[QR_SCAN] Không rõ mã QR: %s", "x", extra=RATE_LIMITED)
+        self.assertIn("đã gộp 9 lần", q.get_nowait().getMessage())
+
+
+if __name__ == '__main__':
+    unittest.main()
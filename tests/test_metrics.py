@@ -0,0 +1,36 @@
+import unittest
+
+from core.metrics import MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry(prefix="test")
+        self.hist = self.registry.histogram("latency_seconds", "test", labelnames=("stage", "lane"),
+                                            buckets=(0.01, 0.1, 1.0))
+        self.counter = self.registry.counter("jobs_total", "test", labelnames=("source",))
+
+    def test_histogram_buckets_and_summary(self):
+        for v in (0.005, 0.05, 0.05, 0.5, 5.0):
+            self.hist.observe(v, stage="decode", lane="A")
+        self.hist.observe(-1, stage="decode", lane="A") # Bỏ qua giá trị âm
+        row = self.registry.summary()["histograms"]["latency_seconds"][0]
+        self.assertEqual((row["stage"], row["lane"], row["count"]), ("decode", "A", 5))
+        self.assertEqual(row["max_ms"], 5000.0)
+        self.assertTrue(10.0 <= row["p50_ms"] <= 100.0)
+        self.assertLessEqual(row["p99_ms"], row["max_ms"])
+
+    def test_prometheus_text(self):
+        self.hist.observe(0.05, stage="sort", lane='La"ne')
+        self.counter.inc(source="QR"); self.counter.inc(2, source="QR")
+        text = self.registry.render_prometheus()
+        self.assertIn("# TYPE test_latency_seconds histogram", text)
+        self.assertIn('test_latency_seconds_bucket{stage="sort",lane="La\\"ne",le="0.01"} 0', text)
+        self.assertIn('test_latency_seconds_bucket{stage="sort",lane="La\\"ne",le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{stage="sort",lane="La\\"ne",le="+Inf"} 1', text)
+        self.assertIn('test_latency_seconds_count{stage="sort",lane="La\\"ne"} 1', text)
+        self.assertIn('test_jobs_total{source="QR"} 3', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import threading
+import unittest
+from types import SimpleNamespace
+
+from bench.common import latency_summary
+from bench.pipeline_bench import _attribute
+from core.simulator import Parcel
+
+NG = 2
+
+
+class TestPipelineAttribution(unittest.TestCase):
+    def _sim(self, parcels):
+        lanes = [{"sensor_pin": 5, "push_pin": 11}, {"sensor_pin": 16, "push_pin": 13}, {}]
+        system = SimpleNamespace(state_lock=threading.Lock(), system_state={"lanes": lanes})
+        return SimpleNamespace(system=system, parcels=parcels, ng_index=NG)
+
+    def test_edge_job_and_relay_matching(self):
+        p0 = Parcel(0, 0, "SP001", 10.0); p0.first_frame_ts = 10.0; p0.windows = {0: (12.0, 12.5)}
+        p1 = Parcel(1, 1, "SP002", 11.0); p1.first_frame_ts = 11.0; p1.windows = {0: (13.0, 13.5), 1: (14.0, 14.5)}
+        p2 = Parcel(2, 0, "SP001", 15.0); p2.first_frame_ts = 15.0; p2.windows = {0: (17.0, 17.5)} # Không có Job
+        recorder = SimpleNamespace(
+            inputs=[(12.0, 5, 0), (12.001, 5, 1), (12.002, 5, 0), (14.0, 16, 0), (17.0, 5, 0)],
+            outputs=[(12.21, 12, 1), (12.215, 11, 0), (14.25, 13, 0)],
+            jobs=[(10.05, 0), (11.1, 1), (18.0, 0)])
+        result = _attribute(self._sim([p0, p1, p2]), recorder, settle_delay=0.2, relay_on_value=0)
+        self.assertEqual(result["dropped"], {"no_job": 1, "no_edge": 0, "no_relay": 1})
+        edge = result["latency_ms"]["edge_to_relay"]
+        self.assertEqual(edge["count"], 2)
+        self.assertAlmostEqual(edge["max"], 250.0, places=3)
+        self.assertAlmostEqual(result["latency_ms"]["overhead"]["p50"], 32.5, places=3)
+        self.assertAlmostEqual(result["latency_ms"]["qr_to_job"]["max"], 100.0, places=3)
+
+    def test_latency_summary_empty(self):
+        self.assertEqual(latency_summary([])["count"], 0)
+        self.assertEqual(latency_summary([0.001, 0.003])["p50"], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+
+from core import qr
+from bench.common import percentile
+from bench.qr_bench import compare, generate_corpus, run_bench
+
+
+class TestQRBench(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = tempfile.mkdtemp()
+        generate_corpus(cls.corpus, per_variant=1, seed=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.corpus)
+
+    def test_report_shape_and_labels(self):
+        result = run_bench(self.corpus, backends=["pipeline", "CV2"], repeats=1)
+        self.assertEqual(result["meta"]["frames"], 9)
+        pipeline = result["backends"]["pipeline"]
+        self.assertEqual(pipeline["by_tag"]["clean"]["decode_rate"], 1.0)
+        self.assertEqual(pipeline["by_tag"]["empty"]["false_reads"], 0)
+        self.assertIsNone(pipeline["by_tag"]["empty"]["decode_rate"])
+        self.assertLessEqual(pipeline["latency_ms"]["p50"], pipeline["latency_ms"]["max"])
+        self.assertTrue(compare(result, result)[0].startswith("pipeline: decode_rate"))
+
+    def test_registered_backend_is_benchmarked_and_used(self):
+        qr.register_decoder("Fake", lambda gray: "SP999", first=True)
+        try:
+            result = run_bench(self.corpus, backends=["Fake"], repeats=1)
+            self.assertEqual(result["backends"]["Fake"]["decoded"], 0)
+            self.assertEqual(result["backends"]["Fake"]["false_reads"], 9)
+            self.assertEqual(qr.scan_qr_from_frame(qr.render_qr_frame("SP001")), ("SP999", "Fake"))
+        finally:
+            del qr.DECODER_BACKENDS["Fake"]; qr.DECODE_ORDER.remove("Fake")
+
+    def test_percentile(self):
+        self.assertEqual(percentile([1.0, 2.0, 3.0, 4.0], 0.5), 2.5)
+        self.assertIsNone(percentile([], 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from core import system as system_module
+
+LANES = [
+    {"id": "A", "name": "Loại A", "sensor_pin": 5, "push_pin": 11, "pull_pin": 12},
+    {"id": "B", "name": "Loại B", "sensor_pin": 16, "push_pin": 13, "pull_pin": 8},
+    {"id": "C", "name": "Loại C", "sensor_pin": 18, "push_pin": 15, "pull_pin": 7},
+    {"id": "NG", "name": "NG", "sensor_pin": None, "push_pin": None, "pull_pin": None},
+]
+
+
+class TestLiveReconfig(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # core.system đã được import (đường dẫn cố định lúc import) -> trỏ config/CSDL/journal vào thư mục tạm
+        cls.workdir = tempfile.mkdtemp()
+        paths = {name: os.path.join(cls.workdir, os.path.basename(getattr(system_module, name))) for name in (
+            "CONFIG_FILE", "DATABASE_FILE", "QUEUE_STATE_FILE", "QUEUE_JOURNAL_FILE", "QUEUE_SNAPSHOT_FILE")}
+        cls.patcher = mock.patch.multiple(system_module, LOG_DIR=cls.workdir, **paths)
+        cls.patcher.start()
+        with open(paths["CONFIG_FILE"], "w", encoding="utf-8") as f:
+            json.dump({"lanes_config": LANES, "timing_config": {"use_sensor_entry_gantry": False}}, f)
+        cls.system = system_module.SortingSystem()
+        cls.system.external_frames = True
+        cls.system.job_triggers_enabled = False
+        cls.system.system_state["vps_config"] = {"url": ""}
+        threading.Thread(target=cls.system.run, daemon=True).start()
+        time.sleep(1.0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.system.stop()
+        cls.patcher.stop()
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def test_lanes_swap_remaps_queue(self):
+        system = self.system
+        for i, lane in enumerate((0, 2, 1, 3)):
+            system.push_job({"job_id": f"j{i}", "lane_index": lane, "status": "QR_MATCHED", "entry_time": time.time()})
+        with system.state_lock: system.system_state["lanes"][2]["count"] = 7
+
+        # Đổi chỗ A/C, bỏ B, thêm D (chân mới), NG giữ cuối
+        new_lanes = [LANES[2], LANES[0], {"id": "D", "name": "Loại D", "sensor_pin": 22, "push_pin": 29, "pull_pin": 31}, LANES[3]]
+        body, status = system.update_config({"lanes_config": new_lanes})
+        self.assertEqual(status, 200)
+        self.assertFalse(body["restart_required"])
+        self.assertIn("lanes", body["applied"])
+
+        with system.processing_queue_lock:
+            self.assertEqual([j["lane_index"] for j in system.processing_queue], [1, 0, 3, 3])
+            system.processing_queue.clear()
+        self.assertEqual(system.NG_LANE_INDEX, 3)
+        with system.state_lock:
+            lanes = system.system_state["lanes"]
+            self.assertEqual([ln["id"] for ln in lanes], ["C", "A", "D", "NG"])
+            self.assertEqual(lanes[0]["count"], 7)
+            self.assertEqual(system.system_state["queue_indices"], [1, 0, 3, 3])
+        self.assertIn(22, system.SENSOR_PINS); self.assertNotIn(16, system.SENSOR_PINS)
+        on, off = (system.gpio.LOW, system.gpio.HIGH) if system_module.ACTIVE_LOW else (system.gpio.HIGH, system.gpio.LOW)
+        self.assertEqual(system.gpio.input(31), on)  # Thu của làn mới về mặc định
+        self.assertEqual(system.gpio.input(8), off)  # Relay của làn B bị bỏ được nhả
+
+    def test_lanes_swap_waits_for_active_sorts(self):
+        system = self.system
+        with system.state_lock: system.active_sorts += 1; version = system.lanes_version
+        try:
+            with self.assertRaises(RuntimeError): system._apply_lanes_config(LANES, timeout=0.05)
+            result = []
+            t = threading.Thread(target=lambda: result.append(system.update_config({"lanes_config": LANES}))); t.start()
+            time.sleep(0.2)
+            self.assertEqual(system.lanes_version, version)  # Chu trình đẩy đang dùng lane_index theo bảng cũ
+        finally:
+            with system.state_lock: system.active_sorts -= 1
+        t.join(5)
+        self.assertEqual(result[0][1], 200)
+        self.assertEqual(system.lanes_version, version + 1)
+
+    def test_trigger_switch_waits_for_stuck_thread(self):
+        system = self.system
+        release = threading.Event()
+        stuck = threading.Thread(target=release.wait, args=(5,), name="OldTriggerThread", daemon=True); stuck.start()
+        with mock.patch.object(system, "_start_job_triggers") as start:
+            with system.reconfig_lock:
+                system.trigger_threads = [stuck]
+                system._switch_trigger_mode(False, timeout=0.05)
+            start.assert_not_called()  # Luồng cũ còn chạy -> chưa khởi động luồng mới
+            self.assertEqual(system.trigger_threads, [stuck])
+            release.set()
+            deadline = time.time() + 5
+            while not start.called and time.time() < deadline: time.sleep(0.01)
+            start.assert_called_once_with(False)
+        self.assertEqual(system.trigger_threads, [])
+
+    def test_trigger_mode_and_camera_restart(self):
+        system = self.system
+        system.job_triggers_enabled = True
+        try:
+            body, _ = system.update_config({"timing_config": {"use_sensor_entry_gantry": True}})
+            self.assertIn("trigger_mode", body["applied"])
+            self.assertEqual(sorted(t.name for t in system.trigger_threads), ["GantryTriggerThread", "QRScannerThread"])
+            old_threads = list(system.trigger_threads)
+
+            system.update_config({"timing_config": {"use_sensor_entry_gantry": False}})
+            self.assertEqual([t.name for t in system.trigger_threads], ["CameraTriggerThread"])
+            self.assertFalse(any(t.is_alive() for t in old_threads))
+        finally:
+            system.job_triggers_enabled = False
+            system.update_config({"timing_config": {"use_sensor_entry_gantry": True}})
+
+        generation = system.camera_generation
+        body, _ = system.update_config({"camera_settings": {"brightness": 90}})
+        self.assertIn("camera", body["applied"])
+        deadline = time.time() + 5
+        while system.camera_generation == generation and time.time() < deadline: time.sleep(0.05)
+        self.assertEqual(system.camera_generation, generation + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
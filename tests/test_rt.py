@@ -0,0 +1,33 @@
+import gc
+import unittest
+
+from core import rt
+
+
+class TestRuntimeProfile(unittest.TestCase):
+    def test_disabled_profile_is_noop(self):
+        status = rt.apply_process_profile({"rt_enabled": False})
+        self.assertFalse(status["enabled"])
+        rt.enter_control_thread("lane_monitor") # Không làm gì khi tắt
+        rt.finish_startup({"rt_enabled": False})
+        self.assertEqual(rt.profile_status()["gc_frozen"], 0)
+
+    def test_timed_sleep_records_wake_delay(self):
+        count = lambda: rt.LOOP_WAKE.snapshot().get(("test_loop",), (0, 0, 0))[2] # Chỉ nhãn của test (luồng nền của test khác cũng ghi)
+        before = count()
+        rt.timed_sleep(0.001, "test_loop")
+        self.assertEqual(count(), before + 1)
+
+    def test_gc_monitor_records_pause(self):
+        rt.install_gc_monitor(); rt.install_gc_monitor()
+        self.assertEqual(gc.callbacks.count(rt._on_gc), 1)
+        gc.collect()
+        self.assertIn(("2",), rt.GC_PAUSE.snapshot())
+
+    def test_split_cpus(self):
+        control, other = rt._split_cpus({"rt_control_cpus": [999]}) # CPU không tồn tại bị bỏ qua
+        self.assertEqual(control, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
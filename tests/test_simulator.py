@@ -0,0 +1,58 @@
+import unittest
+
+from core.gpio import MockGPIO
+from core.simulator import Parcel, evaluate
+
+NG = 3
+
+
+def make_parcel(pid, target, windows):
+    p = Parcel(pid, target, None, 0.0)
+    p.windows = windows
+    return p
+
+
+class TestSimulatorEvaluate(unittest.TestCase):
+    def test_correct_late_wrong_and_missed(self):
+        parcels = [
+            make_parcel(0, 0, {0: (10.0, 10.5)}),                       # Đẩy đúng lúc
+            make_parcel(1, 1, {0: (12.0, 12.5), 1: (13.0, 13.5)}),      # Đẩy sau khi kiện đã qua
+            make_parcel(2, 1, {0: (15.0, 15.5), 1: (16.0, 16.5)}),      # Bị đẩy nhầm ở làn 0
+            make_parcel(3, 0, {0: (18.0, 18.5)}),                       # Không ai đẩy
+            make_parcel(4, NG, {0: (20.0, 20.5), 1: (21.0, 21.5)}),     # NG đi thẳng
+        ]
+        events = [
+            {"outcome": "sorted", "lane_index": 0, "sensor_ts": 10.02, "actuation_ts": 10.25},
+            {"outcome": "sorted", "lane_index": 1, "sensor_ts": 13.02, "actuation_ts": 13.9},
+            {"outcome": "sorted", "lane_index": 0, "sensor_ts": 15.02, "actuation_ts": 15.2},
+            {"outcome": "ng_pass", "lane_index": NG, "sensor_ts": 20.01, "actuation_ts": None},
+            {"outcome": "timeout", "lane_index": 0, "sensor_ts": None, "actuation_ts": None},
+        ]
+        report = evaluate(parcels, events, NG, push_grace=0.05)
+        self.assertEqual([p.result for p in parcels], ["correct", "late", "wrong_lane", "missed", "correct"])
+        self.assertEqual(report["timeouts"], 1)
+        self.assertFalse(report["sustainable"])
+        self.assertEqual(report["accuracy"], 0.4)
+
+    def test_pusher_collision(self):
+        parcels = [make_parcel(0, 0, {0: (1.0, 1.5)}), make_parcel(1, 0, {0: (1.3, 1.8)})]
+        events = [
+            {"outcome": "sorted", "lane_index": 0, "sensor_ts": 1.01, "actuation_ts": 1.2},
+            {"outcome": "sorted", "lane_index": 0, "sensor_ts": 1.31, "actuation_ts": 1.5},
+        ]
+        report = evaluate(parcels, events, NG, push_cycle=0.7)
+        self.assertEqual(report["pusher_collisions"], 1)
+        self.assertEqual(parcels[1].result, "late")
+
+
+class TestMockGPIOInputState(unittest.TestCase):
+    def test_set_and_toggle(self):
+        gpio = MockGPIO()
+        self.assertEqual(gpio.input(5), 1)
+        self.assertEqual(gpio.set_input_state(5, 0), 0)
+        self.assertEqual(gpio.toggle_input_state(5), 1)
+        self.assertEqual(gpio.toggle_input_state(5), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
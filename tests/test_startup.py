@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+import unittest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_core_system_skips_heavy_deps(self):
+        # cv2 / requests / ultralytics / pyzbar chỉ được nạp trong system.run() hoặc khi dùng tới
+        code = ("import sys, core.system; "
+                "print(','.join(m for m in ('cv2', 'requests', 'ultralytics', 'pyzbar') if m in sys.modules))")
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=BASE_DIR, check=True)
+        self.assertEqual(out.stdout.strip(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
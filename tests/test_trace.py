@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.trace import (KIND_JOB, KIND_SENSOR, KIND_SORT, NULL_TRACE, RECORD, TraceRecorder, compare_outcomes,
+                        expected_outcomes, open_trace, read_trace, replay_config)
+
+
+class TestTraceFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_round_trip(self):
+        rec = TraceRecorder(self.dir, {"lanes_config": [{"id": "A"}], "ng_lane_index": 1})
+        rec.sensor(5, 0); rec.sensor(5, 1)
+        rec.job({"job_id": "j1", "lane_index": 0, "status": "QR_ONLY", "source": "QR", "entry_time": 1.0})
+        rec.sort({"job_id": "j1"}, 0, "A", "sorted")
+        rec.sort({"job_id": "j2"}, 1, "NG", "la")
+        rec.close()
+
+        meta, records = read_trace(rec.path)
+        self.assertEqual(meta["ng_lane_index"], 1)
+        self.assertIn("started_at", meta)
+        self.assertEqual([r[1] for r in records], [KIND_SENSOR, KIND_SENSOR, KIND_JOB, KIND_SORT, KIND_SORT])
+        self.assertEqual(records[0][2:4], (0, 5))
+        self.assertEqual(records[2][3], 0)
+        self.assertTrue(all(a[0] <= b[0] for a, b in zip(records, records[1:])))
+        self.assertEqual([(e["job_id"], e["outcome"]) for e in expected_outcomes(records)],
+                         [("j1", "sorted"), ("j2", "unknown")])
+
+    def test_truncated_tail_is_ignored(self):
+        rec = TraceRecorder(self.dir, {})
+        rec.sensor(5, 0); rec.sensor(5, 1); rec.close()
+        with open(rec.path, "ab") as f: f.write(b"\x00" * (RECORD.size - 3))
+        self.assertEqual(len(read_trace(rec.path)[1]), 2)
+
+    def test_rotation_keeps_newest_files(self):
+        rec = TraceRecorder(self.dir, {}, max_bytes=1, keep_files=2, flush_interval=0)
+        for level in (0, 1, 0, 1): rec.sensor(5, level)
+        rec.close()
+        files = sorted(os.listdir(self.dir))
+        self.assertEqual(len(files), 2)
+        self.assertEqual(os.path.basename(rec.path), files[-1])
+
+    def test_disabled_returns_null_trace(self):
+        state = {"timing_config": {"trace_record": False}, "lanes": []}
+        self.assertIs(open_trace(self.dir, state, 1, 6), NULL_TRACE)
+        NULL_TRACE.sensor(5, 0); NULL_TRACE.job({}); NULL_TRACE.close()
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+class TestTraceReplay(unittest.TestCase):
+    def test_replay_config_scales_time_keys(self):
+        cfg = replay_config({"timing_config": {"cycle_delay": 0.3, "queue_head_timeout": 15.0, "gpio_mode": "BOARD",
+                                               "trace_record": True}, "lanes_config": [{"id": "A"}]}, 5.0)
+        self.assertAlmostEqual(cfg["timing_config"]["cycle_delay"], 0.06)
+        self.assertAlmostEqual(cfg["timing_config"]["queue_head_timeout"], 3.0)
+        self.assertEqual(cfg["timing_config"]["gpio_mode"], "BOARD")
+        self.assertFalse(cfg["timing_config"]["trace_record"])
+        self.assertEqual(cfg["lanes_config"], [{"id": "A"}])
+
+    def test_compare_outcomes(self):
+        expected = [{"t": 1.0, "job_id": "a", "lane_index": 0, "outcome": "sorted"},
+                    {"t": 2.0, "job_id": "b", "lane_index": 1, "outcome": "sorted"},
+                    {"t": 3.0, "job_id": "c", "lane_index": 0, "outcome": "timeout"}]
+        actual = [{"t": 1.01, "job_id": "a", "lane_index": 0, "outcome": "sorted"},
+                  {"t": 2.2, "job_id": "b", "lane_index": 1, "outcome": "timeout"},
+                  {"t": 4.0, "job_id": "x", "lane_index": 2, "outcome": "sorted"}]
+        result = compare_outcomes(expected, actual)
+        self.assertFalse(result["identical"])
+        self.assertEqual(result["matched"], 1)
+        self.assertEqual([m["job_id"] for m in result["mismatches"]], ["b", "c"])
+        self.assertIsNone(result["mismatches"][1]["replay"])
+        self.assertEqual([e["job_id"] for e in result["unexpected"]], ["x"])
+        self.assertAlmostEqual(result["timing_diff_ms"]["p50"], 10.0)
+
+        self.assertTrue(compare_outcomes(expected[:1], actual[:1])["identical"])
+
+
+if __name__ == "__main__":
+    unittest.main()
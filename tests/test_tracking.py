@@ -0,0 +1,127 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+from core.qr import render_qr_frame, scan_qr_in_regions
+from core.tracking import BlobSegmenter, ParcelTracker
+from threads.tracker import _classify_pending
+
+H, W = 480, 640
+
+
+def belt_frame(parcels):
+    """Băng chuyền (xám 40) với các kiện sáng tại toạ độ x (cạnh trái), cao 160, rộng 120"""
+    frame = np.full((H, W), 40, np.uint8)
+    for x in parcels:
+        frame[160:320, max(0, x):max(0, x + 120)] = 200
+    return frame
+
+
+class TestParcelTracker(unittest.TestCase):
+    def run_belt(self, positions_per_frame):
+        segmenter, tracker = BlobSegmenter(), ParcelTracker()
+        history = []
+        for ts, parcels in enumerate([[]] + positions_per_frame):
+            tracker.update(segmenter.segment(belt_frame(parcels)), (H, W), ts=float(ts))
+            history.append(tracker.at_entry())
+        return tracker, history
+
+    def test_single_parcel_keeps_id_across_entry_line(self):
+        tracker, history = self.run_belt([[x] for x in range(0, 520, 40)])
+        ids = {t.track_id for t in history if t is not None}
+        self.assertEqual(ids, {1})
+        self.assertIsNone(history[1])  # Chưa đủ n_init frame
+        entry = [i for i, t in enumerate(history) if t is not None]
+        # Vạch cổng ở x=320: kiện che vạch khi cạnh trái trong [200, 320]
+        self.assertEqual(entry[0], 1 + 200 // 40)
+        self.assertEqual(entry[-1], 1 + 320 // 40)
+        self.assertEqual(tracker.stats()["tracks_total"], 1)
+
+    def test_two_parcels_get_distinct_tracks_and_qr(self):
+        frames = [[x, x - 300] for x in range(180, 660, 40)]
+        tracker, history = self.run_belt(frames)
+        first, second = history[1 + 1], history[1 + 8]  # Kiện 1 ở x=220, kiện 2 ở x=200
+        self.assertIsNotNone(first); self.assertIsNotNone(second)
+        self.assertNotEqual(first.track_id, second.track_id)
+        self.assertIs(tracker.attach_qr("SP002"), tracker.at_entry())
+        self.assertEqual(second.qr, "SP002")
+
+    def test_classification_once_per_track(self):
+        tracker, _ = self.run_belt([[100], [120], [140]])
+        track = tracker.pending_classification()
+        self.assertIsNotNone(track)
+        tracker.set_class(track, "APPLE", 0.9)
+        self.assertIsNone(tracker.pending_classification())
+        self.assertEqual(track.ai_class, "APPLE")
+
+    def test_classification_runs_on_tracker_executor(self):
+        tracker, _ = self.run_belt([[100], [120], [140]])
+        release = threading.Event()
+
+        def classify(crop):
+            release.wait(5); return "APPLE", 0.9
+
+        executor = ThreadPoolExecutor(max_workers=1); self.addCleanup(executor.shutdown)
+        frame = np.zeros((H, W, 3), np.uint8)
+        system = SimpleNamespace(ai_detector=SimpleNamespace(enabled=True, classify=classify), tracker_executor=executor,
+                                 get_latest_frame=lambda *a, **kw: (frame, 1))
+        future = _classify_pending(system, tracker)  # Trả về ngay, YOLO vẫn đang chạy
+        self.assertFalse(future.done())
+        track = tracker.pending_classification()
+        self.assertIsNone(track.ai_class)
+        release.set(); future.result(5)
+        self.assertEqual((track.ai_class, track.ai_conf), ("APPLE", 0.9))
+        self.assertIsNone(tracker.pending_classification())
+
+    def test_qr_parcel_is_single_blob(self):
+        segmenter = BlobSegmenter()
+        segmenter.segment(np.full((H, W), 40, np.uint8))
+        boxes = segmenter.segment(render_qr_frame("SP001")[:, :, 0])
+        self.assertEqual(len(boxes), 1)
+        x, y, w, h = boxes[0]
+        self.assertAlmostEqual(w, 240, delta=8); self.assertAlmostEqual(x, 200, delta=8)
+
+
+    def test_qr_decoded_inside_tracked_region(self):
+        segmenter, tracker = BlobSegmenter(), ParcelTracker()
+        empty = np.full((H, W), 40, np.uint8)
+        frame = render_qr_frame("SP001")[:, :, 0].copy()
+        frame[160:320, 0:120] = 200  # Kiện thứ 2 (không có QR) ở mép trái
+        for gray in (empty, frame, frame): tracker.update(segmenter.segment(gray), (H, W))
+        regions = tracker.regions()
+        self.assertEqual(len(regions), 2)
+        data, source, box = scan_qr_in_regions(frame, regions)
+        self.assertEqual(data, "SP001"); self.assertIsNotNone(source)
+        track = tracker.attach_qr(data, box=box)
+        self.assertEqual(track.box, box)
+        self.assertAlmostEqual(track.box[0], 200, delta=8)
+        self.assertEqual(scan_qr_in_regions(frame, []), (None, None, None))  # Băng chuyền trống: không giải mã
+        self.assertEqual(scan_qr_in_regions(frame, None)[0], "SP001")  # Tắt tracker: quét cả frame
+
+
+    def test_regions_lead_moving_parcel_and_full_scan_periodically(self):
+        tracker, _ = self.run_belt([[100], [120], [140]])
+        x, y, w, h = tracker.tracks[1].box
+        self.assertEqual(tracker.regions(), [(x, y, w + 20, h)])  # Nới 20 px theo hướng chạy (+x)
+        tracker.full_scan_every = 3
+        results = [tracker.regions() for _ in range(6)]  # Đã gọi 1 lần ở trên
+        self.assertEqual([r is None for r in results], [False, True, False, False, True, False])
+
+        empty = ParcelTracker(full_scan_every=2)
+        self.assertEqual([empty.regions() for _ in range(4)], [[], None, [], None])  # Băng chuyền trống vẫn quét định kỳ
+
+    def test_parcel_in_first_frame_heals_background(self):
+        segmenter, tracker = BlobSegmenter(), ParcelTracker()
+        for gray in (belt_frame([260]), belt_frame([260])):
+            tracker.update(segmenter.segment(gray), (H, W)); tracker.ready = segmenter.ready
+        self.assertIsNone(tracker.regions())  # Nền chưa tin cậy -> QR quét cả frame
+        self.assertEqual(segmenter.segment(belt_frame([])), [])  # Kiện rời đi: vùng "ma" không thành kiện
+        self.assertTrue(segmenter.ready)
+        self.assertEqual(len(segmenter.segment(belt_frame([260]))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
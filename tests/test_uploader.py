@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from bench.vps_stub import VPSStub
+from core.uploader import LinkEstimator, Spool, VPSUploader
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+
+    def test_append_peek_commit_survives_reopen(self):
+        spool = Spool(self.tmpdir, segment_bytes=200)
+        spool.append([{"seq": i} for i in range(1, 11)])
+        spool.append([{"seq": 11}])
+        self.assertEqual(spool.pending, 11)
+        events, lines = spool.peek(3)
+        self.assertEqual([e["seq"] for e in events], [1, 2, 3])
+        spool.commit(lines)
+
+        reopened = Spool(self.tmpdir, segment_bytes=200)
+        self.assertEqual(reopened.pending, 8)
+        seqs = []
+        while reopened.pending:
+            events, lines = reopened.peek(4); seqs += [e["seq"] for e in events]; reopened.commit(lines)
+        self.assertEqual(seqs, list(range(4, 12)))
+        self.assertEqual([f for f in os.listdir(self.tmpdir) if f.endswith(".jsonl")], [])
+
+    def test_full_spool_drops_oldest_segment(self):
+        spool = Spool(self.tmpdir, max_bytes=300, segment_bytes=100)
+        for i in range(1, 31): spool.append([{"seq": i}])
+        self.assertGreater(spool.dropped, 0)
+        self.assertEqual(spool.pending + spool.dropped, 30)
+        events, _ = spool.peek(100)
+        self.assertEqual(events[0]["seq"], spool.dropped + 1)
+
+
+class TestVPSUploader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        self.stub = VPSStub(api_key="k").start()
+        self.addCleanup(self.stub.stop)
+        self.state = {"lanes": [{"count": 0}], "maintenance_mode": False}
+        self.frame = np.full((48, 64, 3), 40, np.uint8)
+        self.uploader = VPSUploader(self.stub.url, "k", os.path.join(self.tmpdir, "spool"), lambda: dict(self.state),
+                                    lambda: self.frame, frame_max_fps=0, catchup_batch=2, timeout=1.0)
+        import requests
+        self.uploader.session = requests.Session()
+
+    def test_state_deltas_and_sort_events(self):
+        up = self.uploader
+        up._queue_state_delta(); up.flush()
+        self.assertEqual(self.stub.requests[0]["state"], self.state)  # Snapshot đầy đủ ở POST đầu
+
+        up._queue_state_delta(); up.flush()  # Không đổi gì -> không POST
+        self.assertEqual(len(self.stub.requests), 1)
+
+        self.state = {**self.state, "maintenance_mode": True}
+        up._queue_state_delta(); up.flush()
+        self.assertEqual(self.stub.events_of("state")[-1]["data"], {"maintenance_mode": True})
+        self.assertIsNone(self.stub.requests[-1]["state"])
+
+        up.on_sort({"job_id": "J1", "status": "SP001"}, 0, "Lane A", "success", 1.0); up.flush()
+        self.assertEqual(self.stub.events_of("sort")[0]["data"]["job_id"], "J1")
+        self.assertTrue(up._frame_due)  # Làn frame sẽ gửi frame kèm sự kiện sort
+
+    def test_frame_sent_on_change_or_sort_only(self):
+        up = self.uploader
+        self.assertIsNotNone(up._frame_payload(False))
+        self.assertIsNone(up._frame_payload(False))  # Không đổi
+        self.assertIsNotNone(up._frame_payload(True))  # Sự kiện sort
+        self.frame = np.full((48, 64, 3), 200, np.uint8)
+        self.assertIsNotNone(up._frame_payload(False))
+
+    def test_outage_spools_then_catches_up_in_order(self):
+        up = self.uploader
+        up._queue_state_delta(); up.flush()
+        self.stub.fail = True
+        for i in range(5): up.push_event("sort", {"n": i}); up.flush(); up._retry_at = 0
+        self.assertFalse(up.online)
+        self.assertEqual(up.spool.pending, 5)
+        self.assertEqual(self.stub.events_of("sort"), [])
+
+        self.stub.fail = False
+        up.push_event("sort", {"n": 5}); up.flush()
+        self.assertTrue(up.online)
+        self.assertEqual(up.spool.pending, 0)
+        self.assertEqual([e["data"]["n"] for e in self.stub.events_of("sort")], list(range(6)))
+        catchup = self.stub.requests[1:]
+        self.assertEqual([len(r["events"]) for r in catchup], [2, 2, 2])  # Sự kiện mới vào spool sau sự kiện cũ, gửi theo lô 2
+        self.assertEqual(catchup[0]["state"], self.state)  # Snapshot lại sau khi nối lại
+
+    def test_restart_with_spool_is_not_deduplicated_away(self):
+        self.stub.fail = True
+        self.uploader.push_event("sort", {"run": 1}); self.uploader.flush()
+        self.assertEqual(self.uploader.spool.pending, 1)
+        self.stub.fail = False
+
+        restarted = VPSUploader(self.stub.url, "k", os.path.join(self.tmpdir, "spool"), lambda: dict(self.state),
+                                frame_max_fps=0, timeout=1.0, session=self.uploader.session)
+        restarted.push_event("sort", {"run": 2}); restarted.flush()  # Cùng seq = 1 với sự kiện trong spool
+        self.assertEqual([e["data"]["run"] for e in self.stub.events_of("sort")], [1, 2])
+
+
+class TestPipelinedUploads(unittest.TestCase):
+    def test_link_estimator_backs_off_and_recovers(self):
+        link = LinkEstimator(max_fps=2.0, quality=70)
+
+        def post(nbytes, rtt, ok=True, frame=False):
+            link.begin(); link.end(nbytes, rtt, ok, nbytes if frame else 0)
+
+        # Mạng 1 Mbps (125 KB/s), RTT nền 50ms: frame 25 KB x 2 fps = 400 kbps -> không phải nghẽn
+        for _ in range(20): post(500, 0.05); post(25000, 0.05 + 25000 / 125000, frame=True)
+        self.assertEqual((link.quality, link.fps), (70, 2.0))
+        self.assertAlmostEqual(link.status()["bandwidth_kbps"], 1000, delta=1)
+        for _ in range(3): post(25000, 0.6, frame=True)  # Hàng đợi mạng đầy
+        self.assertEqual((link.quality, link.fps), (40, 2.0))  # Giảm chất lượng trước
+        for _ in range(2): post(25000, 3.0, ok=False, frame=True)
+        self.assertEqual(link.quality, 30); self.assertLess(link.fps, 2.0)
+        for _ in range(40): post(25000, 0.25, frame=True)
+        self.assertEqual((link.quality, link.fps), (70, 2.0))
+        self.assertEqual(link.in_flight, 0)
+        self.assertEqual(link.status()["rtt_last_ms"], 250.0)
+
+    def test_slow_vps_keeps_requests_in_flight_with_newest_frame(self):
+        tmpdir = tempfile.mkdtemp(); self.addCleanup(shutil.rmtree, tmpdir, True)
+        stub = VPSStub().start(); self.addCleanup(stub.stop)
+        stub.delay = 0.15
+        grabbed = []
+
+        def get_frame():
+            grabbed.append(len(grabbed))
+            return np.full((48, 64, 3), 40 if len(grabbed) % 2 else 200, np.uint8)  # Luôn đổi
+
+        up = VPSUploader(stub.url, "k", tmpdir, lambda: {"n": 1}, get_frame, frame_max_fps=20, max_in_flight=3)
+        running = [True]
+        thread = threading.Thread(target=up.run, args=(lambda: running[0],), daemon=True); thread.start()
+        peak, pushed, deadline = 0, 0, time.monotonic() + 5.0
+        while time.monotonic() < deadline and (peak < 2 or pushed < 20):
+            peak = max(peak, up.link.in_flight); up.push_event("sort", {}); pushed += 1; time.sleep(0.01)
+        running[0] = False; thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertGreaterEqual(peak, 2)
+        self.assertLessEqual(peak, 3)
+        self.assertEqual(up.status()["frames_sent"], len(grabbed))  # Mỗi frame lấy ra được gửi ngay, không xếp hàng
+        self.assertGreaterEqual(up.status()["rtt_min_ms"], 150)
+        spooled, _ = up.spool.peek(10 ** 6)
+        self.assertEqual(len(stub.events_of("sort")) + sum(e["type"] == "sort" for e in spooled), pushed)  # Không mất sự kiện
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from bench.ws_bench import parse_histogram, tick_summary
+from core.metrics import LOOP_TICK_BUCKETS, MetricsRegistry
+
+
+class TestWSBenchMetrics(unittest.TestCase):
+    def test_tick_histogram_delta_from_prometheus_text(self):
+        registry = MetricsRegistry(prefix="t")
+        tick = registry.histogram("loop_tick_seconds", "", labelnames=("loop",), buckets=LOOP_TICK_BUCKETS)
+        for _ in range(10): tick.observe(0.0002, loop="lane_monitor")
+        tick.observe(0.5, loop="other")
+        before = parse_histogram(registry.render_prometheus(), "t_loop_tick_seconds", 'loop="lane_monitor"')
+        self.assertEqual(before[0], LOOP_TICK_BUCKETS)
+        self.assertEqual(sum(before[1]), 10)
+
+        for _ in range(98): tick.observe(0.0002, loop="lane_monitor")
+        tick.observe(0.03, loop="lane_monitor"); tick.observe(0.2, loop="lane_monitor")
+        after = parse_histogram(registry.render_prometheus(), "t_loop_tick_seconds", 'loop="lane_monitor"')
+        summary = tick_summary(before, after)
+        self.assertEqual(summary["count"], 100)
+        self.assertEqual(summary["over_10ms"], 2)
+        self.assertEqual(summary["over_50ms"], 1)
+        self.assertLessEqual(summary["p50_ms"], 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,14 @@
 import json
 import time
 import logging
+from core.metrics import METRICS
+
+PERF_REFRESH_INTERVAL = 5.0 # Tóm tắt hiệu năng chỉ làm mới mỗi 5s (tránh state đổi liên tục)
 
 def start_broadcast_state_thread(system):
     """Gửi state tới WS (Lấy từ app_god.py)"""
     last_state_str = ""
+    perf_summary = None; last_perf_time = 0.0
     while system.main_loop_running:
         try:
             state_copy = system.get_full_state()
@@ -14,8 +18,15 @@ def start_broadcast_state_thread(system):
             
             # Thêm trạng thái auth (do web/app.py quản lý)
             state_copy["auth_enabled"] = system.system_state.get("auth_enabled", False)
+
+            # Độ trễ từng chặng pipeline (p50/p99 theo lane/source)
+            if time.time() - last_perf_time >= PERF_REFRESH_INTERVAL:
+                perf_summary = METRICS.summary()["histograms"].get("stage_latency_seconds", [])
+                last_perf_time = time.time()
+            state_copy["perf"] = perf_summary
                 
-            current_msg = json.dumps({"type": "state_update", "state": state_copy})
+            # So sánh theo nội dung state; `ts` (lúc gửi) chỉ gắn khi state thực sự đổi
+            current_state_str = json.dumps(state_copy)
             
             clients_to_send = []
             with system.ws_lock: clients_to_send = list(system.ws_clients)
@@ -23,13 +34,14 @@ def start_broadcast_state_thread(system):
             if not clients_to_send:
                 time.sleep(0.5); continue
 
-            if current_msg != last_state_str:
+            if current_state_str != last_state_str:
+                current_msg = '{"type": "state_update", "ts": %.6f, "state": %s}' % (time.time(), current_state_str)
                 with system.broadcast_lock:
                     for client in clients_to_send:
                         try: client.send(current_msg)
                         except Exception: 
                             system.remove_ws_client(client) # Xóa client hỏng
-                last_state_str = current_msg
+                last_state_str = current_state_str
             
             time.sleep(0.5) # Tần suất cập nhật state
             
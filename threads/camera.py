@@ -1,82 +1,468 @@
 # pi/threads/camera.py
+import os
+import sys
 import cv2
+import json
 import time
 import logging
+import argparse
+import numpy as np
+from typing import List, Optional, Tuple
+from core.metrics import observe_stage, FRAMES_TOTAL
+from core.frames import CapturedFrame, PIXEL_FORMATS
+from core.qr import render_qr_frame
+from core.logging_setup import RATE_LIMITED
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+# ===========================================
+# NGUỒN FRAME
+# ===========================================
+# Mọi nguồn có cùng giao diện: open() -> bool, read() -> (ok, frame), release().
+# `fps`: tốc độ gốc của nguồn phát lại (None = camera thật, tự giới hạn bởi phần cứng).
+# `eof`: True khi nguồn phát lại đã hết (không lặp) - luồng camera dừng êm, không vào bảo trì.
+# `pixel_format`: định dạng của frame read() trả về (xem core/frames.py), `frame_size`: (h, w) cho YUYV thô.
+
+class FrameSource:
+    kind = "base"
+    fps: Optional[float] = None
+    pixel_format = "bgr"
+    frame_size = None
+
+    def __init__(self):
+        self.eof = False
+
+    def open(self) -> bool:
+        return True
+
+    def read(self) -> Tuple[bool, Optional[object]]:
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def reopen(self) -> bool:
+        self.release(); time.sleep(1)
+        return self.open()
+
+    def describe(self) -> str:
+        return self.kind
+
+    def capture(self) -> Tuple[bool, Optional[CapturedFrame]]:
+        """read() gói vào CapturedFrame (chuyển xám / màu lười, dùng chung giữa các consumer)"""
+        ret, frame = self.read()
+        if not ret: return ret, None
+        return True, CapturedFrame(frame, self.pixel_format, self.frame_size)
+
+
+class V4L2Source(FrameSource):
+    """Camera thật (cv2.VideoCapture theo index)"""
+    kind = "v4l2"
+
+    def __init__(self, camera_index=0, cam_settings: Optional[dict] = None):
+        super().__init__()
+        self.camera_index = camera_index
+        self.cam_settings = cam_settings or {}
+        self.camera = None
+        self.pixel_format = "bgr"
+
+    def open(self) -> bool:
+        cam_settings = self.cam_settings
+        self.camera = camera = cv2.VideoCapture(self.camera_index)
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, int(cam_settings.get('frame_width', 640)))
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, int(cam_settings.get('frame_height', 480)))
+        camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._set_pixel_format(cam_settings.get('pixel_format', 'bgr'))
+
+        try:
+            auto_exposure_cfg = cam_settings.get('auto_exposure', True)
+            auto_exposure_val = 1 if auto_exposure_cfg else 0
+            camera.set(cv2.CAP_PROP_AUTO_EXPOSURE, auto_exposure_val)
+            logging.info(f"[CAMERA] Đã đặt Auto Exposure: {'BẬT' if auto_exposure_val == 1 else 'TẮT'}.")
+
+            if auto_exposure_val == 0:
+                brightness_val = int(cam_settings.get('brightness', 128))
+                contrast_val = int(cam_settings.get('contrast', 32))
+                camera.set(cv2.CAP_PROP_BRIGHTNESS, brightness_val)
+                camera.set(cv2.CAP_PROP_CONTRAST, contrast_val)
+                logging.info(f"[CAMERA] Đã đặt Brightness thủ công: {brightness_val}")
+                logging.info(f"[CAMERA] Đã đặt Contrast thủ công: {contrast_val}")
+        except Exception as cam_e:
+            logging.error(f"[CAMERA] Lỗi khi cài đặt thông số camera: {cam_e}")
+        return camera.isOpened()
+
+    def _set_pixel_format(self, pixel_format):
+        """Xin V4L2 gửi YUYV / MJPEG thô (CONVERT_RGB=0). Camera / backend không hỗ trợ -> BGR như cũ"""
+        self.pixel_format = "bgr"
+        if pixel_format not in PIXEL_FORMATS:
+            logging.warning("[CAMERA] pixel_format '%s' không hợp lệ, dùng bgr.", pixel_format)
+            return
+        if pixel_format == "bgr": return
+        camera = self.camera
+        fourcc = "YUYV" if pixel_format == "yuyv" else "MJPG"
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        actual = int(camera.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, "little").decode("ascii", errors="replace")
+        if actual != fourcc or not camera.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            logging.warning("[CAMERA] Camera không nhận %s thô (đang là '%s'), dùng BGR.", fourcc, actual)
+            return
+        self.pixel_format = pixel_format
+        self.frame_size = (int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        logging.info(f"[CAMERA] Nhận frame {fourcc} thô {self.frame_size[1]}x{self.frame_size[0]} (QR đọc kênh sáng, BGR khi cần).")
+
+    def read(self):
+        ret, frame = self.camera.read()
+        if ret and self.pixel_format != "bgr" and frame.ndim == 3 and frame.shape[2] == 3:
+            # Backend bỏ qua CONVERT_RGB=0 và vẫn trả BGR
+            logging.warning("[CAMERA] Backend vẫn trả BGR dù đã xin %s thô, dùng BGR.", self.pixel_format)
+            self.pixel_format = "bgr"
+        return ret, frame
+
+    def release(self):
+        if self.camera is not None: self.camera.release()
+
+    def reopen(self) -> bool:
+        # Giữ hành vi cũ: chỉ tạo lại VideoCapture, không đặt lại thông số (trừ định dạng frame đang dùng)
+        self.release(); time.sleep(1)
+        self.camera = cv2.VideoCapture(self.camera_index)
+        if self.pixel_format != "bgr": self._set_pixel_format(self.pixel_format)
+        return self.camera.isOpened()
+
+    def describe(self) -> str:
+        return f"index {self.camera_index}"
+
+
+class VideoFileSource(FrameSource):
+    """Phát lại video đã ghi (mp4/avi...)"""
+    kind = "file"
+
+    def __init__(self, path: str, loop: bool = False):
+        super().__init__()
+        self.path = path
+        self.loop = loop
+        self._cap = None
+
+    def open(self) -> bool:
+        self.eof = False
+        self._cap = cv2.VideoCapture(self.path)
+        if not self._cap.isOpened(): return False
+        fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 30.0
+        return True
+
+    def read(self):
+        ret, frame = self._cap.read()
+        if not ret and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read()
+        if not ret: self.eof = True
+        return ret, frame
+
+    def release(self):
+        if self._cap is not None: self._cap.release()
+
+    def describe(self) -> str:
+        return f"file {self.path}"
+
+
+class ImageDirSource(FrameSource):
+    """Phát lại thư mục ảnh (sắp theo tên file)"""
+    kind = "images"
+
+    def __init__(self, path: str, fps: float = 10.0, loop: bool = False):
+        super().__init__()
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.files: List[str] = []
+        self._index = 0
+
+    def open(self) -> bool:
+        self.eof = False; self._index = 0
+        if not os.path.isdir(self.path): return False
+        self.files = sorted(os.path.join(self.path, f) for f in os.listdir(self.path)
+                            if f.lower().endswith(IMAGE_EXTENSIONS))
+        return bool(self.files)
+
+    def read(self):
+        while True:
+            if self._index >= len(self.files):
+                if not self.loop:
+                    self.eof = True
+                    return False, None
+                self._index = 0
+            path = self.files[self._index]; self._index += 1
+            frame = cv2.imread(path)
+            if frame is not None: return True, frame
+            logging.warning("[CAMERA] Bỏ qua ảnh không đọc được: %s", path)
+
+    def describe(self) -> str:
+        return f"images {self.path} ({len(self.files)} ảnh)"
+
+
+class SyntheticSource(FrameSource):
+    """
+    Frame tổng hợp: lần lượt các kiện mang QR trong `codes` (mỗi kiện `hold_frames` frame),
+    xen giữa là `gap_frames` frame băng chuyền trống. Không cần camera hay file.
+    """
+    kind = "synthetic"
+
+    def __init__(self, codes: Optional[List[str]] = None, fps: float = 30.0,
+                 hold_frames: int = 10, gap_frames: int = 10, frame_size=(480, 640)):
+        super().__init__()
+        self.codes = list(codes) if codes else ["SP001", "SP002", "SP003"]
+        self.fps = fps
+        self.hold_frames = max(1, int(hold_frames)); self.gap_frames = max(0, int(gap_frames))
+        self.frame_size = frame_size
+        self._frames = {}
+        self._index = 0
+
+    def _frame_for(self, code):
+        if code not in self._frames:
+            self._frames[code] = render_qr_frame(code, self.frame_size) if code else \
+                np.zeros(self.frame_size + (3,), np.uint8) # Băng chuyền trống
+        return self._frames[code]
+
+    def read(self):
+        period = self.hold_frames + self.gap_frames
+        code = self.codes[(self._index // period) % len(self.codes)]
+        in_view = self._index % period < self.hold_frames
+        self._index += 1
+        return True, self._frame_for(code if in_view else None).copy()
+
+    def describe(self) -> str:
+        return f"synthetic {','.join(self.codes)}"
+
+
+def parse_source_spec(spec: str) -> dict:
+    """
+    Đọc chuỗi nguồn dạng `kind[:arg]` (dùng cho APP_CAMERA_SOURCE / CLI):
+      v4l2:0 | file:/path/video.mp4 | images:/path/dir | synthetic[:SP001,SP002]
+    Chuỗi không có `kind:` -> đoán theo đường dẫn (thư mục -> images, file -> file, số -> v4l2).
+    """
+    kind, _, arg = spec.partition(":")
+    if kind not in ("v4l2", "file", "images", "synthetic"):
+        arg = spec
+        kind = "v4l2" if spec.isdigit() else "images" if os.path.isdir(spec) else "file"
+    settings = {"source": kind}
+    if kind == "v4l2":
+        if arg: settings["camera_index"] = int(arg) if arg.isdigit() else arg
+    elif kind == "synthetic":
+        if arg: settings["synthetic_codes"] = [c for c in arg.split(",") if c]
+    else:
+        settings["source_path"] = arg
+    return settings
+
+
+def make_frame_source(cam_settings: dict) -> FrameSource:
+    """Tạo nguồn frame theo camera_settings['source'] (mặc định: camera thật)"""
+    kind = cam_settings.get('source', 'v4l2') or 'v4l2'
+    loop = bool(cam_settings.get('source_loop', True))
+    size = (int(cam_settings.get('frame_height', 480)), int(cam_settings.get('frame_width', 640)))
+    if kind == "file":
+        return VideoFileSource(cam_settings.get('source_path', ''), loop=loop)
+    if kind == "images":
+        return ImageDirSource(cam_settings.get('source_path', ''), fps=float(cam_settings.get('source_fps', 10.0)), loop=loop)
+    if kind == "synthetic":
+        return SyntheticSource(cam_settings.get('synthetic_codes'), fps=float(cam_settings.get('source_fps', 30.0)), frame_size=size)
+    if kind != "v4l2":
+        logging.warning("[CAMERA] Nguồn '%s' không hợp lệ, dùng camera thật.", kind)
+    return V4L2Source(cam_settings.get('camera_index', 0), cam_settings)
+
+
+def resolve_camera_settings(cam_settings: dict) -> dict:
+    """camera_settings từ config, ghi đè bởi APP_CAMERA_SOURCE / APP_CAMERA_SPEED (tiện khi chạy trên máy dev)"""
+    settings = dict(cam_settings)
+    env_source = os.environ.get("APP_CAMERA_SOURCE", "").strip()
+    if env_source: settings.update(parse_source_spec(env_source))
+    env_speed = os.environ.get("APP_CAMERA_SPEED", "").strip()
+    if env_speed: settings['playback_speed'] = float(env_speed)
+    return settings
+
+
+class PlaybackPacer:
+    """
+    Giữ nhịp phát lại: speed=1.0 đúng thời gian thực, 2.0 nhanh gấp đôi, 0 = nhanh nhất có thể.
+    Nguồn không có fps (camera thật) -> giữ nhịp cũ 60 FPS.
+    """
+    def __init__(self, fps: Optional[float], speed: float = 1.0):
+        self.interval = 1 / 60 if not fps else (1.0 / (fps * speed) if speed > 0 else 0.0)
+        self.paced = bool(fps)
+        self._next = None
+
+    def wait(self):
+        if not self.paced:
+            time.sleep(self.interval); return
+        if self.interval <= 0: return
+        now = time.monotonic()
+        if self._next is None or now - self._next > 1.0: self._next = now # Tụt quá xa -> không dồn frame
+        self._next += self.interval
+        delay = self._next - now
+        if delay > 0: time.sleep(delay)
+
+
+# ===========================================
+# LUỒNG CAMERA
+# ===========================================
 
 def start_camera_thread(system):
     """Luồng chụp camera (Lấy từ app_god.py)"""
     global latest_frame, fps_value # Vẫn dùng global để tương thích code cũ, nhưng gán vào system
+    if system.external_frames:
+        logging.info("[CAMERA] Frame do nguồn ngoài cung cấp (simulator). Không mở camera.")
+        return
 
+    generation = system.camera_generation # Tăng khi camera_settings đổi -> luồng này nhả camera và thoát
     frame_count = 0
     start_time = time.time()
-    
+
     cam_settings = {}
     with system.state_lock:
         cam_settings = system.system_state.get('camera_settings', {})
-    
-    # Lấy CAMERA_INDEX từ config (nếu có), nếu không dùng 0
-    camera_index = cam_settings.get('camera_index', 0) 
-    
-    camera = cv2.VideoCapture(camera_index)
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640); 
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1) 
-    
-    try:
-        auto_exposure_cfg = cam_settings.get('auto_exposure', True)
-        auto_exposure_val = 1 if auto_exposure_cfg else 0
-        camera.set(cv2.CAP_PROP_AUTO_EXPOSURE, auto_exposure_val)
-        logging.info(f"[CAMERA] Đã đặt Auto Exposure: {'BẬT' if auto_exposure_val == 1 else 'TẮT'}.")
-
-        if auto_exposure_val == 0:
-            brightness_val = int(cam_settings.get('brightness', 128))
-            contrast_val = int(cam_settings.get('contrast', 32))
-            camera.set(cv2.CAP_PROP_BRIGHTNESS, brightness_val)
-            camera.set(cv2.CAP_PROP_CONTRAST, contrast_val)
-            logging.info(f"[CAMERA] Đã đặt Brightness thủ công: {brightness_val}")
-            logging.info(f"[CAMERA] Đã đặt Contrast thủ công: {contrast_val}")
-    except Exception as cam_e:
-        logging.error(f"[CAMERA] Lỗi khi cài đặt thông số camera: {cam_e}")
-    
-    if not camera.isOpened():
-        logging.error(f"[ERROR] Không mở được camera index {camera_index}.")
-        system.error_manager.trigger_maintenance(f"Không thể mở camera (index {camera_index}).")
+    cam_settings = resolve_camera_settings(cam_settings)
+
+    source = make_frame_source(cam_settings)
+    if not source.open():
+        logging.error(f"[ERROR] Không mở được nguồn camera ({source.describe()}).")
+        system.error_manager.trigger_maintenance(f"Không thể mở camera ({source.describe()}).")
         return
-    
-    logging.info(f"[CAMERA] Camera (index {camera_index}) đã khởi động.")
-    
+
+    pacer = PlaybackPacer(source.fps, float(cam_settings.get('playback_speed', 1.0)))
+    logging.info(f"[CAMERA] Camera ({source.describe()}) đã khởi động.")
+
     retries = 0; max_retries = 5
-    while system.main_loop_running:
+    while system.main_loop_running and system.camera_generation == generation:
         if system.error_manager.is_maintenance():
             time.sleep(0.5); continue
-            
-        ret, frame = camera.read()
-        
+
+        read_start = time.perf_counter()
+        ret, frame = source.capture()
+
         if not ret:
+            if source.eof:
+                logging.info("[CAMERA] Đã phát hết nguồn %s.", source.describe())
+                break
+            FRAMES_TOTAL.inc(result="fail")
             retries += 1
-            logging.warning(f"[WARN] Mất camera (lần {retries}/{max_retries}), thử khởi động lại...")
+            logging.warning("[WARN] Mất camera (lần %d/%d), thử khởi động lại...", retries, max_retries, extra=RATE_LIMITED)
             system.broadcast_log("error", f"Mất camera (lần {retries}), đang thử lại...")
             if retries > max_retries:
                 logging.critical("[ERROR] Camera lỗi vĩnh viễn. Chuyển sang chế độ bảo trì.")
                 system.error_manager.trigger_maintenance("Camera lỗi vĩnh viễn (mất kết nối).")
                 break
-            camera.release(); time.sleep(1); camera = cv2.VideoCapture(camera_index)
+            source.reopen()
             continue
+        capture_ts = time.monotonic()
         retries = 0
+        observe_stage("capture", time.perf_counter() - read_start)
+        FRAMES_TOTAL.inc(result="ok")
 
         frame_count += 1
         current_time = time.time()
         elapsed_time = current_time - start_time
-        
+
         if elapsed_time >= 1.0:
             system.fps_value = frame_count / elapsed_time
             frame_count = 0
             start_time = current_time
-        
-        with system.frame_lock:
-            system.latest_frame = frame.copy()
-            
-        time.sleep(1 / 60) # Cung cấp 60 FPS
-        
-    camera.release()
-    logging.info("[CAMERA] Luồng camera đã dừng.")
\ No newline at end of file
+
+        with system.frame_lock: # Nguồn trả buffer mới mỗi lần đọc -> không cần copy
+            system.latest_frame = frame
+            system.latest_frame_ts = capture_ts
+            system.latest_frame_seq += 1
+
+        pacer.wait()
+
+    source.release()
+    logging.info("[CAMERA] Luồng camera đã dừng.")
+
+
+# ===========================================
+# PHÁT LẠI NGOẠI TUYẾN (máy dev)
+# ===========================================
+
+def replay(source: FrameSource, max_frames: int = 0, use_ai: bool = False, ai_config: Optional[dict] = None,
+           model_path: str = "", speed: float = 0.0, on_frame=None) -> dict:
+    """
+    Đưa từng frame của `source` qua scan_qr_from_frame (và AIDetector nếu bật), không bỏ frame nào.
+    Trả về thống kê: số frame, số lần đọc được QR, các mã xuất hiện, frame/s xử lý.
+    """
+    from core.qr import scan_qr_from_frame
+    detector = None
+    if use_ai:
+        from core.ai import AIDetector
+        detector = AIDetector(model_path, dict(ai_config or {}, enable_ai=True))
+        if not detector.enabled:
+            logging.warning("[REPLAY] AIDetector không khả dụng (thiếu ultralytics/model), chỉ quét QR.")
+            detector = None
+
+    pacer = PlaybackPacer(source.fps, speed) if source.fps else None
+    stats = {"source": source.describe(), "frames": 0, "qr_hits": 0, "ai_hits": 0, "codes": {}, "ai_classes": {}}
+    started = time.perf_counter(); busy = 0.0
+    while not max_frames or stats["frames"] < max_frames:
+        ret, frame = source.capture()
+        if not ret: break
+        t0 = time.perf_counter()
+        data, _ = scan_qr_from_frame(frame.gray())
+        ai_class = None
+        if detector is not None:
+            _, ai_class, _ = detector.detect(frame.bgr().copy())
+        busy += time.perf_counter() - t0
+        stats["frames"] += 1
+        if data:
+            stats["qr_hits"] += 1; stats["codes"][data] = stats["codes"].get(data, 0) + 1
+        if ai_class:
+            stats["ai_hits"] += 1; stats["ai_classes"][ai_class] = stats["ai_classes"].get(ai_class, 0) + 1
+        if on_frame: on_frame(stats["frames"] - 1, data, ai_class)
+        if pacer: pacer.wait()
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed_s"] = round(elapsed, 3)
+    stats["fps"] = round(stats["frames"] / elapsed, 1) if elapsed > 0 else None
+    stats["decode_fps"] = round(stats["frames"] / busy, 1) if busy > 0 else None
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Phát lại video/ảnh qua bộ quét QR (và AI) để đo tốc độ / kiểm tra nhận dạng")
+    parser.add_argument("source", help="v4l2:0 | file:video.mp4 | images:thu_muc | synthetic[:SP001,SP002] (hoặc đường dẫn)")
+    parser.add_argument("--speed", type=float, default=0.0, help="Tốc độ phát (1.0 = thời gian thực, 0 = nhanh nhất, mặc định)")
+    parser.add_argument("--fps", type=float, default=10.0, help="FPS gốc cho thư mục ảnh / synthetic")
+    parser.add_argument("--max-frames", type=int, default=0, help="Dừng sau N frame (bắt buộc với synthetic/v4l2)")
+    parser.add_argument("--ai", action="store_true", help="Chạy thêm AIDetector")
+    parser.add_argument("--model", default="", help="Đường dẫn model YOLO (mặc định theo config)")
+    parser.add_argument("--verbose", action="store_true", help="In kết quả từng frame có QR/AI")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    settings = parse_source_spec(args.source)
+    settings.update({"source_loop": False, "source_fps": args.fps})
+    source = make_frame_source(settings)
+    if source.kind in ("v4l2", "synthetic") and not args.max_frames:
+        parser.error("nguồn camera/synthetic không tự kết thúc: cần --max-frames")
+    if not source.open():
+        print(f"Không mở được nguồn {source.describe()}", file=sys.stderr)
+        return 1
+
+    model_path = args.model; ai_config = {}
+    if args.ai:
+        from core.system import CONFIG_FILE
+        try:
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f: ai_config = json.load(f).get('ai_config', {})
+        except (OSError, ValueError): pass
+        model_path = model_path or ai_config.get('model_path', 'yolov8n.pt')
+
+    def on_frame(index, data, ai_class):
+        if args.verbose and (data or ai_class):
+            print(json.dumps({"frame": index, "qr": data, "ai": ai_class}, ensure_ascii=False))
+
+    try:
+        stats = replay(source, args.max_frames, args.ai, ai_config, model_path, args.speed, on_frame)
+    finally:
+        source.release()
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,23 +3,24 @@ import cv2
 import time
 import logging
 import uuid
-from core.utils import canon_id
-from core.qr import PYZBAR, scan_qr_from_frame # Cần PYZBAR và hàm scan
+from core.utils import canon_id, match_source
+from core.metrics import observe_stage, JOBS_TOTAL
+from core.qr import PYZBAR, scan_qr_in_regions # Cần PYZBAR và hàm scan
 
 def start_camera_trigger_thread(system):
     """Luồng tạo Job V1 (Camera) (Lấy từ app_god.py)"""
     
     last_qr, last_time = None, 0.0
+    last_frame_seq = 0
     
     if PYZBAR: logging.info("[CAM_TRIG] Thread Camera Trigger (v1 Logic) started (Ưu tiên Pyzbar).")
     else: logging.info("[CAM_TRIG] Thread Camera Trigger (v1 Logic) started (Chỉ dùng CV2).")
         
-    NG_LANE_INDEX = system.NG_LANE_INDEX
-    NG_LANE_NAME = system.NG_LANE_NAME
+    generation = system.trigger_generation # Tăng khi đổi chế độ v1/v2 -> luồng này thoát
 
-    while system.main_loop_running:
+    while system.main_loop_running and system.trigger_generation == generation:
         try:
-            if system.auto_test_enabled or system.error_manager.is_maintenance():
+            if system.handoff_hold() or system.auto_test_enabled or system.error_manager.is_maintenance():
                 time.sleep(0.2); continue
             
             LANE_MAP = {}
@@ -35,26 +36,33 @@ def start_camera_trigger_thread(system):
                 qr_debounce_time = cfg_timing.get('qr_debounce_time', 3.0)
                 if qr_debounce_time < 1.0: qr_debounce_time = 1.0
                 ai_cfg = system.system_state.get('ai_config', {})
+                NG_LANE_INDEX, NG_LANE_NAME = system.NG_LANE_INDEX, system.NG_LANE_NAME # Có thể đổi nóng cùng lanes
 
             if not LANE_MAP: time.sleep(0.5); continue
 
-            frame_copy = None
-            with system.frame_lock:
-                if system.latest_frame is not None: frame_copy = system.latest_frame.copy()
-            if frame_copy is None: time.sleep(0.1); continue
+            # Chỉ quét frame MỚI và còn "tươi" (không tạo Job từ ảnh cũ khi camera bị treo)
+            # Ảnh xám dùng chung (chỉ đọc): YUYV/MJPEG -> kênh sáng, không chuyển BGR
+            gray, frame_seq = system.get_latest_frame("camera_trigger", after_seq=last_frame_seq, kind="gray", copy=False)
+            last_frame_seq = max(last_frame_seq, frame_seq) # Frame cũ bị từ chối cũng chỉ xét 1 lần
+            if gray is None: time.sleep(0.01 if frame_seq else 0.1); continue
 
-            # Sử dụng hàm scan_qr_from_frame đã module hóa
-            data, qr_source = scan_qr_from_frame(frame_copy)
+            # Sử dụng hàm scan_qr_in_regions đã module hóa
+            decode_start = time.perf_counter()
+            data, qr_source, qr_box = scan_qr_in_regions(gray, system.qr_regions()) # Chỉ vùng kiện khi bật tracker
+            decode_latency = time.perf_counter() - decode_start
             
             now = time.time()
             if data:
                 if data != last_qr:
                     last_qr, last_time = data, now
                     data_key = canon_id(data); data_raw = data
+                    parcel_tracker = system.parcel_tracker # Gắn mã cho kiện đang được theo dõi ở cổng vào
+                    if parcel_tracker is not None: parcel_tracker.attach_qr(data_raw, box=qr_box)
                     
-                    logging.info(f"[CAM_TRIG] ({qr_source}) Phát hiện mã MỚI: {data_raw}")
+                    logging.info("[CAM_TRIG] (%s) Phát hiện mã MỚI: %s", qr_source, data_raw)
 
                     if data_key in LANE_MAP:
+                        job_start = time.perf_counter() # Chặng "job": AI + dựng Job (không gồm giải mã)
                         ai_is_on = ai_cfg.get('enable_ai', False) and system.ai_detector and system.ai_detector.enabled
                         ai_has_priority = ai_cfg.get('ai_priority', False)
                         
@@ -84,7 +92,8 @@ def start_camera_trigger_thread(system):
                         job_id = str(uuid.uuid4())[:8]; job_id_log_prefix = f"[JobID {job_id}]"
                         job = {
                             "job_id": job_id, "lane_index": job_lane_index,
-                            "status": job_status, "entry_time": now, "track_id": job_track_id
+                            "status": job_status, "entry_time": now, "track_id": job_track_id,
+                            "source": match_source(job_status), "decode_latency": decode_latency
                         }
 
                         if job_lane_index != NG_LANE_INDEX:
@@ -94,9 +103,14 @@ def start_camera_trigger_thread(system):
                                     system.system_state["lanes"][job_lane_index]["status"] = "Đang chờ vật..."
                         else: job_lane_name = NG_LANE_NAME
                         
+                        observe_stage("job", time.perf_counter() - job_start, lane=job_lane_name, source=job["source"])
+                        JOBS_TOTAL.inc(lane=job_lane_name, source=job["source"])
+
                         current_queue_indices = []; current_queue_len = 0
                         with system.processing_queue_lock:
                             system.processing_queue.append(job)
+                            system.queue_journal.record("job_push", job=job)
+                            system.trace.job(job)
                             if len(system.processing_queue) == 1:
                                 system.queue_head_since = now
                             current_queue_len = len(system.processing_queue)
@@ -107,10 +121,10 @@ def start_camera_trigger_thread(system):
                             system.system_state["entry_queue_size"] = current_queue_len
                         
                         system.broadcast_log("info", f"{job_id_log_prefix} Vật vào Camera (QR). Ghép cặp: {job_status} -> Lane '{job_lane_name}' (Track ID: {job_track_id if job_track_id else 'N/A'}).", data={"queue": current_queue_indices})
-                        logging.info(f"[CAM_TRIG] {job_id_log_prefix} Phát hiện QR. Ghép cặp: {job_status} -> Lane '{job_lane_name}'. Queue chính: {current_queue_len}")
+                        logging.info("[CAM_TRIG] %s Phát hiện QR. Ghép cặp: %s -> Lane '%s'. Queue chính: %d", job_id_log_prefix, job_status, job_lane_name, current_queue_len)
 
                         if stop_on_qr:
-                            logging.info(f"[CONVEYOR] {job_id_log_prefix} Phát hiện QR, DỪNG băng chuyền trong {stop_delay_qr}s...")
+                            logging.info("[CONVEYOR] %s Phát hiện QR, DỪNG băng chuyền trong %ss...", job_id_log_prefix, stop_delay_qr)
                             system.CONVEYOR_STOP()
                             system.executor.submit(system.restart_conveyor_after_delay, stop_delay_qr)
                 
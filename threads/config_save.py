@@ -1,41 +1,23 @@
 # pi/threads/config_save.py
 import time
 import logging
-import json
-import os
-
-# Cần đường dẫn file config
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-CONFIG_FILE = os.path.join(BASE_DIR, "config", "config.json")
 
 def start_periodic_config_save_thread(system):
-    """Lưu config định kỳ (Lấy từ app_god.py)"""
+    """Lưu config khi có thay đổi (debounce, ghi nguyên tử qua ConfigStore)"""
+    store = system.config_store
     while system.main_loop_running:
-        time.sleep(60)
-        if system.error_manager.is_maintenance(): continue
-        
-        config_to_save = {}
-        
+        if not store.wait_dirty(timeout=1.0): continue
+
+        # Gom các lần update_config liên tiếp thành 1 lần ghi
+        while system.main_loop_running and not store.ready_to_flush():
+            time.sleep(0.05)
+
         try:
-            with system.state_lock:
-                config_to_save['timing_config'] = system.system_state['timing_config'].copy()
-                config_to_save['ai_config'] = system.system_state['ai_config'].copy()
-                config_to_save['camera_settings'] = system.system_state['camera_settings'].copy()
-                
-                current_lanes_config = []
-                for lane_state in system.system_state['lanes']:
-                    current_lanes_config.append({
-                        "id": lane_state['id'], "name": lane_state['name'],
-                        "sensor_pin": lane_state.get('sensor_pin'), 
-                        "push_pin": lane_state.get('push_pin'), 
-                        "pull_pin": lane_state.get('pull_pin')
-                    })
-                config_to_save['lanes_config'] = current_lanes_config
-            
             with system.config_file_lock:
-                with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(config_to_save, f, indent=4)
-            logging.info("[CONFIG] Đã tự động lưu config (timing, ai, lanes, camera).")
-
+                written = store.flush()
+            if written:
+                logging.info(f"[CONFIG] Đã lưu config (v{store.saved_version}).")
         except Exception as e:
-            logging.error(f"[CONFIG] Lỗi tự động lưu config: {e}")
\ No newline at end of file
+            logging.error(f"[CONFIG] Lỗi lưu config: {e}")
+            system.broadcast_log("error", f"Lỗi khi lưu config: {e}")
+            time.sleep(1.0)
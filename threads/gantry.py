@@ -2,20 +2,26 @@
 import time
 import logging
 import uuid
-from core.utils import canon_id # Cần import canon_id
+from core.utils import canon_id, match_source # Cần import canon_id
+from core.gpio import MockGPIO
+from core.metrics import observe_stage, JOBS_TOTAL
+from core.rt import enter_control_thread, timed_sleep
 
 def start_gantry_trigger_thread(system):
     """Luồng tạo Job V2 (Gantry) (Lấy từ app_god.py)"""
+    from core.system import SENSOR_ENTRY_PIN, SENSOR_ENTRY_MOCK_PIN
+    enter_control_thread("gantry")
     
     sensor_pin_to_read = SENSOR_ENTRY_PIN
     if isinstance(system.gpio, MockGPIO):
         sensor_pin_to_read = SENSOR_ENTRY_MOCK_PIN
         
     logging.info(f"[GANTRY] Thread Gantry Trigger (v2 Logic) (Pin: {sensor_pin_to_read}) bắt đầu.")
-    is_first_loop = True
+    is_first_loop = not system.handoff_state_loaded # Sau chuyển giao: giữ trạng thái sensor đã nhận
+    generation = system.trigger_generation # Tăng khi đổi chế độ v1/v2 -> luồng này thoát
 
-    while system.main_loop_running:
-        if system.auto_test_enabled or system.error_manager.is_maintenance():
+    while system.main_loop_running and system.trigger_generation == generation:
+        if system.handoff_hold() or system.auto_test_enabled or system.error_manager.is_maintenance():
             time.sleep(0.1); continue
         
         ai_cfg = {}; debounce_time = 0.1; stop_conveyor_enabled = False
@@ -36,7 +42,7 @@ def start_gantry_trigger_thread(system):
         try:
             sensor_now = system.gpio.input(sensor_pin_to_read)
         except Exception as gpio_e:
-            logging.error(f"[GANTRY] Lỗi đọc GPIO pin {sensor_pin_to_read} (SENSOR_ENTRY): {gpio_e}")
+            logging.error("[GANTRY] Lỗi đọc GPIO pin %s (SENSOR_ENTRY): %s", sensor_pin_to_read, gpio_e)
             system.error_manager.trigger_maintenance(f"Lỗi đọc sensor ENTRY pin {sensor_pin_to_read}: {gpio_e}")
             time.sleep(0.5); continue
 
@@ -49,13 +55,14 @@ def start_gantry_trigger_thread(system):
             logging.info(f"[GANTRY] Đã 'priming' sensor gác cổng, trạng thái ban đầu: {'ACTIVE' if sensor_now == 0 else 'INACTIVE'}")
             time.sleep(0.1); continue
 
+        if sensor_now != system.last_entry_sensor_state: system.trace.sensor(sensor_pin_to_read, sensor_now)
         if sensor_now == 0 and system.last_entry_sensor_state == 1: # Cạnh xuống (Kích hoạt)
             if (now - system.last_entry_sensor_trigger_time) > debounce_time:
                 
                 if stability_delay > 0:
                     time.sleep(stability_delay) 
                     if system.gpio.input(sensor_pin_to_read) != 0: 
-                        logging.info(f"[GANTRY] Bỏ qua nhiễu tạm thời (dưới {stability_delay}s)")
+                        logging.info("[GANTRY] Bỏ qua nhiễu tạm thời (dưới %ss)", stability_delay)
                         system.last_entry_sensor_state = 1 
                         continue 
                 
@@ -65,10 +72,12 @@ def start_gantry_trigger_thread(system):
                 job_lane_name = system.NG_LANE_NAME
                 job_status = "PENDING"; job_track_id = None
 
+                job_start = time.perf_counter() # Chặng "job": lấy QR (đã giải mã ở luồng QR Scanner) + AI + dựng Job
                 qr_lane_index = None
                 try:
                     with system.qr_queue_lock:
                         qr_lane_index = system.qr_queue.pop(0)
+                        system.queue_journal.record("qr_pop")
                 except IndexError: pass
 
                 ai_lane_index = system.NG_LANE_INDEX
@@ -92,7 +101,8 @@ def start_gantry_trigger_thread(system):
                 job_id = str(uuid.uuid4())[:8]; job_id_log_prefix = f"[JobID {job_id}]"
                 job = {
                     "job_id": job_id, "lane_index": job_lane_index,
-                    "status": job_status, "entry_time": now, "track_id": job_track_id
+                    "status": job_status, "entry_time": now, "track_id": job_track_id,
+                    "source": match_source(job_status), "decode_latency": None # Giải mã ở luồng QR Scanner (chặng "decode")
                 }
 
                 if job_lane_index != system.NG_LANE_INDEX:
@@ -102,9 +112,14 @@ def start_gantry_trigger_thread(system):
                             system.system_state["lanes"][job_lane_index]["status"] = "Đang chờ vật..."
                 else: job_lane_name = system.NG_LANE_NAME
                 
+                observe_stage("job", time.perf_counter() - job_start, lane=job_lane_name, source=job["source"])
+                JOBS_TOTAL.inc(lane=job_lane_name, source=job["source"])
+
                 current_queue_indices = []
                 with system.processing_queue_lock:
                     system.processing_queue.append(job)
+                    system.queue_journal.record("job_push", job=job)
+                    system.trace.job(job)
                     if len(system.processing_queue) == 1:
                         system.queue_head_since = now
                     current_queue_len = len(system.processing_queue)
@@ -115,12 +130,12 @@ def start_gantry_trigger_thread(system):
                     system.system_state["entry_queue_size"] = current_queue_len
                 
                 system.broadcast_log("info", f"{job_id_log_prefix} Vật vào Gác Cổng. Ghép cặp: {job_status} -> Lane '{job_lane_name}' (Track ID: {job_track_id if job_track_id else 'N/A'}).", data={"queue": current_queue_indices})
-                logging.info(f"[GANTRY] {job_id_log_prefix} SENSOR_ENTRY kích hoạt. Ghép cặp: {job_status} -> Lane '{job_lane_name}'. Queue chính: {current_queue_len}")
+                logging.info("[GANTRY] %s SENSOR_ENTRY kích hoạt. Ghép cặp: %s -> Lane '%s'. Queue chính: %d", job_id_log_prefix, job_status, job_lane_name, current_queue_len)
 
                 if stop_conveyor_enabled and job_status == "ALL_FAILED":
-                    logging.warning(f"[GANTRY] {job_id_log_prefix} Đọc QR và AI đều thất bại, DỪNG băng chuyền...")
+                    logging.warning("[GANTRY] %s Đọc QR và AI đều thất bại, DỪNG băng chuyền...", job_id_log_prefix)
                     system.CONVEYOR_STOP()
                     system.executor.submit(system.restart_conveyor_after_delay, conveyor_stop_delay)
 
         system.last_entry_sensor_state = sensor_now
-        time.sleep(0.05)
\ No newline at end of file
+        timed_sleep(0.05, "gantry")
\ No newline at end of file
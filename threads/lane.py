@@ -2,26 +2,34 @@
 import time
 import logging
 import threading
+from core.gpio import MockGPIO
+from core.metrics import LOOP_TICK
+from core.rt import enter_control_thread, timed_sleep
 
 def start_lane_monitor_thread(system):
     """
     Luồng giám sát CẢM BIẾN TẠI LÀN (LOGIC PULL).
     Lấy logic từ 'lane_sensor_monitoring_thread' của app_god.py.
     """
+    from core.system import SENSOR_ENTRY_PIN, SENSOR_ENTRY_MOCK_PIN
+    enter_control_thread("lane_monitor")
     
     # Khởi tạo trạng thái ban đầu
     try:
         num_lanes = 0
         with system.state_lock:
             num_lanes = len(system.system_state['lanes'])
+            # Sau chuyển giao: tiếp tục từ mức sensor tiến trình cũ đã thấy (không tạo cạnh giả)
+            readings = [1 if ln.get('sensor_reading', 1) else 0 for ln in system.system_state['lanes']]
         
         # Đảm bảo các mảng trạng thái có kích thước đúng
-        system.last_sensor_state = [1] * num_lanes
-        system.last_sensor_trigger_time = [0.0] * num_lanes
+        system.last_sensor_state = readings
+        if len(system.last_sensor_trigger_time) != num_lanes: system.last_sensor_trigger_time = [0.0] * num_lanes
         system.auto_test_last_state = [1] * num_lanes
         system.auto_test_last_trigger = [0.0] * num_lanes
         
         last_sensor_state_prev = list(system.last_sensor_state)
+        lanes_version = system.lanes_version
         logging.info(f"[LANE_S] Luồng giám sát sensor làn (Pull Logic) đã khởi động cho {num_lanes} làn.")
     
     except Exception as e:
@@ -31,8 +39,11 @@ def start_lane_monitor_thread(system):
 
     try:
         while system.main_loop_running:
+            if system.handoff_hold():
+                time.sleep(0.001); continue
             if system.error_manager.is_maintenance():
                 time.sleep(0.1); continue
+            tick_start = time.perf_counter()
 
             # Lấy config (cần cho cả 2 chế độ)
             debounce_time, current_queue_timeout, num_lanes = 0.1, 15.0, 0
@@ -66,7 +77,7 @@ def start_lane_monitor_thread(system):
                     try:
                         sensor_now = system.gpio.input(sensor_pin)
                     except Exception as gpio_e:
-                        logging.error(f"[AUTO-TEST] Lỗi đọc GPIO pin {sensor_pin} ({lane_name_for_log}): {gpio_e}")
+                        logging.error("[AUTO-TEST] Lỗi đọc GPIO pin %s (%s): %s", sensor_pin, lane_name_for_log, gpio_e)
                         system.error_manager.trigger_maintenance(f"Lỗi đọc sensor pin {sensor_pin} ({lane_name_for_log}): {gpio_e}")
                         continue
                     
@@ -85,6 +96,7 @@ def start_lane_monitor_thread(system):
                     
                     system.auto_test_last_state[i] = sensor_now
 
+                LOOP_TICK.observe(time.perf_counter() - tick_start, loop="lane_monitor")
                 time.sleep(0.02) 
                 continue # Bỏ qua logic queue bên dưới
             
@@ -92,7 +104,8 @@ def start_lane_monitor_thread(system):
             
             # --- LOGIC CHÍNH (QUEUE) ---
             
-            if len(last_sensor_state_prev) != num_lanes:
+            if len(last_sensor_state_prev) != num_lanes or lanes_version != system.lanes_version:
+                lanes_version = system.lanes_version
                 last_sensor_state_prev = [1] * num_lanes
                 system.last_sensor_trigger_time = [0.0] * num_lanes
                 logging.warning(f"[SENSOR] Đã phát hiện thay đổi config. Đồng bộ state (size {num_lanes}).")
@@ -104,6 +117,7 @@ def start_lane_monitor_thread(system):
                 if system.processing_queue and system.queue_head_since > 0.0:
                     if (now - system.queue_head_since) > current_queue_timeout:
                         job_timeout = system.processing_queue.pop(0) 
+                        system.queue_journal.record("job_pop", job_id=job_timeout.get('job_id'), reason="timeout")
                         job_id_timeout = job_timeout.get('job_id', '???') 
                         expected_lane_index = job_timeout['lane_index']
                         expected_lane_name = "UNKNOWN"
@@ -118,12 +132,13 @@ def start_lane_monitor_thread(system):
                             system.system_state["entry_queue_size"] = len(current_queue_indices)
 
                         system.queue_head_since = now if system.processing_queue else 0.0
+                        system.log_sort_event(job_timeout, expected_lane_index, expected_lane_name, "timeout")
 
                         system.broadcast_log("warn",
                             f"[JobID {job_id_timeout}] TIMEOUT! Đã tự động xóa Job cho {expected_lane_name} (>{current_queue_timeout}s).",
                             data={"queue": current_queue_indices}
                         )
-                        logging.warning(f"[SENSOR] [JobID {job_id_timeout}] TIMEOUT! Xóa Job cho {expected_lane_name}.")
+                        logging.warning("[SENSOR] [JobID %s] TIMEOUT! Xóa Job cho %s.", job_id_timeout, expected_lane_name)
             
             # Quét tất cả sensor
             for i in range(num_lanes):
@@ -142,7 +157,7 @@ def start_lane_monitor_thread(system):
                 try:
                     sensor_now = system.gpio.input(sensor_pin)
                 except Exception as gpio_e:
-                    logging.error(f"[SENSOR] Lỗi đọc GPIO pin {sensor_pin} ({lane_name_for_log}): {gpio_e}")
+                    logging.error("[SENSOR] Lỗi đọc GPIO pin %s (%s): %s", sensor_pin, lane_name_for_log, gpio_e)
                     system.error_manager.trigger_maintenance(f"Lỗi đọc sensor pin {sensor_pin} ({lane_name_for_log}): {gpio_e}")
                     continue
 
@@ -151,6 +166,7 @@ def start_lane_monitor_thread(system):
                         system.system_state["lanes"][i]["sensor_reading"] = sensor_now
 
                 prev_state = last_sensor_state_prev[i]
+                if sensor_now != prev_state: system.trace.sensor(sensor_pin, sensor_now)
 
                 if sensor_now == 0 and prev_state == 1: # Cạnh xuống (Kích hoạt)
                     if (now - system.last_sensor_trigger_time[i]) > debounce_time:
@@ -169,9 +185,56 @@ def start_lane_monitor_thread(system):
                                 if job_head["lane_index"] == i:
                                     is_head_match = True
                                     job_to_run = system.processing_queue.pop(0)
+                                    system.queue_journal.record("job_pop", job_id=job_to_run.get('job_id'), reason="match")
                                     system.queue_head_since = now if system.processing_queue else 0.0
                                     break 
 
                                 elif job_head["lane_index"] == system.NG_LANE_INDEX:
                                     job_ng_removed = system.processing_queue.pop(0)
-                                    system.queue_head_since = now if system.processing_queue else 0.0
\ No newline at end of file
+                                    system.queue_journal.record("job_pop", job_id=job_ng_removed.get('job_id'), reason="ng_pass")
+                                    system.queue_head_since = now if system.processing_queue else 0.0
+                                    current_queue_indices_for_log = [j["lane_index"] for j in system.processing_queue]
+                                    job_ng_removed["sensor_time"] = now
+                                    system.log_sort_event(job_ng_removed, system.NG_LANE_INDEX, system.NG_LANE_NAME, "ng_pass")
+
+                                    logging.info("[SENSOR] [JobID %s] %s kích hoạt. Tự động 'tiêu thụ' 1 Job NG khỏi hàng chờ.", job_id_head, lane_name_for_log)
+                                    system.broadcast_log("info", f"[JobID {job_id_head}] Vật NG đã đi thẳng (pass-through). Xóa Job NG.", data={"queue": current_queue_indices_for_log})
+                                    continue
+
+                                else:
+                                    is_head_match = False
+                                    job_to_run = None
+                                    logging.warning("[SENSOR] ⚠️ [JobID %s] %s kích hoạt nhưng KHÔNG KHỚP Job đầu hàng chờ (Lane %s). Bỏ qua.", job_id_head, lane_name_for_log, job_head['lane_index'])
+                                    system.broadcast_log("warn", f"Sensor {lane_name_for_log} kích hoạt (lỗi đồng bộ). Bỏ qua.", data={"queue": current_queue_indices_for_log})
+                                    break
+
+                        if is_head_match and job_to_run:
+                            job_id_for_log = job_to_run.get('job_id', 'N/A')
+                            job_to_run["sensor_time"] = now
+
+                            with system.processing_queue_lock:
+                                current_queue_indices = [j["lane_index"] for j in system.processing_queue]
+
+                            with system.state_lock:
+                                system.system_state["queue_indices"] = current_queue_indices
+                                system.system_state["entry_queue_size"] = len(current_queue_indices)
+                                if 0 <= i < len(system.system_state["lanes"]):
+                                    lane_ref = system.system_state["lanes"][i]
+                                    if push_pin is None: lane_ref["status"] = "Đang đi thẳng..."
+                                    else: lane_ref["status"] = "Đang chờ đẩy"
+
+                            threading.Thread(target=system.sorting_process, args=(i, job_id_for_log, job_to_run), daemon=True).start()
+
+                            system.broadcast_log("info", f"[JobID {job_id_for_log}] Sensor {lane_name_for_log} khớp Job. Bắt đầu xử lý.", data={"queue": current_queue_indices})
+                            logging.info("[LANE_S] [JobID %s] %s kích hoạt. KHỚP Job. Queue chính: %d", job_id_for_log, lane_name_for_log, len(current_queue_indices))
+
+                last_sensor_state_prev[i] = sensor_now
+
+            # Sleep dựa trên trạng thái của tất cả sensor (bao gồm cả gantry)
+            LOOP_TICK.observe(time.perf_counter() - tick_start, loop="lane_monitor")
+            adaptive_sleep = 0.05 if all(st == 1 for st in last_sensor_state_prev) and system.last_entry_sensor_state == 1 else 0.01
+            timed_sleep(adaptive_sleep, "lane_monitor")
+
+    except Exception as e:
+        logging.error(f"[ERROR] Luồng lane_sensor_monitoring_thread bị crash: {e}", exc_info=True)
+        system.error_manager.trigger_maintenance(f"Lỗi luồng Lane Sensor: {e}")
@@ -3,19 +3,22 @@ import cv2
 import time
 import logging
 from core.utils import canon_id
-from core.qr import PYZBAR, scan_qr_from_frame
+from core.qr import PYZBAR, scan_qr_in_regions
+from core.logging_setup import RATE_LIMITED
 
 def start_qr_scanner_thread(system):
     """Luồng quét QR (V2) (Lấy từ app_god.py)"""
     
     last_qr, last_time = "", 0.0
+    last_frame_seq = 0
+    generation = system.trigger_generation # Tăng khi đổi chế độ v1/v2 -> luồng này thoát
     
     if PYZBAR: logging.info("[QR_SCAN] Thread QR Scanner (v2 Logic) started (Ưu tiên Pyzbar).")
     else: logging.info("[QR_SCAN] Thread QR Scanner (v2 Logic) started (Chỉ dùng CV2).")
 
-    while system.main_loop_running:
+    while system.main_loop_running and system.trigger_generation == generation:
         try:
-            if system.auto_test_enabled or system.error_manager.is_maintenance():
+            if system.handoff_hold() or system.auto_test_enabled or system.error_manager.is_maintenance():
                 time.sleep(0.2); continue
             
             LANE_MAP = {}
@@ -25,16 +28,19 @@ def start_qr_scanner_thread(system):
             
             if not LANE_MAP: time.sleep(0.5); continue
 
-            frame_copy = None
-            with system.frame_lock:
-                if system.latest_frame is not None: frame_copy = system.latest_frame.copy()
-            if frame_copy is None: time.sleep(0.1); continue
+            # Chỉ quét frame MỚI và còn "tươi" (không tạo Job từ ảnh cũ khi camera bị treo)
+            # Ảnh xám dùng chung (chỉ đọc): YUYV/MJPEG -> kênh sáng, không chuyển BGR
+            gray, frame_seq = system.get_latest_frame("qr_scanner", after_seq=last_frame_seq, kind="gray", copy=False)
+            last_frame_seq = max(last_frame_seq, frame_seq) # Frame cũ bị từ chối cũng chỉ xét 1 lần
+            if gray is None: time.sleep(0.01 if frame_seq else 0.1); continue
 
-            data, qr_source = scan_qr_from_frame(frame_copy)
+            data, qr_source, qr_box = scan_qr_in_regions(gray, system.qr_regions()) # Chỉ vùng kiện khi bật tracker
             
             if data and (data != last_qr or time.time() - last_time > 3.0):
                 last_qr, last_time = data, time.time()
                 data_key = canon_id(data); data_raw = data
+                parcel_tracker = system.parcel_tracker # Gắn mã cho kiện đang được theo dõi ở cổng vào
+                if parcel_tracker is not None: parcel_tracker.attach_qr(data_raw, box=qr_box)
 
                 if data_key in LANE_MAP:
                     idx = LANE_MAP[data_key]
@@ -42,18 +48,20 @@ def start_qr_scanner_thread(system):
                     
                     with system.qr_queue_lock: 
                         system.qr_queue.append(idx) 
+                        system.queue_journal.record("qr_push", lane=idx)
                         current_queue_for_log = list(system.qr_queue) 
                     
                     system.broadcast_log("qr", f"Phát hiện {system.system_state['lanes'][idx]['name']}", 
                         data={"data_raw": data_raw, "data_key": data_key, "source": qr_source, "queue": current_queue_for_log})
-                    logging.info(f"[QR_SCAN] ({qr_source}) Hợp lệ: canon='{data_key}' -> lane {idx}. (Hàng chờ QR Tạm size={len(current_queue_for_log)})")
+                    logging.info("[QR_SCAN] (%s) Hợp lệ: canon='%s' -> lane %d. (Hàng chờ QR Tạm size=%d)", qr_source, data_key, idx, len(current_queue_for_log))
                             
                 elif data_key == "NG":
                     system.broadcast_log("qr_ng", f"Mã NG: {data_raw}", data=data_raw)
                 else:
                     system.broadcast_log("unknown_qr", f"Không rõ: {data_key}",
                         data={"data_raw": data_raw, "data_key": data_key, "source": qr_source}) 
-                    logging.warning(f"[QR_SCAN] ({qr_source}) Không rõ mã QR: raw='{data_raw}', canon='{data_key}'")
+                    logging.warning("[QR_SCAN] (%s) Không rõ mã QR: raw='%s', canon='%s'", qr_source, data_raw, data_key,
+                                    extra=RATE_LIMITED)
             
             time.sleep(0.1) 
 
@@ -0,0 +1,77 @@
+# pi/threads/tracker.py
+import time
+import logging
+from core.metrics import observe_stage
+from core.tracking import BlobSegmenter, ParcelTracker
+
+TRACKER_KEYS = ("tracker_scale", "tracker_min_area", "tracker_diff_threshold", "tracker_entry_line", "tracker_axis", "tracker_max_misses",
+                "tracker_full_scan_every")
+
+def _build_tracker(ai_cfg):
+    segmenter = BlobSegmenter(scale=float(ai_cfg.get('tracker_scale', 0.25)), min_area=float(ai_cfg.get('tracker_min_area', 0.01)),
+                              diff_threshold=int(ai_cfg.get('tracker_diff_threshold', 25)))
+    tracker = ParcelTracker(entry_line=float(ai_cfg.get('tracker_entry_line', 0.5)), axis=ai_cfg.get('tracker_axis', 'x'),
+                            max_misses=int(ai_cfg.get('tracker_max_misses', 5)),
+                            full_scan_every=int(ai_cfg.get('tracker_full_scan_every', 10)))
+    return segmenter, tracker
+
+def _run_classify(system, tracker, track, crop):
+    """Chạy trên system.tracker_executor: YOLO ảnh cắt rồi gắn lớp cho track"""
+    try:
+        detect_start = time.perf_counter()
+        class_name, conf = system.ai_detector.classify(crop)
+        observe_stage("detect", time.perf_counter() - detect_start, source="TRACK")
+    except Exception as e:
+        logging.error(f"[TRACK] Lỗi AI track #{track.track_id}: {e}", exc_info=True)
+        class_name, conf = None, 0.0
+    tracker.set_class(track, class_name, conf)
+    if class_name: logging.info(f"[TRACK] Track #{track.track_id}: '{class_name}' ({conf:.2f})")
+
+def _classify_pending(system, tracker):
+    """Gửi YOLO ảnh cắt của 1 track chưa có lớp sang system.tracker_executor (trả về Future; không chặn vòng tracker)"""
+    detector = system.ai_detector
+    if not detector or not detector.enabled: return None
+    track = tracker.pending_classification()
+    if track is None: return None
+    frame, _ = system.get_latest_frame("tracker_ai", kind="bgr", copy=False)
+    if frame is None: return None
+    x, y, w, h = track.box; pad_x, pad_y = w // 8, h // 8
+    crop = frame[max(0, y - pad_y):y + h + pad_y, max(0, x - pad_x):x + w + pad_x].copy()
+    return system.tracker_executor.submit(_run_classify, system, tracker, track, crop)
+
+def start_tracker_thread(system):
+    """Luồng theo dõi kiện liên tục: trigger chỉ tra system.parcel_tracker.at_entry() thay vì chạy YOLO"""
+    logging.info("[TRACK] Luồng theo dõi kiện hàng đã khởi động (bật bằng ai_config.enable_tracker).")
+    last_frame_seq = 0; segmenter = None; tracker_cfg = None
+    classify_future = None # Tối đa 1 lần YOLO đang chạy (track đang chờ kết quả không bị gửi lại)
+
+    while system.main_loop_running:
+        try:
+            with system.state_lock:
+                ai_cfg = dict(system.system_state.get('ai_config', {}))
+            if not ai_cfg.get('enable_tracker', False) or system.error_manager.is_maintenance():
+                system.parcel_tracker = None; tracker_cfg = None
+                time.sleep(0.5); continue
+
+            cfg = tuple(ai_cfg.get(k) for k in TRACKER_KEYS)
+            if cfg != tracker_cfg: # Bật lần đầu / đổi thông số -> dựng lại (track cũ bỏ)
+                segmenter, system.parcel_tracker = _build_tracker(ai_cfg); tracker_cfg = cfg
+                logging.info(f"[TRACK] Bộ theo dõi: scale={segmenter.scale}, vạch cổng={system.parcel_tracker.entry_line}.")
+            tracker = system.parcel_tracker
+
+            gray, frame_seq = system.get_latest_frame("tracker", after_seq=last_frame_seq, kind="gray", copy=False)
+            last_frame_seq = max(last_frame_seq, frame_seq)
+            if gray is None: time.sleep(0.005 if frame_seq else 0.1); continue
+
+            track_start = time.perf_counter()
+            tracker.update(segmenter.segment(gray), gray.shape[:2]); tracker.ready = segmenter.ready
+            observe_stage("track", time.perf_counter() - track_start)
+            if classify_future is None or classify_future.done():
+                classify_future = _classify_pending(system, tracker)
+
+        except Exception as e:
+            logging.error(f"[TRACK] Lỗi trong luồng theo dõi: {e}", exc_info=True)
+            time.sleep(0.5)
+
+    system.parcel_tracker = None
+    logging.info("[TRACK] Luồng theo dõi đã dừng.")
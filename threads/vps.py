@@ -1,23 +1,23 @@
 # pi/threads/vps.py
-import requests
-import cv2
-import time
+import os
 import logging
-import json
+from core.uploader import VPSUploader
 
 def start_vps_thread(system):
-    """Gửi dữ liệu lên VPS (Lấy từ app_god.py)"""
-    
+    """Gửi dữ liệu lên VPS theo sự kiện: delta state, sự kiện sort, frame khi đổi (core/uploader.py)"""
+
     # URL và Key này cần được định nghĩa trong config.json
     # Ví dụ: "vps_config": { "url": "https://.../api/pi/update", "api_key": "your-key" }
+    # Tùy chọn: state_interval, frame_max_fps, frame_change, catchup_batch, spool_max_mb, spool_dir,
+    #           max_in_flight (số request song song), jpeg_quality (chất lượng tối đa, tự giảm khi mạng chậm)
     vps_url = ""
     api_key = ""
     try:
         with system.state_lock:
-            vps_cfg = system.system_state.get('vps_config', {})
+            vps_cfg = dict(system.system_state.get('vps_config', {}))
             vps_url = vps_cfg.get('url', 'https://phanloai.kh4idev.id.vn/api/pi/update')
             api_key = vps_cfg.get('api_key', 'your-very-secret-key-12345')
-            
+
         if not vps_url or not api_key:
             logging.warning("[VPS_UPDATE] Thiếu 'url' hoặc 'api_key' trong 'vps_config'. Tắt luồng VPS.")
             return
@@ -25,44 +25,17 @@ def start_vps_thread(system):
         logging.error(f"[VPS_UPDATE] Lỗi đọc config: {e}. Tắt luồng.")
         return
 
-    time.sleep(5) # Chờ khởi động
-    logging.info(f"[VPS_UPDATE] Bắt đầu luồng gửi dữ liệu (Color 20FPS) lên {vps_url}")
-    
-    session = requests.Session()
-    headers = {'X-API-Key': api_key}
-    
-    while system.main_loop_running:
-        try:
-            state_copy = None; frame_copy = None
-            
-            with system.state_lock:
-                state_copy = system.get_full_state() # Dùng hàm lấy state
-            with system.frame_lock:
-                if system.latest_frame is not None:
-                    frame_copy = system.latest_frame.copy()
-            
-            if state_copy is None or frame_copy is None:
-                time.sleep(1); continue
-
-            state_json = json.dumps(state_copy)
-            ret, buffer = cv2.imencode('.jpg', frame_copy, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            if not ret:
-                time.sleep(0.5); continue
-            
-            frame_bytes = buffer.tobytes()
-            files = {'frame': ('frame.jpg', frame_bytes, 'image/jpeg')}
-            data = {'state': state_json}
-            
-            response = session.post(vps_url, files=files, data=data, headers=headers, timeout=2.0)
-            
-            if response.status_code != 200:
-                logging.warning(f"[VPS_UPDATE] VPS báo lỗi: {response.status_code} - {response.text}")
-
-            time.sleep(0.05) # ~20 FPS
-            
-        except requests.exceptions.RequestException as e:
-            logging.error(f"[VPS_UPDATE] Lỗi kết nối VPS: {e}")
-            time.sleep(5)
-        except Exception as e:
-            logging.error(f"[VPS_UPDATE] Lỗi trong luồng: {e}")
-            time.sleep(1)
\ No newline at end of file
+    from core import system as core_system
+    options = {k: vps_cfg[k] for k in ("state_interval", "frame_max_fps", "frame_change", "catchup_batch", "spool_max_mb", "max_in_flight", "jpeg_quality") if k in vps_cfg}
+    uploader = VPSUploader(
+        vps_url, api_key, vps_cfg.get('spool_dir') or os.path.join(core_system.LOG_DIR, "vps_spool"),
+        get_state=system.get_full_state, # (Tự lấy state_lock - không bọc thêm khóa)
+        get_frame=lambda: system.get_latest_frame("vps", reject_stale=False, copy=False)[0], **options)
+    system.vps_uploader = uploader
+    system.sort_event_listeners.append(uploader.on_sort)
+    logging.info(f"[VPS_UPDATE] Bắt đầu gửi dữ liệu theo sự kiện lên {vps_url} (spool: {uploader.spool.directory})")
+    try:
+        uploader.run(lambda: system.main_loop_running)
+    finally:
+        system.sort_event_listeners.remove(uploader.on_sort)
+        logging.info("[VPS_UPDATE] Luồng VPS đã dừng.")